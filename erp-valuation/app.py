@@ -1,32 +1,51 @@
 import os, sys, json, re
+import mimetypes
+import shutil
 from urllib.parse import urlparse, quote
 # Ensure this module is registered as "app" even when executed as a script.
 sys.modules.setdefault("app", sys.modules[__name__])
 import hashlib
 import secrets
+import threading
 from datetime import datetime, timedelta, date
 from typing import Iterable, List
 import fitz  # PyMuPDF (kept to preserve functionality if used in templates/utilities)
-import pytesseract  # OCR (kept to preserve functionality if used elsewhere)
 from PIL import Image  # Image handling (kept)
-from flask import Flask, render_template, request, redirect, url_for, session, send_from_directory, send_file, flash, abort, jsonify, Response
+from flask import Flask, render_template, request, redirect, url_for, session, send_file, flash, abort, jsonify, Response
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from xml.sax.saxutils import escape as xml_escape
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
 from extensions import db
-from sqlalchemy import func, or_, and_, text, inspect, create_engine
+from sqlalchemy import func, or_, and_, text, inspect, create_engine, select, update
 from sqlalchemy.orm import joinedload
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import OperationalError, IntegrityError
 from psycopg.rows import dict_row
 from pywebpush import webpush, WebPushException
 from docx import Document
 from pdf_templates import create_pdf
+from docx_pdf import DocxPdfConverter, find_soffice
+from render_cache import RenderCache
+from zip_stream import ZipEntry, compression_for, iter_zip, prefetch
+from upload_store import UploadStore, display_name, is_blob_ref, parse_blob_ref
+from storage import configure_storage
+from previews import PreviewGenerator
+from file_offload import FileOffload
+from image_normalize import ImageNormalizer
+from static_assets import StaticAssets
+from ocr import OcrPipeline, extract_fields
+from transaction_attachments import (
+    KIND_BANK, TransactionAttachment, add_attachments, backfill_transaction_attachments, bank_attachments_page,
+)
+from resumable_upload import ResumableUploads, UploadError, parse_checksum, parse_metadata
+from resumable_upload import MAX_CHUNK_SIZE as MAX_RESUMABLE_CHUNK
 from reportlab.graphics.barcode import qr as rl_qr
 from reportlab.graphics.shapes import Drawing
 from reportlab.graphics import renderPM
 import requests
 import time
-from b2sdk.v2 import InMemoryAccountInfo, B2Api
+from b2sdk.v2 import B2Api
 
 # Optional override to load the 'consulting' package from a specific directory.
 # If the provided path points to the 'consulting' directory itself, we add its parent
@@ -54,17 +73,48 @@ if CONSULTING_DIR_OVERRIDE:
 from consulting.projects.models import ConsultingProject
 from consulting.clients.models import Client
 from consulting.projects.forms import PROJECT_TYPES
-from consulting.hr.models import Employee
+from consulting.hr.models import Employee, EmployeeDocument, DocumentAlert
 
 # ---------------- إعداد Flask ----------------
-app = Flask(__name__)
+# ERP_INSTANCE_PATH / UPLOAD_FOLDER: مجلدات بديلة (للاختبارات أو أكثر من نسخة على نفس الخادم)
+app = Flask(__name__, instance_path=os.environ.get("ERP_INSTANCE_PATH") or None)
 app.secret_key = "secret_key"
 
 # ---------------- إعداد الملفات ----------------
-UPLOAD_FOLDER = os.path.join(app.root_path, "uploads")
+UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER") or os.path.join(app.root_path, "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
+# ---------------- تحويل المستندات إلى PDF ----------------
+# LibreOffice (SOFFICE_BIN) إن وُجد، وإلا محرك PyMuPDF المدمج
+app.config["PDF_CONVERTER_WORKERS"] = int(os.environ.get("PDF_CONVERTER_WORKERS", "2"))
+app.config["PDF_CONVERT_TIMEOUT"] = float(os.environ.get("PDF_CONVERT_TIMEOUT", "60"))
+# مفسّر Python لعمّال التحويل: python3 النظام غالباً هو من يملك uno (حزمة python3-uno) لا بيئة التطبيق
+app.config["PDF_WORKER_PYTHON"] = os.environ.get("PDF_WORKER_PYTHON") or None
+# كاش المستندات المولّدة (DOCX/PDF) معنون بالمحتوى مع حد أقصى للحجم الكلي
+app.config["RENDER_CACHE_FOLDER"] = os.environ.get("RENDER_CACHE_FOLDER") or os.path.join(app.instance_path, "render_cache")
+app.config["RENDER_CACHE_MAX_MB"] = int(os.environ.get("RENDER_CACHE_MAX_MB", "256"))
+app.config["BULK_RENDER_WORKERS"] = int(os.environ.get("BULK_RENDER_WORKERS", "4"))
+# أرشيف مستندات المعاملات: عدد الملفات التي تُجلب من التخزين البعيد بالتوازي
+app.config["BUNDLE_FETCH_WORKERS"] = int(os.environ.get("BUNDLE_FETCH_WORKERS", "4"))
+# معاينات الملفات المرفوعة (WebP صغيرة معنونة ببصمة المحتوى) تُولَّد في الخلفية
+app.config["PREVIEW_FOLDER"] = os.environ.get("PREVIEW_FOLDER") or os.path.join(app.instance_path, "previews")
+app.config["PREVIEW_WORKERS"] = int(os.environ.get("PREVIEW_WORKERS", "2"))
+# OCR للمستندات المرفوعة (يتطلب برنامج tesseract مع حزمتي ara و eng)
+app.config["OCR_WORKERS"] = int(os.environ.get("OCR_WORKERS", "2"))
+app.config["OCR_LANG"] = os.environ.get("OCR_LANG", "ara+eng")
+app.config["OCR_ON_UPLOAD"] = os.environ.get("OCR_ON_UPLOAD", "1") == "1"
+# إرسال الملفات بعد التحقق من الصلاحية: direct (sendfile من gunicorn) | accel (nginx X-Accel-Redirect) | sendfile (X-Sendfile)
+app.config["FILE_OFFLOAD"] = os.environ.get("FILE_OFFLOAD", "direct")
+app.config["FILE_OFFLOAD_PREFIX"] = os.environ.get("FILE_OFFLOAD_PREFIX", "/_protected")
+# تطبيع صور الإيصالات والمصروفات عند الرفع (تدوير EXIF، تصغير، إعادة ترميز)
+app.config["IMAGE_NORMALIZE"] = os.environ.get("IMAGE_NORMALIZE", "1") == "1"
+app.config["IMAGE_MAX_DIMENSION"] = int(os.environ.get("IMAGE_MAX_DIMENSION", "2000"))
+app.config["IMAGE_FORMAT"] = os.environ.get("IMAGE_FORMAT", "webp")
+app.config["IMAGE_QUALITY"] = int(os.environ.get("IMAGE_QUALITY", "80"))
+app.config["IMAGE_KEEP_ORIGINAL"] = os.environ.get("IMAGE_KEEP_ORIGINAL", "0") == "1"
+app.config["IMAGE_NORMALIZE_WORKERS"] = int(os.environ.get("IMAGE_NORMALIZE_WORKERS", "2"))
+
 # ---------------- Backblaze B2 ----------------
 # يفضل ضبط بيانات الدخول عبر متغيرات البيئة: B2_KEY_ID و B2_APPLICATION_KEY
 app.config["B2_KEY_ID"] = os.environ.get("B2_KEY_ID")
@@ -73,74 +123,49 @@ app.config["B2_APPLICATION_KEY"] = os.environ.get("B2_APPLICATION_KEY")
 app.config["B2_BUCKET_ID"] = os.environ.get("B2_BUCKET_ID")
 app.config["B2_BUCKET_NAME"] = os.environ.get("B2_BUCKET_NAME") or os.environ.get("B2_BUCKET")
 
+# طبقة التخزين: القرص المحلي أولاً ثم نسخ غير متزامن إلى B2 (أو بديل وهمي عبر STORAGE_REMOTE=fake)
+storage = configure_storage(app, UPLOAD_FOLDER)
+# الملفات المرفوعة تُخزَّن معنونة بالمحتوى (uploads/blobs/..) مع إزالة التكرار، وتُنسخ للخادم البعيد
+upload_store = UploadStore(UPLOAD_FOLDER, storage=storage)
+app.extensions["upload_store"] = upload_store
+# رفع على دفعات قابلة للاستئناف للملفات الكبيرة (/api/uploads)
+resumable_uploads = ResumableUploads(upload_store)
+app.extensions["resumable_uploads"] = resumable_uploads
+previews = PreviewGenerator(upload_store, app.config["PREVIEW_FOLDER"], workers=app.config["PREVIEW_WORKERS"])
+upload_store.listeners.append(previews.on_new_blob)
+app.extensions["previews"] = previews
+ocr_pipeline = OcrPipeline(upload_store, workers=app.config["OCR_WORKERS"], lang=app.config["OCR_LANG"], app=app)
+if app.config["OCR_ON_UPLOAD"]:
+    upload_store.listeners.append(ocr_pipeline.on_new_blob)
+app.extensions["ocr"] = ocr_pipeline
+file_offload = FileOffload(app.config["FILE_OFFLOAD"], app.config["FILE_OFFLOAD_PREFIX"])
+file_offload.add_root("uploads", UPLOAD_FOLDER)
+file_offload.add_root("previews", app.config["PREVIEW_FOLDER"])
+app.extensions["file_offload"] = file_offload
+image_normalizer = ImageNormalizer(
+    upload_store,
+    max_dimension=app.config["IMAGE_MAX_DIMENSION"],
+    fmt=app.config["IMAGE_FORMAT"],
+    quality=app.config["IMAGE_QUALITY"],
+    keep_original=app.config["IMAGE_KEEP_ORIGINAL"],
+    workers=app.config["IMAGE_NORMALIZE_WORKERS"],
+    enabled=app.config["IMAGE_NORMALIZE"],
+)
+app.extensions["image_normalizer"] = image_normalizer
+
 def get_b2_api() -> B2Api:
-    key_id = app.config.get("B2_KEY_ID")
-    app_key = app.config.get("B2_APPLICATION_KEY")
-    if not key_id or not app_key:
-        raise RuntimeError("B2 credentials (B2_KEY_ID/B2_APPLICATION_KEY) are not configured")
-    info = InMemoryAccountInfo()
-    api = B2Api(info)
-    api.authorize_account("production", key_id, app_key)
-    return api
+    # اتصال واحد مفوَّض لكل عملية (يُجدد تلقائياً) بدل authorize_account في كل استدعاء
+    return storage.b2.api()
 
 def get_b2_bucket():
-    api = get_b2_api()
-    bucket_id = app.config.get("B2_BUCKET_ID")
-    bucket_name = app.config.get("B2_BUCKET_NAME")
-
-    # أولوية: إذا عرّف المستخدم المعرّف نبحث به، وإلا نحاول بالاسم
-    if bucket_id:
-        try:
-            # متوفر في b2sdk v2
-            return api.get_bucket_by_id(bucket_id)
-        except Exception:
-            # احتياطيًا: ابحث ضمن القوائم
-            for b in api.list_buckets():
-                if getattr(b, "id_", None) == bucket_id:
-                    return b
-            raise RuntimeError("B2 bucket not found for configured B2_BUCKET_ID")
-
-    if bucket_name:
-        try:
-            return api.get_bucket_by_name(bucket_name)
-        except Exception:
-            for b in api.list_buckets():
-                if getattr(b, "name", None) == bucket_name:
-                    return b
-            raise RuntimeError("B2 bucket not found for configured B2_BUCKET_NAME/B2_BUCKET")
-
-    raise RuntimeError("B2 bucket is not configured. Set B2_BUCKET_ID or B2_BUCKET_NAME/B2_BUCKET")
+    return storage.b2.bucket()
 
 # توليد رابط تنزيل عام مباشر لملف داخل Backblaze B2 (يتطلب أن يكون البكت عامًا)
 def build_b2_public_url(file_name: str) -> str | None:
+    if not file_name:
+        return None
     try:
-        if not file_name:
-            return None
-        api = get_b2_api()
-        # الحصول على base download url من معلومات الحساب (تختلف حسب نسخة b2sdk)
-        download_base = None
-        try:
-            download_base = api.account_info.get_download_url()  # type: ignore[attr-defined]
-        except Exception:
-            try:
-                download_base = api.session.account_info.get_download_url()  # type: ignore[attr-defined]
-            except Exception:
-                download_base = None
-
-        bucket_name = app.config.get("B2_BUCKET_NAME")
-        if not bucket_name:
-            try:
-                bucket = get_b2_bucket()
-                bucket_name = getattr(bucket, "name", None)
-            except Exception:
-                bucket_name = None
-
-        if not download_base or not bucket_name:
-            return None
-
-        from urllib.parse import quote
-        # ملاحظة: يفترض أن البكت عام. إن كان خاصًا فسيحتاج رابطًا موقّتًا (خارج نطاق هذا الطلب)
-        return f"{download_base}/file/{bucket_name}/{quote(file_name)}"
+        return storage.b2.public_url(file_name)
     except Exception:
         return None
 
@@ -318,18 +343,30 @@ app.register_blueprint(dashboard_bp)
 from consulting.employee.routes import consulting_employee_bp
 app.register_blueprint(consulting_employee_bp)
 
+# ---------------- ملفات static ببصمات المحتوى (python3 static_assets.py build) ----------------
+# url_for('static', ...) يُخرج الأسماء ذات البصمة وتُخدَّم بـ immutable لمدة سنة مع gzip/brotli مسبق
+static_assets = StaticAssets(app)
+
 # ---------------- Service Worker at root scope ----------------
 @app.route('/service-worker.js')
 def serve_service_worker():
+    sw_path = os.path.join(app.root_path, 'static', 'service-worker.js')
     try:
-        sw_path = os.path.join(app.root_path, 'static', 'service-worker.js')
-        # Ensure correct content type and caching so browser picks updates
-        response = send_file(sw_path, mimetype='application/javascript', max_age=0)
-        response.headers['Service-Worker-Allowed'] = '/'
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        return response
-    except Exception:
+        with open(sw_path, encoding='utf-8') as f:
+            source = f.read()
+    except OSError:
         return abort(404)
+    # قائمة ملفات الواجهة للتخزين المسبق؛ تغيّر أي بصمة يغيّر نص الملف فيُثبَّت Service Worker جديد
+    precache = (
+        f"const PRECACHE_VERSION = {json.dumps(static_assets.version)};\n"
+        f"const PRECACHE_URLS = {json.dumps(static_assets.shell_urls())};\n"
+    )
+    response = Response(precache + source, mimetype='application/javascript')
+    response.headers['Service-Worker-Allowed'] = '/'
+    # no-cache (وليس no-store): المتصفح يتحقق عبر ETag ويحصل على 304 إن لم يتغير شيء
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(hashlib.sha256(response.get_data()).hexdigest()[:16])
+    return response.make_conditional(request)
 
 # ---------------- بث/إشارة تحديث المعاملات (نسخة بسيطة) ----------------
 TRANSACTIONS_VERSION = 0
@@ -349,29 +386,92 @@ def api_transactions_version():
 # -------- تجزئة الملفات للتحقق من سلامتها --------
 
 # ---------------- توليد رقم فاتورة فريد ----------------
+def _reserve_invoice_serials(year: int, count: int) -> int:
+    """يحجز `count` رقماً متتالياً لسنة معينة بعبارة واحدة ذرّية ويعيد آخر رقم في الدفعة.
+
+    - PostgreSQL/SQLite: INSERT ... ON CONFLICT (year) DO UPDATE ... RETURNING
+      (قفل الصف يبقى حتى نهاية المعاملة الحالية فلا يحصل عاملان على نفس الرقم)
+    - غير ذلك: UPDATE ثم SELECT داخل نفس المعاملة (UPDATE يأخذ قفل الكتابة أولاً)
+    """
+    table = InvoiceSequence.__table__
+    dialect = db.session.get_bind().dialect
+    if dialect.name in ("postgresql", "sqlite") and getattr(dialect, "insert_returning", False):
+        if dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        stmt = (
+            upsert(table)
+            .values(year=year, last_number=count)
+            .on_conflict_do_update(
+                index_elements=[table.c.year],
+                set_={"last_number": table.c.last_number + count},
+            )
+            .returning(table.c.last_number)
+        )
+        return int(db.session.execute(stmt).scalar_one())
+
+    updated = db.session.execute(
+        table.update().where(table.c.year == year).values(last_number=table.c.last_number + count)
+    )
+    if not updated.rowcount:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(year=year, last_number=count))
+            return count
+        except IntegrityError:
+            # عامل آخر أنشأ صف السنة في نفس اللحظة
+            db.session.execute(
+                table.update().where(table.c.year == year).values(last_number=table.c.last_number + count)
+            )
+    return int(db.session.execute(select(table.c.last_number).where(table.c.year == year)).scalar_one())
+
+
+def _format_invoice_number(prefix: str, year: int, kind: str | None, serial: int) -> str:
+    if kind:
+        return f"{prefix}-{year}-{kind}-{serial:05d}"
+    return f"{prefix}-{year}-{serial:05d}"
+
+
+def lock_invoice_sequence(year: int | None = None) -> int:
+    """يقفل صف تسلسل السنة حتى نهاية المعاملة الحالية (حجز صفري) ويعيد السنة.
+
+    يُستدعى قبل اختيار ما سيُفوتر حتى تنتظر أي دفعة متزامنة أخرى commit هذه الدفعة
+    ثم ترى فواتيرها.
+    """
+    year = year or datetime.utcnow().year
+    _reserve_invoice_serials(year, 0)
+    return year
+
+
+def allocate_invoice_numbers(
+    count: int, prefix: str = "INV", kind: str | None = None, year: int | None = None
+) -> list[str]:
+    """يحجز دفعة من أرقام الفواتير المتتالية ضمن المعاملة الحالية (بدون commit).
+
+    يُستخدم في الإصدار الجماعي حتى تُنشأ الفواتير وأرقامها في commit واحد؛
+    عند rollback تعود الأرقام المحجوزة ولا تظهر فجوات.
+    """
+    if count <= 0:
+        return []
+    current_year = year or datetime.utcnow().year
+    last = _reserve_invoice_serials(current_year, count)
+    return [_format_invoice_number(prefix, current_year, kind, n) for n in range(last - count + 1, last + 1)]
+
+
 def generate_unique_invoice_number(prefix: str = "INV", kind: str | None = None) -> str:
     """يولّد رقم فاتورة فريدًا على مستوى النظام بشكل متسلسل سنويًا.
 
     التنسيق: {prefix}-{YYYY}{optional-kind}-{NNNNN}
     أمثلة: INV-2025-00001 أو INV-2025-CUST-00042
-    يضمن عدم التكرار عبر جميع أنواع الفواتير باستخدام جدول invoice_sequence.
+    يضمن عدم التكرار عبر جميع أنواع الفواتير باستخدام جدول invoice_sequence،
+    والحجز ذرّي على مستوى قاعدة البيانات فلا يتكرر الرقم بين عمّال gunicorn.
     """
-    current_year = datetime.utcnow().year
-    # احصل/أنشئ صف السنة الحالية
-    seq = InvoiceSequence.query.filter_by(year=current_year).first()
-    if not seq:
-        seq = InvoiceSequence(year=current_year, last_number=0)
-        db.session.add(seq)
-        db.session.commit()
-
-    # زد الرقم المتسلسل
-    seq.last_number = int(seq.last_number or 0) + 1
+    number = allocate_invoice_numbers(1, prefix=prefix, kind=kind)[0]
     db.session.commit()
+    return number
+
 
-    serial = f"{seq.last_number:05d}"
-    if kind:
-        return f"{prefix}-{current_year}-{kind}-{serial}"
-    return f"{prefix}-{current_year}-{serial}"
 def compute_file_sha256(file_path: str) -> str:
     """إرجاع بصمة SHA-256 لملف كبير بطريقة فعّالة بالذاكرة."""
     sha256 = hashlib.sha256()
@@ -723,8 +823,9 @@ class Transaction(db.Model):
     land_value      = db.Column(db.Float, default=0)
     building_value  = db.Column(db.Float, default=0)
     total_estimate  = db.Column(db.Float, default=0)
+    # قديم: قوائم أسماء مفصولة بفواصل؛ المرفقات الآن في transaction_attachment (attachments)
     files           = db.Column(db.Text)
-    # ملفات أُرسلت للبنك بواسطة الموظف (قائمة أسماء مفصولة بفواصل)
+    # ملفات أُرسلت للبنك بواسطة الموظف (قديم، انظر attachments بنوع bank)
     bank_sent_files = db.Column(db.Text)
     area            = db.Column(db.Float, default=0)
     building_area   = db.Column(db.Float, default=0)
@@ -770,6 +871,18 @@ class Transaction(db.Model):
     report_b2_file_id = db.Column(db.String(255), nullable=True)
 
     payments = db.relationship("Payment", backref="transaction", lazy=True)
+    attachments = db.relationship(
+        "TransactionAttachment", backref="transaction", lazy=True,
+        cascade="all, delete-orphan", order_by="TransactionAttachment.id",
+    )
+
+    @property
+    def file_attachments(self):
+        return [a for a in self.attachments if a.kind != KIND_BANK]
+
+    @property
+    def bank_attachments(self):
+        return [a for a in self.attachments if a.kind == KIND_BANK]
 
 
 class NotificationSubscription(db.Model):
@@ -942,10 +1055,29 @@ class BranchDocument(db.Model):
     b2_file_name = db.Column(db.String(255), nullable=True)
     b2_file_id = db.Column(db.String(255), nullable=True)
     issued_at = db.Column(db.DateTime, nullable=True)
-    expires_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     branch = db.relationship("Branch", backref="documents")
 
+# 🔔 تنبيهات انتهاء مستندات الفروع (يملؤها sweep_document_alerts)
+class BranchDocumentAlert(db.Model):
+    __tablename__ = "branch_document_alert"
+    __table_args__ = (
+        db.UniqueConstraint("document_id", "alert_type", "expiry_date", name="unique_branch_document_alert"),
+        {"extend_existing": True},
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey("branch_document.id"), nullable=False)
+    branch_id = db.Column(db.Integer, db.ForeignKey("branch.id"), nullable=False, index=True)
+    alert_type = db.Column(db.String(20), nullable=False)  # تحذير / انتهاء
+    days_before_expiry = db.Column(db.Integer, nullable=True)
+    expiry_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), default="نشط", index=True)  # نشط / معالج / ملغي
+    notified_at = db.Column(db.DateTime, nullable=True)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    document = db.relationship("BranchDocument", backref=db.backref("alerts", lazy=True, cascade="all, delete-orphan"))
+
 # ✅ مستندات عامة مرسلة إلى البنوك (غير مرتبطة بمعاملة)
 class BankDocument(db.Model):
     __tablename__ = "bank_document"
@@ -1259,6 +1391,24 @@ def column_exists(table_name: str, column_name: str) -> bool:
     except Exception:
         return False
 
+# ---------------- فِلتر جينجا: اسم الملف المرفوع للعرض ----------------
+@app.template_filter('upload_name')
+def upload_display_name(ref):
+    return display_name(ref)
+
+# ---------------- معاينات الملفات المرفوعة ----------------
+PREVIEW_EXTENSIONS = {"pdf", "jpg", "jpeg", "png", "gif", "webp", "tif", "tiff", "bmp"}
+
+@app.template_global("preview_url")
+def preview_url(ref):
+    """رابط المعاينة المصغّرة لمرجع ملف في المخزن، أو None إن لم تكن المعاينة ممكنة."""
+    sha256, name = parse_blob_ref(ref or "")
+    if not sha256 or name.rsplit(".", 1)[-1].lower() not in PREVIEW_EXTENSIONS:
+        return None
+    if previews.unavailable(sha256):
+        return None
+    return url_for("upload_preview", sha256=sha256)
+
 # ---------------- فِلتر جينجا: "كم مضى" بالعربية ----------------
 @app.template_filter('ago')
 def naturaltime_ar(dt):
@@ -1328,6 +1478,217 @@ def document_status(doc):
     except Exception:
         return "بدون تاريخ انتهاء"
 
+# ---------------- تنبيهات انتهاء المستندات ----------------
+# المسح يمر على المستندات عبر فهرس تاريخ الانتهاء (expiry_date / expires_at) ويحدّث جداول التنبيهات
+# (hr_document_alert / branch_document_alert)، واللوحات تقرأ التنبيهات النشطة فقط.
+DOCUMENT_ALERT_WARNING_DAYS = int(os.environ.get("DOCUMENT_ALERT_WARNING_DAYS", "30"))
+# المجدول الداخلي (0 = معطل والاعتماد على cron: python3 document_alert_sweep.py)
+DOCUMENT_ALERT_SWEEP_MINUTES = int(os.environ.get("DOCUMENT_ALERT_SWEEP_MINUTES", "60"))
+DOCUMENT_ALERT_BATCH_SIZE = 500
+ALERT_WARNING = "تحذير"
+ALERT_EXPIRED = "انتهاء"
+
+
+def _sync_document_alerts(alert_model, owner_field, docs, today):
+    """مزامنة تنبيهات دفعة مستندات [(document_id, owner_id, expiry_date)] وإرجاع عدد التنبيهات الجديدة.
+
+    - التنبيه المطلوب: "انتهاء" إن انتهى المستند، وإلا "تحذير".
+    - التنبيه النشط بتاريخ انتهاء مختلف يعني أن المستند جُدّد ⇒ "معالج".
+    - تحذير نشط لمستند انتهى ⇒ "ملغي" (حلّ محله تنبيه الانتهاء).
+    - تنبيه بنفس المفتاح عولج يدوياً لا يُعاد إنشاؤه.
+    """
+    if not docs:
+        return 0
+    now = datetime.utcnow()
+    existing = {}
+    for alert in alert_model.query.filter(alert_model.document_id.in_([d[0] for d in docs])).all():
+        existing.setdefault(alert.document_id, []).append(alert)
+
+    new_rows = []
+    for document_id, owner_id, expiry in docs:
+        wanted = ALERT_EXPIRED if expiry < today else ALERT_WARNING
+        days_left = (expiry - today).days
+        found = False
+        for alert in existing.get(document_id, []):
+            if alert.alert_type == wanted and alert.expiry_date == expiry:
+                found = True
+                if alert.status == "نشط" and alert.days_before_expiry != days_left:
+                    alert.days_before_expiry = days_left
+            elif alert.status == "نشط":
+                alert.status = "معالج" if alert.expiry_date != expiry else "ملغي"
+                alert.resolved_at = now
+        if not found:
+            new_rows.append({
+                "document_id": document_id,
+                owner_field: owner_id,
+                "alert_type": wanted,
+                "days_before_expiry": days_left,
+                "expiry_date": expiry,
+                "status": "نشط",
+                "created_at": now,
+            })
+    if not new_rows:
+        return 0
+    return _insert_new_alerts(alert_model, new_rows)
+
+
+def _insert_new_alerts(alert_model, rows) -> int:
+    """إدراج التنبيهات وإرجاع عدد ما أُدرج فعلاً.
+
+    عمليتا مسح متزامنتان (عدة عمليات gunicorn) قد تدرجان نفس التنبيه: يُتجاوز الصف المكرر
+    وحده (ON CONFLICT DO NOTHING على القيد الفريد) وتُدرج بقية الدفعة.
+    """
+    table = alert_model.__table__
+    dialect = db.session.get_bind().dialect
+    if dialect.name in ("postgresql", "sqlite") and getattr(dialect, "insert_returning", False):
+        if dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        stmt = (
+            upsert(table)
+            .on_conflict_do_nothing(index_elements=[table.c.document_id, table.c.alert_type, table.c.expiry_date])
+            .returning(table.c.id)
+        )
+        return len(db.session.execute(stmt, rows).all())
+
+    inserted = 0
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert(), row)
+            inserted += 1
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def _notify_document_alerts(alert_model, roles, title, body_template):
+    """إرسال التنبيهات الجديدة على دفعات: إشعار واحد لكل مستخدم لكل دفعة بدل إشعار لكل مستند."""
+    pending = [
+        alert_id for (alert_id,) in db.session.query(alert_model.id)
+        .filter(alert_model.status == "نشط", alert_model.notified_at.is_(None))
+        .order_by(alert_model.id.asc())
+    ]
+    if not pending:
+        return 0
+    recipients = [user_id for (user_id,) in db.session.query(User.id).filter(User.role.in_(roles))]
+    sent = 0
+    for offset in range(0, len(pending), DOCUMENT_ALERT_BATCH_SIZE):
+        batch = pending[offset:offset + DOCUMENT_ALERT_BATCH_SIZE]
+        # حجز الدفعة قبل الإرسال: UPDATE ... WHERE notified_at IS NULL يمنع الإرسال المزدوج
+        claimed = db.session.execute(
+            update(alert_model)
+            .where(alert_model.id.in_(batch), alert_model.notified_at.is_(None))
+            .values(notified_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            continue
+        for user_id in recipients:
+            send_notification(user_id, title, body_template.format(count=claimed))
+        sent += claimed
+    return sent
+
+
+def sweep_document_alerts(today=None, notify=True, branch_document_ids=None):
+    """مسح مستندات الموظفين والفروع وتحديث تنبيهات الانتهاء (قابل لإعادة التشغيل دون تكرار).
+
+    branch_document_ids: لتحديث تنبيهات مستندات فرع محددة فقط (بعد رفعها أو تعديلها).
+    """
+    today = today or date.today()
+    horizon = today + timedelta(days=DOCUMENT_ALERT_WARNING_DAYS)
+    horizon_dt = datetime.combine(horizon + timedelta(days=1), datetime.min.time())
+    now = datetime.utcnow()
+    result = {"employee": 0, "branch": 0, "notified": 0}
+
+    try:
+        branch_docs = (
+            db.session.query(BranchDocument.id, BranchDocument.branch_id, BranchDocument.expires_at)
+            .filter(BranchDocument.expires_at < horizon_dt)
+        )
+        branch_out_of_range = select(BranchDocument.id).where(or_(
+            BranchDocument.expires_at.is_(None), BranchDocument.expires_at >= horizon_dt
+        ))
+        if branch_document_ids is not None:
+            branch_docs = branch_docs.filter(BranchDocument.id.in_(branch_document_ids))
+            branch_out_of_range = branch_out_of_range.where(BranchDocument.id.in_(branch_document_ids))
+        sources = [(BranchDocumentAlert, "branch_id", branch_docs, branch_out_of_range, "branch")]
+        if branch_document_ids is None:
+            sources.append((
+                DocumentAlert, "employee_id",
+                db.session.query(EmployeeDocument.id, EmployeeDocument.employee_id, EmployeeDocument.expiry_date)
+                .filter(EmployeeDocument.expiry_date <= horizon),
+                select(EmployeeDocument.id).where(or_(
+                    EmployeeDocument.expiry_date.is_(None), EmployeeDocument.expiry_date > horizon
+                )),
+                "employee",
+            ))
+
+        for alert_model, owner_field, docs_query, out_of_range, key in sources:
+            docs = [
+                (doc_id, owner_id, expiry.date() if isinstance(expiry, datetime) else expiry)
+                for doc_id, owner_id, expiry in docs_query.all()
+            ]
+            for offset in range(0, len(docs), DOCUMENT_ALERT_BATCH_SIZE):
+                result[key] += _sync_document_alerts(
+                    alert_model, owner_field, docs[offset:offset + DOCUMENT_ALERT_BATCH_SIZE], today
+                )
+            # مستندات جُدّدت خارج نافذة التحذير أو أزيل تاريخ انتهائها: تنبيهاتها النشطة تُعالج
+            db.session.execute(
+                update(alert_model)
+                .where(alert_model.status == "نشط", alert_model.document_id.in_(out_of_range))
+                .values(status="معالج", resolved_at=now)
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if notify:
+        result["notified"] += _notify_document_alerts(
+            DocumentAlert, ["manager", "hr", "hr_manager"],
+            "🔔 مستندات موظفين تنتهي قريباً", "{count} مستند موظفين انتهى أو ينتهي خلال " + f"{DOCUMENT_ALERT_WARNING_DAYS} يوماً",
+        )
+        result["notified"] += _notify_document_alerts(
+            BranchDocumentAlert, ["manager"],
+            "🔔 وثائق فروع تنتهي قريباً", "{count} وثيقة فرع انتهت أو تنتهي خلال " + f"{DOCUMENT_ALERT_WARNING_DAYS} يوماً",
+        )
+    return result
+
+
+_document_alert_sweep_at = None
+_document_alert_sweep_lock = threading.Lock()
+
+
+def _run_document_alert_sweep():
+    try:
+        with app.app_context():
+            try:
+                sweep_document_alerts()
+            except Exception as e:
+                db.session.rollback()
+                print("DOCUMENT ALERT SWEEP ERROR:", e)
+    finally:
+        _document_alert_sweep_lock.release()
+
+
+@app.before_request
+def schedule_document_alert_sweep():
+    """مجدول داخلي خفيف: يطلق المسح في خيط خلفي كل DOCUMENT_ALERT_SWEEP_MINUTES دقيقة."""
+    global _document_alert_sweep_at
+    if DOCUMENT_ALERT_SWEEP_MINUTES <= 0:
+        return
+    now_utc = datetime.utcnow()
+    if _document_alert_sweep_at and (now_utc - _document_alert_sweep_at).total_seconds() < DOCUMENT_ALERT_SWEEP_MINUTES * 60:
+        return
+    if not _document_alert_sweep_lock.acquire(blocking=False):
+        return
+    _document_alert_sweep_at = now_utc
+    threading.Thread(target=_run_document_alert_sweep, daemon=True).start()
+
 # ---------------- المسارات ----------------
 @app.route("/")
 def index():
@@ -1920,6 +2281,23 @@ def employee_dashboard():
     # تمرير السعر الافتراضي (لو ما فيه ذاكرة نخليه صفر)
     price_per_meter = 0.0  
 
+    # حالة المستندات من التنبيهات النشطة (يحدّثها sweep_document_alerts)
+    alert_types = {}
+    if branch_docs:
+        alert_types = dict(
+            db.session.query(BranchDocumentAlert.document_id, BranchDocumentAlert.alert_type)
+            .filter(BranchDocumentAlert.branch_id == user.branch_id, BranchDocumentAlert.status == "نشط")
+            .all()
+        )
+
+    def status_for(doc):
+        alert_type = alert_types.get(doc.id)
+        if alert_type == ALERT_EXPIRED:
+            return "منتهي"
+        if alert_type == ALERT_WARNING:
+            return "قارب على الانتهاء"
+        return "ساري" if doc.expires_at else "بدون تاريخ انتهاء"
+
     return render_template(
         "employee.html",
         transactions=transactions,
@@ -1927,7 +2305,7 @@ def employee_dashboard():
         vapid_public_key=VAPID_PUBLIC_KEY,
         price_per_meter=price_per_meter,
         docs=branch_docs,
-        status_for=document_status,
+        status_for=status_for,
         start_date=start_date_str,
         end_date=end_date_str,
         real_estate_brought_count=real_estate_brought_count,
@@ -2087,10 +2465,8 @@ def add_transaction():
     saved_files = []
     for file in files:
         if file and file.filename:
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
-            saved_files.append(filename)
-    t.files = ",".join(saved_files)
+            saved_files.append(upload_store.save(file))
+    add_attachments(upload_store, t, saved_files)
 
     db.session.add(t)
     db.session.commit()
@@ -2325,10 +2701,12 @@ def manager_dashboard():
         })
 
     # 🔔 مستندات على وشك الانتهاء خلال 30 يومًا (كل الفروع)
-    expiring_docs = BranchDocument.query.filter(
-        BranchDocument.expires_at != None,
-        BranchDocument.expires_at <= (now + timedelta(days=30))
-    ).order_by(BranchDocument.expires_at.asc()).all()
+    expiring_docs = (
+        BranchDocument.query.join(BranchDocumentAlert, BranchDocumentAlert.document_id == BranchDocument.id)
+        .filter(BranchDocumentAlert.status == "نشط")
+        .order_by(BranchDocumentAlert.expiry_date.asc())
+        .all()
+    )
 
     # ⚠️ معاملات متأخرة (5 ساعات)
     five_hours_ago = now - timedelta(hours=5)
@@ -3202,11 +3580,8 @@ def add_transaction_engineer():
                 saved_files = []
                 for file in files:
                     if file and file.filename:
-                        filename = secure_filename(file.filename)
-                        file.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
-                        saved_files.append(filename)
-                if saved_files:
-                    t.files = ",".join(saved_files)
+                        saved_files.append(upload_store.save(file))
+                add_attachments(upload_store, t, saved_files)
             except Exception:
                 # إن حدث خطأ أثناء رفع الملفات، نُكمل إنشاء المعاملة بدون ملفات
                 pass
@@ -3240,12 +3615,20 @@ def engineer_upload_report(tid):
 
     t = Transaction.query.get_or_404(tid)
 
-    if "report_file" not in request.files or request.files["report_file"].filename == "":
+    # الملف إما مرفوع على دفعات مسبقاً (upload_id) أو ضمن النموذج مباشرة
+    file = request.files.get("report_file")
+    upload_ref = None
+    if request.form.get("upload_id"):
+        upload_ref = resumable_uploads.consume(request.form.get("upload_id"), session.get("user_id"), "report")
+        if not upload_ref:
+            flash("⚠️ لم يكتمل رفع الملف، يرجى المحاولة مرة أخرى", "danger")
+            return redirect(url_for("engineer_transaction_details", tid=tid))
+        original_name = display_name(upload_ref)
+    elif not file or file.filename == "":
         flash("⚠️ لم يتم اختيار ملف", "danger")
         return redirect(url_for("engineer_dashboard"))
-
-    file = request.files["report_file"]
-    original_name = file.filename
+    else:
+        original_name = file.filename
     # السماح فقط برفع ملفات PDF
     if not original_name.lower().endswith(".pdf"):
         flash("⚠️ يجب رفع ملف بصيغة PDF.", "danger")
@@ -3266,7 +3649,12 @@ def engineer_upload_report(tid):
     # احفظ الملف باسم رقم التقرير مثل ref1010.pdf
     filename = secure_filename(f"{t.report_number}.pdf")
     filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(filepath)
+    if upload_ref:
+        # التقرير يُختم ويُعدَّل في مكانه، لذا نأخذ نسخة من المحتوى ونحرر المرجع المؤقت
+        shutil.copyfile(upload_store.resolve(upload_ref), filepath)
+        upload_store.release(upload_ref)
+    else:
+        file.save(filepath)
 
     # 1) حساب بصمة الملف الأصلي كما في index.html
     try:
@@ -3318,28 +3706,12 @@ def engineer_upload_report(tid):
         final_hash = None
     t.report_sha256 = final_hash or original_hash
 
-    # 5) رفع التقرير النهائي إلى Backblaze B2 وتخزين بياناته (إن أمكن)
-    try:
-        bucket = get_b2_bucket()
-        with open(filepath, "rb") as fh:
-            data = fh.read()
-        safe_ref = (t.report_number or "ref").replace("/", "-")
-        b2_name = f"reports/{t.id}_{safe_ref}_{int(time.time())}.pdf"
-        uploaded = bucket.upload_bytes(data, file_name=b2_name)
+    # 5) نسخ التقرير النهائي إلى التخزين البعيد في الخلفية بعد commit؛ معرّف الملف يُسجَّل عند اكتمال النسخ
+    safe_ref = (t.report_number or "ref").replace("/", "-")
+    b2_name = f"reports/{t.id}_{safe_ref}_{int(time.time())}.pdf"
+    if storage.replicate_after_commit(db.session, filename, remote_key=b2_name, callback=_record_report_replica):
         t.report_b2_file_name = b2_name
-        t.report_b2_file_id = getattr(uploaded, "id_", None) or getattr(uploaded, "file_id", None)
-    except Exception as e:
-        # إذا لم تُضبط مفاتيح B2 أو حدث خطأ، نتجاهل بدون إيقاف العملية
-        try:
-            print(
-                f"⚠️ B2 upload failed for transaction {t.id}: {e} | "
-                f"has_key_id={bool(app.config.get('B2_KEY_ID'))}, "
-                f"has_application_key={bool(app.config.get('B2_APPLICATION_KEY'))}, "
-                f"bucket_id={app.config.get('B2_BUCKET_ID')}"
-            )
-        except Exception:
-            pass
-        pass
+        t.report_b2_file_id = None
 
     db.session.commit()
     bump_transactions_version()
@@ -3395,8 +3767,7 @@ def finance_dashboard():
         file = request.files.get("file")
         filename = None
         if file and file.filename:
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
+            filename = image_normalizer.save(file)
         e = Expense(
             description=expense_name,
             amount=amount,
@@ -3535,167 +3906,156 @@ def _fill_docx_from_template_xml(template_path: str, out_path: str, mapping: dic
                 zout.writestr(info, data)
 
 
-def _set_paragraph_rtl(paragraph, rtl: bool = True) -> None:
-    try:
-        from docx.oxml import OxmlElement
-        from docx.oxml.ns import qn
-        pPr = paragraph._p.get_or_add_pPr()
-        bidi = OxmlElement('w:bidi')
-        bidi.set(qn('w:val'), '1' if rtl else '0')
-        pPr.append(bidi)
-    except Exception:
-        pass
+# القالب الافتراضي (فاتورة/عرض سعر) يُعبّأ بنفس مسار استبدال XML المستخدم للقوالب المرفوعة
+DEFAULT_DOCX_TEMPLATE = os.path.join(app.root_path, "docx_templates", "default_document.docx")
 
 
-def _generate_default_docx(doc_type: str, placeholders: dict, out_path: str) -> None:
-    # ينشئ ملف DOCX افتراضي عربي منسق كجدول لفاتورة/عرض سعر
-    from docx import Document as DocxDocument
-    from docx.shared import Pt
-    from docx.enum.text import WD_ALIGN_PARAGRAPH
-    from docx.enum.table import WD_TABLE_ALIGNMENT
+def _docx_text_value(value) -> str:
+    # القيم تُحقن داخل <w:t> مباشرة: نهرب رموز XML ونحوّل الأسطر إلى فواصل أسطر وورد
+    text = xml_escape(str(value if value is not None else ""))
+    return text.replace("\r\n", "\n").replace("\n", '</w:t><w:br/><w:t xml:space="preserve">')
 
-    document = DocxDocument()
 
-    # ترويسة
-    header_p = document.add_paragraph()
-    header_text = "invoice" if doc_type == "invoice" else "عرض سعر"
-    run = header_p.add_run(header_text)
-    run.bold = True
-    try:
-        run.font.size = Pt(16)
-        run.font.name = "Arial"
-    except Exception:
-        pass
-    header_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    _set_paragraph_rtl(header_p, True)
-
-    document.add_paragraph().add_run(" ")
-
-    # ملخص أساسي
-    meta_pairs = [
-        ("رقم العملية", placeholders.get("TRANSACTION_ID", "")),
-        ("التاريخ", placeholders.get("DATE", "")),
-        ("العميل", placeholders.get("CLIENT_NAME", placeholders.get("NAME", ""))),
-        ("الموظف", placeholders.get("EMPLOYEE", "")),
-        ("البنك", placeholders.get("BANK_NAME", "")),
-        ("فرع البنك", placeholders.get("BANK_BRANCH", "")),
-    ]
+def _default_docx_mapping(doc_type: str, placeholders: dict) -> dict:
+    ref_text = placeholders.get("INVOICE_NO") or placeholders.get("QUOTE_NO") or placeholders.get("QUTE_NO")
+    values = {
+        "DOC_TITLE": "invoice" if doc_type == "invoice" else "عرض سعر",
+        "TRANSACTION_ID": placeholders.get("TRANSACTION_ID", ""),
+        "DATE": placeholders.get("DATE", ""),
+        "CLIENT_NAME": placeholders.get("CLIENT_NAME", placeholders.get("NAME", "")),
+        "EMPLOYEE": placeholders.get("EMPLOYEE", ""),
+        "BANK_NAME": placeholders.get("BANK_NAME", ""),
+        "BANK_BRANCH": placeholders.get("BANK_BRANCH", ""),
+        "PRICE": placeholders.get("PRICE", placeholders.get("AMOUNT", "0.00")),
+        "TAX": placeholders.get("TAX", "0.00"),
+        "TOTAL_PRICE": placeholders.get("TOTAL_PRICE", placeholders.get("TOTAL", "0.00")),
+        "DETAILS": placeholders.get("DETAILS", ""),
+        "REFERENCE_LINE": f"المرجع: {ref_text}" if ref_text else "",
+    }
+    return {key: _docx_text_value(value) for key, value in values.items()}
+
+
+_pdf_converter: DocxPdfConverter | None = None
+_render_cache: RenderCache | None = None
+# خيوط التوليد الجماعي (iter_rendered_documents) قد تطلب الكائنات المشتركة في نفس اللحظة
+_render_services_lock = threading.Lock()
+
+
+def get_pdf_converter() -> DocxPdfConverter:
+    """مجموعة تحويل PDF واحدة لكل عملية (تُنشأ عند أول طلب لا عند الاستيراد)."""
+    global _pdf_converter
+    if _pdf_converter is None:
+        with _render_services_lock:
+            if _pdf_converter is None:
+                converter = DocxPdfConverter(
+                    work_dir=app.config["RENDER_CACHE_FOLDER"],
+                    workers=app.config.get("PDF_CONVERTER_WORKERS", 2),
+                    timeout=app.config.get("PDF_CONVERT_TIMEOUT", 60),
+                    soffice=find_soffice(),
+                    python=app.config.get("PDF_WORKER_PYTHON"),
+                )
+                converter.start()
+                _pdf_converter = converter
+    return _pdf_converter
+
+
+def get_render_cache() -> RenderCache:
+    global _render_cache
+    if _render_cache is None:
+        # نسخة واحدة فقط: أقفال المفاتيح داخل RenderCache هي ما يمنع توليد نفس المحتوى مرتين
+        with _render_services_lock:
+            if _render_cache is None:
+                _render_cache = RenderCache(
+                    app.config["RENDER_CACHE_FOLDER"],
+                    max_bytes=app.config.get("RENDER_CACHE_MAX_MB", 256) * 1024 * 1024,
+                )
+    return _render_cache
 
-    table = document.add_table(rows=0, cols=2)
-    try:
-        table.style = 'Table Grid'
-        table.alignment = WD_TABLE_ALIGNMENT.CENTER
-    except Exception:
-        pass
 
-    for label, value in meta_pairs:
-        row_cells = table.add_row().cells
-        lc = row_cells[0].paragraphs[0]
-        lr = lc.add_run(str(label))
-        lr.bold = True
-        try:
-            lr.font.name = "Arial"; lr.font.size = Pt(11)
-        except Exception:
-            pass
-        _set_paragraph_rtl(lc, True)
-        lc.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+def _send_rendered_file(path: str, download_name: str, etag: str, mimetype: str | None = None):
+    # no-cache: المتصفح يحتفظ بالنسخة لكنه يتحقق عبر ETag قبل كل استخدام
+    response = send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name, etag=etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
-        rc = row_cells[1].paragraphs[0]
-        rr = rc.add_run(str(value))
-        try:
-            rr.font.name = "Arial"; rr.font.size = Pt(11)
-        except Exception:
-            pass
-        _set_paragraph_rtl(rc, True)
-        rc.alignment = WD_ALIGN_PARAGRAPH.RIGHT
 
-    document.add_paragraph().add_run(" ")
+def _resolve_docx_template(doc_type: str, placeholders: dict, branch_id: int | None = None) -> tuple[str, dict, bool]:
+    """يعيد (مسار القالب، القيم الجاهزة للاستبدال، هل القالب مرفوع) لنوع المستند والفرع."""
+    template_filename = get_template_filename(doc_type, branch_id)
+    if template_filename:
+        return os.path.join(app.config["UPLOAD_FOLDER"], template_filename), placeholders, True
+    # لا يوجد قالب مرفوع: القالب الافتراضي العربي المرفق مع التطبيق
+    return DEFAULT_DOCX_TEMPLATE, _default_docx_mapping(doc_type, placeholders), False
+
 
-    # جدول المبلغ والضريبة والإجمالي
-    amounts = [
-        ("السعر قبل الضريبة", placeholders.get("PRICE", placeholders.get("AMOUNT", "0.00"))),
-        ("الضريبة", placeholders.get("TAX", "0.00")),
-        ("الإجمالي بعد الضريبة", placeholders.get("TOTAL_PRICE", placeholders.get("TOTAL", "0.00"))),
-    ]
+def _render_cached_docx(template_path: str, mapping: dict, key: str) -> str:
+    return get_render_cache().get_or_create(
+        key, "docx", lambda tmp_path: _fill_docx_from_template_xml(template_path, tmp_path, mapping)
+    )
+
+
+def _render_cached_pdf(docx_path: str, key: str) -> str:
+    return get_render_cache().get_or_create(
+        key, "pdf", lambda tmp_path: get_pdf_converter().convert(docx_path, tmp_path)
+    )
+
+
+def _render_document_file(template_path: str, mapping: dict, output_format: str = "docx") -> str:
+    """يولّد المستند (أو يجلبه من الكاش) ويعيد مساره. لا يلمس قاعدة البيانات ولا الطلب،
+    لذا يصلح للتشغيل داخل خيوط متوازية."""
+    cache = get_render_cache()
+    key = cache.key(cache.template_sha256(template_path), mapping)
+    docx_path = _render_cached_docx(template_path, mapping, key)
+    if (output_format or "").lower() == "pdf":
+        return _render_cached_pdf(docx_path, key)
+    return docx_path
+
+
+def _render_docx_from_template(
+    doc_type: str,
+    placeholders: dict,
+    out_name: str,
+    branch_id: int | None = None,
+    output_format: str = "docx",
+):
+    template_path, mapping, uploaded = _resolve_docx_template(doc_type, placeholders, branch_id)
+    want_pdf = (output_format or "").lower() == "pdf"
+    pdf_name = os.path.splitext(out_name)[0] + ".pdf"
+
+    cache = get_render_cache()
+    key = cache.key(cache.template_sha256(template_path), mapping)
+    docx_etag = f"{key}-docx"
+    pdf_etag = f"{key}-pdf"
+
+    # طلب شرطي لنسخة لم تتغير: لا توليد ولا نقل
+    if request.if_none_match.contains(pdf_etag if want_pdf else docx_etag):
+        response = Response(status=304)
+        response.set_etag(pdf_etag if want_pdf else docx_etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    if want_pdf:
+        cached_pdf = cache.get(key, "pdf")
+        if cached_pdf:
+            return _send_rendered_file(cached_pdf, pdf_name, pdf_etag, mimetype="application/pdf")
 
-    amt_table = document.add_table(rows=1, cols=3)
     try:
-        amt_table.style = 'Table Grid'
-        amt_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+        docx_path = _render_cached_docx(template_path, mapping, key)
     except Exception:
-        pass
+        flash("⚠️ تعذر تعبئة القالب" if uploaded else "⚠️ تعذر إنشاء القالب الافتراضي", "warning")
+        return redirect(url_for("finance_templates"))
 
-    hdr_cells = amt_table.rows[0].cells
-    headers = ["البند", "القيمة", "العملة"]
-    for idx, text in enumerate(headers):
-        p = hdr_cells[idx].paragraphs[0]
-        r = p.add_run(text)
-        r.bold = True
-        try:
-            r.font.name = "Arial"; r.font.size = Pt(11)
-        except Exception:
-            pass
-        _set_paragraph_rtl(p, True)
-        p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-    for label, value in amounts:
-        row = amt_table.add_row().cells
-        p0 = row[0].paragraphs[0]
-        r0 = p0.add_run(label)
-        r0.bold = True
-        _set_paragraph_rtl(p0, True)
-        p0.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-
-        p1 = row[1].paragraphs[0]
-        p1.add_run(str(value))
-        _set_paragraph_rtl(p1, True)
-        p1.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        p2 = row[2].paragraphs[0]
-        p2.add_run("ريال عماني")
-        _set_paragraph_rtl(p2, True)
-        p2.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-    document.add_paragraph().add_run(" ")
-
-    # تفاصيل إضافية
-    details_title = document.add_paragraph()
-    dr = details_title.add_run("التفاصيل")
-    dr.bold = True
-    _set_paragraph_rtl(details_title, True)
-    details_title.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-
-    details_p = document.add_paragraph()
-    details_p.add_run(placeholders.get("DETAILS", ""))
-    _set_paragraph_rtl(details_p, True)
-    details_p.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-
-    # أرقام المستند
-    ref_p = document.add_paragraph()
-    ref_text = placeholders.get("INVOICE_NO") or placeholders.get("QUOTE_NO") or placeholders.get("QUTE_NO")
-    if ref_text:
-        ref_run = ref_p.add_run(f"المرجع: {ref_text}")
-        ref_run.bold = True
-    _set_paragraph_rtl(ref_p, True)
-    ref_p.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-
-    # حفظ
-    document.save(out_path)
-def _render_docx_from_template(doc_type: str, placeholders: dict, out_name: str, branch_id: int | None = None):
-    template_filename = get_template_filename(doc_type, branch_id)
-    output_path = os.path.join(app.config["UPLOAD_FOLDER"], out_name)
-    if not template_filename:
-        # لا يوجد قالب مرفوع: أنشئ ملف DOCX افتراضي عربي منسق
+    if want_pdf:
         try:
-            _generate_default_docx(doc_type, placeholders, output_path)
-            return send_file(output_path, as_attachment=True, download_name=out_name)
-        except Exception:
-            flash("⚠️ تعذر إنشاء القالب الافتراضي", "warning")
-            return redirect(url_for("finance_templates"))
-    else:
-        path = os.path.join(app.config["UPLOAD_FOLDER"], template_filename)
-        _fill_docx_from_template_xml(path, output_path, placeholders)
-        return send_file(output_path, as_attachment=True, download_name=out_name)
+            pdf_path = _render_cached_pdf(docx_path, key)
+            return _send_rendered_file(pdf_path, pdf_name, pdf_etag, mimetype="application/pdf")
+        except Exception as e:
+            # في حال فشل التحويل نسلّم ملف الوورد بدلاً من إيقاف العملية
+            print(f"⚠️ PDF conversion failed for {out_name}: {e}")
+            flash("⚠️ تعذر تحويل المستند إلى PDF، تم تنزيل نسخة Word", "warning")
+    return _send_rendered_file(docx_path, out_name, docx_etag)
 
 
 def _get_vat_rate() -> float:
@@ -3812,6 +4172,7 @@ def download_quote_doc(transaction_id: int):
         placeholders,
         out_name,
         branch_id=t.branch_id,
+        output_format=(request.args.get("format") or "docx"),
     )
 
 @app.route("/finance/templates/invoice/<int:transaction_id>")
@@ -3865,6 +4226,7 @@ def download_invoice_doc(transaction_id: int):
         placeholders,
         out_name,
         branch_id=t.branch_id,
+        output_format=(request.args.get("format") or "docx"),
     )
 
 # ✅ طباعة فاتورة HTML احترافية للمعاملة
@@ -4038,32 +4400,8 @@ def print_customer_quote_html(quote_id: int):
         employee_name=(transaction.employee if transaction else "-"),
     )
 
-# ✅ تنزيل فاتورة بنك (من جدول BankInvoice)
-@app.route("/finance/download/bank_invoice/<int:invoice_id>")
-def download_bank_invoice_doc(invoice_id: int):
-    if session.get("role") not in ["finance", "manager"]:
-        return redirect(url_for("login"))
-    inv = BankInvoice.query.get_or_404(invoice_id)
-    bank = Bank.query.get(inv.bank_id)
-    # اختيار الفرع: إن وجدت معاملة مرتبطة نستخدم فرعها، وإلا فرع موظف المالية
-    preferred_branch_id = None
-    transaction = None
-    if inv.transaction_id:
-        transaction = Transaction.query.get(inv.transaction_id)
-        preferred_branch_id = transaction.branch_id if transaction else None
-    if preferred_branch_id is None:
-        user = User.query.get(session.get("user_id"))
-        preferred_branch_id = getattr(user, "branch_id", None)
-
+def _bank_invoice_placeholders(inv: "BankInvoice", bank: "Bank | None", transaction: "Transaction | None", apply_vat: bool = True) -> dict:
     amount = float(inv.amount or 0)
-    # ضريبة اختيارية عبر الاستعلام
-    apply_vat = (request.args.get("apply_vat") or "1") == "1"
-    vat_percent = request.args.get("vat")
-    if vat_percent is not None:
-        try:
-            os.environ["VAT_RATE"] = str(float(vat_percent) / 100.0)
-        except Exception:
-            pass
     tax, total_with_tax = _compute_tax_and_total(amount) if apply_vat else (0.0, amount)
     placeholders = {
         "NAME": (bank.name if bank else f"Bank #{inv.bank_id}"),
@@ -4095,6 +4433,168 @@ def download_bank_invoice_doc(invoice_id: int):
             "BUILDING_VALUE": f"{float(transaction.building_value or 0):.2f}",
             "TOTAL_ESTIMATE": f"{float(transaction.total_estimate or 0):.2f}",
         })
+    return placeholders
+
+
+def _month_bounds(day: date) -> tuple[datetime, datetime]:
+    start = datetime(day.year, day.month, 1)
+    end = datetime(day.year + (day.month == 12), day.month % 12 + 1, 1)
+    return start, end
+
+
+def uninvoiced_bank_transactions_query(period_start: datetime, period_end: datetime, bank_id: int | None = None):
+    """المعاملات المؤهلة للفوترة: مرتبطة ببنك، غير مرفوضة، ولا توجد لها فاتورة بنك سابقة."""
+    invoiced = db.session.query(BankInvoice.id).filter(BankInvoice.transaction_id == Transaction.id)
+    query = Transaction.query.filter(
+        Transaction.bank_id.isnot(None),
+        Transaction.date >= period_start,
+        Transaction.date < period_end,
+        or_(Transaction.status.is_(None), Transaction.status != "مرفوضة"),
+        ~invoiced.exists(),
+    )
+    if bank_id:
+        query = query.filter(Transaction.bank_id == bank_id)
+    return query.order_by(Transaction.bank_id.asc(), Transaction.id.asc())
+
+
+BULK_INVOICE_ATTEMPTS = 3
+
+
+def issue_bank_invoices_for_period(
+    period_start: datetime,
+    period_end: datetime,
+    bank_id: int | None = None,
+    note: str | None = None,
+) -> list["BankInvoice"]:
+    """ينشئ فواتير بنك لكل المعاملات غير المفوترة ضمن الفترة [period_start, period_end).
+
+    الأرقام تُحجز كدفعة واحدة وكل السجلات تُحفظ في commit واحد؛ أي خطأ يلغي الدفعة كاملة.
+    قفل صف التسلسل يسبق اختيار المعاملات، فالدفعة المتزامنة (الويب و bank_invoice_run.py أو
+    إرسال مزدوج) تنتظر ثم لا ترى إلا ما لم يُفوتر بعد. الفهرس الفريد على transaction_id يمنع
+    التكرار مع إنشاء فاتورة مفردة لنفس المعاملة؛ عندها تُعاد المحاولة على ما تبقى.
+    """
+    for attempt in range(BULK_INVOICE_ATTEMPTS):
+        try:
+            return _issue_bank_invoices_once(period_start, period_end, bank_id, note)
+        except IntegrityError as e:
+            db.session.rollback()
+            if attempt + 1 == BULK_INVOICE_ATTEMPTS:
+                raise
+            print(f"⚠️ Bulk bank invoices: transaction invoiced concurrently, retrying ({e.orig})")
+    return []
+
+
+def _issue_bank_invoices_once(period_start, period_end, bank_id, note) -> list["BankInvoice"]:
+    try:
+        year = lock_invoice_sequence()
+        transactions = uninvoiced_bank_transactions_query(period_start, period_end, bank_id).all()
+        if not transactions:
+            db.session.commit()
+            return []
+        numbers = allocate_invoice_numbers(len(transactions), prefix="INV", kind="BANK", year=year)
+        issued_at = datetime.utcnow()
+        invoices = [
+            BankInvoice(
+                bank_id=t.bank_id,
+                transaction_id=t.id,
+                amount=float(t.fee or 0),
+                note=note,
+                issued_at=issued_at,
+                invoice_number=number,
+            )
+            for t, number in zip(transactions, numbers)
+        ]
+        db.session.add_all(invoices)
+        db.session.flush()
+        invoice_ids = [inv.id for inv in invoices]
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    # إعادة التحميل باستعلام واحد بدلاً من تحديث كل سجل منتهٍ بعد commit على حدة
+    return BankInvoice.query.filter(BankInvoice.id.in_(invoice_ids)).order_by(BankInvoice.id.asc()).all()
+
+
+def prepare_bank_invoice_documents(invoices: list["BankInvoice"]) -> list[tuple[str, str, dict]]:
+    """يجهز (اسم الملف، مسار القالب، القيم) لكل فاتورة. يقرأ قاعدة البيانات لذا يُستدعى قبل التوليد المتوازي."""
+    bank_ids = {inv.bank_id for inv in invoices}
+    tx_ids = {inv.transaction_id for inv in invoices if inv.transaction_id}
+    banks = {b.id: b for b in Bank.query.filter(Bank.id.in_(bank_ids)).all()} if bank_ids else {}
+    transactions = {t.id: t for t in Transaction.query.filter(Transaction.id.in_(tx_ids)).all()} if tx_ids else {}
+    jobs = []
+    for inv in invoices:
+        transaction = transactions.get(inv.transaction_id)
+        bank = banks.get(inv.bank_id)
+        placeholders = _bank_invoice_placeholders(inv, bank, transaction)
+        template_path, mapping, _ = _resolve_docx_template(
+            "invoice", placeholders, transaction.branch_id if transaction else None
+        )
+        bank_label = (secure_filename(bank.name) if bank and bank.name else "") or f"bank_{inv.bank_id}"
+        name = f"{bank_label}/{inv.invoice_number or f'bank_invoice_{inv.id}'}"
+        jobs.append((name, template_path, mapping))
+    return jobs
+
+
+BULK_RENDER_ERRORS_NOTE = "errors.txt"
+
+
+def iter_rendered_documents(
+    jobs: list[tuple[str, str, dict]],
+    output_format: str = "docx",
+    workers: int = 4,
+    errors: list | None = None,
+):
+    """يولّد المستندات بالتوازي ويعيد (اسم داخل الأرشيف، المسار) بنفس ترتيب المهام فور جاهزية كل منها.
+
+    فشل مستند واحد لا يقطع الأرشيف (الفواتير محفوظة مسبقاً): يُعاد مساره None فيسرده iter_zip
+    في BULK_RENDER_ERRORS_NOTE، ويُضاف (الاسم، الخطأ) إلى errors إن مُرّرت.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    ext = "pdf" if (output_format or "").lower() == "pdf" else "docx"
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            (name, pool.submit(_render_document_file, template_path, mapping, ext))
+            for name, template_path, mapping in jobs
+        ]
+        for name, future in futures:
+            arcname = f"{name}.{ext}"
+            try:
+                path = future.result()
+            except Exception as e:
+                print(f"⚠️ Bulk render failed for {arcname}: {e}")
+                if errors is not None:
+                    errors.append((arcname, str(e)))
+                path = None
+            yield arcname, path
+
+
+# ✅ تنزيل فاتورة بنك (من جدول BankInvoice)
+@app.route("/finance/download/bank_invoice/<int:invoice_id>")
+def download_bank_invoice_doc(invoice_id: int):
+    if session.get("role") not in ["finance", "manager"]:
+        return redirect(url_for("login"))
+    inv = BankInvoice.query.get_or_404(invoice_id)
+    bank = Bank.query.get(inv.bank_id)
+    # اختيار الفرع: إن وجدت معاملة مرتبطة نستخدم فرعها، وإلا فرع موظف المالية
+    preferred_branch_id = None
+    transaction = None
+    if inv.transaction_id:
+        transaction = Transaction.query.get(inv.transaction_id)
+        preferred_branch_id = transaction.branch_id if transaction else None
+    if preferred_branch_id is None:
+        user = User.query.get(session.get("user_id"))
+        preferred_branch_id = getattr(user, "branch_id", None)
+
+    # ضريبة اختيارية عبر الاستعلام
+    apply_vat = (request.args.get("apply_vat") or "1") == "1"
+    vat_percent = request.args.get("vat")
+    if vat_percent is not None:
+        try:
+            os.environ["VAT_RATE"] = str(float(vat_percent) / 100.0)
+        except Exception:
+            pass
+    placeholders = _bank_invoice_placeholders(inv, bank, transaction, apply_vat=apply_vat)
 
     out_name = f"bank_invoice_{inv.id}.docx"
     return _render_docx_from_template(
@@ -4102,6 +4602,7 @@ def download_bank_invoice_doc(invoice_id: int):
         placeholders,
         out_name,
         branch_id=preferred_branch_id,
+        output_format=(request.args.get("format") or "docx"),
     )
 
 # ✅ تنزيل فاتورة عميل (من جدول CustomerInvoice)
@@ -4166,6 +4667,7 @@ def download_customer_invoice_doc(invoice_id: int):
         placeholders,
         out_name,
         branch_id=preferred_branch_id,
+        output_format=(request.args.get("format") or "docx"),
     )
 
 # ✅ تنزيل عرض سعر عميل (من جدول CustomerQuote)
@@ -4220,6 +4722,7 @@ def download_customer_quote_doc(quote_id: int):
         placeholders,
         out_name,
         branch_id=preferred_branch_id,
+        output_format=(request.args.get("format") or "docx"),
     )
 
 # ✅ إضافة دفعة جديدة
@@ -4241,8 +4744,7 @@ def add_payment(tid):
         receipt = request.files.get("receipt_file")
         filename = None
         if receipt and receipt.filename:
-            filename = secure_filename(receipt.filename)
-            receipt.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
+            filename = image_normalizer.save(receipt)
         payment = Payment(
             transaction_id=transaction.id,
             amount=amount,
@@ -4312,7 +4814,16 @@ def finance_create_bank_invoice():
         issued_at=datetime.utcnow(),
     )
     db.session.add(inv)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # للمعاملة فاتورة بنك سابقة (uq_bank_invoice_transaction)
+        db.session.rollback()
+        existing = BankInvoice.query.filter_by(transaction_id=int(transaction_id)).first()
+        flash("⚠️ توجد فاتورة بنك سابقة لهذه المعاملة", "warning")
+        if existing:
+            return redirect(url_for("print_bank_invoice_html", invoice_id=existing.id))
+        return redirect(url_for("finance_dashboard"))
 
     # توليد رقم فاتورة فريد بعد إنشاء السجل والحصول على id
     try:
@@ -4328,6 +4839,42 @@ def finance_create_bank_invoice():
     flash("✅ تم إنشاء فاتورة البنك", "success")
     return redirect(url_for("print_bank_invoice_html", invoice_id=inv.id) + "?auto=1")
 
+# ✅ إصدار فواتير البنك لنهاية الشهر دفعة واحدة وتنزيلها كأرشيف ZIP
+@app.route("/finance/bank_invoices/bulk", methods=["POST"])
+def finance_bulk_bank_invoices():
+    if session.get("role") != "finance":
+        return redirect(url_for("login"))
+
+    bank_id = request.form.get("bank_id", type=int)
+    output_format = (request.form.get("format") or "docx").lower()
+    try:
+        month = datetime.strptime(request.form.get("month") or "", "%Y-%m").date()
+    except ValueError:
+        flash("⛔ الشهر غير صالح، استخدم الصيغة YYYY-MM", "danger")
+        return redirect(url_for("finance_dashboard"))
+    period_start, period_end = _month_bounds(month)
+
+    try:
+        invoices = issue_bank_invoices_for_period(
+            period_start, period_end, bank_id=bank_id, note=(request.form.get("note") or None)
+        )
+    except Exception as e:
+        print(f"⚠️ Bulk bank invoice run failed: {e}")
+        flash("⚠️ تعذر إصدار الفواتير، لم يتم حفظ أي فاتورة", "warning")
+        return redirect(url_for("finance_dashboard"))
+    if not invoices:
+        flash("ℹ️ لا توجد معاملات غير مفوترة في هذه الفترة", "info")
+        return redirect(url_for("finance_dashboard"))
+
+    jobs = prepare_bank_invoice_documents(invoices)
+    entries = iter_rendered_documents(jobs, output_format, workers=app.config.get("BULK_RENDER_WORKERS", 4))
+    archive_name = f"bank_invoices_{period_start:%Y-%m}.zip"
+    return Response(
+        iter_zip(entries, missing_note=BULK_RENDER_ERRORS_NOTE),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{archive_name}"'},
+    )
+
 # ✅ تحديث حالة فاتورة البنك (تسليم / استلام)
 @app.route("/finance/bank_invoices/<int:invoice_id>/status", methods=["POST"])
 def finance_update_bank_invoice_status(invoice_id: int):
@@ -4349,8 +4896,7 @@ def finance_update_bank_invoice_status(invoice_id: int):
             return redirect(url_for("finance_dashboard"))
 
         # حفظ الإيصال
-        filename = secure_filename(receipt.filename)
-        receipt.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
+        filename = image_normalizer.save(receipt)
 
         invoice.received_at = datetime.utcnow()
         db.session.commit()
@@ -4413,6 +4959,9 @@ def finance_update_bank_invoice_status(invoice_id: int):
         if created_income:
             flash("✅ تم تحديث الحالة وإضافة الدخل", "success")
         else:
+            # الإيصال لم يُربط بأي دفعة (دفعة سابقة بنفس المبلغ): نحرر مرجعه ومرجع أصله المحتفظ به
+            image_normalizer.release(filename)
+            db.session.commit()
             flash("✅ تم تحديث الحالة", "success")
     else:
         flash("⚠️ إجراء غير معروف", "warning")
@@ -4731,29 +5280,14 @@ def bank_detail(bank_id):
         pay_query = pay_query.filter(Payment.date_received < end_date)
     payments = pay_query.order_by(Payment.date_received.desc()).all()
 
-    # المستندات المرتبطة بمعاملات هذا البنك
+    # المستندات المرتبطة بمعاملات هذا البنك (ملفات المعاملة + ملفات البنك، بدون التقارير)
     # ملاحظة: نعرضها دائمًا بدون أي فلترة حسب التاريخ بناءً على طلب المستخدم
-    txs = (
-        Transaction.query
-        .filter(Transaction.bank_id == bank_id)
-        .order_by(Transaction.id.desc())
-        .all()
-    )
-    documents = []
-    for t in txs:
-        # ملفات متعددة محفوظة كسلسلة مفصولة بفواصل
-        if t.files:
-            for fname in (t.files or "").split(","):
-                fname = (fname or "").strip()
-                if fname:
-                    documents.append({"transaction_id": t.id, "filename": fname})
-        # لا نعرض ملفات التقارير هنا حسب الطلب
-        # ملفات البنك التي رفعها الموظف
-        if getattr(t, "bank_sent_files", None):
-            for fname in (t.bank_sent_files or "").split(","):
-                fname = (fname or "").strip()
-                if fname:
-                    documents.append({"transaction_id": t.id, "filename": fname})
+    try:
+        docs_page = max(int(request.args.get("docs_page") or 1), 1)
+    except ValueError:
+        docs_page = 1
+    docs_per_page = 50
+    documents, documents_total = bank_attachments_page(bank_id, docs_page, docs_per_page)
 
     # 📨 مستندات عامة مرسلة للبنك (غير مرتبطة بمعاملة)
     try:
@@ -4807,6 +5341,9 @@ def bank_detail(bank_id):
         total_tx=total_tx,
         payments=payments,
         documents=documents,
+        documents_total=documents_total,
+        docs_page=docs_page,
+        docs_per_page=docs_per_page,
         general_docs=general_docs,
         invoices=invoices,
         invoice_summary=invoice_summary,
@@ -4928,7 +5465,12 @@ def update_bank_invoice_stage(bank_id):
         if amount:
             invoice.amount = amount
         db.session.add(invoice)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # فاتورة المعاملة أُنشئت من مكان آخر (دفعة نهاية الشهر مثلاً): نحدّث مراحلها
+            db.session.rollback()
+            invoice = BankInvoice.query.filter_by(transaction_id=int(transaction_id)).first_or_404()
 
     now_ts = datetime.utcnow()
     if action == "issue":
@@ -5164,35 +5706,176 @@ def complete_invitation(token: str):
         form_values=form_values,
     )
 
+def _record_report_replica(remote_key, file_id):
+    """يُستدعى من طابور النسخ بعد وصول التقرير إلى التخزين البعيد."""
+    Transaction.query.filter_by(report_b2_file_name=remote_key).update(
+        {"report_b2_file_id": file_id}, synchronize_session=False
+    )
+    db.session.commit()
+
+def _requeue_report_replicas():
+    """sweeper لطابور النسخ: التقارير التي لم يُسجَّل معرّفها على التخزين البعيد بعد."""
+    rows = (
+        db.session.query(Transaction.report_file, Transaction.report_b2_file_name)
+        .filter(
+            Transaction.report_file.isnot(None),
+            Transaction.report_b2_file_name.isnot(None),
+            Transaction.report_b2_file_id.is_(None),
+        )
+        .all()
+    )
+    db.session.rollback()
+    for report_file, b2_name in rows:
+        if storage.has_local(report_file):
+            storage.replicate(report_file, remote_key=b2_name, callback=_record_report_replica)
+
+storage.sweepers.append(_requeue_report_replicas)
+
+@app.before_request
+def start_storage_replication():
+    # خيط النسخ لا ينتقل عبر fork (gunicorn --preload)؛ أول طلب في كل عامل يشغّله فيعيد جدولة ما لم يُنسخ
+    storage.start()
+
+def _report_url(t):
+    """رابط التقرير: النسخة المحلية إن وُجدت (أسرع)، وإلا الرابط العام على التخزين البعيد."""
+    if storage.has_local(t.report_file):
+        return url_for("uploaded_file", filename=t.report_file)
+    return build_b2_public_url(getattr(t, "report_b2_file_name", None)) or url_for("uploaded_file", filename=t.report_file)
+
+def _send_report(t):
+    if storage.has_local(t.report_file):
+        return _send_upload(t.report_file)
+    remote_key = getattr(t, "report_b2_file_name", None)
+    b2_url = build_b2_public_url(remote_key)
+    if b2_url:
+        return redirect(b2_url)
+    stream = storage.open(None, remote_key) if remote_key else None
+    if stream is None:
+        abort(404)
+    return Response(stream, mimetype="application/pdf")
+
 @app.route("/r/<string:token>")
 def public_report(token):
     t = Transaction.query.filter_by(public_share_token=token).first_or_404()
     if not t.report_file:
         abort(404)
-    # إن كان للمعاملة ملف مرفوعًا على B2 ونستطيع توليد رابط عام، حوّل المستخدم له
-    if getattr(t, "report_b2_file_name", None):
-        b2_url = build_b2_public_url(t.report_b2_file_name)
-        if b2_url:
-            return redirect(b2_url)
-    return send_from_directory(app.config["UPLOAD_FOLDER"], t.report_file)
+    return _send_report(t)
 
 # ---------------- عرض الملفات ----------------
+def _send_upload(filename, as_attachment=False):
+    """إرسال ملف من مجلد الرفع عبر file_offload؛ مراجع blobs/ تُحل إلى ملف المحتوى مع الاسم الأصلي."""
+    if not is_blob_ref(filename):
+        path = safe_join(app.config["UPLOAD_FOLDER"], filename)
+        if not path or not os.path.isfile(path):
+            abort(404)
+        return file_offload.send(path, as_attachment=as_attachment)
+    path = upload_store.resolve(filename)
+    if not path or not os.path.isfile(path):
+        # النسخة المحلية غير موجودة (قرص جديد مثلاً): نمرر المحتوى من التخزين البعيد
+        stream = upload_store.open(filename)
+        if stream is None:
+            abort(404)
+        return Response(stream, mimetype=mimetypes.guess_type(display_name(filename))[0] or "application/octet-stream")
+    # المحتوى لا يتغير لنفس البصمة، فهي ETag ثابت
+    sha256 = parse_blob_ref(filename)[0]
+    return file_offload.send(path, download_name=display_name(filename), as_attachment=as_attachment, etag=sha256)
+
 @app.route("/uploads/<path:filename>")
 def uploaded_file(filename):
-    resp = send_from_directory(app.config["UPLOAD_FOLDER"], filename)
-    try:
-        # Ensure inline display in browser tabs instead of forced download
-        basename = os.path.basename(filename)
-        resp.headers["Content-Disposition"] = f'inline; filename="{basename}"'
-        # Make sure Content-Type is set appropriately for better inline rendering
-        if not resp.headers.get("Content-Type") or resp.headers.get("Content-Type") == "application/octet-stream":
-            import mimetypes
-            guessed, _ = mimetypes.guess_type(basename)
-            if guessed:
-                resp.headers["Content-Type"] = guessed
-    except Exception:
-        pass
-    return resp
+    # inline (وليس تنزيلاً) حتى يعرض المتصفح ملفات PDF والصور في تبويب
+    return _send_upload(filename)
+
+# رمز بديل يظهر حتى تجهز المعاينة (لا يُخزَّن مؤقتاً في المتصفح)
+PREVIEW_PLACEHOLDER_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="64" height="80" viewBox="0 0 64 80">'
+    '<rect x="1" y="1" width="62" height="78" rx="4" fill="#f1f3f5" stroke="#ced4da"/>'
+    '<path d="M14 22h36M14 34h36M14 46h24" stroke="#adb5bd" stroke-width="4"/></svg>'
+)
+
+@app.route("/preview/<string:sha256>.webp")
+def upload_preview(sha256):
+    if not re.fullmatch(r"[0-9a-f]{64}", sha256 or ""):
+        abort(404)
+    if previews.ready(sha256):
+        # نفس البصمة = نفس المعاينة دائماً
+        return file_offload.send(previews.path(sha256), mimetype="image/webp", etag=sha256, immutable=True)
+    if previews.unavailable(sha256) or not os.path.isfile(upload_store.blob_path(sha256)):
+        abort(404)
+    # التوليد في مجمع العمال وليس داخل الطلب
+    previews.schedule(sha256)
+    return Response(PREVIEW_PLACEHOLDER_SVG, status=202, mimetype="image/svg+xml", headers={"Cache-Control": "no-store", "Retry-After": "2"})
+
+# ---------------- OCR: استخراج النص والبحث فيه ----------------
+def _ocr_result(sha256):
+    row = ocr_pipeline.get(sha256)
+    if row is None:
+        return {"sha256": sha256, "status": "queued" if ocr_pipeline.enabled else "unavailable"}
+    result = {"sha256": sha256, "status": row.status, "pages": row.pages}
+    if row.status == "done":
+        result["fields"] = extract_fields(row.text)
+        result["text"] = (row.text or "")[:2000]
+    return result
+
+@app.route("/api/ocr/extract", methods=["POST"])
+def api_ocr_extract():
+    """رفع مستند (صك/إيصال) لقراءته وتعبئة نموذج المعاملة؛ النتيجة تُطلب لاحقاً من /api/ocr/<sha256>."""
+    if session.get("role") not in ["employee", "manager"]:
+        return jsonify({"error": "unauthorized"}), 401
+    if not ocr_pipeline.enabled:
+        return jsonify({"error": "ocr_unavailable"}), 503
+    f = request.files.get("file")
+    if not f or not f.filename:
+        return jsonify({"error": "no_file"}), 400
+    # مسح مؤقت للتعبئة بدون مرجع: لا يُنسخ للتخزين البعيد ويحذفه collect() بعد المهلة،
+    # إلا إن أُرفق نفس الملف بالمعاملة بعد حفظها (فيأخذ مرجعه من هناك)
+    ref = upload_store.save(f, refs=0)
+    db.session.commit()
+    sha256 = parse_blob_ref(ref)[0]
+    # المحتوى الموجود مسبقاً لا يمر بمستمع الرفع؛ نجدوله هنا إن لم يُقرأ بعد
+    if ocr_pipeline.get(sha256) is None:
+        ocr_pipeline.schedule(sha256)
+    return jsonify(_ocr_result(sha256)), 202
+
+@app.route("/api/ocr/<string:sha256>")
+def api_ocr_status(sha256):
+    if session.get("role") not in ["employee", "manager", "finance"]:
+        return jsonify({"error": "unauthorized"}), 401
+    if not re.fullmatch(r"[0-9a-f]{64}", sha256 or ""):
+        abort(404)
+    return jsonify(_ocr_result(sha256))
+
+@app.route("/api/ocr/search")
+def api_ocr_search():
+    """بحث في نصوص المستندات المقروءة؛ يعيد المرفقات ومستندات البنوك المرتبطة بكل نتيجة."""
+    if session.get("role") not in ["manager", "finance", "employee"]:
+        return jsonify({"error": "unauthorized"}), 401
+    q = (request.args.get("q") or "").strip()
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 50)
+    rows = ocr_pipeline.search(q, limit=limit) if q else []
+    if not rows:
+        return jsonify({"q": q, "results": []})
+    # المرجع يبدأ بمسار المحتوى: blobs/ab/cd/<sha256>/...
+    prefixes = {r.sha256: upload_store.blob_relpath(r.sha256) + "/" for r in rows}
+    attachments = TransactionAttachment.query.filter(
+        or_(*[TransactionAttachment.ref.startswith(p) for p in prefixes.values()])
+    ).all()
+    bank_docs = BankDocument.query.filter(
+        or_(*[BankDocument.file.startswith(p) for p in prefixes.values()])
+    ).all()
+    results = []
+    for r in rows:
+        prefix = prefixes[r.sha256]
+        text = r.text or ""
+        pos = text.lower().find(q.lower())
+        results.append({
+            "sha256": r.sha256,
+            "snippet": text[max(pos - 60, 0):pos + 140] if pos >= 0 else text[:200],
+            "transactions": sorted({a.transaction_id for a in attachments if a.ref.startswith(prefix)}),
+            "bank_documents": [
+                {"id": d.id, "bank_id": d.bank_id, "title": d.title} for d in bank_docs if (d.file or "").startswith(prefix)
+            ],
+        })
+    return jsonify({"q": q, "results": results})
 
 # تنزيل ملف محلي من مجلد الرفع مع إجبار التنزيل
 @app.route("/download/local/<path:filename>")
@@ -5200,7 +5883,82 @@ def download_local_file(filename):
     # يسمح للمدير والمالية فقط
     if session.get("role") not in ["manager", "finance"]:
         return redirect(url_for("login"))
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename, as_attachment=True)
+    return _send_upload(filename, as_attachment=True)
+
+# ---------------- تنزيل كل مستندات معاملة / بنك / فترة كأرشيف ZIP ----------------
+def _bundle_entries(rows):
+    """عناصر الأرشيف لمرفقات المعاملات: <رقم المعاملة>/[bank/]<اسم الملف>.
+
+    الملف المحلي يُقرأ من القرص مباشرة، وغير الموجود محلياً يُجلب من التخزين البعيد
+    (دالة فتح يشغّلها prefetch بالتوازي).
+    """
+    used = set()
+    for transaction_id, kind, ref, created_at in rows:
+        folder = f"{transaction_id}/bank" if kind == KIND_BANK else str(transaction_id)
+        base, ext = os.path.splitext(display_name(ref) or "file")
+        arcname, n = f"{folder}/{base}{ext}", 1
+        while arcname in used:
+            n += 1
+            arcname = f"{folder}/{base} ({n}){ext}"
+        used.add(arcname)
+        path = upload_store.resolve(ref)
+        if path and os.path.isfile(path):
+            source = path
+        else:
+            source = (lambda r=ref: upload_store.open(r))
+        yield ZipEntry(
+            arcname, source, compression_for(arcname),
+            created_at.timetuple()[:6] if created_at and created_at.year >= 1980 else None,
+        )
+
+@app.route("/documents/bundle.zip")
+def documents_bundle():
+    """أرشيف ZIP يُولَّد أثناء الإرسال لمرفقات معاملة (transaction_id) أو بنك (bank_id) أو فترة (start/end)."""
+    if session.get("role") not in ["manager", "finance"]:
+        return redirect(url_for("login"))
+
+    transaction_id = request.args.get("transaction_id", type=int)
+    bank_id = request.args.get("bank_id", type=int)
+    try:
+        start = datetime.fromisoformat(request.args["start"]) if request.args.get("start") else None
+        end = datetime.fromisoformat(request.args["end"]) + timedelta(days=1) if request.args.get("end") else None
+    except ValueError:
+        abort(400)
+    if not (transaction_id or bank_id or start or end):
+        abort(400)
+
+    query = (
+        db.session.query(
+            TransactionAttachment.transaction_id, TransactionAttachment.kind,
+            TransactionAttachment.ref, TransactionAttachment.created_at,
+        )
+        .join(Transaction, Transaction.id == TransactionAttachment.transaction_id)
+    )
+    name_parts = []
+    if transaction_id:
+        query = query.filter(Transaction.id == transaction_id)
+        name_parts.append(f"transaction_{transaction_id}")
+    if bank_id:
+        query = query.filter(Transaction.bank_id == bank_id)
+        name_parts.append(f"bank_{bank_id}")
+    if start:
+        query = query.filter(Transaction.date >= start)
+        name_parts.append(f"{start:%Y-%m-%d}")
+    if end:
+        query = query.filter(Transaction.date < end)
+        name_parts.append(f"{end - timedelta(days=1):%Y-%m-%d}")
+    rows = query.order_by(TransactionAttachment.transaction_id, TransactionAttachment.kind, TransactionAttachment.id).all()
+    if not rows:
+        flash("ℹ️ لا توجد مستندات لتنزيلها", "info")
+        return redirect(request.referrer or url_for("banks_overview"))
+
+    entries = prefetch(_bundle_entries(rows), workers=app.config.get("BUNDLE_FETCH_WORKERS", 4))
+    archive_name = "_".join(["documents"] + name_parts) + ".zip"
+    return Response(
+        iter_zip(entries, missing_note="missing_files.txt"),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{archive_name}"', "X-Accel-Buffering": "no"},
+    )
 
 # تنزيل ملف من B2 عبر قراءة المحتوى وتمريره كمرفق (في حال البكت خاص)
 @app.route("/download/b2")
@@ -5211,24 +5969,13 @@ def download_b2_file():
     file_name = request.args.get("file")
     if not file_name:
         abort(400)
-    # محاولة بناء رابط عام إن كان البكت عامًا
-    b2_public = build_b2_public_url(file_name)
-    if b2_public:
-        # تمرير تلميح التنزيل للمستخدم عبر هيدر Content-Disposition
-        try:
-            resp = requests.get(b2_public, stream=True, timeout=20)
-            resp.raise_for_status()
-            from flask import Response
-            cd = f"attachment; filename*=UTF-8''{file_name}"
-            headers = {
-                "Content-Disposition": cd,
-                "Content-Type": resp.headers.get("Content-Type", "application/octet-stream"),
-            }
-            return Response(resp.iter_content(chunk_size=8192), headers=headers)
-        except Exception:
-            abort(404)
-    # إن لم نستطع، نفشل بشكل آمن
-    abort(404)
+    stream = storage.open(None, file_name)
+    if stream is None:
+        abort(404)
+    return Response(stream, headers={
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(os.path.basename(file_name))}",
+        "Content-Type": mimetypes.guess_type(file_name)[0] or "application/octet-stream",
+    })
 
 # (تمت إزالة مسارات QR والروابط العامة المرتبطة بها)
 
@@ -5259,12 +6006,7 @@ def verify_by_hash():
     if not t or not t.report_file:
         return "<h2>❌ هذا التقرير غير أصلي أو تم التعديل</h2>", 404
 
-    # إن توفر ملف على B2 نحاول إنشاء رابط عام دائم
-    if getattr(t, "report_b2_file_name", None):
-        b2_url = build_b2_public_url(t.report_b2_file_name)
-    else:
-        b2_url = None
-    file_url = b2_url or url_for("uploaded_file", filename=t.report_file)
+    file_url = _report_url(t)
     return (
         f"""
         <h2>✅ التقرير أصلي</h2>
@@ -5288,12 +6030,84 @@ def file_by_hash():
     if not t or not t.report_file:
         return "❌ لم يتم العثور على ملف مرتبط بهذا الهاش", 404
 
-    # إن توفر ملف على B2 نحاول التحويل إليه مباشرة
-    if getattr(t, "report_b2_file_name", None):
-        b2_url = build_b2_public_url(t.report_b2_file_name)
-        if b2_url:
-            return redirect(b2_url)
-    return send_from_directory(app.config["UPLOAD_FOLDER"], t.report_file)
+    return _send_report(t)
+
+# ---------------- رفع على دفعات قابل للاستئناف (نمط tus) ----------------
+TUS_VERSION = "1.0.0"
+
+def _tus_headers(upload=None):
+    headers = {"Tus-Resumable": TUS_VERSION, "Cache-Control": "no-store"}
+    if upload is not None:
+        headers["Upload-Offset"] = str(upload.offset)
+        headers["Upload-Length"] = str(upload.length)
+    return headers
+
+def _tus_error(e: UploadError):
+    db.session.rollback()
+    return jsonify({"error": str(e)}), e.status, _tus_headers()
+
+@app.route("/api/uploads", methods=["POST"])
+def resumable_upload_create():
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        length = int(request.headers.get("Upload-Length", ""))
+    except ValueError:
+        return jsonify({"error": "Upload-Length is required"}), 400, _tus_headers()
+    try:
+        upload = resumable_uploads.create(user_id, length, parse_metadata(request.headers.get("Upload-Metadata")))
+    except UploadError as e:
+        return _tus_error(e)
+    headers = _tus_headers(upload)
+    headers["Location"] = url_for("resumable_upload_patch", upload_id=upload.id)
+    return jsonify({
+        "upload_id": upload.id,
+        "offset": upload.offset,
+        "chunk_size": min(MAX_RESUMABLE_CHUNK, 1024 * 1024),
+    }), 201, headers
+
+@app.route("/api/uploads/<string:upload_id>", methods=["HEAD", "PATCH", "DELETE"])
+def resumable_upload_patch(upload_id):
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        if request.method == "HEAD":
+            upload = resumable_uploads.get(upload_id, user_id)
+            return "", 200, _tus_headers(upload)
+        if request.method == "DELETE":
+            resumable_uploads.terminate(upload_id, user_id)
+            return "", 204, _tus_headers()
+        if request.mimetype != "application/offset+octet-stream":
+            return jsonify({"error": "unsupported content type"}), 415, _tus_headers()
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+        except ValueError:
+            return jsonify({"error": "Upload-Offset is required"}), 400, _tus_headers()
+        upload = resumable_uploads.append(
+            upload_id, user_id, offset, request.stream, request.content_length,
+            parse_checksum(request.headers.get("Upload-Checksum")),
+        )
+    except UploadError as e:
+        return _tus_error(e)
+    return "", 204, _tus_headers(upload)
+
+@app.route("/api/uploads/<string:upload_id>/finalize", methods=["POST"])
+def resumable_upload_finalize(upload_id):
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        upload = resumable_uploads.finalize(upload_id, user_id)
+    except UploadError as e:
+        return _tus_error(e)
+    return jsonify({
+        "upload_id": upload.id,
+        "status": upload.status,
+        "filename": upload.filename,
+        "size": upload.length,
+    }), 200, _tus_headers(upload)
 
 # ---------------- رفع ملف إلى Backblaze B2 ----------------
 @app.route("/api/upload", methods=["POST"])
@@ -5308,29 +6122,43 @@ def api_upload_to_b2():
     f = request.files["file"]
     if not f or not f.filename:
         return jsonify({"error": "empty_filename"}), 400
+    if storage.remote is None:
+        return jsonify({"error": "remote storage is not configured"}), 503
 
-    fname = secure_filename(f.filename)
+    fname = secure_filename(f.filename) or "file"
+    # لتفادي التعارض، نضيف طابعًا زمنيًا لو كان الاسم مستخدمًا
+    unique_name = f"{int(time.time())}_{fname}"
     try:
-        bucket = get_b2_bucket()
-        # نقرأ المحتوى إلى الذاكرة للبساطة. يمكن تحسين ذلك بتدفق chunked عند الحاجة
-        data = f.read()
-        # لتفادي التعارض، نضيف طابعًا زمنيًا لو كان الاسم مستخدمًا
-        unique_name = f"{int(time.time())}_{fname}"
-        uploaded = bucket.upload_bytes(data, file_name=unique_name)
-        file_id = uploaded.id_ if hasattr(uploaded, "id_") else getattr(uploaded, "file_id", None)
-        return jsonify({
-            "status": "ok",
-            "bucket_id": app.config.get("B2_BUCKET_ID"),
-            "file_name": unique_name,
-            "file_id": file_id,
-        })
+        # رفع متزامن مباشر (عبر ملف مؤقت بدل قراءة المحتوى كاملاً في الذاكرة)؛ لا نسخة في uploads/
+        file_id = storage.upload_now(f.stream, unique_name)
     except Exception as e:
-        print(
-            f"⚠️ /api/upload B2 error: {e} | "
-            f"has_key_id={bool(app.config.get('B2_KEY_ID'))}, "
-            f"has_application_key={bool(app.config.get('B2_APPLICATION_KEY'))}, "
-            f"bucket_id={app.config.get('B2_BUCKET_ID')}")
+        print(f"⚠️ /api/upload storage error: {e}")
         return jsonify({"error": str(e)}), 500
+    return jsonify({
+        "status": "ok",
+        "bucket_id": app.config.get("B2_BUCKET_ID"),
+        "file_name": unique_name,
+        "file_id": file_id,
+        "url": storage.public_url(unique_name),
+    })
+
+# ---------------- مقاييس تطبيع الصور ----------------
+@app.route("/api/images/normalization", methods=["GET"])
+def api_image_normalization():
+    """البايتات الموفرة من تطبيع صور الإيصالات والمصروفات (إجمالي + آخر العمليات)."""
+    if session.get("role") not in ["manager", "admin"]:
+        return jsonify({"error": "unauthorized"}), 401
+    result = image_normalizer.stats(recent=min(request.args.get("recent", 20, type=int) or 20, 200))
+    result["settings"] = {
+        "enabled": image_normalizer.enabled,
+        "max_dimension": image_normalizer.max_dimension,
+        "format": image_normalizer.fmt,
+        "quality": image_normalizer.quality,
+        "keep_original": image_normalizer.keep_original,
+    }
+    # عدادات هذا العامل منذ بدء التشغيل (تشمل الصور التي لم تُطبَّع)
+    result["process"] = dict(image_normalizer.counters)
+    return jsonify(result)
 
 # ---------------- فحص صحة الربط مع Backblaze B2 ----------------
 @app.route("/api/b2/health", methods=["GET"])
@@ -5344,6 +6172,11 @@ def api_b2_health():
         "has_application_key": bool(app.config.get("B2_APPLICATION_KEY")),
         "bucket_id": app.config.get("B2_BUCKET_ID"),
         "bucket_name": app.config.get("B2_BUCKET_NAME") or app.config.get("B2_BUCKET"),
+        "replication": {
+            "remote": type(storage.remote).__name__ if storage.remote is not None else None,
+            "pending": storage.pending(),
+            "failed": len(storage.failed),
+        },
     }
 
     try:
@@ -5403,28 +6236,22 @@ def api_b2_download():
     if not file_name:
         return jsonify({"error": "missing_name"}), 400
 
-    try:
-        bucket = get_b2_bucket()
-        # تنزيل المحتوى إلى الذاكرة. يمكن التحسين عبر stream_tmp file عند الكبر.
-        downloaded = bucket.download_file_by_name(file_name)
-        data = downloaded.response.content
-
-        # تخمين نوع المحتوى بشكل بسيط
-        guessed = "application/octet-stream"
-        if file_name.lower().endswith(".pdf"):
-            guessed = "application/pdf"
-        elif file_name.lower().endswith(".png"):
-            guessed = "image/png"
-        elif file_name.lower().endswith(".jpg") or file_name.lower().endswith(".jpeg"):
-            guessed = "image/jpeg"
-        elif file_name.lower().endswith(".docx"):
-            guessed = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-
-        return Response(data, mimetype=guessed, headers={
-            "Content-Disposition": f"attachment; filename=\"{os.path.basename(file_name)}\""
-        })
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    # مراجع المخزن المحلي (blobs/..) تُقرأ محلياً أولاً، وغيرها مفاتيح على التخزين البعيد
+    if is_blob_ref(file_name):
+        stream = upload_store.open(file_name)
+    else:
+        stream = storage.open(None, file_name)
+    if stream is None:
+        return jsonify({"error": "not_found"}), 404
+    return Response(stream, mimetype=mimetypes.guess_type(display_name(file_name))[0] or "application/octet-stream", headers={
+        "Content-Disposition": f"attachment; filename=\"{display_name(file_name)}\""
+    })
+
+def _save_bank_doc_uploads():
+    """مراجع ملفات البنك من النموذج: الملفات المرفقة مباشرة والرفوع المنتهية (upload_id)."""
+    saved = [upload_store.save(f) for f in request.files.getlist("bank_docs") if f and f.filename]
+    saved += resumable_uploads.consume_many(request.form.getlist("upload_id"), session.get("user_id"), "bank_docs")
+    return saved
 
 # ---------------- صفحة التقارير المشتركة ----------------
 @app.route("/employee/upload_bank_docs/<int:tid>", methods=["POST"])
@@ -5444,18 +6271,10 @@ def employee_upload_bank_docs(tid):
         flash("⚠️ يجب ربط المعاملة ببنك قبل رفع مستندات البنك.", "warning")
         return redirect(url_for("employee_dashboard"))
 
-    uploaded = request.files.getlist("bank_docs")
-    saved = []
-    for f in uploaded:
-        if f and f.filename:
-            fname = secure_filename(f.filename)
-            f.save(os.path.join(app.config["UPLOAD_FOLDER"], fname))
-            saved.append(fname)
+    saved = _save_bank_doc_uploads()
 
     if saved:
-        existing = (t.bank_sent_files or "").split(",") if t.bank_sent_files else []
-        existing = [x.strip() for x in existing if x.strip()]
-        t.bank_sent_files = ",".join(existing + saved)
+        add_attachments(upload_store, t, saved, KIND_BANK)
         db.session.commit()
         flash("✅ تم رفع ملفات البنك وحفظها", "success")
     else:
@@ -5527,13 +6346,7 @@ def employee_upload_bank_docs_lookup():
         flash("⚠️ المعاملة غير مرتبطة بأي بنك. يرجى اختيار البنك قبل رفع المستندات.", "warning")
         return redirect(url_for("employee_dashboard"))
 
-    uploaded = request.files.getlist("bank_docs")
-    saved = []
-    for f in uploaded:
-        if f and f.filename:
-            fname = secure_filename(f.filename)
-            f.save(os.path.join(app.config["UPLOAD_FOLDER"], fname))
-            saved.append(fname)
+    saved = _save_bank_doc_uploads()
 
     if saved:
         # في حال تم تحديد بنك في النموذج:
@@ -5541,9 +6354,7 @@ def employee_upload_bank_docs_lookup():
         # - وإن كانت مرتبطة ببنك مختلف، نحدث الربط للبنك المختار لضمان ظهور المستندات في صفحة البنك الصحيحة
         if bank_id_val and (not t.bank_id or t.bank_id != bank_id_val):
             t.bank_id = bank_id_val
-        existing = (t.bank_sent_files or "").split(",") if t.bank_sent_files else []
-        existing = [x.strip() for x in existing if x.strip()]
-        t.bank_sent_files = ",".join(existing + saved)
+        add_attachments(upload_store, t, saved, KIND_BANK)
         db.session.commit()
         flash("✅ تم رفع ملفات البنك وحفظها", "success")
     else:
@@ -5583,22 +6394,11 @@ def employee_add_bank_document():
     b2_file_name = None
     b2_file_id = None
     if file and file.filename:
-        # Try uploading to Backblaze B2; if fails, fallback to local save
-        safe_name = secure_filename(file.filename)
+        # الحفظ محلياً أولاً؛ النسخ إلى B2 يتم في الخلفية عبر طبقة التخزين
         try:
-            bucket = get_b2_bucket()
-            data = file.read()
-            unique_name = f"{int(time.time())}_{safe_name}"
-            uploaded = bucket.upload_bytes(data, file_name=unique_name)
-            b2_file_name = unique_name
-            b2_file_id = getattr(uploaded, "id_", None) or getattr(uploaded, "file_id", None)
+            filename = upload_store.save(file, secure_filename(file.filename))
         except Exception:
-            try:
-                filename = safe_name
-                file.stream.seek(0)
-                file.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
-            except Exception:
-                filename = None
+            filename = None
 
     try:
         doc = BankDocument(
@@ -5702,22 +6502,11 @@ def employee_add_branch_document():
     b2_file_name = None
     b2_file_id = None
     if file and file.filename:
-        safe_name = secure_filename(file.filename)
-        # Try uploading to B2 first; fallback to local disk
+        # الحفظ محلياً أولاً؛ النسخ إلى B2 يتم في الخلفية عبر طبقة التخزين
         try:
-            bucket = get_b2_bucket()
-            data = file.read()
-            unique_name = f"{int(time.time())}_{safe_name}"
-            uploaded = bucket.upload_bytes(data, file_name=unique_name)
-            b2_file_name = unique_name
-            b2_file_id = getattr(uploaded, "id_", None) or getattr(uploaded, "file_id", None)
+            filename = upload_store.save(file, secure_filename(file.filename))
         except Exception:
-            try:
-                filename = safe_name
-                file.stream.seek(0)
-                file.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
-            except Exception:
-                filename = None
+            filename = None
 
     doc = BranchDocument(
         branch_id=user.branch_id,
@@ -5731,9 +6520,17 @@ def employee_add_branch_document():
     )
     db.session.add(doc)
     db.session.commit()
+    _refresh_branch_document_alerts(doc.id)
     flash("✅ تم رفع مستند الفرع", "success")
     return redirect(url_for("employee_dashboard"))
 
+def _refresh_branch_document_alerts(doc_id):
+    # تحديث تنبيه المستند فوراً بدل انتظار المسح الدوري (الإشعارات تبقى للمسح الدوري)
+    try:
+        sweep_document_alerts(notify=False, branch_document_ids=[doc_id])
+    except Exception as e:
+        print("DOCUMENT ALERT REFRESH ERROR:", e)
+
 # ✅ تعديل مستند فرع (للموظف ضمن فرعه)
 @app.route("/employee/branch_documents/<int:doc_id>/edit", methods=["POST"])
 def employee_edit_branch_document(doc_id):
@@ -5759,34 +6556,21 @@ def employee_edit_branch_document(doc_id):
     doc.expires_at = datetime.fromisoformat(expires_at) if expires_at else None
 
     if file and file.filename:
-        safe_name = secure_filename(file.filename)
-        # Try to upload replacement to B2; fallback to local save
-        new_local = None
-        new_b2_name = None
-        new_b2_id = None
+        # الحفظ محلياً أولاً؛ النسخ إلى B2 يتم في الخلفية عبر طبقة التخزين
         try:
-            bucket = get_b2_bucket()
-            data = file.read()
-            unique_name = f"{int(time.time())}_{safe_name}"
-            uploaded = bucket.upload_bytes(data, file_name=unique_name)
-            new_b2_name = unique_name
-            new_b2_id = getattr(uploaded, "id_", None) or getattr(uploaded, "file_id", None)
+            new_local = upload_store.save(file, secure_filename(file.filename))
         except Exception:
-            try:
-                new_local = safe_name
-                file.stream.seek(0)
-                file.save(os.path.join(app.config["UPLOAD_FOLDER"], new_local))
-            except Exception:
-                new_local = None
+            new_local = None
 
-        if new_b2_name:
-            doc.b2_file_name = new_b2_name
-            doc.b2_file_id = new_b2_id
-            doc.file = None
-        elif new_local:
+        if new_local:
+            upload_store.release(doc.file)
             doc.file = new_local
+            # النسخة القديمة على B2 (إن وُجدت) لم تعد ملف المستند
+            doc.b2_file_name = None
+            doc.b2_file_id = None
 
     db.session.commit()
+    _refresh_branch_document_alerts(doc.id)
     flash("✅ تم تحديث المستند", "success")
     return redirect(url_for("employee_dashboard"))
 
@@ -5802,13 +6586,8 @@ def employee_delete_branch_document(doc_id):
         flash("⛔ غير مسموح حذف مستندات فرع آخر", "danger")
         return redirect(url_for("employee_dashboard"))
 
-    try:
-        if doc.file:
-            fpath = os.path.join(app.config["UPLOAD_FOLDER"], doc.file)
-            if os.path.exists(fpath):
-                os.remove(fpath)
-    except Exception:
-        pass
+    # الملف قد يكون مشتركاً مع مراجع أخرى بنفس المحتوى؛ نُنقص عدد مراجعه فقط
+    upload_store.release(doc.file)
 
     db.session.delete(doc)
     db.session.commit()
@@ -5846,6 +6625,75 @@ with app.app_context():
     except Exception as e:
         print("DB INIT ERROR:", e)
 
+    # بناء ملخص الحضور الشهري (hr_attendance_monthly) لقواعد البيانات القديمة مرة واحدة
+    try:
+        from consulting.hr.attendance import backfill_attendance_monthly
+        backfill_attendance_monthly()
+    except Exception as e:
+        db.session.rollback()
+        print("ATTENDANCE ROLLUP BACKFILL ERROR:", e)
+
+    # فهرس كشف تداخل الإجازات + بناء دفتر الإجازات (hr_leave_ledger) من الأرصدة والطلبات القديمة
+    try:
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_hr_leave_request_employee_dates "
+            "ON hr_leave_request(employee_id, start_date, end_date)"
+        ))
+        db.session.commit()
+        from consulting.hr.leave_ledger import backfill_leave_ledger
+        backfill_leave_ledger()
+    except Exception as e:
+        db.session.rollback()
+        print("LEAVE LEDGER BACKFILL ERROR:", e)
+
+    # مرفقات المعاملات: فهرس البنك للاستعلام المرقّم + نقل السلاسل القديمة إلى transaction_attachment
+    try:
+        db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_transaction_bank_id ON "transaction"(bank_id)'))
+        db.session.commit()
+        created = backfill_transaction_attachments(upload_store)
+        if created:
+            print(f"✅ تم نقل {created} مرفقاً إلى transaction_attachment")
+    except Exception as e:
+        db.session.rollback()
+        print("TRANSACTION ATTACHMENT BACKFILL ERROR:", e)
+
+    # فهارس مسح تنبيهات انتهاء المستندات + منع تكرار التنبيه لنفس المستند وتاريخ الانتهاء
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS ix_branch_document_expires_at ON branch_document(expires_at)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS unique_document_alert ON hr_document_alert(document_id, alert_type, expiry_date)",
+    ):
+        try:
+            db.session.execute(text(ddl))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print("DOCUMENT ALERT INDEX ERROR:", e)
+
+    # فهارس البحث بالبادئة (LIKE 'q%') لواجهات typeahead للعملاء والمشاريع؛
+    # في PostgreSQL يلزم text_pattern_ops ليستخدم الفهرس مع collation غير C
+    if db.engine.dialect.name == "postgresql":
+        for ddl in (
+            "CREATE INDEX IF NOT EXISTS ix_consulting_client_name_prefix ON consulting_client (name text_pattern_ops)",
+            "CREATE INDEX IF NOT EXISTS ix_consulting_project_name_prefix ON consulting_project (name text_pattern_ops)",
+        ):
+            try:
+                db.session.execute(text(ddl))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print("TYPEAHEAD INDEX ERROR:", e)
+
+        # بحث النص الكامل في نصوص OCR (document_text)
+        try:
+            db.session.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_document_text_fts ON document_text "
+                "USING gin (to_tsvector('simple', coalesce(text, '')))"
+            ))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print("OCR SEARCH INDEX ERROR:", e)
+
     # محاولة إضافة عمود sent_to_engineer_at إذا كان الجدول قديم
     try:
         if not column_exists("transaction", "sent_to_engineer_at"):
@@ -6094,6 +6942,17 @@ with app.app_context():
     except Exception:
         db.session.rollback()
 
+    # فاتورة بنك واحدة لكل معاملة (يمنع تكرار الفوترة بين دفعات نهاية الشهر المتزامنة)
+    try:
+        db.session.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_bank_invoice_transaction "
+            "ON bank_invoice(transaction_id) WHERE transaction_id IS NOT NULL"
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print("BANK INVOICE TRANSACTION INDEX ERROR (duplicate invoices per transaction?):", e)
+
     try:
         if not column_exists("transaction", "bank_branch"):
             db.session.execute(text("ALTER TABLE transaction ADD COLUMN bank_branch VARCHAR(120)"))
@@ -6332,6 +7191,15 @@ def ensure_b2_columns_exist():
     except Exception:
         db.session.rollback()
 
+    # حالة النسخ البعيد لمحتوى مخزن الرفع
+    try:
+        if not column_exists("upload_blob", "replicated_at"):
+            db.session.execute(text('ALTER TABLE "upload_blob" ADD COLUMN replicated_at TIMESTAMP'))
+            db.session.commit()
+            print("✅ تمت إضافة عمود replicated_at إلى upload_blob")
+    except Exception:
+        db.session.rollback()
+
 # تشغيل مهمة التهيئة عند بدء التشغيل لضمان الأعمدة المطلوبة
 try:
     with app.app_context():
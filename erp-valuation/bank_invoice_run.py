@@ -0,0 +1,86 @@
+"""
+bank_invoice_run.py
+
+إصدار فواتير البنوك لنهاية الشهر من سطر الأوامر (نفس منطق /finance/bank_invoices/bulk).
+
+- يختار كل المعاملات غير المفوترة لبنك معيّن أو لكل البنوك خلال الشهر المحدد
+- يحجز أرقام الفواتير دفعة واحدة وينشئ كل سجلات BankInvoice في commit واحد
+- يولّد المستندات بالتوازي ويكتبها في ملف ZIP واحد؛ ما فشل توليده يُسرد في errors.txt داخل الأرشيف
+
+أمثلة:
+  python3 bank_invoice_run.py --month 2025-01 --out bank_invoices_2025-01.zip
+  python3 bank_invoice_run.py --month 2025-01 --bank-id 3 --format pdf --out bank3.zip
+  python3 bank_invoice_run.py --month 2025-01 --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import datetime
+from typing import Iterable
+
+
+def parse_args(argv: Iterable[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Issue month-end bank invoices in bulk.")
+    parser.add_argument("--month", required=True, help="Billing month as YYYY-MM")
+    parser.add_argument("--bank-id", type=int, default=None, help="Limit the run to one bank")
+    parser.add_argument("--format", choices=["docx", "pdf"], default="docx", help="Document format inside the ZIP")
+    parser.add_argument("--note", default=None, help="Note stored on every issued invoice")
+    parser.add_argument("--out", default=None, help="Path of the ZIP archive to write")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel render workers")
+    parser.add_argument("--dry-run", action="store_true", help="List eligible transactions without issuing")
+    return parser.parse_args(list(argv))
+
+
+def main(argv: Iterable[str]) -> int:
+    args = parse_args(argv)
+    try:
+        month = datetime.strptime(args.month, "%Y-%m").date()
+    except ValueError:
+        print(f"Invalid --month {args.month!r}, expected YYYY-MM", file=sys.stderr)
+        return 2
+
+    from app import (
+        BULK_RENDER_ERRORS_NOTE,
+        app,
+        _month_bounds,
+        issue_bank_invoices_for_period,
+        iter_rendered_documents,
+        prepare_bank_invoice_documents,
+        uninvoiced_bank_transactions_query,
+    )
+    from zip_stream import iter_zip
+
+    period_start, period_end = _month_bounds(month)
+    with app.app_context():
+        if args.dry_run:
+            for t in uninvoiced_bank_transactions_query(period_start, period_end, args.bank_id).all():
+                print(f"{t.id}\tbank={t.bank_id}\tfee={float(t.fee or 0):.2f}\tstatus={t.status or ''}")
+            return 0
+
+        invoices = issue_bank_invoices_for_period(period_start, period_end, bank_id=args.bank_id, note=args.note)
+        if not invoices:
+            print("No uninvoiced transactions in this period")
+            return 0
+        print(f"Issued {len(invoices)} invoices: {invoices[0].invoice_number} .. {invoices[-1].invoice_number}")
+
+        out_path = args.out or f"bank_invoices_{period_start:%Y-%m}.zip"
+        jobs = prepare_bank_invoice_documents(invoices)
+        workers = args.workers or app.config.get("BULK_RENDER_WORKERS", 4)
+        errors: list = []
+        entries = iter_rendered_documents(jobs, args.format, workers=workers, errors=errors)
+        with open(out_path, "wb") as fh:
+            for chunk in iter_zip(entries, missing_note=BULK_RENDER_ERRORS_NOTE):
+                fh.write(chunk)
+    print(f"Wrote {out_path}")
+    if errors:
+        # الفواتير محفوظة؛ المستندات الفاشلة تُنزَّل لاحقاً من /finance/download/bank_invoice/<id>
+        for name, error in errors:
+            print(f"Failed to render {name}: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -223,3 +223,26 @@ def api_clients():
         "pages": pagination.pages,
         "per_page": pagination.per_page,
     })
+
+
+TYPEAHEAD_LIMIT = 20
+
+
+def _prefix_like(q: str) -> str:
+    """نمط LIKE للبحث بالبادئة مع تهريب % و _ حتى يبقى البحث قابلاً لاستخدام فهرس الاسم."""
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+@clients_bp.route("/api/clients/typeahead")
+def api_clients_typeahead():
+    # قائمة مختصرة (id, name) لحقول اختيار العميل بدل تحميل جدول العملاء كاملاً في كل صفحة
+    maybe_redirect = _require_roles(["manager", "employee", "engineer", "finance", "hr"])
+    if maybe_redirect:
+        return maybe_redirect
+
+    q = (request.args.get("q") or "").strip()
+    query = db.session.query(Client.id, Client.name)
+    if q:
+        query = query.filter(Client.name.like(_prefix_like(q), escape="\\"))
+    rows = query.order_by(Client.name.asc()).limit(TYPEAHEAD_LIMIT).all()
+    return jsonify({"items": [{"id": row.id, "name": row.name} for row in rows]})
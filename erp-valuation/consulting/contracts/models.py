@@ -25,7 +25,7 @@ class Contract(db.Model):
     payment_terms = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(20), nullable=False, default="ساري", index=True)  # ساري / منتهي / موقوف
     notes = db.Column(db.Text, nullable=True)
-    file_path = db.Column(db.String(255), nullable=True)  # stored filename in UPLOAD_FOLDER
+    file_path = db.Column(db.String(255), nullable=True)  # upload_store ref in UPLOAD_FOLDER
 
     # Audit
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
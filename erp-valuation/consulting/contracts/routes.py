@@ -1,7 +1,5 @@
 from __future__ import annotations
 
-import os
-import time
 from typing import Any, Dict, List, Optional
 
 from flask import (
@@ -13,12 +11,13 @@ from flask import (
     flash,
     jsonify,
     session,
-    current_app,
 )
 from werkzeug.utils import secure_filename
 from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 
 from extensions import db
+from upload_store import get_upload_store
 from consulting.clients.models import Client
 from consulting.projects.models import ConsultingProject
 from .models import Contract, generate_unique_contract_number, preview_next_contract_number
@@ -99,11 +98,12 @@ def list_contracts():
         except Exception:
             pass
 
-    query = query.order_by(Contract.id.desc())
+    query = query.options(joinedload(Contract.client), joinedload(Contract.project)).order_by(Contract.id.desc())
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
-    clients = Client.query.order_by(Client.name.asc()).all()
-    projects = ConsultingProject.query.order_by(ConsultingProject.name.asc()).all()
+    # الفلاتر تُملأ عبر واجهات typeahead؛ نحمّل أسماء القيم المختارة فقط
+    selected_client = db.session.get(Client, int(client_id)) if client_id.isdigit() else None
+    selected_project = db.session.get(ConsultingProject, int(project_id)) if project_id.isdigit() else None
 
     return render_template(
         "contracts/list.html",
@@ -114,8 +114,8 @@ def list_contracts():
         current_client_id=client_id,
         current_project_id=project_id,
         CONTRACT_STATUSES=CONTRACT_STATUSES,
-        clients=clients,
-        projects=projects,
+        selected_client=selected_client,
+        selected_project=selected_project,
         title="عقود الاستشارات",
     )
 
@@ -170,12 +170,7 @@ def create_contract():
             original = secure_filename(file.filename)
             ext = _ext_of(original)
             if ext in ALLOWED_FILE_EXTENSIONS:
-                upload_dir = current_app.config.get("UPLOAD_FOLDER")
-                os.makedirs(upload_dir, exist_ok=True)
-                unique = f"contract_{contract.id}_{int(time.time())}_{secure_filename(original)}"
-                path = os.path.join(upload_dir, unique)
-                file.save(path)
-                contract.file_path = unique
+                contract.file_path = get_upload_store().save(file, original)
                 db.session.commit()
             else:
                 flash("⚠️ تم تجاهل الملف (يجب أن يكون PDF)", "warning")
@@ -225,12 +220,11 @@ def upload_contract_file(contract_id: int):
         flash("⚠️ امتداد غير مسموح. يُقبل فقط PDF", "warning")
         return redirect(url_for("consulting_contracts.contract_detail", contract_id=contract.id))
 
-    upload_dir = current_app.config.get("UPLOAD_FOLDER")
-    os.makedirs(upload_dir, exist_ok=True)
-    unique = f"contract_{contract.id}_{int(time.time())}_{secure_filename(original)}"
-    path = os.path.join(upload_dir, unique)
-    file.save(path)
-    contract.file_path = unique
+    store = get_upload_store()
+    previous = contract.file_path
+    contract.file_path = store.save(file, original)
+    # الملف السابق قد يكون مشتركاً بنفس المحتوى؛ ننقص عدد مراجعه فقط
+    store.release(previous)
     db.session.commit()
 
     flash("✅ تم رفع العقد (PDF) بنجاح", "success")
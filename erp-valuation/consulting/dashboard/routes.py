@@ -12,13 +12,9 @@ from flask import (
     redirect,
     url_for,
 )
-from sqlalchemy import func
-
-from extensions import db
 from consulting.projects.models import ConsultingProject
-from consulting.contracts.models import Contract
-from consulting.invoices.models import Invoice
 from consulting.hr.models import Task
+from .stats import get_consulting_stats
 
 
 dashboard_bp = Blueprint(
@@ -46,34 +42,15 @@ def dashboard_home():
     if maybe_redirect:
         return maybe_redirect
 
-    # المشاريع
-    total_projects = db.session.query(func.count(ConsultingProject.id)).scalar() or 0
-    ongoing_projects = (
-        db.session.query(func.count(ConsultingProject.id))
-        .filter(ConsultingProject.status == "قيد التنفيذ")
-        .scalar()
-        or 0
-    )
-    finished_projects = (
-        db.session.query(func.count(ConsultingProject.id))
-        .filter(ConsultingProject.status == "مكتمل")
-        .scalar()
-        or 0
-    )
-
-    # العقود
-    active_contracts = (
-        db.session.query(func.count(Contract.id)).filter(Contract.status == "ساري").scalar() or 0
-    )
-    ended_contracts = (
-        db.session.query(func.count(Contract.id)).filter(Contract.status == "منتهي").scalar() or 0
-    )
-
-    # الفواتير
-    total_invoices = db.session.query(func.count(Invoice.id)).scalar() or 0
-    paid_invoices = (
-        db.session.query(func.count(Invoice.id)).filter(Invoice.status == "مدفوعة").scalar() or 0
-    )
+    # كل العدّادات من خدمة الإحصاءات (استعلام واحد لكل جدول + كاش قصير العمر)
+    stats = get_consulting_stats()
+    total_projects = stats["projects"]["total"]
+    ongoing_projects = stats["projects"]["ongoing"]
+    finished_projects = stats["projects"]["finished"]
+    active_contracts = stats["contracts"]["active"]
+    ended_contracts = stats["contracts"]["ended"]
+    total_invoices = stats["invoices"]["total"]
+    paid_invoices = stats["invoices"]["paid_status"]
 
     # أحدث خمسة مشاريع
     latest_projects = (
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""عدّادات لوحات الاستشارات (المشاريع/العقود/الفواتير/العملاء).
+
+- استعلام واحد لكل جدول بتجميع شرطي SUM(CASE ...) بدل COUNT منفصل لكل حالة.
+- النتيجة محفوظة في كاش قصير العمر (CONSULTING_STATS_TTL ثانية، الافتراضي 30) داخل كل عملية،
+  ويُفرَّغ بعد أي commit يضيف أو يعدّل أو يحذف مشروعاً أو عقداً أو فاتورة أو عميلاً.
+  العمليات الأخرى (عدة عمليات gunicorn) تلتقط التغيير عند انتهاء مدة الكاش.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import date
+from typing import Dict, Optional
+
+from sqlalchemy import case, event, func
+from sqlalchemy.orm import Session
+
+from extensions import db
+from consulting.clients.models import Client
+from consulting.contracts.models import Contract
+from consulting.invoices.models import Invoice
+from consulting.projects.models import ConsultingProject
+
+
+STATS_TTL_SECONDS = float(os.environ.get("CONSULTING_STATS_TTL", "30"))
+
+_WATCHED_MODELS = (ConsultingProject, Contract, Invoice, Client)
+
+_lock = threading.Lock()
+_cached: Optional[Dict[str, Dict[str, float]]] = None
+_cached_day: Optional[date] = None
+_expires_at = 0.0
+
+
+def _count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _compute_stats(today: date) -> Dict[str, Dict[str, float]]:
+    projects = db.session.query(
+        func.count(ConsultingProject.id),
+        _count_if(ConsultingProject.status == "قيد التنفيذ"),
+        _count_if(ConsultingProject.status == "مكتمل"),
+        _count_if(ConsultingProject.progress >= 100),
+        func.avg(ConsultingProject.progress),
+    ).one()
+    contracts = db.session.query(
+        func.count(Contract.id),
+        _count_if(Contract.status == "ساري"),
+        _count_if(Contract.status == "منتهي"),
+    ).one()
+    invoices = db.session.query(
+        func.count(Invoice.id),
+        _count_if(Invoice.status == "مدفوعة"),
+        _count_if(Invoice.paid_date.isnot(None)),
+        _count_if(
+            (Invoice.paid_date.is_(None)) & (Invoice.due_date.isnot(None)) & (Invoice.due_date < today)
+        ),
+    ).one()
+    clients = db.session.query(func.count(Client.id)).scalar() or 0
+
+    return {
+        "projects": {
+            "total": int(projects[0] or 0),
+            "ongoing": int(projects[1] or 0),
+            "finished": int(projects[2] or 0),
+            "completed_by_progress": int(projects[3] or 0),
+            "avg_progress": float(projects[4] or 0),
+        },
+        "contracts": {
+            "total": int(contracts[0] or 0),
+            "active": int(contracts[1] or 0),
+            "ended": int(contracts[2] or 0),
+        },
+        "invoices": {
+            "total": int(invoices[0] or 0),
+            "paid_status": int(invoices[1] or 0),
+            "paid": int(invoices[2] or 0),
+            "overdue": int(invoices[3] or 0),
+        },
+        "clients": {"total": int(clients)},
+    }
+
+
+def get_consulting_stats() -> Dict[str, Dict[str, float]]:
+    """عدّادات اللوحات من الكاش أو من قاعدة البيانات عند انتهاء صلاحيته."""
+    global _cached, _cached_day, _expires_at
+    today = date.today()
+    now = time.monotonic()
+    with _lock:
+        # "المتأخرة" تعتمد على تاريخ اليوم، فتغيّر اليوم يبطل الكاش أيضاً
+        if _cached is not None and now < _expires_at and _cached_day == today:
+            return _cached
+    stats = _compute_stats(today)
+    with _lock:
+        _cached, _cached_day, _expires_at = stats, today, now + STATS_TTL_SECONDS
+    return stats
+
+
+def invalidate_consulting_stats() -> None:
+    global _cached, _expires_at
+    with _lock:
+        _cached = None
+        _expires_at = 0.0
+
+
+# ---------- الإبطال عند تغيّر البيانات ----------
+
+@event.listens_for(Session, "after_flush")
+def _mark_stats_dirty(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, _WATCHED_MODELS):
+            session.info["consulting_stats_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_stats_dirty_bulk(orm_execute_state):
+    # query.update()/delete() والعبارات المجمّعة لا تمر عبر after_flush
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, _WATCHED_MODELS):
+        orm_execute_state.session.info["consulting_stats_dirty"] = True
+
+
+# كاشات أخرى تعتمد على نفس الجداول (مثل تقرير أعمار الفواتير) تسجّل دالة الإبطال هنا
+_invalidation_callbacks = [invalidate_consulting_stats]
+
+
+def register_invalidation(callback) -> None:
+    """تسجيل دالة تُستدعى بعد أي commit يغيّر المشاريع أو العقود أو الفواتير أو العملاء."""
+    if callback not in _invalidation_callbacks:
+        _invalidation_callbacks.append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("consulting_stats_dirty", False):
+        for callback in _invalidation_callbacks:
+            callback()
+
@@ -17,7 +17,7 @@ class Document(db.Model):
     uploaded_by = db.Column(db.String(120), nullable=True, index=True)  # username or engineer name
     title = db.Column(db.String(255), nullable=False, index=True)
     category = db.Column(db.String(30), nullable=False, index=True)  # تصميم / إشراف / مراسلات / تقرير
-    file_path = db.Column(db.String(255), nullable=False)  # stored filename under static/uploads/projects
+    file_path = db.Column(db.String(255), nullable=False)  # upload_store ref (legacy: filename under static/uploads/projects)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     def __repr__(self) -> str:  # pragma: no cover
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import os
-import time
 from typing import List, Optional
 
 from flask import (
@@ -14,11 +13,14 @@ from flask import (
     session,
     current_app,
     send_from_directory,
+    send_file,
+    abort,
 )
 from werkzeug.utils import secure_filename
 from sqlalchemy import or_
 
 from extensions import db
+from upload_store import display_name, get_upload_store, is_blob_ref
 from consulting.projects.models import ConsultingProject
 from .models import Document
 from .forms import (
@@ -91,8 +93,17 @@ def list_documents():
     query = query.order_by(Document.id.desc())
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
-    projects = ConsultingProject.query.order_by(ConsultingProject.name.asc()).all()
-    project_map = {p.id: p for p in projects}
+    # أسماء مشاريع الصفحة الحالية فقط باستعلام واحد، وفلتر المشروع يُملأ عبر /api/projects/typeahead
+    page_project_ids = {d.project_id for d in pagination.items}
+    if project_id.isdigit():
+        page_project_ids.add(int(project_id))
+    project_map = {}
+    if page_project_ids:
+        project_map = {
+            p.id: p
+            for p in ConsultingProject.query.filter(ConsultingProject.id.in_(page_project_ids)).all()
+        }
+    selected_project = project_map.get(int(project_id)) if project_id.isdigit() else None
 
     return render_template(
         "documents/list.html",
@@ -102,7 +113,7 @@ def list_documents():
         current_category=category,
         current_project_id=project_id,
         DOCUMENT_CATEGORIES=DOCUMENT_CATEGORIES,
-        projects=projects,
+        selected_project=selected_project,
         project_map=project_map,
         title="مستندات المشاريع",
     )
@@ -140,17 +151,13 @@ def create_document():
                 title="رفع مستند مشروع",
             )
 
-        upload_dir = _documents_upload_dir()
         original = secure_filename(file.filename)
-        unique = f"doc_project_{data['project_id']}_{int(time.time())}_{original}"
-        save_path = os.path.join(upload_dir, unique)
-        file.save(save_path)
 
         doc = Document(
             project_id=data["project_id"],
             title=data["title"],
             category=data["category"],
-            file_path=unique,
+            file_path=get_upload_store().save(file, original),
             uploaded_by=session.get("username") or str(session.get("user_id") or ""),
         )
         db.session.add(doc)
@@ -179,6 +186,11 @@ def download_document(doc_id: int):
         return maybe_redirect
 
     doc = Document.query.get_or_404(doc_id)
-    # Serve from static/uploads/projects while forcing download
+    if is_blob_ref(doc.file_path):
+        path = get_upload_store().resolve(doc.file_path)
+        if not path or not os.path.isfile(path):
+            abort(404)
+        return send_file(path, download_name=display_name(doc.file_path), as_attachment=True, conditional=True)
+    # مستندات قديمة لم تُرحَّل بعد: static/uploads/projects
     directory = _documents_upload_dir()
     return send_from_directory(directory, doc.file_path, as_attachment=True)
@@ -4,10 +4,9 @@ from __future__ import annotations
 from datetime import date
 
 from flask import Blueprint, redirect, render_template, session, url_for
-from sqlalchemy import func
 
 from consulting.clients.models import Client
-from consulting.contracts.models import Contract
+from consulting.dashboard.stats import get_consulting_stats
 from consulting.hr.models import Task
 from consulting.invoices.models import Invoice
 from consulting.projects.models import ConsultingProject
@@ -29,25 +28,17 @@ def dashboard():
 
     today = date.today()
 
-    total_projects = ConsultingProject.query.count() or 0
-    completed_projects = (
-        ConsultingProject.query.filter(ConsultingProject.progress >= 100).count() or 0
-    )
+    stats = get_consulting_stats()
+    total_projects = stats["projects"]["total"]
+    completed_projects = stats["projects"]["completed_by_progress"]
     active_projects = total_projects - completed_projects
 
-    total_invoices = Invoice.query.count() or 0
-    paid_invoices = Invoice.query.filter(Invoice.paid_date.isnot(None)).count() or 0
-    overdue_invoices = (
-        Invoice.query.filter(
-            Invoice.paid_date.is_(None),
-            Invoice.due_date.isnot(None),
-            Invoice.due_date < today,
-        ).count()
-        or 0
-    )
+    total_invoices = stats["invoices"]["total"]
+    paid_invoices = stats["invoices"]["paid"]
+    overdue_invoices = stats["invoices"]["overdue"]
 
-    total_contracts = Contract.query.count() or 0
-    total_clients = Client.query.count() or 0
+    total_contracts = stats["contracts"]["total"]
+    total_clients = stats["clients"]["total"]
 
     latest_projects = (
         ConsultingProject.query.order_by(ConsultingProject.created_at.desc())
@@ -70,11 +61,7 @@ def dashboard():
         Client.query.order_by(Client.created_at.desc()).limit(5).all()
     )
 
-    total_progress = (
-        ConsultingProject.query.with_entities(func.avg(ConsultingProject.progress))
-        .scalar()
-        or 0
-    )
+    total_progress = stats["projects"]["avg_progress"]
 
     return render_template(
         "employee/dashboard.html",
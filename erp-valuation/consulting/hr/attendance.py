@@ -0,0 +1,291 @@
+"""استيراد الحضور بالجملة وتحديث ملخص الحضور الشهري (hr_attendance_monthly).
+
+- يقبل ملف CSV بصيغتين:
+  * سجل يومي: employee_number/employee_id, date, check_in, check_out, status, hours
+  * تصدير جهاز البصمة: employee_number/employee_id, timestamp (بصمة لكل سطر)؛
+    تُجمع البصمات لكل موظف/يوم فتكون أول بصمة حضوراً وآخرها انصرافاً.
+- الإدخال على دفعات: استعلام واحد لمعرفة السجلات الموجودة ثم تحديث جماعي وإدراج جماعي لكل دفعة.
+- بعد الاستيراد يُعاد حساب الملخص الشهري للأشهر المتأثرة فقط باستعلام INSERT ... SELECT مجمّع.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import case, delete, func, insert, literal, select, update
+
+from extensions import db
+from .forms import ATTENDANCE_STATUSES, _parse_date, _parse_datetime
+from .models import Attendance, AttendanceMonthly, Employee
+
+
+BATCH_SIZE = 1000
+
+# أسماء الأعمدة المقبولة (إنجليزي/عربي) مقابل الاسم الداخلي
+_COLUMN_ALIASES = {
+    "employee_id": "employee_id",
+    "employee_number": "employee_number",
+    "emp_no": "employee_number",
+    "رقم الموظف": "employee_number",
+    "date": "attendance_date",
+    "attendance_date": "attendance_date",
+    "التاريخ": "attendance_date",
+    "check_in": "check_in",
+    "الحضور": "check_in",
+    "check_out": "check_out",
+    "الانصراف": "check_out",
+    "status": "status",
+    "الحالة": "status",
+    "hours": "hours_worked",
+    "hours_worked": "hours_worked",
+    "الساعات": "hours_worked",
+    "notes": "notes",
+    "ملاحظات": "notes",
+    "timestamp": "punch_time",
+    "punch_time": "punch_time",
+    "وقت البصمة": "punch_time",
+}
+
+_STATUS_ALIASES = {
+    "present": "حاضر",
+    "absent": "غائب",
+    "leave": "إجازة",
+    "late": "متأخر",
+}
+
+
+def month_range(year: int, month: int) -> Tuple[date, date]:
+    """بداية الشهر وبداية الشهر التالي (نطاق نصف مفتوح يستفيد من فهرس التاريخ)."""
+    start = date(year, month, 1)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+def _normalize_header(name: str) -> str:
+    key = (name or "").strip().lstrip("﻿").lower()
+    return _COLUMN_ALIASES.get(key, key)
+
+
+def _parse_punch(value: str | None) -> Optional[datetime]:
+    parsed = _parse_datetime(value)
+    if parsed is None and value:
+        for fmt in ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%Y/%m/%d %H:%M:%S"):
+            try:
+                return datetime.strptime(value.strip(), fmt)
+            except ValueError:
+                continue
+    return parsed
+
+
+def read_attendance_csv(stream) -> Tuple[List[dict], List[str]]:
+    """يقرأ ملف CSV ويعيد (سجلات يومية، أخطاء). السجلات تحمل employee_id أو employee_number."""
+    if isinstance(stream, (bytes, bytearray)):
+        stream = io.StringIO(stream.decode("utf-8-sig"))
+    reader = csv.DictReader(stream)
+    reader.fieldnames = [_normalize_header(h) for h in (reader.fieldnames or [])]
+    punch_mode = "punch_time" in reader.fieldnames and "attendance_date" not in reader.fieldnames
+
+    rows: List[dict] = []
+    errors: List[str] = []
+    punches: Dict[Tuple[str, date], List[datetime]] = {}
+    for line_no, raw in enumerate(reader, start=2):
+        employee_ref = (raw.get("employee_id") or raw.get("employee_number") or "").strip()
+        if not employee_ref:
+            errors.append(f"سطر {line_no}: رقم الموظف مفقود")
+            continue
+        ref_kind = "employee_id" if (raw.get("employee_id") or "").strip() else "employee_number"
+
+        if punch_mode:
+            punch = _parse_punch(raw.get("punch_time"))
+            if punch is None:
+                errors.append(f"سطر {line_no}: وقت البصمة غير صالح")
+                continue
+            punches.setdefault((f"{ref_kind}:{employee_ref}", punch.date()), []).append(punch)
+            continue
+
+        attendance_date = _parse_date(raw.get("attendance_date"))
+        if attendance_date is None:
+            errors.append(f"سطر {line_no}: التاريخ غير صالح")
+            continue
+        status = (raw.get("status") or "").strip()
+        status = _STATUS_ALIASES.get(status.lower(), status) or "حاضر"
+        if status not in ATTENDANCE_STATUSES:
+            errors.append(f"سطر {line_no}: حالة غير صالحة ({status})")
+            continue
+        hours = None
+        if (raw.get("hours_worked") or "").strip():
+            try:
+                hours = Decimal(raw["hours_worked"].strip())
+            except Exception:
+                errors.append(f"سطر {line_no}: عدد الساعات غير صالح")
+                continue
+        rows.append({
+            ref_kind: employee_ref,
+            "attendance_date": attendance_date,
+            "check_in": _parse_punch(raw.get("check_in")),
+            "check_out": _parse_punch(raw.get("check_out")),
+            "status": status,
+            "hours_worked": hours,
+            "notes": (raw.get("notes") or "").strip() or None,
+        })
+
+    for (ref, day), times in punches.items():
+        ref_kind, employee_ref = ref.split(":", 1)
+        first, last = min(times), max(times)
+        rows.append({
+            ref_kind: employee_ref,
+            "attendance_date": day,
+            "check_in": first,
+            "check_out": last if last > first else None,
+            "status": "حاضر",
+            "hours_worked": None,
+            "notes": None,
+        })
+    return rows, errors
+
+
+def _resolve_employee_ids(rows: List[dict]) -> Tuple[List[dict], int]:
+    """يحوّل employee_number إلى employee_id باستعلام واحد ويستبعد الموظفين غير المعروفين."""
+    numbers = {r["employee_number"] for r in rows if r.get("employee_number")}
+    ids = set()
+    for r in rows:
+        if r.get("employee_id"):
+            try:
+                ids.add(int(r["employee_id"]))
+            except (TypeError, ValueError):
+                pass
+    by_number: Dict[str, int] = {}
+    if numbers:
+        by_number = dict(
+            db.session.query(Employee.employee_number, Employee.id)
+            .filter(Employee.employee_number.in_(numbers))
+            .all()
+        )
+    known_ids: Set[int] = set()
+    if ids:
+        known_ids = {row[0] for row in db.session.query(Employee.id).filter(Employee.id.in_(ids)).all()}
+
+    resolved: List[dict] = []
+    skipped = 0
+    for r in rows:
+        emp_id = None
+        if r.get("employee_number"):
+            emp_id = by_number.get(r["employee_number"])
+        elif r.get("employee_id"):
+            try:
+                emp_id = int(r["employee_id"])
+            except (TypeError, ValueError):
+                emp_id = None
+            if emp_id not in known_ids:
+                emp_id = None
+        if emp_id is None:
+            skipped += 1
+            continue
+        record = {k: v for k, v in r.items() if k not in ("employee_id", "employee_number")}
+        record["employee_id"] = emp_id
+        if record.get("hours_worked") is None and record.get("check_in") and record.get("check_out"):
+            seconds = (record["check_out"] - record["check_in"]).total_seconds()
+            record["hours_worked"] = Decimal(str(round(seconds / 3600.0, 2)))
+        resolved.append(record)
+    return resolved, skipped
+
+
+def _upsert_batch(batch: List[dict]) -> Tuple[int, int]:
+    """إدراج/تحديث دفعة سجلات (موظف، يوم): استعلام للموجود + تحديث جماعي + إدراج جماعي."""
+    # آخر سطر لنفس الموظف/اليوم هو المعتمد
+    by_key = {(r["employee_id"], r["attendance_date"]): r for r in batch}
+    employee_ids = {key[0] for key in by_key}
+    days = [key[1] for key in by_key]
+    existing = {
+        (emp_id, day): row_id
+        for row_id, emp_id, day in db.session.query(
+            Attendance.id, Attendance.employee_id, Attendance.attendance_date
+        ).filter(
+            Attendance.employee_id.in_(employee_ids),
+            Attendance.attendance_date >= min(days),
+            Attendance.attendance_date <= max(days),
+        )
+    }
+    updates, inserts = [], []
+    for key, record in by_key.items():
+        if key in existing:
+            updates.append({**record, "id": existing[key]})
+        else:
+            inserts.append(record)
+    if updates:
+        db.session.execute(update(Attendance), updates)
+    if inserts:
+        db.session.execute(insert(Attendance), inserts)
+    return len(inserts), len(updates)
+
+
+def refresh_attendance_monthly(periods: Iterable[Tuple[int, int]]) -> None:
+    """يعيد حساب ملخص الأشهر المحددة بالكامل من hr_attendance (حذف ثم INSERT ... SELECT مجمّع)."""
+    table = AttendanceMonthly.__table__
+    now = datetime.utcnow()
+    for year, month in sorted(set(periods)):
+        start, end = month_range(year, month)
+        db.session.execute(delete(table).where(table.c.year == year, table.c.month == month))
+        summary = (
+            select(
+                Attendance.employee_id,
+                literal(year),
+                literal(month),
+                func.coalesce(func.sum(case((Attendance.status == "حاضر", 1), else_=0)), 0),
+                func.coalesce(func.sum(case((Attendance.status == "متأخر", 1), else_=0)), 0),
+                func.coalesce(func.sum(case((Attendance.status == "غائب", 1), else_=0)), 0),
+                func.coalesce(func.sum(case((Attendance.status == "إجازة", 1), else_=0)), 0),
+                func.coalesce(func.sum(Attendance.hours_worked), 0),
+                literal(now),
+            )
+            .where(Attendance.attendance_date >= start, Attendance.attendance_date < end)
+            .group_by(Attendance.employee_id)
+        )
+        db.session.execute(
+            insert(table).from_select(
+                [
+                    "employee_id", "year", "month", "present_days", "late_days",
+                    "absent_days", "leave_days", "hours_worked", "updated_at",
+                ],
+                summary,
+            )
+        )
+
+
+def import_attendance_rows(rows: List[dict], batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """يستورد سجلات الحضور على دفعات ثم يحدّث الملخص الشهري في نفس المعاملة (commit واحد)."""
+    resolved, skipped = _resolve_employee_ids(rows)
+    inserted = updated = 0
+    periods: Set[Tuple[int, int]] = set()
+    try:
+        for offset in range(0, len(resolved), batch_size):
+            batch = resolved[offset:offset + batch_size]
+            added, changed = _upsert_batch(batch)
+            inserted += added
+            updated += changed
+            periods.update((r["attendance_date"].year, r["attendance_date"].month) for r in batch)
+        refresh_attendance_monthly(periods)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {"inserted": inserted, "updated": updated, "skipped": skipped, "months": len(periods)}
+
+
+def backfill_attendance_monthly() -> None:
+    """يبني الملخص لكل الأشهر الموجودة إن كان جدول الملخص فارغاً (قواعد بيانات قديمة)."""
+    if db.session.query(AttendanceMonthly.id).first() is not None:
+        return
+    bounds = db.session.query(func.min(Attendance.attendance_date), func.max(Attendance.attendance_date)).one()
+    if not bounds[0]:
+        return
+    periods: List[Tuple[int, int]] = []
+    year, month = bounds[0].year, bounds[0].month
+    while (year, month) <= (bounds[1].year, bounds[1].month):
+        periods.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    refresh_attendance_monthly(periods)
+    db.session.commit()
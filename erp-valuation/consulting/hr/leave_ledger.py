@@ -0,0 +1,426 @@
+"""دفتر حركات الإجازات (hr_leave_ledger) وصيانة الأرصدة (hr_leave_balance).
+
+- كل تغيير على الرصيد يُسجّل كحركة جديدة في الدفتر ولا تُعدّل الحركات السابقة أبداً.
+- اعتماد/رفض/إلغاء طلب إجازة يضيف حركة ويحدّث صف الرصيد تزايدياً بعبارة UPDATE واحدة
+  (used_balance = used_balance + x) فلا يُعاد حساب الرصيد من الصفر ولا تضيع التحديثات المتزامنة.
+- recompute_balances(year) يعيد بناء أرصدة السنة كلها من الدفتر بعبارتين مجمّعتين (INSERT ... SELECT
+  للأرصدة الناقصة ثم UPDATE واحد بقيم مجمّعة من الدفتر). الأرصدة التي لا حركات لها في الدفتر
+  (سابقة له أو أُدخلت مباشرة) تُثبَّت أولاً بحركات افتتاحية من قيمها الحالية حتى لا تُصفَّر.
+- carry_forward_balances(year) يرحّل المتبقي من السنة إلى التالية لأنواع الإجازات التي تسمح بالترحيل
+  (LeaveType.carry_forward) بحد أقصى LeaveType.max_days.
+- find_overlaps(requests) يكشف تداخل الفترات باستعلام واحد على الفهرس (employee_id, start_date, end_date).
+
+الاستخدام من سطر الأوامر:
+  python -m consulting.hr.leave_ledger carry-forward --year 2024
+  python -m consulting.hr.leave_ledger recompute --year 2025
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, func, insert, literal, select, update
+from sqlalchemy.orm import aliased
+
+from extensions import db
+from .models import LeaveBalance, LeaveLedgerEntry, LeaveRequest, LeaveType
+
+
+ALLOCATION = "allocation"
+ADJUSTMENT = "adjustment"
+CARRY_FORWARD = "carry_forward"
+USAGE = "usage"
+REVERSAL = "reversal"
+
+# الطلبات التي تحجز أياماً في التقويم عند كشف التداخل
+ACTIVE_REQUEST_STATUSES = ("معلق", "معتمد")
+
+OPENING_NOTE = "رصيد سابق للدفتر"
+
+
+def _request_days_by_year(leave: LeaveRequest) -> Dict[int, Decimal]:
+    """توزيع أيام الطلب على السنوات (الطلب الممتد بين سنتين يُقسم حسب الأيام التقويمية)."""
+    total = Decimal(leave.total_days or 0)
+    if leave.start_date.year == leave.end_date.year:
+        return {leave.start_date.year: total}
+    calendar_days = (leave.end_date - leave.start_date).days + 1
+    result: Dict[int, Decimal] = {}
+    remaining = total
+    year = leave.start_date.year
+    while year <= leave.end_date.year:
+        if year == leave.end_date.year:
+            result[year] = remaining
+            break
+        start = max(leave.start_date, date(year, 1, 1))
+        span = (date(year + 1, 1, 1) - start).days
+        share = (total * span / calendar_days).quantize(Decimal("0.01"))
+        result[year] = share
+        remaining -= share
+        year += 1
+    return result
+
+
+def _apply_to_balance(employee_id: int, leave_type_id: int, year: int, entry_type: str, days: Decimal) -> None:
+    """يطبّق حركة واحدة على صف الرصيد تزايدياً (وينشئ الصف إن لم يوجد)."""
+    values = {
+        "remaining_balance": func.coalesce(LeaveBalance.remaining_balance, 0) + days,
+        "updated_at": datetime.utcnow(),
+    }
+    if entry_type in (USAGE, REVERSAL):
+        values["used_balance"] = func.coalesce(LeaveBalance.used_balance, 0) - days
+    elif entry_type == CARRY_FORWARD:
+        values["carry_forward"] = func.coalesce(LeaveBalance.carry_forward, 0) + days
+    else:
+        values["initial_balance"] = func.coalesce(LeaveBalance.initial_balance, 0) + days
+    updated = db.session.execute(
+        update(LeaveBalance)
+        .where(
+            LeaveBalance.employee_id == employee_id,
+            LeaveBalance.leave_type_id == leave_type_id,
+            LeaveBalance.year == year,
+        )
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if updated.rowcount:
+        return
+    zero = Decimal("0")
+    db.session.execute(
+        insert(LeaveBalance).values(
+            employee_id=employee_id,
+            leave_type_id=leave_type_id,
+            year=year,
+            initial_balance=days if entry_type in (ALLOCATION, ADJUSTMENT) else zero,
+            carry_forward=days if entry_type == CARRY_FORWARD else zero,
+            used_balance=-days if entry_type in (USAGE, REVERSAL) else zero,
+            remaining_balance=days,
+        )
+    )
+
+
+def post_entry(
+    employee_id: int,
+    leave_type_id: int,
+    year: int,
+    entry_type: str,
+    days: Decimal,
+    leave_request_id: Optional[int] = None,
+    created_by: Optional[int] = None,
+    notes: Optional[str] = None,
+) -> None:
+    """يضيف حركة إلى الدفتر ويحدّث الرصيد تزايدياً. لا يقوم بـ commit."""
+    days = Decimal(days)
+    if not days:
+        return
+    db.session.execute(
+        insert(LeaveLedgerEntry).values(
+            employee_id=employee_id,
+            leave_type_id=leave_type_id,
+            year=year,
+            entry_type=entry_type,
+            days=days,
+            leave_request_id=leave_request_id,
+            created_by=created_by,
+            notes=notes,
+            created_at=datetime.utcnow(),
+        )
+    )
+    _apply_to_balance(employee_id, leave_type_id, year, entry_type, days)
+
+
+def set_request_status(leave: LeaveRequest, new_status: str, user_id: Optional[int] = None,
+                       reason: Optional[str] = None) -> None:
+    """يغيّر حالة طلب الإجازة ويسجّل أثرها في الدفتر. لا يقوم بـ commit.
+
+    الدخول إلى "معتمد" يسجّل استخداماً، والخروج منه (رفض/إلغاء) يسجّل عكساً بنفس الأيام.
+    """
+    old_status = leave.status
+    if old_status == new_status:
+        return
+    now = datetime.utcnow()
+    if new_status == "معتمد":
+        for year, days in _request_days_by_year(leave).items():
+            post_entry(leave.employee_id, leave.leave_type_id, year, USAGE, -days, leave.id, user_id)
+        leave.approved_by = user_id
+        leave.approved_at = now
+    elif old_status == "معتمد":
+        for year, days in _request_days_by_year(leave).items():
+            post_entry(leave.employee_id, leave.leave_type_id, year, REVERSAL, days, leave.id, user_id, reason)
+    if new_status == "مرفوض":
+        leave.rejected_by = user_id
+        leave.rejected_at = now
+        leave.rejection_reason = reason
+    leave.status = new_status
+    leave.approval_status = new_status if new_status in ("معتمد", "مرفوض") else leave.approval_status
+
+
+def find_overlaps(requests: Iterable[LeaveRequest]) -> Dict[int, List[Tuple[int, date, date, str]]]:
+    """الطلبات النشطة الأخرى لنفس الموظف التي تتقاطع فتراتها مع كل طلب (استعلام واحد)."""
+    ids = [r.id for r in requests]
+    if not ids:
+        return {}
+    current = aliased(LeaveRequest)
+    other = aliased(LeaveRequest)
+    rows = (
+        db.session.query(current.id, other.id, other.start_date, other.end_date, other.status)
+        .join(
+            other,
+            and_(
+                other.employee_id == current.employee_id,
+                other.id != current.id,
+                other.start_date <= current.end_date,
+                other.end_date >= current.start_date,
+            ),
+        )
+        .filter(current.id.in_(ids), other.status.in_(ACTIVE_REQUEST_STATUSES))
+        .order_by(other.start_date.asc())
+        .all()
+    )
+    overlaps: Dict[int, List[Tuple[int, date, date, str]]] = {}
+    for request_id, other_id, start, end, status in rows:
+        overlaps.setdefault(request_id, []).append((other_id, start, end, status))
+    return overlaps
+
+
+def seed_opening_entries(year: int) -> int:
+    """يسجّل حركات افتتاحية لأرصدة السنة التي لا حركات لها في الدفتر ويعيد عددها. لا يقوم بـ commit.
+
+    الرصيد الابتدائي والمرحّل والمستخدم تُنقل كما هي (allocation / carry_forward / usage)،
+    فيبقى كل عمود على قيمته بعد recompute_balances ويصبح المتبقي مجموعها.
+    """
+    ledger = LeaveLedgerEntry.__table__
+    balance = LeaveBalance.__table__
+    has_entries = (
+        select(ledger.c.id)
+        .where(
+            ledger.c.employee_id == balance.c.employee_id,
+            ledger.c.leave_type_id == balance.c.leave_type_id,
+            ledger.c.year == balance.c.year,
+        )
+        .exists()
+    )
+    balance_ids = db.session.execute(
+        select(balance.c.id).where(balance.c.year == year, ~has_entries)
+    ).scalars().all()
+    if not balance_ids:
+        return 0
+    now = datetime.utcnow()
+    for entry_type, days in (
+        (ALLOCATION, balance.c.initial_balance),
+        (CARRY_FORWARD, balance.c.carry_forward),
+        (USAGE, -balance.c.used_balance),
+    ):
+        db.session.execute(
+            insert(ledger).from_select(
+                ["employee_id", "leave_type_id", "year", "entry_type", "days", "notes", "created_at"],
+                select(
+                    balance.c.employee_id,
+                    balance.c.leave_type_id,
+                    balance.c.year,
+                    literal(entry_type),
+                    days,
+                    literal(OPENING_NOTE),
+                    literal(now),
+                ).where(balance.c.id.in_(balance_ids), func.coalesce(days, 0) != 0),
+            )
+        )
+    return len(balance_ids)
+
+
+def recompute_balances(year: int) -> None:
+    """يعيد حساب كل أرصدة السنة من الدفتر بعبارات مجمّعة. لا يقوم بـ commit."""
+    ledger = LeaveLedgerEntry.__table__
+    balance = LeaveBalance.__table__
+    now = datetime.utcnow()
+
+    seeded = seed_opening_entries(year)
+    if seeded:
+        print(f"⚠️ leave ledger {year}: seeded opening entries for {seeded} balances without ledger history")
+
+    # أرصدة لها حركات في الدفتر ولا يوجد لها صف بعد
+    missing = (
+        select(ledger.c.employee_id, ledger.c.leave_type_id, literal(year), literal(now), literal(now))
+        .where(ledger.c.year == year)
+        .where(
+            ~select(balance.c.id)
+            .where(
+                balance.c.employee_id == ledger.c.employee_id,
+                balance.c.leave_type_id == ledger.c.leave_type_id,
+                balance.c.year == year,
+            )
+            .exists()
+        )
+        .group_by(ledger.c.employee_id, ledger.c.leave_type_id)
+    )
+    db.session.execute(
+        insert(balance).from_select(
+            ["employee_id", "leave_type_id", "year", "created_at", "updated_at"], missing
+        )
+    )
+
+    def _sum(types: Tuple[str, ...]):
+        return (
+            select(func.coalesce(func.sum(ledger.c.days), 0))
+            .where(
+                ledger.c.employee_id == balance.c.employee_id,
+                ledger.c.leave_type_id == balance.c.leave_type_id,
+                ledger.c.year == balance.c.year,
+                ledger.c.entry_type.in_(types),
+            )
+            .scalar_subquery()
+        )
+
+    db.session.execute(
+        update(balance)
+        .where(balance.c.year == year)
+        .values(
+            initial_balance=_sum((ALLOCATION, ADJUSTMENT)),
+            carry_forward=_sum((CARRY_FORWARD,)),
+            used_balance=-_sum((USAGE, REVERSAL)),
+            remaining_balance=_sum((ALLOCATION, ADJUSTMENT, CARRY_FORWARD, USAGE, REVERSAL)),
+            updated_at=now,
+        )
+    )
+
+
+def carry_forward_balances(from_year: int, created_by: Optional[int] = None) -> int:
+    """يرحّل المتبقي من from_year إلى السنة التالية ويعيد عدد الأرصدة التي تغيّر ترحيلها.
+
+    المهمة قابلة لإعادة التشغيل: تُسجّل فقط الفرق بين الترحيل المطلوب والمسجّل سابقاً.
+    """
+    to_year = from_year + 1
+    remaining_rows = (
+        db.session.query(
+            LeaveLedgerEntry.employee_id,
+            LeaveLedgerEntry.leave_type_id,
+            func.sum(LeaveLedgerEntry.days),
+            LeaveType.max_days,
+        )
+        .join(LeaveType, LeaveType.id == LeaveLedgerEntry.leave_type_id)
+        .filter(LeaveLedgerEntry.year == from_year, LeaveType.carry_forward.is_(True))
+        .group_by(LeaveLedgerEntry.employee_id, LeaveLedgerEntry.leave_type_id, LeaveType.max_days)
+        .all()
+    )
+    already = {
+        (employee_id, leave_type_id): Decimal(days or 0)
+        for employee_id, leave_type_id, days in db.session.query(
+            LeaveLedgerEntry.employee_id, LeaveLedgerEntry.leave_type_id, func.sum(LeaveLedgerEntry.days)
+        )
+        .filter(LeaveLedgerEntry.year == to_year, LeaveLedgerEntry.entry_type == CARRY_FORWARD)
+        .group_by(LeaveLedgerEntry.employee_id, LeaveLedgerEntry.leave_type_id)
+    }
+
+    now = datetime.utcnow()
+    entries = []
+    for employee_id, leave_type_id, remaining, max_days in remaining_rows:
+        target = max(Decimal(remaining or 0), Decimal("0"))
+        if max_days is not None:
+            target = min(target, Decimal(max_days))
+        delta = target - already.pop((employee_id, leave_type_id), Decimal("0"))
+        if delta:
+            entries.append((employee_id, leave_type_id, delta))
+    # ترحيل سابق لم يعد له رصيد متبقٍ (مثلاً اعتُمدت إجازة متأخرة في السنة السابقة)
+    for (employee_id, leave_type_id), days in already.items():
+        if days:
+            entries.append((employee_id, leave_type_id, -days))
+
+    try:
+        if entries:
+            db.session.execute(
+                insert(LeaveLedgerEntry),
+                [
+                    {
+                        "employee_id": employee_id,
+                        "leave_type_id": leave_type_id,
+                        "year": to_year,
+                        "entry_type": CARRY_FORWARD,
+                        "days": days,
+                        "created_by": created_by,
+                        "notes": f"ترحيل من {from_year}",
+                        "created_at": now,
+                    }
+                    for employee_id, leave_type_id, days in entries
+                ],
+            )
+            recompute_balances(to_year)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(entries)
+
+
+def backfill_leave_ledger() -> None:
+    """يبني الدفتر من الأرصدة والطلبات المعتمدة الموجودة إن كان فارغاً (قواعد بيانات قديمة)."""
+    if db.session.query(LeaveLedgerEntry.id).first() is not None:
+        return
+    now = datetime.utcnow()
+    rows: List[dict] = []
+    years: Set[int] = set()
+    request_used: Dict[Tuple[int, int, int], Decimal] = {}
+    for leave in LeaveRequest.query.filter_by(status="معتمد").all():
+        for year, days in _request_days_by_year(leave).items():
+            rows.append({
+                "employee_id": leave.employee_id, "leave_type_id": leave.leave_type_id,
+                "year": year, "entry_type": USAGE, "days": -days,
+                "leave_request_id": leave.id, "created_at": now,
+            })
+            key = (leave.employee_id, leave.leave_type_id, year)
+            request_used[key] = request_used.get(key, Decimal("0")) + days
+            years.add(year)
+    for balance in LeaveBalance.query.all():
+        key = (balance.employee_id, balance.leave_type_id, balance.year)
+        # المستخدم المسجّل يدوياً بلا طلب معتمد يبقى كحركة استخدام افتتاحية (قد تكون سالبة)
+        legacy_used = Decimal(balance.used_balance or 0) - request_used.get(key, Decimal("0"))
+        for entry_type, days in (
+            (ALLOCATION, balance.initial_balance),
+            (CARRY_FORWARD, balance.carry_forward),
+            (USAGE, -legacy_used),
+        ):
+            if days:
+                rows.append({
+                    "employee_id": balance.employee_id, "leave_type_id": balance.leave_type_id,
+                    "year": balance.year, "entry_type": entry_type, "days": Decimal(days),
+                    "notes": OPENING_NOTE, "created_at": now,
+                })
+                years.add(balance.year)
+    if not rows:
+        return
+    for row in rows:
+        row.setdefault("leave_request_id", None)
+        row.setdefault("notes", None)
+    db.session.execute(insert(LeaveLedgerEntry), rows)
+    for year in sorted(years):
+        recompute_balances(year)
+    db.session.commit()
+
+
+def parse_args(argv: Iterable[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Leave ledger maintenance jobs.")
+    parser.add_argument("job", choices=["carry-forward", "recompute"])
+    parser.add_argument("--year", type=int, default=date.today().year,
+                        help="Year to recompute, or the year to carry forward from")
+    return parser.parse_args(list(argv))
+
+
+def main(argv: Iterable[str]) -> int:
+    args = parse_args(argv)
+    from app import app
+
+    with app.app_context():
+        if args.job == "carry-forward":
+            changed = carry_forward_balances(args.year)
+            print(f"carried forward {args.year} -> {args.year + 1}: {changed} balances changed")
+        else:
+            recompute_balances(args.year)
+            db.session.commit()
+            print(f"recomputed balances for {args.year}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -224,6 +224,27 @@ class Attendance(db.Model):
         return f"<Attendance {self.id} emp={self.employee_id} date={self.attendance_date}>"
 
 
+class AttendanceMonthly(db.Model):
+    """ملخص الحضور الشهري لكل موظف (يُعاد حسابه من hr_attendance بعد كل استيراد)"""
+    __tablename__ = "hr_attendance_monthly"
+
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey("hr_employee.id"), nullable=False, index=True)
+    year = db.Column(db.Integer, nullable=False, index=True)
+    month = db.Column(db.Integer, nullable=False, index=True)  # 1-12
+    present_days = db.Column(db.Integer, nullable=False, default=0)
+    late_days = db.Column(db.Integer, nullable=False, default=0)
+    absent_days = db.Column(db.Integer, nullable=False, default=0)
+    leave_days = db.Column(db.Integer, nullable=False, default=0)
+    hours_worked = db.Column(db.Numeric(8, 2), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('employee_id', 'year', 'month', name='unique_attendance_month'),)
+
+    def __repr__(self) -> str:
+        return f"<AttendanceMonthly emp={self.employee_id} {self.year}/{self.month}>"
+
+
 class SalaryComponent(db.Model):
     """مكونات الراتب (بدلات، استقطاعات، إلخ)"""
     __tablename__ = "hr_salary_component"
@@ -400,6 +421,9 @@ class LeaveRequest(db.Model):
 
     leave_type = db.relationship("LeaveType", backref=db.backref("requests", lazy=True))
 
+    # فهرس مركب لكشف تداخل الفترات لنفس الموظف
+    __table_args__ = (db.Index("ix_hr_leave_request_employee_dates", "employee_id", "start_date", "end_date"),)
+
     def calculate_days(self):
         """حساب عدد أيام الإجازة"""
         if self.start_date and self.end_date:
@@ -410,6 +434,32 @@ class LeaveRequest(db.Model):
         return f"<LeaveRequest {self.id} emp={self.employee_id} {self.start_date} to {self.end_date}>"
 
 
+class LeaveLedgerEntry(db.Model):
+    """دفتر حركات الإجازات (إضافة فقط، لا تعديل ولا حذف)
+
+    كل حركة تؤثر على الرصيد المتبقي بقيمة days (موجبة أو سالبة):
+    allocation/adjustment رصيد ابتدائي، carry_forward محول من السنة السابقة،
+    usage استخدام (سالب)، reversal عكس استخدام عند الرفض أو الإلغاء (موجب).
+    """
+    __tablename__ = "hr_leave_ledger"
+
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey("hr_employee.id"), nullable=False)
+    leave_type_id = db.Column(db.Integer, db.ForeignKey("hr_leave_type.id"), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    entry_type = db.Column(db.String(20), nullable=False)
+    days = db.Column(db.Numeric(6, 2), nullable=False)
+    leave_request_id = db.Column(db.Integer, db.ForeignKey("hr_leave_request.id"), nullable=True, index=True)
+    created_by = db.Column(db.Integer, nullable=True)
+    notes = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index("ix_hr_leave_ledger_balance", "year", "employee_id", "leave_type_id"),)
+
+    def __repr__(self) -> str:
+        return f"<LeaveLedgerEntry {self.id} {self.entry_type} {self.days} emp={self.employee_id}>"
+
+
 # ==================== التقييم والتطوير (Performance & Development) ====================
 
 class PerformanceReview(db.Model):
@@ -748,5 +798,7 @@ class DocumentAlert(db.Model):
     document = db.relationship("EmployeeDocument", backref=db.backref("alerts", lazy=True))
     employee = db.relationship("Employee", backref=db.backref("document_alerts", lazy=True))
 
+    __table_args__ = (db.UniqueConstraint("document_id", "alert_type", "expiry_date", name="unique_document_alert"),)
+
     def __repr__(self) -> str:
         return f"<DocumentAlert {self.id} doc={self.document_id} type={self.alert_type}>"
@@ -0,0 +1,364 @@
+"""تشغيل كشف الرواتب الشهري لكل الموظفين دفعة واحدة.
+
+- التحميل في عدد ثابت من الاستعلامات: الموظفون، مكونات الراتب الفعالة، ملخص الحضور الشهري
+  (hr_attendance_monthly)، الإجازات المعتمدة المتقاطعة مع الشهر، والكشوف الموجودة للفترة.
+- الحساب مجمّع حسب المدخلات لا حسب الموظف: مبالغ المكونات تُحسب مرة لكل راتب أساسي مختلف،
+  وخصومات الأيام مرة لكل (راتب، عدد أيام)، ثم يُجمع كل موظف من هذه النتائج.
+  الحساب نفسه يبقى في Python بقيم Decimal مقرّبة لخانتين (ROUND_HALF_UP) لا في SQL: SQLite يخزن
+  Numeric كـ REAL فلا يطابق تقريب كل مكوّن بالسنت، ومعاينة الفروقات تحتاج قيم كل موظف على أي حال.
+- الكتابة: حذف المسودات السابقة للفترة ثم إدراج جماعي لـ Payroll (مع RETURNING للمعرفات)
+  وإدراج جماعي لـ PayrollDetail. الكشوف المعتمدة/المدفوعة لا تُلمس (unique_payroll_period).
+- وضع المعاينة (dry_run) يعيد الفروقات مقارنة بالكشوف الحالية دون أي كتابة.
+
+الاستخدام من سطر الأوامر:
+  python -m consulting.hr.payroll --year 2025 --month 1 --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert
+
+from extensions import db
+from .attendance import month_range
+from .models import (
+    AttendanceMonthly,
+    Employee,
+    LeaveRequest,
+    LeaveType,
+    Payroll,
+    PayrollDetail,
+    SalaryComponent,
+)
+
+
+CENT = Decimal("0.01")
+ZERO = Decimal("0.00")
+# عطلة نهاية الأسبوع: الجمعة والسبت (weekday: الاثنين=0)
+WEEKEND_DAYS = (4, 5)
+# الموظفون المستثنون من كشف الرواتب
+EXCLUDED_STATUSES = ("متوقف",)
+# كشوف لا يعاد حسابها بعد اعتمادها
+LOCKED_STATUSES = ("معتمد", "مدفوع")
+
+
+def _money(value) -> Decimal:
+    return Decimal(value or 0).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def working_days_between(start: date, end: date) -> int:
+    """عدد أيام العمل في النطاق [start, end) دون أيام العطلة الأسبوعية."""
+    days = 0
+    current = start
+    while current < end:
+        if current.weekday() not in WEEKEND_DAYS:
+            days += 1
+        current += timedelta(days=1)
+    return days
+
+
+@dataclass
+class PayrollLine:
+    employee_id: int
+    base_salary: Decimal
+    allowances_total: Decimal = ZERO
+    bonuses_total: Decimal = ZERO
+    other_deductions: Decimal = ZERO
+    gross_salary: Decimal = ZERO
+    net_salary: Decimal = ZERO
+    working_days: int = 0
+    present_days: int = 0
+    absent_days: int = 0
+    leave_days: int = 0
+    details: List[dict] = field(default_factory=list)
+
+
+@dataclass
+class PayrollRunResult:
+    year: int
+    month: int
+    dry_run: bool
+    lines: List[PayrollLine]
+    # employee_id -> "جديد" / "متغير" / "بدون تغيير" / "مقفل"
+    changes: Dict[int, str]
+    previous_net: Dict[int, Decimal]
+    written: int = 0
+
+    @property
+    def total_net(self) -> Decimal:
+        return sum((line.net_salary for line in self.lines), ZERO)
+
+
+def _load_unpaid_and_leave_days(year: int, month: int) -> Tuple[Dict[int, int], Dict[int, int]]:
+    """أيام الإجازة المعتمدة داخل الشهر لكل موظف (كل الإجازات، وغير المدفوعة منها)."""
+    start, end = month_range(year, month)
+    rows = (
+        db.session.query(
+            LeaveRequest.employee_id,
+            LeaveRequest.start_date,
+            LeaveRequest.end_date,
+            LeaveType.is_paid,
+        )
+        .join(LeaveType, LeaveType.id == LeaveRequest.leave_type_id)
+        .filter(
+            LeaveRequest.status == "معتمد",
+            LeaveRequest.start_date < end,
+            LeaveRequest.end_date >= start,
+        )
+        .all()
+    )
+    leave_days: Dict[int, int] = {}
+    unpaid_days: Dict[int, int] = {}
+    for employee_id, leave_start, leave_end, is_paid in rows:
+        days = working_days_between(max(leave_start, start), min(leave_end + timedelta(days=1), end))
+        leave_days[employee_id] = leave_days.get(employee_id, 0) + days
+        if is_paid is False:
+            unpaid_days[employee_id] = unpaid_days.get(employee_id, 0) + days
+    return leave_days, unpaid_days
+
+
+@dataclass
+class _ComponentTotals:
+    """مبالغ المكونات الثابتة لراتب أساسي واحد (مشتركة بين كل من له نفس الراتب)."""
+    allowances: Decimal = ZERO
+    bonuses: Decimal = ZERO
+    deductions: Decimal = ZERO
+    details: List[dict] = field(default_factory=list)
+
+
+def _component_totals(base: Decimal, components: List[tuple]) -> _ComponentTotals:
+    totals = _ComponentTotals()
+    for component_id, name, component_type, is_percentage, default_value in components:
+        value = Decimal(default_value or 0)
+        amount = _money(base * value / 100 if is_percentage else value)
+        if not amount:
+            continue
+        if component_type == "allowance":
+            totals.allowances += amount
+        elif component_type == "bonus":
+            totals.bonuses += amount
+        elif component_type == "deduction":
+            totals.deductions += amount
+        else:
+            continue
+        totals.details.append({
+            "component_id": component_id,
+            "component_name": name,
+            "amount": amount,
+            "type": component_type,
+        })
+    return totals
+
+
+def compute_payroll(year: int, month: int) -> List[PayrollLine]:
+    """يحسب كشف الشهر لكل الموظفين دون كتابة شيء إلى قاعدة البيانات."""
+    start, end = month_range(year, month)
+    working_days = working_days_between(start, end)
+
+    # الموظفون مع ملخص حضورهم في استعلام واحد (صفوف أعمدة لا كائنات ORM)
+    employees = (
+        db.session.query(
+            Employee.id,
+            Employee.base_salary,
+            func.coalesce(AttendanceMonthly.present_days, 0) + func.coalesce(AttendanceMonthly.late_days, 0),
+            func.coalesce(AttendanceMonthly.absent_days, 0),
+        )
+        .outerjoin(
+            AttendanceMonthly,
+            and_(
+                AttendanceMonthly.employee_id == Employee.id,
+                AttendanceMonthly.year == year,
+                AttendanceMonthly.month == month,
+            ),
+        )
+        .filter(Employee.status.notin_(EXCLUDED_STATUSES), Employee.base_salary.isnot(None))
+        .order_by(Employee.id.asc())
+        .all()
+    )
+    components = (
+        db.session.query(
+            SalaryComponent.id,
+            func.coalesce(SalaryComponent.name_ar, SalaryComponent.name),
+            SalaryComponent.type,
+            SalaryComponent.is_percentage,
+            SalaryComponent.default_value,
+        )
+        .filter(SalaryComponent.is_active.is_(True))
+        .order_by(SalaryComponent.id.asc())
+        .all()
+    )
+    leave_days, unpaid_days = _load_unpaid_and_leave_days(year, month)
+
+    by_base: Dict[Decimal, _ComponentTotals] = {}
+    day_deductions: Dict[Tuple[Decimal, int], Decimal] = {}
+
+    def day_deduction(base: Decimal, days: int) -> Decimal:
+        key = (base, days)
+        if key not in day_deductions:
+            daily_rate = base / working_days if working_days else ZERO
+            day_deductions[key] = _money(daily_rate * days)
+        return day_deductions[key]
+
+    lines: List[PayrollLine] = []
+    for employee_id, base_salary, present_days, absent_days in employees:
+        base = _money(base_salary)
+        totals = by_base.get(base)
+        if totals is None:
+            totals = by_base[base] = _component_totals(base, components)
+        line = PayrollLine(
+            employee_id=employee_id,
+            base_salary=base,
+            allowances_total=totals.allowances,
+            bonuses_total=totals.bonuses,
+            other_deductions=totals.deductions,
+            working_days=working_days,
+            present_days=int(present_days),
+            absent_days=int(absent_days),
+            leave_days=leave_days.get(employee_id, 0),
+            details=[dict(detail) for detail in totals.details],
+        )
+
+        for label, days in (
+            ("خصم غياب", line.absent_days),
+            ("خصم إجازة بدون راتب", unpaid_days.get(employee_id, 0)),
+        ):
+            amount = day_deduction(base, days) if days else ZERO
+            if amount:
+                line.other_deductions += amount
+                line.details.append({
+                    "component_id": None,
+                    "component_name": label,
+                    "amount": amount,
+                    "type": "deduction",
+                    "notes": f"{days} يوم",
+                })
+
+        line.gross_salary = base + line.allowances_total + line.bonuses_total
+        line.net_salary = line.gross_salary - line.other_deductions
+        lines.append(line)
+    return lines
+
+
+def run_payroll(
+    year: int,
+    month: int,
+    dry_run: bool = False,
+    created_by: Optional[int] = None,
+) -> PayrollRunResult:
+    """يحسب كشف الشهر ويكتبه (أو يعرض الفروقات فقط عند dry_run)."""
+    lines = compute_payroll(year, month)
+    existing = {
+        employee_id: (payroll_id, status, net)
+        for payroll_id, employee_id, status, net in db.session.query(
+            Payroll.id, Payroll.employee_id, Payroll.status, Payroll.net_salary
+        ).filter(Payroll.payroll_year == year, Payroll.payroll_month == month)
+    }
+
+    changes: Dict[int, str] = {}
+    previous_net: Dict[int, Decimal] = {}
+    writable: List[PayrollLine] = []
+    for line in lines:
+        current = existing.get(line.employee_id)
+        if current is None:
+            changes[line.employee_id] = "جديد"
+            writable.append(line)
+            continue
+        _, status, net = current
+        previous_net[line.employee_id] = _money(net)
+        if status in LOCKED_STATUSES:
+            changes[line.employee_id] = "مقفل"
+            continue
+        changes[line.employee_id] = "متغير" if _money(net) != line.net_salary else "بدون تغيير"
+        writable.append(line)
+
+    result = PayrollRunResult(year, month, dry_run, lines, changes, previous_net)
+    if dry_run or not writable:
+        return result
+
+    try:
+        # المسودات السابقة لنفس الفترة تُستبدل بالكامل (مع تفاصيلها)
+        draft_ids = [
+            existing[line.employee_id][0] for line in writable if line.employee_id in existing
+        ]
+        if draft_ids:
+            db.session.execute(delete(PayrollDetail).where(PayrollDetail.payroll_id.in_(draft_ids)))
+            db.session.execute(delete(Payroll).where(Payroll.id.in_(draft_ids)))
+
+        now = datetime.utcnow()
+        payroll_rows = [
+            {
+                "employee_id": line.employee_id,
+                "payroll_month": month,
+                "payroll_year": year,
+                "base_salary": line.base_salary,
+                "allowances_total": line.allowances_total,
+                "bonuses_total": line.bonuses_total,
+                "deductions_total": line.other_deductions,
+                "other_deductions": line.other_deductions,
+                "gross_salary": line.gross_salary,
+                "net_salary": line.net_salary,
+                "working_days": line.working_days,
+                "present_days": line.present_days,
+                "absent_days": line.absent_days,
+                "leave_days": line.leave_days,
+                "status": "مسودة",
+                "created_at": now,
+                "updated_at": now,
+                "created_by": created_by,
+            }
+            for line in writable
+        ]
+        inserted = db.session.execute(
+            insert(Payroll).returning(Payroll.id, Payroll.employee_id, sort_by_parameter_order=True),
+            payroll_rows,
+        ).all()
+        payroll_ids = {employee_id: payroll_id for payroll_id, employee_id in inserted}
+
+        detail_rows = [
+            {"payroll_id": payroll_ids[line.employee_id], "notes": None, **detail}
+            for line in writable
+            for detail in line.details
+        ]
+        if detail_rows:
+            db.session.execute(insert(PayrollDetail), detail_rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    result.written = len(writable)
+    return result
+
+
+def parse_args(argv: Iterable[str]) -> argparse.Namespace:
+    today = date.today()
+    parser = argparse.ArgumentParser(description="Run the monthly payroll for all employees.")
+    parser.add_argument("--year", type=int, default=today.year)
+    parser.add_argument("--month", type=int, default=today.month)
+    parser.add_argument("--dry-run", action="store_true", help="Show the diff without writing")
+    return parser.parse_args(list(argv))
+
+
+def main(argv: Iterable[str]) -> int:
+    args = parse_args(argv)
+    from app import app
+
+    with app.app_context():
+        result = run_payroll(args.year, args.month, dry_run=args.dry_run)
+        for line in result.lines:
+            change = result.changes.get(line.employee_id, "")
+            if args.dry_run and change == "بدون تغيير":
+                continue
+            previous = result.previous_net.get(line.employee_id)
+            print(f"{line.employee_id}\t{change}\t{previous if previous is not None else '-'}\t{line.net_salary}")
+        print(f"employees={len(result.lines)} written={result.written} total_net={result.total_net}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -15,7 +15,8 @@ from flask import (
     jsonify,
     session,
 )
-from sqlalchemy import or_, func
+from sqlalchemy import or_, func, case, select
+from sqlalchemy.orm import joinedload
 from werkzeug.security import generate_password_hash
 
 from extensions import db
@@ -160,6 +161,56 @@ def _ensure_default_departments() -> None:
     if created:
         db.session.commit()
 
+def _engineer_task_counts(engineer_ids: List[int]) -> tuple[Dict[int, int], Dict[int, int]]:
+    """عدد المهام المفتوحة والمتأخرة لكل مهندس باستعلام مجمّع واحد.
+
+    تعيد (open_counts, overdue_counts)؛ المهندس بدون مهام مفتوحة لا يظهر في القاموس.
+    """
+    if not engineer_ids:
+        return {}, {}
+    rows = (
+        db.session.query(
+            Task.engineer_id,
+            func.count(Task.id),
+            func.coalesce(func.sum(case((Task.deadline < date.today(), 1), else_=0)), 0),
+        )
+        .filter(Task.engineer_id.in_(engineer_ids), Task.status != "مكتملة")
+        .group_by(Task.engineer_id)
+        .all()
+    )
+    open_counts = {eng_id: int(open_count) for eng_id, open_count, _ in rows}
+    overdue_counts = {eng_id: int(overdue) for eng_id, _, overdue in rows}
+    return open_counts, overdue_counts
+
+
+def _page_per_department(query, model, page: int, per_page: int, options=()):
+    """يعيد صفحة `page` من كل قسم على حدة (حتى per_page سجل لكل قسم) مع إجمالي كل قسم.
+
+    يستخدم row_number() OVER (PARTITION BY department_id) فيبقى عدد الاستعلامات ثابتاً
+    مهما كان عدد الأقسام.
+    """
+    totals = dict(
+        query.with_entities(model.department_id, func.count(model.id))
+        .group_by(model.department_id)
+        .all()
+    )
+    row_number = func.row_number().over(
+        partition_by=model.department_id, order_by=model.id.desc()
+    ).label("rn")
+    ranked = query.with_entities(model.id.label("id"), row_number).subquery()
+    page_ids = select(ranked.c.id).where(
+        ranked.c.rn > (page - 1) * per_page,
+        ranked.c.rn <= page * per_page,
+    )
+    items = (
+        model.query.options(*options)
+        .filter(model.id.in_(page_ids))
+        .order_by(model.id.desc())
+        .all()
+    )
+    return items, totals
+
+
 # ---------- Pages ----------
 
 # تم نقل وظيفة dashboard القديمة إلى hr_dashboard الموحدة أدناه
@@ -189,12 +240,7 @@ def list_engineers():
     query = query.order_by(Engineer.id.desc())
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
-    # Build quick stats for overdue tasks per engineer (lightweight for small pages)
-    overdue_counts: Dict[int, int] = {}
-    open_counts: Dict[int, int] = {}
-    for eng in pagination.items:
-        overdue_counts[eng.id] = sum(1 for t in eng.tasks if t.is_overdue())
-        open_counts[eng.id] = sum(1 for t in eng.tasks if t.status != "مكتملة")
+    open_counts, overdue_counts = _engineer_task_counts([eng.id for eng in pagination.items])
 
     can_manage = session.get("role") in {"manager", "employee", "hr"}
 
@@ -445,7 +491,7 @@ def update_task(task_id: int):
 # تم توثيق جميع المسارات المطلوبة في ملف HR_SYSTEM_DOCUMENTATION.md
 
 from .models import (
-    Department, Employee, Attendance, SalaryComponent, Payroll, PayrollDetail,
+    Department, Employee, Attendance, AttendanceMonthly, SalaryComponent, Payroll, PayrollDetail,
     LeaveType, LeaveBalance, LeaveRequest, PerformanceReview, EmployeeGoal,
     TrainingProgram, TrainingParticipant, JobPosting, Candidate, JobApplication,
     Interview, EmployeeDocument, DocumentAlert
@@ -461,6 +507,9 @@ from .forms import (
     INTERVIEW_STATUSES, INTERVIEW_RESULTS, GOAL_PRIORITIES, GOAL_STATUSES
 )
 from decimal import Decimal
+from .attendance import import_attendance_rows, read_attendance_csv
+from .payroll import run_payroll
+from .leave_ledger import find_overlaps, set_request_status
 
 
 @hr_bp.route("/staff")
@@ -492,7 +541,13 @@ def list_staff():
         employee_query = employee_query.filter(Employee.department_id == department_id)
     if employee_status:
         employee_query = employee_query.filter(Employee.status == employee_status)
-    employees = employee_query.order_by(Employee.id.desc()).all()
+    employees, employee_totals = _page_per_department(
+        employee_query,
+        Employee,
+        page,
+        per_page,
+        options=(joinedload(Employee.department), joinedload(Employee.user_account)),
+    )
     
     # جلب المهندسين
     engineer_query = Engineer.query
@@ -507,26 +562,37 @@ def list_staff():
         engineer_query = engineer_query.filter(Engineer.department_id == department_id)
     if engineer_status:
         engineer_query = engineer_query.filter(Engineer.status == engineer_status)
-    engineers = engineer_query.order_by(Engineer.id.desc()).all()
+    engineers, engineer_totals = _page_per_department(
+        engineer_query,
+        Engineer,
+        page,
+        per_page,
+        options=(joinedload(Engineer.department),),
+    )
     
-    # تجميع حسب الفرع
-    from collections import defaultdict
-    staff_by_department = defaultdict(lambda: {"employees": [], "engineers": []})
+    # تجميع حسب الفرع (كل قسم يعرض صفحته الخاصة من الموظفين والمهندسين)؛ المفتاح معرّف القسم
+    # كالمجاميع، فقسمان بنفس الاسم لا يُدمجان، والاسم للعرض فقط
+    staff_by_department = {}
     
-    for emp in employees:
-        dept_key = emp.department.name if emp.department else "بدون فرع"
-        staff_by_department[dept_key]["employees"].append(emp)
+    for kind, items in (("employees", employees), ("engineers", engineers)):
+        for person in items:
+            group = staff_by_department.get(person.department_id)
+            if group is None:
+                group = staff_by_department[person.department_id] = {
+                    "name": person.department.name if person.department else "بدون فرع",
+                    "employees": [],
+                    "engineers": [],
+                    "employees_total": employee_totals.get(person.department_id, 0),
+                    "engineers_total": engineer_totals.get(person.department_id, 0),
+                }
+            group[kind].append(person)
     
-    for eng in engineers:
-        dept_key = eng.department.name if eng.department else "بدون فرع"
-        staff_by_department[dept_key]["engineers"].append(eng)
+    # أكبر قسم يحدد عدد الصفحات
+    largest_department = max(list(employee_totals.values()) + list(engineer_totals.values()) + [0])
+    total_pages = max((largest_department + per_page - 1) // per_page, 1)
     
     # بناء إحصائيات المهام للمهندسين
-    overdue_counts: Dict[int, int] = {}
-    open_counts: Dict[int, int] = {}
-    for eng in engineers:
-        overdue_counts[eng.id] = sum(1 for t in eng.tasks if t.is_overdue())
-        open_counts[eng.id] = sum(1 for t in eng.tasks if t.status != "مكتملة")
+    open_counts, overdue_counts = _engineer_task_counts([eng.id for eng in engineers])
     
     _ensure_default_departments()
     departments = Department.query.filter_by(is_active=True).order_by(Department.name).all()
@@ -534,7 +600,7 @@ def list_staff():
     
     return render_template(
         "hr/staff.html",
-        staff_by_department=dict(staff_by_department),
+        staff_by_department=staff_by_department,
         q=q,
         current_department_id=department_id,
         current_employee_status=employee_status,
@@ -546,6 +612,9 @@ def list_staff():
         overdue_counts=overdue_counts,
         open_counts=open_counts,
         can_manage=can_manage,
+        page=page,
+        per_page=per_page,
+        total_pages=total_pages,
         title="الموظفين والمهندسين",
     )
 
@@ -907,21 +976,46 @@ def dashboard():
     
     today = date.today()
     
-    # ===== إحصائيات عامة للموظفين =====
-    total_employees = Employee.query.count()
-    active_employees = Employee.query.filter(Employee.status == "نشط").count()
-    on_leave_employees = Employee.query.filter(Employee.status == "إجازة").count()
+    # ===== إحصائيات الموظفين (استعلام واحد مجمّع حسب القسم والحالة) =====
+    employee_counts: Dict[Optional[int], Dict[str, int]] = {}
+    for dept_id, status, count in (
+        db.session.query(Employee.department_id, Employee.status, func.count(Employee.id))
+        .group_by(Employee.department_id, Employee.status)
+        .all()
+    ):
+        employee_counts.setdefault(dept_id, {})[status] = count
+    total_employees = sum(sum(by_status.values()) for by_status in employee_counts.values())
+    active_employees = sum(by_status.get("نشط", 0) for by_status in employee_counts.values())
+    on_leave_employees = sum(by_status.get("إجازة", 0) for by_status in employee_counts.values())
     
-    # ===== إحصائيات الحضور (هذا الشهر) =====
-    current_month_attendance = Attendance.query.filter(
-        func.extract('year', Attendance.attendance_date) == today.year,
-        func.extract('month', Attendance.attendance_date) == today.month
-    ).all()
-    present_count = sum(1 for a in current_month_attendance if a.status == "حاضر")
-    absent_count = sum(1 for a in current_month_attendance if a.status == "غائب")
+    # ===== إحصائيات الحضور (هذا الشهر) من ملخص hr_attendance_monthly حسب القسم =====
+    attendance_counts: Dict[Optional[int], Dict[str, int]] = {}
+    for dept_id, present, absent in (
+        db.session.query(
+            Employee.department_id,
+            func.sum(AttendanceMonthly.present_days),
+            func.sum(AttendanceMonthly.absent_days),
+        )
+        .select_from(AttendanceMonthly)
+        .outerjoin(Employee, Employee.id == AttendanceMonthly.employee_id)
+        .filter(AttendanceMonthly.year == today.year, AttendanceMonthly.month == today.month)
+        .group_by(Employee.department_id)
+        .all()
+    ):
+        attendance_counts[dept_id] = {"حاضر": int(present or 0), "غائب": int(absent or 0)}
+    present_count = sum(by_status.get("حاضر", 0) for by_status in attendance_counts.values())
+    absent_count = sum(by_status.get("غائب", 0) for by_status in attendance_counts.values())
     
     # ===== إحصائيات الإجازات =====
-    pending_leaves = LeaveRequest.query.filter(LeaveRequest.status == "معلق").count()
+    pending_leave_counts: Dict[Optional[int], int] = dict(
+        db.session.query(Employee.department_id, func.count(LeaveRequest.id))
+        .select_from(LeaveRequest)
+        .outerjoin(Employee, Employee.id == LeaveRequest.employee_id)
+        .filter(LeaveRequest.status == "معلق")
+        .group_by(Employee.department_id)
+        .all()
+    )
+    pending_leaves = sum(pending_leave_counts.values())
     approved_leaves_today = LeaveRequest.query.filter(
         LeaveRequest.status == "معتمد",
         LeaveRequest.start_date <= today,
@@ -939,10 +1033,10 @@ def dashboard():
     ).scalar() or Decimal(0)
     
     # ===== المستندات المنتهية الصلاحية =====
-    expiring_documents = EmployeeDocument.query.filter(
-        EmployeeDocument.expiry_date.isnot(None),
-        EmployeeDocument.expiry_date <= today + timedelta(days=30),
-        EmployeeDocument.expiry_date >= today
+    # تُقرأ من التنبيهات النشطة التي يحدّثها sweep_document_alerts بدل مسح المستندات في كل طلب
+    expiring_documents = DocumentAlert.query.filter(
+        DocumentAlert.status == "نشط",
+        DocumentAlert.alert_type == "تحذير",
     ).count()
     
     # ===== طلبات التوظيف المعلقة =====
@@ -951,57 +1045,42 @@ def dashboard():
     ).count()
     
     # ===== إحصائيات المهندسين (للتوافق مع النظام القديم) =====
-    total_engineers = Engineer.query.count()
-    active_engineers = Engineer.query.filter(Engineer.status == "نشط").count()
+    total_engineers, active_engineers = db.session.query(
+        func.count(Engineer.id),
+        func.coalesce(func.sum(case((Engineer.status == "نشط", 1), else_=0)), 0),
+    ).one()
     open_tasks_query = Task.query.filter(Task.status != "مكتملة")
-    total_open_tasks = open_tasks_query.count()
-    overdue_tasks_count = open_tasks_query.filter(
-        Task.deadline.isnot(None),
-        Task.deadline < today,
-    ).count()
+    total_open_tasks, overdue_tasks_count = (
+        db.session.query(
+            func.count(Task.id),
+            func.coalesce(func.sum(case((Task.deadline < today, 1), else_=0)), 0),
+        )
+        .filter(Task.status != "مكتملة")
+        .one()
+    )
     
     # ===== إحصائيات لكل قسم =====
     _ensure_default_departments()
     departments = Department.query.filter_by(is_active=True).order_by(Department.name).all()
     department_stats = []
     
+    department_distribution = {}
     for dept in departments:
-        dept_employees = Employee.query.filter(Employee.department_id == dept.id).all()
-        dept_total = len(dept_employees)
-        dept_active = sum(1 for e in dept_employees if e.status == "نشط")
-        dept_on_leave = sum(1 for e in dept_employees if e.status == "إجازة")
-        
-        # الحضور لهذا الشهر
-        dept_employee_ids = [e.id for e in dept_employees]
-        dept_attendance = [
-            a for a in current_month_attendance 
-            if a.employee_id in dept_employee_ids
-        ]
-        dept_present = sum(1 for a in dept_attendance if a.status == "حاضر")
-        dept_absent = sum(1 for a in dept_attendance if a.status == "غائب")
-        
-        # الإجازات المعلقة
-        dept_pending_leaves = LeaveRequest.query.filter(
-            LeaveRequest.employee_id.in_(dept_employee_ids),
-            LeaveRequest.status == "معلق"
-        ).count()
-        
+        dept_employees = employee_counts.get(dept.id, {})
+        dept_attendance = attendance_counts.get(dept.id, {})
+        dept_total = sum(dept_employees.values())
         department_stats.append({
             "department": dept,
             "total_employees": dept_total,
-            "active_employees": dept_active,
-            "on_leave_employees": dept_on_leave,
-            "present_count": dept_present,
-            "absent_count": dept_absent,
-            "pending_leaves": dept_pending_leaves,
+            "active_employees": dept_employees.get("نشط", 0),
+            "on_leave_employees": dept_employees.get("إجازة", 0),
+            "present_count": dept_attendance.get("حاضر", 0),
+            "absent_count": dept_attendance.get("غائب", 0),
+            "pending_leaves": pending_leave_counts.get(dept.id, 0),
         })
-    
-    # ===== توزيع الموظفين حسب الأقسام =====
-    department_distribution = {}
-    for dept in departments:
-        count = Employee.query.filter(Employee.department_id == dept.id).count()
-        if count > 0:
-            department_distribution[dept.name] = count
+        # ===== توزيع الموظفين حسب الأقسام =====
+        if dept_total > 0:
+            department_distribution[dept.name] = dept_total
     
     # ===== أحدث الموظفين من جميع الأقسام =====
     recent_employees = Employee.query.order_by(Employee.created_at.desc()).limit(5).all()
@@ -1013,11 +1092,14 @@ def dashboard():
     ).order_by(LeaveRequest.start_date.asc()).limit(5).all()
     
     # ===== المستندات المنتهية قريباً =====
-    docs_expiring_soon = EmployeeDocument.query.filter(
-        EmployeeDocument.expiry_date.isnot(None),
-        EmployeeDocument.expiry_date <= today + timedelta(days=30),
-        EmployeeDocument.expiry_date >= today
-    ).order_by(EmployeeDocument.expiry_date.asc()).limit(5).all()
+    docs_expiring_soon = (
+        EmployeeDocument.query.join(DocumentAlert, DocumentAlert.document_id == EmployeeDocument.id)
+        .options(joinedload(EmployeeDocument.employee))
+        .filter(DocumentAlert.status == "نشط", DocumentAlert.alert_type == "تحذير")
+        .order_by(DocumentAlert.expiry_date.asc())
+        .limit(5)
+        .all()
+    )
     
     # ===== المهام القادمة والمتأخرة (للمهندسين) =====
     upcoming_tasks = (
@@ -1089,6 +1171,187 @@ def dashboard():
     )
 
 
+@hr_bp.route("/attendance/import", methods=["POST"])
+def import_attendance():
+    """استيراد الحضور من ملف CSV (سجل يومي أو تصدير جهاز البصمة)"""
+    maybe_redirect = _require_roles(["manager", "hr", "hr_manager"])
+    if maybe_redirect:
+        return maybe_redirect
+
+    upload = request.files.get("attendance_file")
+    if not upload or not upload.filename:
+        flash("⚠️ يرجى اختيار ملف CSV للحضور", "warning")
+        return redirect(url_for("consulting_hr.dashboard"))
+
+    try:
+        rows, errors = read_attendance_csv(upload.read())
+        result = import_attendance_rows(rows)
+    except UnicodeDecodeError:
+        flash("⚠️ يجب أن يكون الملف CSV بترميز UTF-8", "warning")
+        return redirect(url_for("consulting_hr.dashboard"))
+    except Exception as e:
+        print(f"⚠️ Attendance import failed: {e}")
+        flash("⚠️ تعذر استيراد الحضور، لم يتم حفظ أي سجل", "danger")
+        return redirect(url_for("consulting_hr.dashboard"))
+
+    flash(
+        f"✅ تم استيراد الحضور: {result['inserted']} جديد، {result['updated']} محدّث"
+        + (f"، {result['skipped']} لموظفين غير معروفين" if result["skipped"] else ""),
+        "success",
+    )
+    if errors:
+        flash("⚠️ أسطر تم تجاهلها: " + "؛ ".join(errors[:5]) + (" …" if len(errors) > 5 else ""), "warning")
+    return redirect(url_for("consulting_hr.dashboard"))
+
+
+@hr_bp.route("/payroll/run", methods=["GET", "POST"])
+def payroll_run():
+    """تشغيل كشف الرواتب الشهري لكل الموظفين: GET للمعاينة (dry-run) و POST للحفظ"""
+    maybe_redirect = _require_roles(["manager", "hr", "hr_manager"])
+    if maybe_redirect:
+        return maybe_redirect
+
+    today = date.today()
+    try:
+        year = int(request.values.get("year") or today.year)
+        month = int(request.values.get("month") or today.month)
+        if not 1 <= month <= 12:
+            raise ValueError
+    except ValueError:
+        flash("⚠️ الشهر أو السنة غير صالحة", "warning")
+        return redirect(url_for("consulting_hr.payroll_run"))
+
+    if request.method == "POST":
+        try:
+            result = run_payroll(year, month, created_by=session.get("user_id"))
+        except Exception as e:
+            print(f"⚠️ Payroll run failed: {e}")
+            flash("⚠️ تعذر تشغيل كشف الرواتب، لم يتم حفظ أي سجل", "danger")
+            return redirect(url_for("consulting_hr.payroll_run", year=year, month=month))
+        locked = sum(1 for change in result.changes.values() if change == "مقفل")
+        flash(
+            f"✅ تم حفظ كشف {month:02d}/{year}: {result.written} موظف"
+            + (f"، {locked} كشف معتمد لم يُعدّل" if locked else ""),
+            "success",
+        )
+        return redirect(url_for("consulting_hr.payroll_run", year=year, month=month))
+
+    result = run_payroll(year, month, dry_run=True)
+    # الجدول يعرض أول 500 فرق فقط؛ الملخص أعلاه يغطي كل الموظفين
+    changed = [line for line in result.lines if result.changes.get(line.employee_id) != "بدون تغيير"][:500]
+    names = {}
+    if changed:
+        names = {
+            emp_id: f"{first} {last}"
+            for emp_id, first, last in db.session.query(
+                Employee.id, Employee.first_name, Employee.last_name
+            ).filter(Employee.id.in_([line.employee_id for line in changed]))
+        }
+    counts: Dict[str, int] = {}
+    for change in result.changes.values():
+        counts[change] = counts.get(change, 0) + 1
+
+    return render_template(
+        "hr/payroll_run.html",
+        result=result,
+        changed=changed,
+        names=names,
+        counts=counts,
+        year=year,
+        month=month,
+        title="تشغيل كشف الرواتب",
+    )
+
+
+@hr_bp.route("/leaves")
+def list_leaves():
+    """شاشة اعتماد الإجازات مع كشف تداخل الفترات لكل طلب"""
+    maybe_redirect = _require_roles(["manager", "hr", "hr_manager"])
+    if maybe_redirect:
+        return maybe_redirect
+
+    status = request.args.get("status", "معلق")
+    page = max(request.args.get("page", 1, type=int) or 1, 1)
+    per_page = 50
+
+    query = LeaveRequest.query.options(joinedload(LeaveRequest.leave_type))
+    if status in LEAVE_REQUEST_STATUSES:
+        query = query.filter(LeaveRequest.status == status)
+    total = query.order_by(None).count()
+    leaves = (
+        query.order_by(LeaveRequest.start_date.asc(), LeaveRequest.id.asc())
+        .offset((page - 1) * per_page)
+        .limit(per_page)
+        .all()
+    )
+    overlaps = find_overlaps(leaves)
+
+    employee_ids = {leave.employee_id for leave in leaves}
+    names = {}
+    balances = {}
+    if employee_ids:
+        names = {
+            emp_id: f"{first} {last}"
+            for emp_id, first, last in db.session.query(
+                Employee.id, Employee.first_name, Employee.last_name
+            ).filter(Employee.id.in_(employee_ids))
+        }
+        years = {leave.start_date.year for leave in leaves}
+        balances = {
+            (b.employee_id, b.leave_type_id, b.year): b.remaining_balance
+            for b in LeaveBalance.query.filter(
+                LeaveBalance.employee_id.in_(employee_ids), LeaveBalance.year.in_(years)
+            )
+        }
+
+    return render_template(
+        "hr/leaves.html",
+        leaves=leaves,
+        overlaps=overlaps,
+        names=names,
+        balances=balances,
+        status=status,
+        statuses=LEAVE_REQUEST_STATUSES,
+        page=page,
+        total_pages=max((total + per_page - 1) // per_page, 1),
+        title="اعتماد الإجازات",
+    )
+
+
+@hr_bp.route("/leaves/<int:leave_id>/status", methods=["POST"])
+def update_leave_status(leave_id: int):
+    """اعتماد/رفض/إلغاء طلب إجازة مع تسجيل الأثر في دفتر الإجازات"""
+    maybe_redirect = _require_roles(["manager", "hr", "hr_manager"])
+    if maybe_redirect:
+        return maybe_redirect
+
+    leave = LeaveRequest.query.get_or_404(leave_id)
+    new_status = request.form.get("status", "")
+    back = redirect(request.referrer or url_for("consulting_hr.list_leaves"))
+    if new_status not in LEAVE_REQUEST_STATUSES:
+        flash("⚠️ حالة غير صالحة", "warning")
+        return back
+
+    if new_status == "معتمد":
+        conflicts = [o for o in find_overlaps([leave]).get(leave.id, []) if o[3] == "معتمد"]
+        if conflicts:
+            _, start, end, _ = conflicts[0]
+            flash(f"⚠️ لا يمكن الاعتماد: الطلب يتداخل مع إجازة معتمدة ({start} - {end})", "danger")
+            return back
+
+    try:
+        set_request_status(leave, new_status, session.get("user_id"), request.form.get("reason") or None)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Leave status update failed: {e}")
+        flash("⚠️ تعذر تحديث حالة الإجازة", "danger")
+        return back
+
+    flash(f"✅ تم تحديث حالة الإجازة إلى {new_status}", "success")
+    return back
+
+
 # ========== Unified Staff Creation (Employee or Engineer) ==========
 
 @hr_bp.route("/staff/new", methods=["GET", "POST"])
@@ -0,0 +1,178 @@
+"""تقرير أعمار الفواتير (Invoice aging) لفواتير الاستشارات.
+
+- استعلام مجمّع واحد على consulting_invoice (GROUP BY العميل/المشروع/العقد) يحسب المبالغ
+  المستحقة في كل فئة عمر بـ SUM(CASE ...) على due_date، مع حدود الفئات محسوبة مسبقاً كتواريخ
+  فيبقى الشرط قابلاً لاستخدام فهرس due_date ولا يعتمد على دوال تواريخ خاصة بقاعدة البيانات.
+- التجميع حسب العميل أو المشروع أو العقد يُشتق من نفس النتيجة دون استعلامات إضافية.
+- النتيجة محفوظة في كاش قصير العمر (INVOICE_AGING_TTL ثانية، الافتراضي 30) لليوم الحالي فقط
+  (الفئات تتغير بتغير التاريخ)، وتُبطل فوراً عند أي تعديل على الفواتير في نفس العملية؛ العمليات
+  الأخرى (عمال gunicorn) ترى التعديل بعد انتهاء المهلة على الأكثر.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func
+
+from extensions import db
+from consulting.clients.models import Client
+from consulting.contracts.models import Contract
+from consulting.dashboard.stats import register_invalidation
+from consulting.projects.models import ConsultingProject
+from .models import Invoice
+
+
+# (المفتاح، العنوان، أقل عدد أيام تأخير، أكبر عدد أيام تأخير)
+AGING_BUCKETS = [
+    ("not_due", "غير مستحقة", None, None),
+    # متأخرة حتى 30 يوماً (يوم الاستحقاق نفسه غير متأخر كما في Invoice.is_overdue)
+    ("d0_30", "0-30", 1, 30),
+    ("d31_60", "31-60", 31, 60),
+    ("d61_90", "61-90", 61, 90),
+    ("d90_plus", "90+", 91, None),
+]
+BUCKET_KEYS = [key for key, _, _, _ in AGING_BUCKETS]
+OVERDUE_KEYS = [key for key in BUCKET_KEYS if key != "not_due"]
+GROUPS = ("client", "project", "contract")
+
+AGING_TTL_SECONDS = float(os.environ.get("INVOICE_AGING_TTL", "30"))
+
+_lock = threading.Lock()
+# اليوم → (وقت انتهاء الصلاحية، التقرير)
+_cache: Dict[date, Tuple[float, Dict[str, Any]]] = {}
+
+
+def _bucket_condition(today: date, min_days: Optional[int], max_days: Optional[int]):
+    """تأخير بين min_days و max_days يوماً ⇔ due_date بين today-max_days و today-min_days."""
+    if min_days is None:
+        # غير مستحقة: بدون تاريخ استحقاق أو تستحق اليوم أو بعده
+        return (Invoice.due_date.is_(None)) | (Invoice.due_date >= today)
+    condition = Invoice.due_date <= today - timedelta(days=min_days)
+    if max_days is not None:
+        condition = condition & (Invoice.due_date >= today - timedelta(days=max_days))
+    return condition
+
+
+def _compute_aging(today: date) -> Dict[str, Any]:
+    unpaid = Invoice.status != "مدفوعة"
+    bucket_columns = [
+        func.coalesce(func.sum(case((unpaid & _bucket_condition(today, lo, hi), Invoice.amount), else_=0)), 0)
+        for _, _, lo, hi in AGING_BUCKETS
+    ]
+    rows = (
+        db.session.query(
+            Invoice.client_id,
+            Client.name,
+            Invoice.project_id,
+            ConsultingProject.name,
+            Invoice.contract_id,
+            Contract.contract_number,
+            func.coalesce(func.sum(Invoice.amount), 0),
+            func.count(Invoice.id),
+            *bucket_columns,
+        )
+        .outerjoin(Client, Client.id == Invoice.client_id)
+        .outerjoin(ConsultingProject, ConsultingProject.id == Invoice.project_id)
+        .outerjoin(Contract, Contract.id == Invoice.contract_id)
+        .group_by(
+            Invoice.client_id, Client.name,
+            Invoice.project_id, ConsultingProject.name,
+            Invoice.contract_id, Contract.contract_number,
+        )
+        .all()
+    )
+
+    lines: List[Dict[str, Any]] = []
+    totals = {"total": 0.0, "invoices": 0, **{key: 0.0 for key in BUCKET_KEYS}}
+    for client_id, client_name, project_id, project_name, contract_id, contract_number, total, count, *amounts in rows:
+        buckets = {key: round(float(value or 0), 2) for key, value in zip(BUCKET_KEYS, amounts)}
+        totals["total"] += float(total or 0)
+        totals["invoices"] += int(count or 0)
+        for key, value in buckets.items():
+            totals[key] += value
+        if not any(buckets.values()):
+            continue
+        lines.append({
+            "client": {"id": client_id, "name": client_name},
+            "project": {"id": project_id, "name": project_name},
+            "contract": {"id": contract_id, "number": contract_number} if contract_id else None,
+            "buckets": buckets,
+        })
+
+    totals = {key: round(value, 2) if isinstance(value, float) else value for key, value in totals.items()}
+    totals["outstanding"] = round(sum(totals[key] for key in BUCKET_KEYS), 2)
+    totals["overdue"] = round(sum(totals[key] for key in OVERDUE_KEYS), 2)
+    return {"as_of": today, "lines": lines, "totals": totals}
+
+
+def get_invoice_aging(today: Optional[date] = None) -> Dict[str, Any]:
+    """تقرير الأعمار ليوم today (محفوظ AGING_TTL_SECONDS ثانية أو حتى أول تعديل على الفواتير)."""
+    today = today or date.today()
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get(today)
+    if cached is not None and now < cached[0]:
+        return cached[1]
+    report = _compute_aging(today)
+    with _lock:
+        _cache.clear()
+        _cache[today] = (now + AGING_TTL_SECONDS, report)
+    return report
+
+
+def invalidate_invoice_aging() -> None:
+    with _lock:
+        _cache.clear()
+
+
+register_invalidation(invalidate_invoice_aging)
+
+
+def aging_by(report: Dict[str, Any], group: str) -> List[Dict[str, Any]]:
+    """تجميع سطور التقرير حسب client أو project أو contract مرتبة حسب المتأخر تنازلياً."""
+    if group not in GROUPS:
+        raise ValueError(f"unknown aging group: {group}")
+    grouped: Dict[Any, Dict[str, Any]] = {}
+    for line in report["lines"]:
+        ref = line[group]
+        key = ref["id"] if ref else None
+        entry = grouped.get(key)
+        if entry is None:
+            if group == "contract":
+                label = ref["number"] if ref else "بدون عقد"
+            else:
+                label = ref["name"] if ref and ref["name"] else f"#{key}"
+            entry = grouped[key] = {"id": key, "name": label, **{k: 0.0 for k in BUCKET_KEYS}}
+        for bucket, value in line["buckets"].items():
+            entry[bucket] += value
+    result = []
+    for entry in grouped.values():
+        for bucket in BUCKET_KEYS:
+            entry[bucket] = round(entry[bucket], 2)
+        entry["outstanding"] = round(sum(entry[k] for k in BUCKET_KEYS), 2)
+        entry["overdue"] = round(sum(entry[k] for k in OVERDUE_KEYS), 2)
+        result.append(entry)
+    result.sort(key=lambda e: (-e["overdue"], -e["outstanding"], str(e["name"])))
+    return result
+
+
+def aging_csv(report: Dict[str, Any], group: str) -> str:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["ID", group.capitalize(), *[label for _, label, _, _ in AGING_BUCKETS], "Overdue", "Outstanding"])
+    for entry in aging_by(report, group):
+        writer.writerow([
+            entry["id"] if entry["id"] is not None else "",
+            entry["name"],
+            *[f"{entry[key]:.2f}" for key in BUCKET_KEYS],
+            f"{entry['overdue']:.2f}",
+            f"{entry['outstanding']:.2f}",
+        ])
+    return buf.getvalue()
@@ -5,6 +5,8 @@ from typing import List, Optional
 
 from flask import (
     Blueprint,
+    Response,
+    jsonify,
     render_template,
     request,
     redirect,
@@ -12,13 +14,15 @@ from flask import (
     flash,
     session,
 )
-from sqlalchemy import or_, func
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 
 from extensions import db
 from consulting.clients.models import Client
 from consulting.projects.models import ConsultingProject
 from consulting.contracts.models import Contract
 from .models import Invoice, INVOICE_STATUSES
+from .aging import AGING_BUCKETS, GROUPS as AGING_GROUPS, aging_by, aging_csv, get_invoice_aging
 from .forms import validate_invoice_form, validate_status_form, INVOICE_STATUSES as FORM_STATUSES
 
 
@@ -84,12 +88,13 @@ def list_invoices():
         except Exception:
             pass
 
-    query = query.order_by(Invoice.id.desc())
+    # العميل والمشروع يظهران في كل صف؛ تحميلهما مع الصفحة بدل استعلام لكل فاتورة
+    query = query.options(joinedload(Invoice.client), joinedload(Invoice.project)).order_by(Invoice.id.desc())
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
-    # For filters
-    clients = Client.query.order_by(Client.name.asc()).all()
-    projects = ConsultingProject.query.order_by(ConsultingProject.name.asc()).all()
+    # الفلاتر تُملأ عبر واجهات typeahead؛ نحمّل أسماء القيم المختارة فقط
+    selected_client = db.session.get(Client, int(client_id)) if client_id.isdigit() else None
+    selected_project = db.session.get(ConsultingProject, int(project_id)) if project_id.isdigit() else None
 
     # Overdue alert count
     today = date.today()
@@ -104,8 +109,8 @@ def list_invoices():
         current_status=status_filter,
         current_client_id=client_id,
         current_project_id=project_id,
-        clients=clients,
-        projects=projects,
+        selected_client=selected_client,
+        selected_project=selected_project,
         overdue_count=overdue_count,
         title="فواتير الاستشارات",
     )
@@ -247,33 +252,62 @@ def invoices_reports():
     if maybe_redirect:
         return maybe_redirect
 
-    total_amount = db.session.query(func.coalesce(func.sum(Invoice.amount), 0.0)).scalar() or 0.0
-    unpaid_amount = (
-        db.session.query(func.coalesce(func.sum(Invoice.amount), 0.0))
-        .filter(Invoice.status != "مدفوعة")
-        .scalar()
-        or 0.0
-    )
-
-    # Overdue amount: due_date < today and not paid
-    today = date.today()
-    overdue_amount = (
-        db.session.query(func.coalesce(func.sum(Invoice.amount), 0.0))
-        .filter(Invoice.status != "مدفوعة")
-        .filter(Invoice.due_date.isnot(None))
-        .filter(Invoice.due_date < today)
-        .scalar()
-        or 0.0
-    )
-
+    # المجاميع وفئات الأعمار من استعلام مجمّع واحد (محفوظ لليوم)
+    report = get_invoice_aging()
+    group = request.args.get("group", "client")
+    if group not in AGING_GROUPS:
+        group = "client"
     totals = {
-        "total": total_amount,
-        "unpaid": unpaid_amount,
-        "overdue": overdue_amount,
+        "total": report["totals"]["total"],
+        "unpaid": report["totals"]["outstanding"],
+        "overdue": report["totals"]["overdue"],
     }
 
     return render_template(
         "invoices/reports.html",
         totals=totals,
+        aging=aging_by(report, group),
+        aging_buckets=AGING_BUCKETS,
+        group=group,
+        as_of=report["as_of"],
         title="تقارير الفواتير"
     )
+
+
+@invoices_bp.route("/api/invoices/aging")
+def api_invoices_aging():
+    maybe_redirect = _require_roles(["manager", "finance", "hr"])
+    if maybe_redirect:
+        return maybe_redirect
+
+    report = get_invoice_aging()
+    group = request.args.get("group", "client")
+    if group not in AGING_GROUPS:
+        return jsonify({"error": f"group must be one of {', '.join(AGING_GROUPS)}"}), 400
+
+    return jsonify({
+        "as_of": report["as_of"].isoformat(),
+        "group": group,
+        "buckets": [{"key": key, "label": label} for key, label, _, _ in AGING_BUCKETS],
+        "totals": report["totals"],
+        "items": aging_by(report, group),
+    })
+
+
+@invoices_bp.route("/invoices/aging.csv")
+def invoices_aging_csv():
+    maybe_redirect = _require_roles(["manager", "finance", "hr"])
+    if maybe_redirect:
+        return maybe_redirect
+
+    report = get_invoice_aging()
+    group = request.args.get("group", "client")
+    if group not in AGING_GROUPS:
+        group = "client"
+    return Response(
+        aging_csv(report, group),
+        mimetype="text/csv; charset=utf-8",
+        headers={
+            "Content-Disposition": f"attachment; filename=invoice_aging_{group}_{report['as_of'].isoformat()}.csv"
+        },
+    )
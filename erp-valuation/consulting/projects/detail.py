@@ -0,0 +1,92 @@
+"""تحميل صفحة تفاصيل المشروع بعدد ثابت من الاستعلامات.
+
+- المشروع وعميله وملخصات الفواتير والمهام (استعلامات فرعية مجمّعة) في استعلام واحد.
+- العقود والملفات وتعيينات المهندسين (مع المهندس) عبر selectinload: استعلام لكل مجموعة
+  مهما كان عدد العناصر، بدل استعلام منفصل من المسار أو تحميل كسول من القالب.
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from extensions import db
+from consulting.hr.models import Task
+from consulting.invoices.models import Invoice
+from .models import ConsultingProject, ProjectEngineerAssignment
+
+
+def _invoice_summary_columns(today: date):
+    scope = Invoice.project_id == ConsultingProject.id
+    unpaid = Invoice.status != "مدفوعة"
+    return (
+        select(func.count(Invoice.id)).where(scope).correlate(ConsultingProject).scalar_subquery(),
+        select(func.coalesce(func.sum(Invoice.amount), 0)).where(scope).correlate(ConsultingProject).scalar_subquery(),
+        select(func.coalesce(func.sum(case((unpaid, Invoice.amount), else_=0)), 0))
+        .where(scope).correlate(ConsultingProject).scalar_subquery(),
+        select(func.count(Invoice.id))
+        .where(scope, unpaid, Invoice.due_date.isnot(None), Invoice.due_date < today)
+        .correlate(ConsultingProject).scalar_subquery(),
+    )
+
+
+def _task_summary_columns(today: date):
+    scope = Task.project_id == ConsultingProject.id
+    open_task = Task.status != "مكتملة"
+    return (
+        select(func.count(Task.id)).where(scope).correlate(ConsultingProject).scalar_subquery(),
+        select(func.count(Task.id)).where(scope, open_task).correlate(ConsultingProject).scalar_subquery(),
+        select(func.count(Task.id))
+        .where(scope, open_task, Task.deadline.isnot(None), Task.deadline < today)
+        .correlate(ConsultingProject).scalar_subquery(),
+    )
+
+
+def load_project_detail(project_id: int, today: Optional[date] = None) -> Optional[Dict[str, Any]]:
+    """المشروع مع عقوده وملفاته وتعييناته وملخصات الفواتير والمهام، أو None إن لم يوجد."""
+    today = today or date.today()
+    row = (
+        db.session.query(ConsultingProject, *_invoice_summary_columns(today), *_task_summary_columns(today))
+        .options(
+            joinedload(ConsultingProject.client),
+            selectinload(ConsultingProject.files),
+            selectinload(ConsultingProject.contracts),
+            selectinload(ConsultingProject.engineer_assignments).joinedload(ProjectEngineerAssignment.engineer),
+        )
+        .filter(ConsultingProject.id == project_id)
+        .one_or_none()
+    )
+    if row is None:
+        return None
+
+    project, inv_count, inv_total, inv_outstanding, inv_overdue, task_total, task_open, task_overdue = row
+
+    # الترتيب كما كان في المسار (بدون استعلامات إضافية)
+    files = sorted(project.files, key=lambda f: f.uploaded_at or datetime.min, reverse=True)
+    contracts = sorted(project.contracts, key=lambda c: c.id, reverse=True)
+    assignments = sorted(
+        project.engineer_assignments,
+        key=lambda a: (bool(a.is_lead), a.assigned_at or datetime.min),
+        reverse=True,
+    )
+
+    return {
+        "project": project,
+        "files": files,
+        "contracts": contracts,
+        "assignments": assignments,
+        "invoice_summary": {
+            "count": int(inv_count or 0),
+            "total": float(inv_total or 0),
+            "outstanding": float(inv_outstanding or 0),
+            "overdue": int(inv_overdue or 0),
+        },
+        "task_summary": {
+            "total": int(task_total or 0),
+            "open": int(task_open or 0),
+            "overdue": int(task_overdue or 0),
+        },
+    }
@@ -1,7 +1,5 @@
 from __future__ import annotations
 
-import os
-import time
 from datetime import datetime
 from typing import Dict, Optional, Tuple
 
@@ -13,16 +11,19 @@ from flask import (
     url_for,
     flash,
     session,
-    current_app,
+    jsonify,
+    abort,
 )
 from werkzeug.utils import secure_filename
 from sqlalchemy import or_, func, text
+from sqlalchemy.orm import joinedload
 
 from extensions import db
 from consulting.clients.models import Client
-from consulting.contracts.models import Contract
 from consulting.hr.models import Engineer
 from .models import ConsultingProject, ProjectFile, ProjectEngineerAssignment
+from .detail import load_project_detail
+from upload_store import get_upload_store
 from .forms import (
     PROJECT_TYPES,
     PROJECT_STATUSES,
@@ -31,6 +32,7 @@ from .forms import (
     validate_engineer_assignment_form,
 )
 from consulting.clients.forms import validate_client_form, CLIENT_TYPES
+from consulting.clients.routes import TYPEAHEAD_LIMIT, _prefix_like
 
 
 projects_bp = Blueprint(
@@ -153,11 +155,11 @@ def list_projects():
         except Exception:
             pass
 
-    query = query.order_by(ConsultingProject.id.desc())
+    query = query.options(joinedload(ConsultingProject.client)).order_by(ConsultingProject.id.desc())
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
-    # Clients for filter dropdown
-    clients = Client.query.order_by(Client.name.asc()).all()
+    # فلتر العميل يُملأ عبر /api/clients/typeahead؛ نحمّل اسم العميل المختار فقط
+    selected_client = db.session.get(Client, int(client_id)) if client_id.isdigit() else None
 
     return render_template(
         "projects/list.html",
@@ -167,7 +169,7 @@ def list_projects():
         current_status=status_filter,
         current_client_id=client_id,
         PROJECT_STATUSES=PROJECT_STATUSES,
-        clients=clients,
+        selected_client=selected_client,
         title="مشاريع الاستشارات",
     )
 
@@ -178,19 +180,10 @@ def project_detail(project_id: int):
     if maybe_redirect:
         return maybe_redirect
 
-    project = ConsultingProject.query.get_or_404(project_id)
-
-    related_contracts = (
-        Contract.query.filter_by(project_id=project.id)
-        .order_by(Contract.id.desc())
-        .all()
-    )
-
-    assigned_engineers = (
-        ProjectEngineerAssignment.query.filter_by(project_id=project.id)
-        .order_by(ProjectEngineerAssignment.is_lead.desc(), ProjectEngineerAssignment.assigned_at.desc())
-        .all()
-    )
+    detail = load_project_detail(project_id)
+    if detail is None:
+        abort(404)
+    project = detail["project"]
 
     engineers = (
         Engineer.query.filter(Engineer.status == "نشط").order_by(Engineer.name.asc()).all()
@@ -199,34 +192,29 @@ def project_detail(project_id: int):
     consulting_engineer_source = "branch"
     current_user_id = session.get("user_id")
     if current_user_id:
-        branch_row = db.session.execute(
-            text("SELECT branch_id FROM user WHERE id = :uid"),
+        # فرع المستخدم الحالي يُحسب داخل نفس الاستعلام بدل استعلام منفصل
+        rows = db.session.execute(
+            text(
+                """
+                SELECT u.id, u.username
+                FROM user AS u
+                LEFT JOIN branch_section AS s ON s.id = u.section_id
+                WHERE u.role = 'engineer'
+                  AND u.branch_id IS NOT NULL
+                  AND u.branch_id = (SELECT cu.branch_id FROM user AS cu WHERE cu.id = :uid)
+                  AND LOWER(COALESCE(s.name, '')) IN (
+                    'consultations', 'consultation', 'consulting', 'الاستشارات'
+                  )
+                ORDER BY LOWER(u.username) ASC
+                """
+            ),
             {"uid": current_user_id},
-        ).fetchone()
-        branch_id = branch_row[0] if branch_row else None
-
-        if branch_id:
-            rows = db.session.execute(
-                text(
-                    """
-                    SELECT u.id, u.username
-                    FROM user AS u
-                    LEFT JOIN branch_section AS s ON s.id = u.section_id
-                    WHERE u.role = 'engineer'
-                      AND u.branch_id = :branch_id
-                      AND LOWER(COALESCE(s.name, '')) IN (
-                        'consultations', 'consultation', 'consulting', 'الاستشارات'
-                      )
-                    ORDER BY LOWER(u.username) ASC
-                    """
-                ),
-                {"branch_id": branch_id},
-            ).fetchall()
-            consulting_branch_engineers = [
-                {"id": row[0], "name": row[1]}
-                for row in rows
-                if row and row[1]
-            ]
+        ).fetchall()
+        consulting_branch_engineers = [
+            {"id": row[0], "name": row[1]}
+            for row in rows
+            if row and row[1]
+        ]
     if not consulting_branch_engineers:
         consulting_branch_engineers = [
             {"id": eng.id, "name": eng.name}
@@ -236,15 +224,14 @@ def project_detail(project_id: int):
         consulting_engineer_source = "registry"
     can_manage_project = session.get("role") in {"manager", "employee", "hr"}
 
-    # Files
-    files = ProjectFile.query.filter_by(project_id=project.id).order_by(ProjectFile.uploaded_at.desc()).all()
-
     return render_template(
         "projects/detail.html",
         project=project,
-        files=files,
-        related_contracts=related_contracts,
-        assigned_engineers=assigned_engineers,
+        files=detail["files"],
+        related_contracts=detail["contracts"],
+        assigned_engineers=detail["assignments"],
+        invoice_summary=detail["invoice_summary"],
+        task_summary=detail["task_summary"],
         engineers=engineers,
         consulting_branch_engineers=consulting_branch_engineers,
         consulting_engineer_source=consulting_engineer_source,
@@ -504,9 +491,7 @@ def upload_project_file(project_id: int):
         flash("❌ لم يتم اختيار ملفات", "error")
         return redirect(url_for("consulting_projects.project_detail", project_id=project.id))
 
-    upload_dir = current_app.config.get("UPLOAD_FOLDER")
-    os.makedirs(upload_dir, exist_ok=True)
-
+    store = get_upload_store()
     saved_count = 0
     for file in files:
         if not file or not file.filename:
@@ -516,12 +501,9 @@ def upload_project_file(project_id: int):
         if ext not in ALLOWED_FILE_EXTENSIONS:
             flash(f"⚠️ تم تجاهل {original} (امتداد غير مسموح)", "warning")
             continue
-        unique = f"project_{project.id}_{int(time.time())}_{secure_filename(original)}"
-        path = os.path.join(upload_dir, unique)
-        file.save(path)
         pf = ProjectFile(
             project_id=project.id,
-            stored_filename=unique,
+            stored_filename=store.save(file, original),
             original_filename=original,
             file_type=ext,
             uploaded_by=session.get("user_id"),
@@ -536,3 +518,23 @@ def upload_project_file(project_id: int):
         flash("⚠️ لم يتم حفظ أي ملف", "warning")
 
     return redirect(url_for("consulting_projects.project_detail", project_id=project.id))
+
+
+# ---------- API ----------
+
+@projects_bp.route("/api/projects/typeahead")
+def api_projects_typeahead():
+    # قائمة مختصرة (id, name) لحقول اختيار المشروع؛ client_id اختياري لتضييق النتائج
+    maybe_redirect = _require_roles(["manager", "employee", "engineer", "finance", "hr"])
+    if maybe_redirect:
+        return maybe_redirect
+
+    q = (request.args.get("q") or "").strip()
+    client_id = (request.args.get("client_id") or "").strip()
+    query = db.session.query(ConsultingProject.id, ConsultingProject.name)
+    if q:
+        query = query.filter(ConsultingProject.name.like(_prefix_like(q), escape="\\"))
+    if client_id.isdigit():
+        query = query.filter(ConsultingProject.client_id == int(client_id))
+    rows = query.order_by(ConsultingProject.name.asc()).limit(TYPEAHEAD_LIMIT).all()
+    return jsonify({"items": [{"id": row.id, "name": row.name} for row in rows]})
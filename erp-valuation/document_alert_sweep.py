@@ -0,0 +1,54 @@
+"""
+document_alert_sweep.py
+
+مسح تنبيهات انتهاء المستندات من سطر الأوامر (للجدولة عبر cron بدل المجدول الداخلي أو معه).
+
+- يمر على مستندات الموظفين (hr_employee_document.expiry_date) ومستندات الفروع
+  (branch_document.expires_at) التي تنتهي خلال DOCUMENT_ALERT_WARNING_DAYS يوماً
+- ينشئ/يحدّث تنبيهات hr_document_alert و branch_document_alert دون تكرار
+- يرسل الإشعارات الجديدة على دفعات
+
+أمثلة:
+  python3 document_alert_sweep.py
+  python3 document_alert_sweep.py --date 2025-01-31 --no-notify
+  # cron يومي:  15 6 * * * cd /app && DOCUMENT_ALERT_SWEEP_MINUTES=0 python3 document_alert_sweep.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import datetime
+from typing import Iterable
+
+
+def parse_args(argv: Iterable[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Refresh document expiry alerts.")
+    parser.add_argument("--date", default=None, help="Sweep as of this day (YYYY-MM-DD), default today")
+    parser.add_argument("--no-notify", action="store_true", help="Update alerts without sending notifications")
+    return parser.parse_args(list(argv))
+
+
+def main(argv: Iterable[str]) -> int:
+    args = parse_args(argv)
+    today = None
+    if args.date:
+        try:
+            today = datetime.strptime(args.date, "%Y-%m-%d").date()
+        except ValueError:
+            print(f"Invalid --date {args.date!r}, expected YYYY-MM-DD", file=sys.stderr)
+            return 2
+
+    from app import app, sweep_document_alerts
+
+    with app.app_context():
+        result = sweep_document_alerts(today=today, notify=not args.no_notify)
+    print(
+        f"new employee alerts={result['employee']} new branch alerts={result['branch']} "
+        f"notified={result['notified']}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
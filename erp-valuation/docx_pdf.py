@@ -0,0 +1,545 @@
+"""
+docx_pdf.py
+
+تحويل ملفات DOCX المولّدة (فواتير/عروض أسعار) إلى PDF عبر مجموعة عمليات تحويل دافئة.
+
+- كل عامل (worker) عملية Python مستقلة تعمل باستمرار وتستقبل المهام عبر stdin/stdout
+  (JSON سطر لكل مهمة).
+- المحرك حسب المتوفر:
+  * uno: إن وُجد LibreOffice ووحدة uno (python3-uno) في مفسّر العامل، يشغّل كل عامل soffice
+    واحداً دائماً (--accept=pipe,...;urp;) ويحوّل عبره كل المستندات؛ لا تشغيل لـ LibreOffice لكل مستند.
+  * soffice: LibreOffice بدون uno: تشغيل soffice --convert-to لكل مستند (الإحماء يقتصر على
+    تهيئة ملف التعريف، وكل مستند يدفع كلفة بدء LibreOffice كاملة).
+  * pymupdf: بدون LibreOffice، محرك PyMuPDF (fitz) المتوفر أصلاً.
+  لكل عامل ملف تعريف LibreOffice خاص به حتى تعمل التحويلات بالتوازي دون تعارض قفل الملف.
+  مفسّر العامل قابل للتغيير (PDF_WORKER_PYTHON) لأن uno يأتي عادةً مع python3 النظام لا مع بيئة التطبيق.
+- المهام تمر عبر طابور واحد (queue.Queue)، ولكل مستند مهلة؛ عند تجاوزها تُقتل مجموعة عمليات
+  العامل ومجموعة soffice التابعة له (soffice.bin يعمل كعملية فرعية لا تصلها إشارة الأب وحده)
+  ثم يُعاد تشغيل العامل بشكل نظيف.
+- التخزين المؤقت للناتج مسؤولية المستدعي (انظر render_cache.py).
+
+الاستخدام كعامل (يستدعيه المحوّل تلقائياً):
+  python3 docx_pdf.py --worker [--soffice /usr/bin/soffice] [--profile DIR]
+
+قياس كلفة التحويل (مستند افتراضي، بارد لكل مستند مقابل المجموعة الدافئة):
+  python3 docx_pdf.py --bench 20 [--workers 2]
+
+تحويل مباشر من سطر الأوامر:
+  python3 docx_pdf.py --convert input.docx output.pdf
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from typing import Iterable
+
+
+class PdfConversionError(RuntimeError):
+    """فشل تحويل مستند إلى PDF (مهلة أو خطأ من المحرك)."""
+
+
+def find_soffice() -> str | None:
+    """مسار LibreOffice إن كان مثبتاً (SOFFICE_BIN له الأولوية)."""
+    configured = os.environ.get("SOFFICE_BIN")
+    if configured and os.path.exists(configured):
+        return configured
+    return shutil.which("soffice") or shutil.which("libreoffice")
+
+
+def uno_available() -> bool:
+    try:
+        import uno  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _kill_group(pgid: int | None) -> None:
+    """يقتل مجموعة عمليات كاملة (soffice يشغّل soffice.bin كعملية فرعية)."""
+    if not pgid:
+        return
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(pgid, signal.SIGKILL)
+        else:
+            os.kill(pgid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+
+def _profile_arg(profile_dir: str | None) -> list[str]:
+    if not profile_dir:
+        return []
+    return ["-env:UserInstallation=file://" + os.path.abspath(profile_dir).replace(os.sep, "/")]
+
+
+# ---------------- جانب العامل (عملية مستقلة) ----------------
+
+class OfficeListener:
+    """soffice واحد دائم التشغيل لكل عامل، يُستدعى عبر UNO على pipe خاص به."""
+
+    def __init__(self, soffice: str, profile_dir: str | None, start_timeout: float = 120.0):
+        self.soffice = soffice
+        self.profile_dir = profile_dir
+        self.start_timeout = start_timeout
+        self.pipe_name = f"erp_docx_pdf_{os.getpid()}"
+        self.proc: subprocess.Popen | None = None
+        self.desktop = None
+
+    @property
+    def pgid(self) -> int | None:
+        return self.proc.pid if self.proc is not None else None
+
+    def start(self) -> None:
+        import uno
+        from com.sun.star.connection import NoConnectException
+
+        cmd = [self.soffice, "--headless", "--invisible", "--norestore", "--nologo", "--nodefault"]
+        cmd += _profile_arg(self.profile_dir)
+        cmd.append(f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext")
+        # مجموعة عمليات مستقلة حتى يقتلها العامل أو المجموعة الأم كاملة (مع soffice.bin)
+        self.proc = subprocess.Popen(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+        )
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+        url = f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            try:
+                ctx = resolver.resolve(url)
+                break
+            except NoConnectException:
+                if self.proc.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError("soffice listener did not accept connections")
+                time.sleep(0.25)
+        self.desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+
+    def stop(self) -> None:
+        desktop, self.desktop = self.desktop, None
+        proc, self.proc = self.proc, None
+        if desktop is not None:
+            try:
+                desktop.terminate()
+            except Exception:
+                pass
+        if proc is not None:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+            _kill_group(proc.pid)
+
+    def _convert_once(self, src: str, dst: str) -> None:
+        import uno
+        from com.sun.star.beans import PropertyValue
+
+        def props(**values):
+            out = []
+            for name, value in values.items():
+                prop = PropertyValue()
+                prop.Name, prop.Value = name, value
+                out.append(prop)
+            return tuple(out)
+
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(src)), "_blank", 0, props(Hidden=True, ReadOnly=True)
+        )
+        if doc is None:
+            raise RuntimeError("LibreOffice could not open the document")
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(dst)), props(FilterName="writer_pdf_Export"))
+        finally:
+            doc.close(True)
+
+    def convert(self, src: str, dst: str) -> None:
+        if self.proc is None or self.proc.poll() is not None:
+            self.stop()
+            self.start()
+        try:
+            self._convert_once(src, dst)
+        except Exception as exc:
+            # انقطع الجسر (تعطل soffice): إعادة تشغيل المستمع ومحاولة واحدة أخرى
+            bridge_lost = type(exc).__name__ == "DisposedException" or self.proc.poll() is not None
+            if not bridge_lost:
+                raise
+            self.stop()
+            self.start()
+            self._convert_once(src, dst)
+
+
+def _convert_with_soffice(soffice: str, profile_dir: str | None, src: str, dst: str, timeout: float | None) -> None:
+    out_dir = tempfile.mkdtemp(prefix="docx_pdf_")
+    try:
+        cmd = [soffice, "--headless", "--invisible", "--norestore"] + _profile_arg(profile_dir)
+        cmd += ["--convert-to", "pdf", "--outdir", out_dir, src]
+        # مجموعة عمليات مستقلة: عند المهلة تُقتل مع soffice.bin ولا يبقى شيء يتيماً
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        try:
+            returncode = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill_group(proc.pid)
+            proc.wait()
+            raise RuntimeError(f"soffice timed out after {timeout:.0f}s")
+        if returncode:
+            raise RuntimeError(f"soffice exited with status {returncode}")
+        produced = os.path.join(out_dir, os.path.splitext(os.path.basename(src))[0] + ".pdf")
+        if not os.path.exists(produced):
+            raise RuntimeError("soffice did not produce a PDF")
+        shutil.move(produced, dst)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def _convert_with_pymupdf(src: str, dst: str) -> None:
+    import fitz  # PyMuPDF
+
+    doc = fitz.open(src)
+    try:
+        pdf_bytes = doc.convert_to_pdf()
+    finally:
+        doc.close()
+    with open(dst, "wb") as fh:
+        fh.write(pdf_bytes)
+
+
+def convert_file(
+    src: str,
+    dst: str,
+    soffice: str | None = None,
+    profile_dir: str | None = None,
+    timeout: float | None = None,
+) -> None:
+    if soffice:
+        _convert_with_soffice(soffice, profile_dir, src, dst, timeout)
+    else:
+        _convert_with_pymupdf(src, dst)
+
+
+def _warm_up(soffice: str | None, profile_dir: str | None) -> None:
+    # تهيئة المحرك مرة واحدة عند بدء العامل (ملف التعريف أو تحميل المكتبة)
+    try:
+        if soffice:
+            cmd = [soffice, "--headless", "--invisible", "--norestore", "--terminate_after_init"]
+            cmd += _profile_arg(profile_dir)
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120)
+        else:
+            import fitz  # noqa: F401
+    except Exception:
+        pass
+
+
+def _start_listener(soffice: str | None, profile_dir: str | None) -> OfficeListener | None:
+    if not soffice or not uno_available():
+        return None
+    listener = OfficeListener(soffice, profile_dir)
+    try:
+        listener.start()
+    except Exception as exc:
+        print(f"soffice listener unavailable, converting per document: {exc}", file=sys.stderr)
+        listener.stop()
+        return None
+    return listener
+
+
+def serve_worker(soffice: str | None, profile_dir: str | None) -> int:
+    listener = _start_listener(soffice, profile_dir)
+    if listener is None:
+        _warm_up(soffice, profile_dir)
+    engine = "uno" if listener else ("soffice" if soffice else "pymupdf")
+
+    def send(reply: dict) -> None:
+        # office_pgid يسمح للمجموعة الأم بقتل soffice أيضاً إن قتلت العامل عند المهلة
+        reply["office_pgid"] = listener.pgid if listener else None
+        sys.stdout.write(json.dumps(reply) + "\n")
+        sys.stdout.flush()
+
+    send({"ready": True, "engine": engine})
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+                if listener is not None:
+                    listener.convert(job["src"], job["dst"])
+                else:
+                    convert_file(
+                        job["src"], job["dst"], soffice=soffice, profile_dir=profile_dir, timeout=job.get("timeout")
+                    )
+                reply = {"ok": True}
+            except Exception as exc:
+                reply = {"ok": False, "error": str(exc)}
+            send(reply)
+    finally:
+        if listener is not None:
+            listener.stop()
+    return 0
+
+
+# ---------------- جانب التطبيق (المجموعة والطابور) ----------------
+
+class _WorkerSlot:
+    """عملية تحويل واحدة دائمة التشغيل مع خيط قراءة لردودها."""
+
+    def __init__(self, index: int, soffice: str | None, profile_root: str | None, python: str | None = None):
+        self.index = index
+        self.soffice = soffice
+        self.python = python or sys.executable
+        self.profile_dir = os.path.join(profile_root, f"worker_{index}") if profile_root else None
+        self.proc: subprocess.Popen | None = None
+        self.replies: queue.Queue = queue.Queue()
+        self.ready = False
+        self.engine: str | None = None
+        self.office_pgid: int | None = None
+
+    def start(self) -> None:
+        cmd = [self.python, os.path.abspath(__file__), "--worker"]
+        if self.soffice:
+            cmd += ["--soffice", self.soffice]
+        if self.profile_dir:
+            cmd += ["--profile", self.profile_dir]
+        self.replies = queue.Queue()
+        self.ready = False
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+            # العامل قائد مجموعة عملياته؛ قتل المجموعة لا يترك عمليات فرعية يتيمة
+            start_new_session=True,
+        )
+        replies = self.replies
+        stdout = self.proc.stdout
+
+        def _reader() -> None:
+            for reply_line in stdout:
+                try:
+                    replies.put(json.loads(reply_line))
+                except ValueError:
+                    continue
+            replies.put(None)  # انتهت العملية
+
+        threading.Thread(target=_reader, name=f"docx-pdf-reader-{self.index}", daemon=True).start()
+
+    def stop(self) -> None:
+        proc, self.proc = self.proc, None
+        office_pgid, self.office_pgid = self.office_pgid, None
+        if proc is None:
+            return
+        try:
+            if proc.poll() is None:
+                _kill_group(proc.pid)
+                proc.kill()
+            proc.wait(timeout=5)
+        except Exception:
+            pass
+        _kill_group(office_pgid)
+
+    def _take_reply(self, timeout: float) -> dict | None:
+        reply = self.replies.get(timeout=timeout)
+        if reply and "office_pgid" in reply:
+            self.office_pgid = reply["office_pgid"]
+        return reply
+
+    def restart(self) -> None:
+        self.stop()
+        self.start()
+
+    def _await_ready(self, timeout: float) -> None:
+        if self.ready:
+            return
+        try:
+            reply = self._take_reply(timeout)
+        except queue.Empty:
+            self.restart()
+            raise PdfConversionError("converter worker did not become ready")
+        if not reply or not reply.get("ready"):
+            self.restart()
+            raise PdfConversionError("converter worker failed to start")
+        self.ready = True
+        self.engine = reply.get("engine")
+
+    def convert(self, src: str, dst: str, timeout: float, warm_timeout: float = 120.0) -> None:
+        if self.proc is None or self.proc.poll() is not None:
+            self.restart()
+        # الإحماء (تهيئة ملف التعريف) لا يُحسب ضمن مهلة المستند
+        self._await_ready(warm_timeout)
+        try:
+            self.proc.stdin.write(json.dumps({"src": src, "dst": dst, "timeout": timeout}) + "\n")
+            self.proc.stdin.flush()
+        except Exception as exc:
+            self.restart()
+            raise PdfConversionError(f"converter worker unavailable: {exc}") from exc
+
+        try:
+            # مهلة إضافية قصيرة ليتمكن العامل من الرد بخطأ مهلة soffice قبل قتله
+            reply = self._take_reply(timeout + 5)
+        except queue.Empty:
+            self.restart()
+            raise PdfConversionError(f"PDF conversion timed out after {timeout:.0f}s")
+        if reply is None:
+            self.restart()
+            raise PdfConversionError("converter worker exited unexpectedly")
+        if not reply.get("ok"):
+            raise PdfConversionError(reply.get("error") or "conversion failed")
+
+
+class DocxPdfConverter:
+    """مجموعة عمّال تحويل دافئة مع طابور مهام."""
+
+    def __init__(
+        self,
+        work_dir: str,
+        workers: int = 2,
+        timeout: float = 60.0,
+        soffice: str | None = None,
+        python: str | None = None,
+    ):
+        self.work_dir = work_dir
+        self.workers = max(1, int(workers or 1))
+        self.timeout = float(timeout or 60.0)
+        self.soffice = soffice
+        self.python = python
+        self._jobs: queue.Queue = queue.Queue()
+        self._slots: list[_WorkerSlot] = []
+        self._lock = threading.Lock()
+        self._started = False
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    # ----- دورة حياة المجموعة -----
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            profile_root = os.path.join(self.work_dir, "_profiles") if self.soffice else None
+            for idx in range(self.workers):
+                slot = _WorkerSlot(idx, self.soffice, profile_root, python=self.python)
+                slot.start()
+                self._slots.append(slot)
+                threading.Thread(
+                    target=self._run_slot, args=(slot,), name=f"docx-pdf-{idx}", daemon=True
+                ).start()
+            self._started = True
+            atexit.register(self.shutdown)
+
+    def shutdown(self) -> None:
+        for slot in self._slots:
+            slot.stop()
+
+    @property
+    def engine(self) -> str:
+        """المحرك الفعلي الذي أبلغ عنه العمّال (uno / soffice / pymupdf)."""
+        for slot in self._slots:
+            if slot.engine:
+                return slot.engine
+        return "soffice" if self.soffice else "pymupdf"
+
+    def _run_slot(self, slot: _WorkerSlot) -> None:
+        while True:
+            src, dst, future = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                slot.convert(src, dst, self.timeout)
+                future.set_result(dst)
+            except Exception as exc:
+                future.set_exception(exc)
+
+    # ----- واجهة الاستخدام -----
+    def submit(self, docx_path: str, pdf_path: str) -> Future:
+        """يضيف مهمة تحويل إلى الطابور ويعيد Future بمسار PDF الناتج."""
+        self.start()
+        future: Future = Future()
+        self._jobs.put((os.path.abspath(docx_path), os.path.abspath(pdf_path), future))
+        return future
+
+    def convert(self, docx_path: str, pdf_path: str) -> str:
+        # مهلة الانتظار تشمل وقت الانتظار في الطابور وإحماء العامل أول مرة
+        wait = self.timeout * (1 + self._jobs.qsize() / self.workers) + 125
+        try:
+            return self.submit(docx_path, pdf_path).result(timeout=wait)
+        except PdfConversionError:
+            raise
+        except Exception as exc:
+            raise PdfConversionError(str(exc)) from exc
+
+
+BENCH_DOCX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docx_templates", "default_document.docx")
+
+
+def benchmark(count: int = 20, workers: int = 2, soffice: str | None = None, python: str | None = None) -> dict:
+    """متوسط زمن المستند: عملية جديدة لكل مستند (بارد) مقابل مجموعة العمّال الدافئة."""
+    python = python or sys.executable
+    with tempfile.TemporaryDirectory(prefix="docx_pdf_bench_") as tmp:
+        cmd = [python, os.path.abspath(__file__)] + (["--soffice", soffice] if soffice else [])
+        start = time.perf_counter()
+        for i in range(count):
+            subprocess.run(cmd + ["--convert", BENCH_DOCX, os.path.join(tmp, f"cold_{i}.pdf")],
+                           check=True, stdout=subprocess.DEVNULL)
+        cold = (time.perf_counter() - start) / count
+
+        pool = DocxPdfConverter(os.path.join(tmp, "pool"), workers=workers, soffice=soffice, python=python)
+        try:
+            # أول مستند لكل عامل يشمل الإحماء ولا يدخل في القياس
+            for future in [pool.submit(BENCH_DOCX, os.path.join(tmp, f"warm_{i}.pdf")) for i in range(workers)]:
+                future.result()
+            start = time.perf_counter()
+            futures = [pool.submit(BENCH_DOCX, os.path.join(tmp, f"pool_{i}.pdf")) for i in range(count)]
+            for future in futures:
+                future.result()
+            warm = (time.perf_counter() - start) / count
+            engine = pool.engine
+        finally:
+            pool.shutdown()
+    return {"engine": engine, "count": count, "workers": workers, "cold_ms": cold * 1000, "pool_ms": warm * 1000}
+
+
+def parse_args(argv: Iterable[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="DOCX to PDF converter worker.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--worker", action="store_true", help="Run as a pooled worker (JSON lines on stdin/stdout)")
+    group.add_argument("--convert", nargs=2, metavar=("SRC", "DST"), help="Convert a single DOCX file")
+    group.add_argument("--bench", type=int, metavar="N", help="Time N conversions, cold vs pooled")
+    parser.add_argument("--soffice", default=None, help="Path to LibreOffice soffice binary")
+    parser.add_argument("--profile", default=None, help="Dedicated LibreOffice profile directory")
+    parser.add_argument("--workers", type=int, default=2, help="Pool size for --bench")
+    return parser.parse_args(list(argv))
+
+
+def main(argv: Iterable[str]) -> int:
+    args = parse_args(argv)
+    if args.worker:
+        return serve_worker(args.soffice, args.profile)
+    if args.bench:
+        result = benchmark(args.bench, args.workers, soffice=args.soffice or find_soffice())
+        print(
+            f"engine={result['engine']} documents={result['count']} workers={result['workers']} "
+            f"cold={result['cold_ms']:.1f}ms/doc pool={result['pool_ms']:.1f}ms/doc"
+        )
+        return 0
+    src, dst = args.convert
+    convert_file(src, dst, soffice=args.soffice or find_soffice(), profile_dir=args.profile)
+    print(f"Wrote {dst}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
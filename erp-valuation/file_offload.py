@@ -0,0 +1,172 @@
+"""
+file_offload.py
+
+إرسال الملفات المحلية (المرفوعات، التقارير، المعاينات) بدون تمرير بايتاتها عبر كود بايثون،
+حتى لا يبقى عامل gunicorn مشغولاً طوال مدة التنزيل. التحقق من الصلاحية يتم في المسار قبل الاستدعاء.
+
+أوضاع FILE_OFFLOAD:
+- direct (الافتراضي، بدون وكيل أمامي): الملف يُسلَّم لـ wsgi.file_wrapper فيرسله gunicorn عبر
+  os.sendfile (نسخ صفري من القرص إلى الشبكة). طلبات Range (عارض PDF في المتصفح يطلب أجزاء)
+  تُعالج هنا بتحريك موضع الملف وضبط Content-Length، لأن غلاف Range في werkzeug يقرأ الملف
+  في بايثون ويُلغي sendfile.
+- accel: ترويسة X-Accel-Redirect فيرسل nginx الملف بنفسه من موقع داخلي (internal)، وهو يدعم
+  Range تلقائياً. مثال إعداد nginx (FILE_OFFLOAD_PREFIX=/_protected):
+
+      location /_protected/uploads/  { internal; alias /srv/erp-valuation/uploads/; }
+      location /_protected/previews/ { internal; alias /srv/erp-valuation/instance/previews/; }
+
+- sendfile: ترويسة X-Sendfile بالمسار المطلق (Apache mod_xsendfile / lighttpd).
+
+الملف خارج المجلدات المسجلة (add_root) يُرسل دائماً بوضع direct. طلبات If-None-Match /
+If-Modified-Since تُجاب بـ 304 هنا في كل الأوضاع.
+"""
+
+from __future__ import annotations
+
+import mimetypes
+import os
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from flask import Response, abort, request
+from werkzeug.http import http_date, is_resource_modified, parse_if_range_header, parse_range_header
+from werkzeug.wsgi import FileWrapper
+
+MODES = ("direct", "accel", "sendfile")
+
+
+class _FileSlice:
+    """جزء من ملف مفتوح [start, start+length) بواجهة read/fileno.
+
+    gunicorn يرسله عبر sendfile من الموضع الحالي بطول Content-Length؛ وعند عدم توفر sendfile
+    (خادم التطوير، TLS داخل gunicorn) تُقرأ البايتات بحد الطول فقط.
+    """
+
+    def __init__(self, path: str, start: int, length: int):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = length
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def read(self, size: int = -1) -> bytes:
+        if self._remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def content_disposition(name: Optional[str], as_attachment: bool = False) -> str:
+    kind = "attachment" if as_attachment else "inline"
+    if not name:
+        return kind
+    ascii_name = name.encode("ascii", "ignore").decode("ascii").replace('"', "").replace("\\", "").strip()
+    value = f'{kind}; filename="{ascii_name or "file"}"'
+    if ascii_name != name:
+        value += f"; filename*=UTF-8''{quote(name, safe='')}"
+    return value
+
+
+class FileOffload:
+    def __init__(self, mode: str = "direct", accel_prefix: str = "/_protected"):
+        mode = (mode or "direct").strip().lower()
+        if mode not in MODES:
+            raise ValueError(f"FILE_OFFLOAD must be one of {', '.join(MODES)}, got {mode!r}")
+        self.mode = mode
+        self.accel_prefix = "/" + (accel_prefix or "").strip("/")
+        self.roots: Dict[str, str] = {}
+
+    def add_root(self, name: str, directory: str) -> None:
+        """مجلد يخدمه الوكيل الأمامي تحت <prefix>/<name>/."""
+        self.roots[name] = os.path.realpath(directory)
+
+    def _internal_uri(self, path: str) -> Optional[str]:
+        real = os.path.realpath(path)
+        for name, root in self.roots.items():
+            if real.startswith(root + os.sep):
+                rel = os.path.relpath(real, root).replace(os.sep, "/")
+                return f"{self.accel_prefix}/{name}/{quote(rel)}"
+        return None
+
+    def send(self, path: str, mimetype: Optional[str] = None, download_name: Optional[str] = None,
+             as_attachment: bool = False, etag: Optional[str] = None, max_age: Optional[int] = None,
+             immutable: bool = False) -> Response:
+        """استجابة لملف محلي موجود (404 إن لم يوجد)."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            abort(404)
+        name = download_name or os.path.basename(path)
+        mimetype = mimetype or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        etag = etag or f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+        resp = Response(status=200, mimetype=mimetype)
+        resp.set_etag(etag)
+        resp.last_modified = int(st.st_mtime)
+        resp.headers["Content-Disposition"] = content_disposition(name, as_attachment)
+        resp.headers["Accept-Ranges"] = "bytes"
+        if immutable:
+            resp.headers["Cache-Control"] = f"public, max-age={max_age or 31536000}, immutable"
+        elif max_age is not None:
+            resp.headers["Cache-Control"] = f"private, max-age={max_age}"
+        else:
+            resp.headers["Cache-Control"] = "private, no-cache"
+
+        environ = request.environ
+        if not is_resource_modified(environ, etag=etag, last_modified=resp.last_modified):
+            resp.status_code = 304
+            return resp
+
+        uri = self._internal_uri(path) if self.mode == "accel" else None
+        if uri:
+            resp.headers["X-Accel-Redirect"] = uri
+            return resp
+        if self.mode == "sendfile":
+            resp.headers["X-Sendfile"] = os.path.realpath(path)
+            return resp
+        return self._direct(resp, path, st.st_size, etag, environ)
+
+    def _direct(self, resp: Response, path: str, size: int, etag: str, environ) -> Response:
+        start, length = 0, size
+        byte_range = self._requested_range(environ, size, etag, resp.last_modified)
+        if byte_range == "invalid":
+            resp.status_code = 416
+            resp.headers["Content-Range"] = f"bytes */{size}"
+            return resp
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start
+            resp.status_code = 206
+            resp.headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        wrapper = environ.get("wsgi.file_wrapper", FileWrapper)
+        resp.response = wrapper(_FileSlice(path, start, length))
+        resp.direct_passthrough = True
+        resp.headers["Content-Length"] = str(length)
+        return resp
+
+    @staticmethod
+    def _requested_range(environ, size: int, etag: str, last_modified):
+        """(start, end) لنطاق واحد صالح، أو None للملف كاملاً، أو 'invalid' لنطاق خارج الملف."""
+        header = environ.get("HTTP_RANGE")
+        if not header or size == 0:
+            return None
+        if_range = parse_if_range_header(environ.get("HTTP_IF_RANGE"))
+        if if_range.etag is not None and if_range.etag != etag:
+            return None
+        if if_range.date is not None and (last_modified is None or http_date(last_modified) != http_date(if_range.date)):
+            return None
+        parsed = parse_range_header(header)
+        if parsed is None:
+            # ترويسة غير مفهومة تُتجاهل (RFC 7233)
+            return None
+        if len(parsed.ranges) != 1:
+            # عدة نطاقات (multipart/byteranges) نادرة؛ إرسال الملف كاملاً مسموح
+            return None
+        return parsed.range_for_length(size) or "invalid"
@@ -0,0 +1,226 @@
+"""
+image_normalize.py
+
+تطبيع صور الإيصالات والصور الميدانية عند الرفع: صور الجوال تصل بحجم 4-12 ميجابايت وتُخزَّن
+وتُخدَّم كما هي.
+
+- التدوير حسب EXIF، ثم التصغير بحيث لا يتجاوز أكبر بعد IMAGE_MAX_DIMENSION، ثم إعادة الترميز
+  (WebP أو JPEG بجودة IMAGE_QUALITY). بيانات EXIF (ومنها موقع GPS) لا تُنقل للنسخة الجديدة.
+- فك الصورة وترميزها يتم في مجمع خيوط محدود (Pillow يحرر GIL أثناء المعالجة)، فلا تُفك أكثر
+  من IMAGE_NORMALIZE_WORKERS صورة في نفس الوقت مهما كثرت الطلبات؛ الطلب ينتظر النتيجة بمهلة،
+  وعند انتهاء المهلة أو فشل المعالجة يُخزَّن الأصل كما هو.
+- النسخة المطبّعة تُخزَّن فقط إن كانت أصغر من الأصل. الأصل يُحذف إلا إذا ضُبط
+  IMAGE_KEEP_ORIGINAL=1 (يُحفظ في upload_store ويُسجَّل مرجعه). لذلك تُحرَّر مراجع الملفات
+  المحفوظة عبر هذه المرحلة بـ ImageNormalizer.release لا upload_store.release مباشرة، حتى
+  يُحرَّر الأصل معها ويستطيع collect() حذفه.
+- كل رفع مطبَّع صف في جدول image_normalization (الحجم قبل/بعد، الأبعاد)، ومنه تُحسب مقاييس
+  البايتات الموفرة.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from extensions import db
+from previews import sniff_kind
+from upload_store import BLOB_PREFIX
+
+
+FORMATS = {"webp": ("WEBP", ".webp"), "jpeg": ("JPEG", ".jpg")}
+DEFAULT_MAX_DIMENSION = 2000
+DEFAULT_QUALITY = 80
+DEFAULT_TIMEOUT = 30.0
+
+
+def _discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ImageNormalization(db.Model):
+    __tablename__ = "image_normalization"
+
+    id = db.Column(db.Integer, primary_key=True)
+    # مرجع النسخة المخزنة (المطبّعة) ومرجع الأصل إن احتُفظ به
+    ref = db.Column(db.String(400), nullable=False, index=True)
+    original_ref = db.Column(db.String(400), nullable=True)
+    original_size = db.Column(db.BigInteger, nullable=False)
+    stored_size = db.Column(db.BigInteger, nullable=False)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    @property
+    def bytes_saved(self) -> int:
+        return max(int(self.original_size or 0) - int(self.stored_size or 0), 0)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<ImageNormalization {self.ref} {self.original_size}->{self.stored_size}>"
+
+
+def _normalize(src: str, dst: str, max_dimension: int, fmt: str, quality: int) -> Tuple[int, int]:
+    """كتابة النسخة المطبّعة إلى dst وإرجاع أبعادها. يُنفذ داخل مجمع الخيوط."""
+    from PIL import Image, ImageOps
+
+    pil_format, _ = FORMATS[fmt]
+    with Image.open(src) as img:
+        if getattr(img, "n_frames", 1) > 1:
+            # GIF متحرك أو TIFF متعدد الصفحات: إعادة الترميز تفقد الإطارات
+            raise ValueError("multi-frame image")
+        # JPEG: فك ترميز بدقة أقرب للمطلوب بدل فك الصورة كاملة ثم تصغيرها
+        img.draft("RGB", (max_dimension, max_dimension))
+        out = ImageOps.exif_transpose(img)
+        out.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        has_alpha = out.mode in ("RGBA", "LA", "PA") or "transparency" in out.info
+        if pil_format == "JPEG" and has_alpha:
+            flat = Image.new("RGB", out.size, (255, 255, 255))
+            flat.paste(out.convert("RGBA"), mask=out.convert("RGBA").getchannel("A"))
+            out = flat
+        elif out.mode not in ("RGB", "RGBA"):
+            out = out.convert("RGBA" if has_alpha else "RGB")
+        if pil_format == "JPEG":
+            out.save(dst, "JPEG", quality=quality, optimize=True, progressive=True)
+        else:
+            out.save(dst, "WEBP", quality=quality, method=4)
+        return out.size
+
+
+class ImageNormalizer:
+    """مرحلة رفع للصور: upload_store.save مع تطبيع الصورة قبل التخزين."""
+
+    def __init__(self, upload_store, max_dimension: int = DEFAULT_MAX_DIMENSION, fmt: str = "webp",
+                 quality: int = DEFAULT_QUALITY, keep_original: bool = False, workers: int = 2,
+                 timeout: float = DEFAULT_TIMEOUT, enabled: bool = True):
+        fmt = (fmt or "webp").strip().lower().replace("jpg", "jpeg")
+        if fmt not in FORMATS:
+            raise ValueError(f"IMAGE_FORMAT must be one of {', '.join(FORMATS)}, got {fmt!r}")
+        self.store = upload_store
+        self.max_dimension = max(int(max_dimension or DEFAULT_MAX_DIMENSION), 64)
+        self.fmt = fmt
+        self.quality = min(max(int(quality or DEFAULT_QUALITY), 1), 100)
+        self.keep_original = keep_original
+        self.workers = max(1, int(workers or 1))
+        self.timeout = timeout
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        # عدادات هذه العملية منذ بدء التشغيل (الأرقام الدائمة في image_normalization)
+        self.counters: Dict[str, int] = {"normalized": 0, "not_smaller": 0, "skipped": 0, "failed": 0, "timeouts": 0}
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # بعد fork (gunicorn --preload) لا تنتقل خيوط المجمع للعملية الابنة
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-normalize")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] += 1
+
+    def _tmp_path(self) -> str:
+        return os.path.join(self.store.root, BLOB_PREFIX, "tmp", uuid.uuid4().hex)
+
+    def save(self, file_storage, filename: Optional[str] = None) -> str:
+        """حفظ ملف مرفوع وإرجاع مرجعه؛ الصور تُطبَّع أولاً، وغيرها يُحفظ كما هو."""
+        filename = filename or file_storage.filename
+        if not self.enabled:
+            return self.store.save(file_storage, filename)
+        src = self._tmp_path()
+        file_storage.save(src)
+        try:
+            if sniff_kind(src) != "image":
+                self._count("skipped")
+                return self.store.save_file(src, filename, move=True)
+            return self._save_image(src, filename)
+        finally:
+            _discard(src)
+
+    def _save_image(self, src: str, filename: Optional[str]) -> str:
+        dst = self._tmp_path()
+        future = self._pool().submit(_normalize, src, dst, self.max_dimension, self.fmt, self.quality)
+        try:
+            width, height = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self._count("timeouts")
+            # العامل يكمل في الخلفية؛ نحذف ناتجه عند انتهائه
+            future.add_done_callback(lambda _f: _discard(dst))
+            return self.store.save_file(src, filename, move=True)
+        except Exception as e:
+            self._count("failed")
+            _discard(dst)
+            print(f"⚠️ image normalization failed for {filename}: {e}")
+            return self.store.save_file(src, filename, move=True)
+
+        original_size = os.path.getsize(src)
+        stored_size = os.path.getsize(dst)
+        if stored_size >= original_size:
+            self._count("not_smaller")
+            _discard(dst)
+            return self.store.save_file(src, filename, move=True)
+
+        base = os.path.splitext(filename or "")[0] or "image"
+        ref = self.store.save_file(dst, base + FORMATS[self.fmt][1], move=True)
+        original_ref = self.store.save_file(src, filename, move=True) if self.keep_original else None
+        # لا commit هنا؛ يُثبَّت مع سجل الطلب (الدفعة/المصروف/الفاتورة)
+        db.session.add(ImageNormalization(
+            ref=ref, original_ref=original_ref, original_size=original_size,
+            stored_size=stored_size, width=width, height=height,
+        ))
+        self._count("normalized")
+        return ref
+
+    def release(self, ref: Optional[str]) -> None:
+        """إنقاص مراجع ملف حفظته save() عند حذف سجله أو استبداله، ومعه الأصل المحتفظ به لنفس الرفع.
+
+        لا commit هنا؛ يُثبَّت مع تعديل السجل. يبقى صف image_normalization للمقاييس بلا original_ref.
+        """
+        if not ref:
+            return
+        self.store.release(ref)
+        row = (
+            ImageNormalization.query
+            .filter(ImageNormalization.ref == ref, ImageNormalization.original_ref.isnot(None))
+            .order_by(ImageNormalization.id.desc())
+            .first()
+        )
+        if row is not None:
+            self.store.release(row.original_ref)
+            row.original_ref = None
+
+    @staticmethod
+    def stats(recent: int = 20) -> dict:
+        """مجاميع البايتات الموفرة وآخر العمليات."""
+        count, original, stored = db.session.query(
+            db.func.count(ImageNormalization.id),
+            db.func.coalesce(db.func.sum(ImageNormalization.original_size), 0),
+            db.func.coalesce(db.func.sum(ImageNormalization.stored_size), 0),
+        ).one()
+        rows = ImageNormalization.query.order_by(ImageNormalization.id.desc()).limit(recent).all()
+        return {
+            "uploads": int(count),
+            "original_bytes": int(original),
+            "stored_bytes": int(stored),
+            "bytes_saved": int(original) - int(stored),
+            "recent": [
+                {
+                    "ref": r.ref,
+                    "original_size": r.original_size,
+                    "stored_size": r.stored_size,
+                    "bytes_saved": r.bytes_saved,
+                    "width": r.width,
+                    "height": r.height,
+                    "kept_original": r.original_ref is not None,
+                    "created_at": r.created_at.isoformat() if r.created_at else None,
+                }
+                for r in rows
+            ],
+        }
@@ -0,0 +1,258 @@
+"""
+ocr.py
+
+استخراج النص (OCR) من المستندات المرفوعة: مستندات البنوك، الإيصالات، وصكوك الملكية الممسوحة.
+
+- النتيجة مخزنة في جدول document_text بمفتاح بصمة المحتوى (sha256 في upload_store)، فالملف
+  المرفوع أكثر من مرة يُقرأ مرة واحدة فقط، والبحث يتم على هذا الجدول (فهرس نص كامل في PostgreSQL).
+- كل صفحة تُعالج في عملية مستقلة (ProcessPoolExecutor بسياق spawn) لأن tesseract يستهلك المعالج؛
+  صفحات PDF التي تحتوي طبقة نص أصلاً تُقرأ مباشرة بدون OCR.
+- اللغة الافتراضية ara+eng (قابلة للتغيير بـ OCR_LANG). إن لم يكن برنامج tesseract مثبتاً يبقى
+  الخط معطلاً بصمت ولا يؤثر على الرفع.
+- extract_fields() يستخرج من النص قيماً لتعبئة نموذج المعاملة مسبقاً (العميل، المساحة، الولاية، المنطقة).
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from extensions import db
+from previews import sniff_kind
+
+
+DEFAULT_LANG = "ara+eng"
+DEFAULT_DPI = 200
+# صفحة PDF فيها نص أصلي بهذا الطول أو أكثر لا تحتاج OCR
+MIN_TEXT_LAYER_CHARS = 20
+MAX_PAGES = 30
+
+
+class DocumentText(db.Model):
+    __tablename__ = "document_text"
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    # pending → done | failed | unsupported
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    pages = db.Column(db.Integer, nullable=True)
+    lang = db.Column(db.String(30), nullable=True)
+    text = db.Column(db.Text, nullable=True)
+    error = db.Column(db.String(300), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<DocumentText {self.sha256[:12]} {self.status} pages={self.pages}>"
+
+
+# ----- عمل الصفحة الواحدة (يُنفذ داخل عمليات المجمع؛ دوال على مستوى الوحدة لتقبل pickle) -----
+def _ocr_pdf_page(path: str, index: int, lang: str, dpi: int) -> str:
+    import fitz
+    import pytesseract
+    from PIL import Image
+
+    with fitz.open(path) as doc:
+        pix = doc.load_page(index).get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    return pytesseract.image_to_string(img, lang=lang)
+
+
+def _ocr_image_frame(path: str, index: int, lang: str) -> str:
+    import pytesseract
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as img:
+        img.seek(index)
+        frame = ImageOps.exif_transpose(img).convert("L")
+    return pytesseract.image_to_string(frame, lang=lang)
+
+
+def tesseract_available() -> bool:
+    try:
+        import pytesseract
+    except ImportError:
+        return False
+    return shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+
+
+class OcrPipeline:
+    """جدولة OCR في الخلفية: موزّع خيطي + مجمع عمليات لمعالجة الصفحات بالتوازي."""
+
+    def __init__(self, upload_store, workers: int = 2, lang: str = DEFAULT_LANG, dpi: int = DEFAULT_DPI,
+                 app=None, enabled: Optional[bool] = None):
+        self.store = upload_store
+        self.workers = max(1, int(workers or 1))
+        self.lang = lang or DEFAULT_LANG
+        self.dpi = dpi
+        self.app = app
+        self.enabled = tesseract_available() if enabled is None else enabled
+        self._lock = threading.Lock()
+        self._inflight: Set[str] = set()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._dispatcher: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+
+    # ----- المجمعات (تُنشأ عند أول استخدام ولكل عملية بعد fork) -----
+    def _executors(self) -> Tuple[ThreadPoolExecutor, ProcessPoolExecutor]:
+        if self._pid != os.getpid():
+            # spawn بدل fork: عملية الويب فيها خيوط (النسخ، المعاينات) وfork معها غير آمن
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            self._dispatcher = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+            self._pid = os.getpid()
+        return self._dispatcher, self._pool
+
+    # ----- الجدولة -----
+    def schedule(self, sha256: str, path: Optional[str] = None) -> bool:
+        if not self.enabled or not sha256:
+            return False
+        with self._lock:
+            if sha256 in self._inflight:
+                return False
+            self._inflight.add(sha256)
+            dispatcher, _ = self._executors()
+            dispatcher.submit(self._run, sha256, path or self.store.blob_path(sha256))
+        return True
+
+    def on_new_blob(self, sha256: str, path: str) -> None:
+        """مستمع upload_store: قراءة كل مستند جديد (PDF/صورة) في الخلفية."""
+        if sniff_kind(path) is not None:
+            self.schedule(sha256, path)
+
+    def _run(self, sha256: str, path: str) -> None:
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    self.process(sha256, path)
+            else:
+                self.process(sha256, path)
+        except Exception as e:
+            print(f"⚠️ OCR failed for {sha256[:12]}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.discard(sha256)
+
+    # ----- المعالجة -----
+    def process(self, sha256: str, path: str) -> DocumentText:
+        """قراءة المستند وحفظ النتيجة (أو إرجاع النتيجة المحفوظة مسبقاً لنفس المحتوى)."""
+        row = DocumentText.query.filter_by(sha256=sha256).first()
+        if row is not None and row.status in ("done", "unsupported"):
+            return row
+        if row is None:
+            row = DocumentText(sha256=sha256)
+            db.session.add(row)
+        row.status, row.lang, row.updated_at = "pending", self.lang, datetime.utcnow()
+        db.session.commit()
+
+        try:
+            text, pages = self.extract(path)
+        except Exception as e:
+            db.session.rollback()
+            row.status, row.error = "failed", str(e)[:300]
+            row.updated_at = datetime.utcnow()
+            db.session.commit()
+            return row
+        row.status = "done" if pages else "unsupported"
+        row.text, row.pages, row.error = text, pages, None
+        row.updated_at = datetime.utcnow()
+        db.session.commit()
+        return row
+
+    def extract(self, path: str) -> Tuple[str, int]:
+        """(النص، عدد الصفحات). الصفحات تُرسل لمجمع العمليات دفعة واحدة ثم تُجمع بالترتيب."""
+        kind = sniff_kind(path)
+        if kind is None:
+            return "", 0
+        _, pool = self._executors()
+        texts: Dict[int, str] = {}
+        futures = {}
+        if kind == "pdf":
+            import fitz
+
+            with fitz.open(path) as doc:
+                count = min(doc.page_count, MAX_PAGES)
+                for i in range(count):
+                    layer = doc.load_page(i).get_text().strip()
+                    if len(layer) >= MIN_TEXT_LAYER_CHARS:
+                        texts[i] = layer
+                    else:
+                        futures[i] = pool.submit(_ocr_pdf_page, path, i, self.lang, self.dpi)
+        else:
+            from PIL import Image
+
+            with Image.open(path) as img:
+                count = min(getattr(img, "n_frames", 1), MAX_PAGES)
+            for i in range(count):
+                futures[i] = pool.submit(_ocr_image_frame, path, i, self.lang)
+        for i, future in futures.items():
+            texts[i] = future.result().strip()
+        return "\f".join(texts[i] for i in range(count)), count
+
+    # ----- القراءة والبحث -----
+    @staticmethod
+    def get(sha256: str) -> Optional[DocumentText]:
+        return DocumentText.query.filter_by(sha256=sha256).first()
+
+    @staticmethod
+    def search(query: str, limit: int = 20) -> List[DocumentText]:
+        query = (query or "").strip()
+        if not query:
+            return []
+        base = DocumentText.query.filter(DocumentText.status == "done")
+        if db.engine.dialect.name == "postgresql":
+            vector = db.func.to_tsvector("simple", db.func.coalesce(DocumentText.text, ""))
+            base = base.filter(vector.op("@@")(db.func.plainto_tsquery("simple", query)))
+        else:
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            base = base.filter(DocumentText.text.ilike(f"%{escaped}%", escape="\\"))
+        return base.order_by(DocumentText.updated_at.desc()).limit(limit).all()
+
+
+# ----- استخراج الحقول لتعبئة نموذج المعاملة -----
+_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹٫", "01234567890123456789.")
+_SEP = r"\s*[:：\-]?\s*"
+_FIELD_PATTERNS = {
+    "client": [
+        rf"(?:اسم\s+المالك|المالك|اسم\s+العميل|اسم\s+المستفيد|Owner(?:'s)?\s+Name){_SEP}([^\n\d]{{3,80}})",
+    ],
+    "state": [
+        rf"(?:الولاية|المحافظة|Wilayat|Governorate){_SEP}([^\n\d:]{{2,60}})",
+    ],
+    "region": [
+        rf"(?:المنطقة|الحي|القرية|المدينة|Region|Village|City){_SEP}([^\n\d:]{{2,60}})",
+    ],
+    "area": [
+        rf"(?:المساحة|مساحة\s+(?:الأرض|القطعة|العقار)|Area){_SEP}([\d.,]+)",
+        r"([\d.,]+)\s*(?:م2|م²|متر\s*مربع|m2|m²|sqm)",
+    ],
+}
+
+
+def extract_fields(text: Optional[str]) -> Dict[str, str]:
+    """قيم مقترحة لحقول المعاملة من نص المستند (الحقول غير الموجودة لا تُرجع)."""
+    text = (text or "").translate(_DIGITS)
+    fields: Dict[str, str] = {}
+    for name, patterns in _FIELD_PATTERNS.items():
+        for pattern in patterns:
+            match = re.search(pattern, text, flags=re.IGNORECASE)
+            if not match:
+                continue
+            value = match.group(1).strip(" .,:-\t")
+            if name == "area":
+                value = value.replace(",", "")
+                try:
+                    value = f"{float(value):g}"
+                except ValueError:
+                    continue
+            if value:
+                fields[name] = value
+                break
+    return fields
@@ -0,0 +1,203 @@
+"""
+ocr_index.py
+
+أدوات سطر الأوامر لقراءة المستندات (OCR).
+
+- backfill: قراءة المحتوى الموجود في upload_store الذي لم يُقرأ بعد (document_text) بالترتيب
+  الأحدث أولاً. آمن لإعادة التشغيل.
+- bench: قياس سرعة القراءة على مجلد من المستندات الممسوحة (PDF/صور) بعدد عمال مختلف، بدون
+  الكتابة في قاعدة البيانات؛ لاختيار OCR_WORKERS المناسب للخادم. مع --check يقارن الحقول
+  المستخرجة بملف expected.json في المجلد (إن وُجد).
+- fixtures: توليد مجموعة المستندات الممسوحة المرجعية (tests/fixtures/scans): صورة PNG، صورة جوال
+  JPEG مدوّرة عبر EXIF، PDF ممسوح بلا طبقة نص، و PDF بطبقة نص، مع expected.json.
+
+أمثلة:
+  python3 ocr_index.py backfill --limit 500
+  python3 ocr_index.py bench ./scans --workers 1 2 4
+  python3 ocr_index.py bench tests/fixtures/scans --check
+  python3 ocr_index.py fixtures tests/fixtures/scans
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterable, List
+
+EXPECTED_NAME = "expected.json"
+FIXTURE_LINES = [
+    "Title Deed / Sanad Milkiya",
+    "Owner Name: Salim Nasser Harthy",
+    "Wilayat: Seeb",
+    "Region: Khoudh",
+    "Plot No. 1234 / Block 7",
+    "Area: 600 m2",
+]
+FIXTURE_FIELDS = {"client": "Salim Nasser Harthy", "state": "Seeb", "region": "Khoudh", "area": "600"}
+
+
+def parse_args(argv: Iterable[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="OCR uploaded documents.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill = sub.add_parser("backfill", help="OCR stored blobs that have no extracted text yet")
+    backfill.add_argument("--limit", type=int, default=None, help="Stop after this many documents")
+    bench = sub.add_parser("bench", help="Measure OCR throughput on a folder of scans")
+    bench.add_argument("folder", help="Folder with PDF/image scans")
+    bench.add_argument("--workers", type=int, nargs="+", default=[1, 2], help="Worker counts to compare")
+    bench.add_argument("--lang", default=None, help="Tesseract languages (default: OCR_LANG or ara+eng)")
+    bench.add_argument("--check", action="store_true", help="Compare extracted fields with expected.json")
+    fixtures = sub.add_parser("fixtures", help="Write the reference scan set used by bench/tests")
+    fixtures.add_argument("folder", help="Output folder")
+    return parser.parse_args(list(argv))
+
+
+def backfill(limit=None) -> int:
+    from app import db, ocr_pipeline, upload_store
+    from ocr import DocumentText
+    from previews import sniff_kind
+    from upload_store import UploadBlob
+
+    done_shas = db.session.query(DocumentText.sha256)
+    query = (
+        UploadBlob.query.with_entities(UploadBlob.sha256)
+        .filter(UploadBlob.refcount > 0, ~UploadBlob.sha256.in_(done_shas))
+        .order_by(UploadBlob.id.desc())
+    )
+    if limit:
+        query = query.limit(limit)
+    processed = 0
+    for (sha256,) in query.all():
+        path = upload_store.blob_path(sha256)
+        if not os.path.isfile(path) or sniff_kind(path) is None:
+            continue
+        row = ocr_pipeline.process(sha256, path)
+        processed += 1
+        print(f"{sha256[:12]} {row.status} pages={row.pages}")
+    return processed
+
+
+def _render_page(width: int = 1100, height: int = 620):
+    from PIL import Image, ImageDraw, ImageFont
+
+    font_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts", "Amiri-Regular.ttf")
+    font = ImageFont.truetype(font_path, 44)
+    page = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    for i, line in enumerate(FIXTURE_LINES):
+        draw.text((60, 40 + i * 90), line, fill=0, font=font)
+    return page
+
+
+def make_fixtures(folder: str) -> List[str]:
+    """كتابة مجموعة المستندات المرجعية وإرجاع أسماء الملفات."""
+    import io
+
+    import fitz
+    from PIL import Image
+
+    os.makedirs(folder, exist_ok=True)
+    page = _render_page()
+    written: Dict[str, Dict[str, str]] = {}
+
+    # مسح ضوئي أبيض وأسود
+    page.convert("1").save(os.path.join(folder, "deed_scan.png"), optimize=True)
+    written["deed_scan.png"] = FIXTURE_FIELDS
+
+    # صورة جوال: البكسلات مدوّرة والاتجاه الصحيح في EXIF (Orientation=6)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    page.rotate(90, expand=True).save(
+        os.path.join(folder, "receipt_photo.jpg"), "JPEG", quality=60, exif=exif.tobytes()
+    )
+    written["receipt_photo.jpg"] = FIXTURE_FIELDS
+
+    # PDF ممسوح: صورة فقط بلا طبقة نص
+    png = io.BytesIO()
+    page.convert("1").save(png, "PNG", optimize=True)
+    with fitz.open() as doc:
+        pdf_page = doc.new_page(width=595, height=335)
+        pdf_page.insert_image(pdf_page.rect, stream=png.getvalue())
+        doc.save(os.path.join(folder, "deed_scanned.pdf"), deflate=True)
+    written["deed_scanned.pdf"] = FIXTURE_FIELDS
+
+    # PDF بطبقة نص: يُقرأ مباشرة بدون OCR
+    with fitz.open() as doc:
+        pdf_page = doc.new_page(width=595, height=335)
+        for i, line in enumerate(FIXTURE_LINES):
+            pdf_page.insert_text((30, 40 + i * 48), line, fontsize=18)
+        doc.save(os.path.join(folder, "deed_text.pdf"), deflate=True)
+    written["deed_text.pdf"] = FIXTURE_FIELDS
+
+    with open(os.path.join(folder, EXPECTED_NAME), "w", encoding="utf-8") as f:
+        json.dump(written, f, ensure_ascii=False, indent=1, sort_keys=True)
+        f.write("\n")
+    return sorted(written)
+
+
+def bench(folder: str, workers_list, lang=None, check: bool = False) -> int:
+    from ocr import DEFAULT_LANG, OcrPipeline, extract_fields, tesseract_available
+    from previews import sniff_kind
+
+    if not tesseract_available():
+        print("tesseract is not installed", file=sys.stderr)
+        return 1
+    files = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if sniff_kind(os.path.join(folder, name)) is not None
+    )
+    if not files:
+        print("no PDF/image scans found", file=sys.stderr)
+        return 1
+    lang = lang or os.environ.get("OCR_LANG", DEFAULT_LANG)
+    expected = {}
+    if check:
+        with open(os.path.join(folder, EXPECTED_NAME), encoding="utf-8") as f:
+            expected = json.load(f)
+    mismatches = 0
+    for workers in workers_list:
+        pipeline = OcrPipeline(None, workers=workers, lang=lang, enabled=True)
+        # تشغيل المجمع مسبقاً حتى لا يُحسب وقت بدء العمليات ضمن القياس
+        pipeline.extract(files[0])
+        started = time.perf_counter()
+        pages = chars = 0
+        for path in files:
+            text, count = pipeline.extract(path)
+            pages += count
+            chars += len(text)
+            want = expected.get(os.path.basename(path))
+            if want is not None:
+                got = extract_fields(text)
+                missing = {k: v for k, v in want.items() if got.get(k) != v}
+                if missing:
+                    mismatches += 1
+                    print(f"  {os.path.basename(path)}: expected {missing}, got {got}")
+        elapsed = time.perf_counter() - started
+        print(
+            f"workers={workers} files={len(files)} pages={pages} chars={chars} "
+            f"seconds={elapsed:.2f} pages_per_sec={pages / elapsed if elapsed else 0:.2f}"
+        )
+    return 1 if mismatches else 0
+
+
+def main(argv: Iterable[str]) -> int:
+    args = parse_args(argv)
+    if args.command == "bench":
+        return bench(args.folder, args.workers, args.lang, args.check)
+    if args.command == "fixtures":
+        for name in make_fixtures(args.folder):
+            print(os.path.join(args.folder, name))
+        return 0
+
+    from app import app
+
+    with app.app_context():
+        processed = backfill(args.limit)
+    print(f"processed={processed}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,173 @@
+"""
+previews.py
+
+معاينات مصغّرة (WebP) للملفات المرفوعة: الصفحة الأولى من ملفات PDF عبر PyMuPDF، والصور
+بعد تصغيرها عبر Pillow.
+
+- المعاينة معنونة ببصمة المحتوى (sha256 في upload_store): previews/ab/<sha256>.webp، فمحتوى
+  واحد مرفوع عدة مرات له معاينة واحدة، ولا تتغير المعاينة لنفس البصمة أبداً، لذا تُخدَّم
+  بترويسة Cache-Control: immutable.
+- التوليد يتم في مجمع عمال بالخلفية (ThreadPoolExecutor) ولا يحدث داخل الطلب: عند وصول محتوى
+  جديد (مستمع upload_store) أو عند طلب معاينة غير جاهزة يُجدول التوليد ويُعاد رمز بديل.
+- نوع الملف يُعرف من أول بايتات المحتوى (وليس من الاسم). الملفات غير المدعومة أو التالفة
+  يُكتب لها ملف .none حتى لا يُعاد المحاولة معها في كل طلب.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Set
+
+PREVIEW_SIZE = 320
+WEBP_QUALITY = 70
+# أكبر ملف يُحاول توليد معاينة له (الصور الضخمة جداً تستهلك ذاكرة كبيرة)
+MAX_SOURCE_BYTES = 80 * 1024 * 1024
+
+PDF_MAGIC = b"%PDF"
+IMAGE_MAGICS = (
+    b"\xff\xd8\xff",          # JPEG
+    b"\x89PNG\r\n\x1a\n",     # PNG
+    b"GIF87a", b"GIF89a",
+    b"RIFF",                  # WebP
+    b"II*\x00", b"MM\x00*",   # TIFF (مستندات ممسوحة)
+    b"BM",                    # BMP
+)
+
+
+def sniff_kind(path: str) -> Optional[str]:
+    """'pdf' أو 'image' حسب أول بايتات الملف، أو None إن لم يكن مدعوماً."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(16)
+    except OSError:
+        return None
+    if head.startswith(PDF_MAGIC):
+        return "pdf"
+    if any(head.startswith(magic) for magic in IMAGE_MAGICS):
+        if head.startswith(b"RIFF") and head[8:12] != b"WEBP":
+            return None
+        return "image"
+    return None
+
+
+def _render_pdf(src: str, size: int):
+    import fitz
+    from PIL import Image
+
+    with fitz.open(src) as doc:
+        if doc.page_count == 0:
+            return None
+        page = doc.load_page(0)
+        rect = page.rect
+        scale = size / max(rect.width, rect.height, 1)
+        pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+def _render_image(src: str, size: int):
+    from PIL import Image, ImageOps
+
+    img = Image.open(src)
+    # JPEG: فك ترميز بدقة منخفضة مباشرة بدل فك الصورة كاملة ثم تصغيرها
+    img.draft("RGB", (size * 2, size * 2))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((size, size))
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+    return img
+
+
+class PreviewGenerator:
+    """مجلد معاينات بمفاتيح sha256 مع مجمع عمال للتوليد في الخلفية."""
+
+    def __init__(self, upload_store, cache_dir: str, size: int = PREVIEW_SIZE, workers: int = 2):
+        self.store = upload_store
+        self.cache_dir = cache_dir
+        self.size = size
+        self.workers = max(1, int(workers or 1))
+        self._lock = threading.Lock()
+        self._inflight: Set[str] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # ----- المسارات -----
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, sha256[:2], f"{sha256}.webp")
+
+    def _none_marker(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, sha256[:2], f"{sha256}.none")
+
+    def ready(self, sha256: str) -> bool:
+        return os.path.isfile(self.path(sha256))
+
+    def unavailable(self, sha256: str) -> bool:
+        return os.path.isfile(self._none_marker(sha256))
+
+    # ----- الجدولة -----
+    def _pool(self) -> ThreadPoolExecutor:
+        # بعد fork (gunicorn --preload) لا تنتقل خيوط المجمع للعملية الابنة؛ ننشئ مجمعاً جديداً
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="preview")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def schedule(self, sha256: str, src_path: Optional[str] = None) -> bool:
+        """جدولة توليد المعاينة إن لم تكن موجودة. يرجع True إن جُدولت الآن."""
+        if not sha256 or self.ready(sha256) or self.unavailable(sha256):
+            return False
+        with self._lock:
+            if sha256 in self._inflight:
+                return False
+            self._inflight.add(sha256)
+            self._pool().submit(self._generate, sha256, src_path or self.store.blob_path(sha256))
+        return True
+
+    def on_new_blob(self, sha256: str, path: str) -> None:
+        """مستمع upload_store: توليد المعاينة مسبقاً لكل محتوى جديد."""
+        self.schedule(sha256, path)
+
+    # ----- التوليد -----
+    def _generate(self, sha256: str, src: str) -> None:
+        try:
+            self.generate(sha256, src)
+        except Exception as e:
+            print(f"⚠️ preview failed for {sha256[:12]}: {e}")
+            self._mark_unavailable(sha256)
+        finally:
+            with self._lock:
+                self._inflight.discard(sha256)
+
+    def generate(self, sha256: str, src: str) -> Optional[str]:
+        """توليد المعاينة متزامناً (يُستدعى من العمال أو من سطر الأوامر)."""
+        if not os.path.isfile(src):
+            return None
+        kind = sniff_kind(src)
+        if kind is None or os.path.getsize(src) > MAX_SOURCE_BYTES:
+            self._mark_unavailable(sha256)
+            return None
+        img = _render_pdf(src, self.size) if kind == "pdf" else _render_image(src, self.size)
+        if img is None:
+            self._mark_unavailable(sha256)
+            return None
+        out = self.path(sha256)
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        tmp = f"{out}.{uuid.uuid4().hex}.tmp"
+        try:
+            img.save(tmp, "WEBP", quality=WEBP_QUALITY, method=4)
+            os.replace(tmp, out)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return out
+
+    def _mark_unavailable(self, sha256: str) -> None:
+        marker = self._none_marker(sha256)
+        try:
+            os.makedirs(os.path.dirname(marker), exist_ok=True)
+            open(marker, "wb").close()
+        except OSError:
+            pass
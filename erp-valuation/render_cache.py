@@ -0,0 +1,135 @@
+"""
+render_cache.py
+
+كاش للمستندات المولّدة (فواتير/عروض أسعار) معنون بالمحتوى.
+
+- المفتاح = SHA-256 لـ (بصمة بايتات القالب، القيم بعد ترتيب المفاتيح)، فأي تغيير في القالب
+  أو في البيانات ينتج مفتاحاً جديداً تلقائياً ولا حاجة لإبطال الكاش يدوياً.
+- كل ملف يُكتب إلى اسم مؤقت فريد ثم يُنقل ذرّياً (os.replace)، فلا تتسابق النقرات المتزامنة
+  على نفس اسم الملف ولا يُقرأ ملف ناقص.
+- الإخلاء LRU حسب الحجم الكلي: كل قراءة تحدّث وقت التعديل للملف، وعند تجاوز الحد
+  تُحذف الملفات الأقدم استخداماً أولاً.
+- المفتاح نفسه يصلح كـ ETag للطلبات الشرطية.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict
+
+
+def placeholders_digest(mapping: Dict[str, Any]) -> str:
+    """تمثيل ثابت لقيم المتغيرات بغض النظر عن ترتيب المفاتيح."""
+    normalized = {str(k): str(v) for k, v in (mapping or {}).items()}
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+class RenderCache:
+    """مجلد كاش بمفاتيح SHA-256 مع إخلاء LRU بحسب الحجم الكلي."""
+
+    def __init__(self, cache_dir: str, max_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max(0, int(max_bytes or 0))
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        # بصمات القوالب محفوظة حسب (المسار، الحجم، وقت التعديل) حتى لا يُعاد قراءة القالب كل مرة
+        self._template_digests: Dict[tuple, str] = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # ----- المفاتيح -----
+    def template_sha256(self, template_path: str) -> str:
+        st = os.stat(template_path)
+        memo_key = (os.path.abspath(template_path), st.st_size, st.st_mtime_ns)
+        digest = self._template_digests.get(memo_key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(template_path, "rb") as f:
+                for chunk in iter(lambda: f.read(65536), b""):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            self._template_digests[memo_key] = digest
+        return digest
+
+    def key(self, template_sha256: str, placeholders: Dict[str, Any]) -> str:
+        h = hashlib.sha256()
+        h.update(template_sha256.encode("ascii"))
+        h.update(b"\0")
+        h.update(placeholders_digest(placeholders).encode("utf-8"))
+        return h.hexdigest()
+
+    def path(self, key: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{ext}")
+
+    # ----- القراءة والكتابة -----
+    def get(self, key: str, ext: str) -> str | None:
+        path = self.path(key, ext)
+        try:
+            # تحديث وقت الاستخدام لخوارزمية LRU
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def get_or_create(self, key: str, ext: str, writer: Callable[[str], None]) -> str:
+        """يعيد مسار الملف من الكاش أو ينشئه عبر writer(tmp_path) مرة واحدة فقط."""
+        path = self.get(key, ext)
+        if path:
+            return path
+        with self._lock:
+            key_lock = self._key_locks.setdefault(f"{key}.{ext}", threading.Lock())
+        with key_lock:
+            path = self.get(key, ext)
+            if path:
+                return path
+            final_path = self.path(key, ext)
+            tmp_path = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}.{ext}")
+            try:
+                writer(tmp_path)
+                os.replace(tmp_path, final_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                with self._lock:
+                    self._key_locks.pop(f"{key}.{ext}", None)
+        self.evict()
+        return final_path
+
+    # ----- الإخلاء -----
+    def evict(self) -> None:
+        if not self.max_bytes:
+            return
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if not entry.is_file() or entry.name.startswith("."):
+                        continue
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        except OSError:
+            return
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        now = time.time()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            # لا نحذف ملفاً كُتب للتو حتى لا يُسحب من تحت طلب يرسله الآن
+            if now - mtime < 5:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
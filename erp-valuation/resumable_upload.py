@@ -0,0 +1,271 @@
+"""
+resumable_upload.py
+
+رفع الملفات الكبيرة على دفعات قابلة للاستئناف (على نمط بروتوكول tus).
+
+- إنشاء: POST /api/uploads مع Upload-Length و Upload-Metadata (filename/purpose/sha256 بترميز base64)
+  فيُنشأ صف في resumable_upload وملف جزئي uploads/resumable/<id>.part.
+- دفعة: PATCH /api/uploads/<id> بجسم application/offset+octet-stream و Upload-Offset المساوي
+  لما استلمه الخادم، مع Upload-Checksum: sha256 <base64> اختيارياً. الدفعة تُكتب ثم يُتحقق من
+  بصمتها؛ عند عدم التطابق يُقص الملف للإزاحة السابقة ويُرد 460 فيعيد العميل الدفعة نفسها فقط.
+- استئناف: HEAD /api/uploads/<id> يعيد Upload-Offset الحالي بعد انقطاع الاتصال.
+- إنهاء: POST /api/uploads/<id>/finalize ينقل الملف المجمّع إلى upload_store (مع التحقق من
+  sha256 الكامل إن أُرسل) ويعيد معرّف الرفع الذي تمرره النماذج الحالية في حقل upload_id.
+- المعالجات (تقرير المهندس، مستندات البنك) تستهلك الرفع مرة واحدة عبر consume() فتنتقل ملكية
+  المرجع إليها. الرفوع المتروكة تُحذف بـ collect() (upload_blobs.py gc).
+
+كل دفعة طلب قصير، فلا يبقى عامل gunicorn متزامن محجوزاً طوال رفع ملف كامل عبر اتصال ضعيف.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from extensions import db
+from upload_store import CHUNK_SIZE, parse_blob_ref
+
+
+PART_DIR = "resumable"
+# الحد الأقصى لدفعة واحدة وللملف كاملاً (قابلان للتعديل من البيئة)
+MAX_CHUNK_SIZE = int(os.environ.get("RESUMABLE_MAX_CHUNK", str(8 * 1024 * 1024)))
+MAX_UPLOAD_SIZE = int(os.environ.get("RESUMABLE_MAX_SIZE", str(200 * 1024 * 1024)))
+# الرفع غير المكتمل أو غير المستهلك يُحذف بعد هذه المدة
+EXPIRE_AFTER = timedelta(hours=24)
+
+# الأغراض المسموحة وامتدادات الملفات لكل منها (None = أي امتداد)
+PURPOSES: Dict[str, Optional[Tuple[str, ...]]] = {
+    "report": (".pdf",),
+    "bank_docs": None,
+}
+
+
+class UploadError(Exception):
+    """خطأ في بروتوكول الرفع؛ status هو رمز HTTP المناسب للرد."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class ResumableUpload(db.Model):
+    __tablename__ = "resumable_upload"
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    purpose = db.Column(db.String(30), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    length = db.Column(db.BigInteger, nullable=False)
+    offset = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256 = db.Column(db.String(64), nullable=True)
+    # uploading → finalized → consumed
+    status = db.Column(db.String(20), nullable=False, default="uploading")
+    # مرجع upload_store بعد الإنهاء
+    ref = db.Column(db.String(400), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<ResumableUpload {self.id} {self.offset}/{self.length} {self.status}>"
+
+
+def parse_metadata(header: Optional[str]) -> Dict[str, str]:
+    """Upload-Metadata: "key base64,key base64" → قاموس نصي."""
+    result: Dict[str, str] = {}
+    for pair in (header or "").split(","):
+        pair = pair.strip()
+        if not pair:
+            continue
+        key, _, value = pair.partition(" ")
+        try:
+            result[key] = base64.b64decode(value).decode("utf-8") if value else ""
+        except Exception:
+            raise UploadError(f"invalid metadata for {key}")
+    return result
+
+
+def parse_checksum(header: Optional[str]) -> Optional[bytes]:
+    """Upload-Checksum: "sha256 <base64>" → البصمة الخام، أو None إن لم تُرسل."""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(" ")
+    if algorithm.lower() != "sha256":
+        raise UploadError("unsupported checksum algorithm", 400)
+    try:
+        return base64.b64decode(value)
+    except Exception:
+        raise UploadError("invalid checksum")
+
+
+class ResumableUploads:
+    """إدارة الرفوع الجزئية فوق مجلد الرفع ومخزن الملفات."""
+
+    def __init__(self, upload_store):
+        self.store = upload_store
+        self.root = os.path.join(upload_store.root, PART_DIR)
+        os.makedirs(self.root, exist_ok=True)
+
+    def part_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    # ----- البروتوكول -----
+    def create(self, user_id: int, length: int, metadata: Dict[str, str]) -> ResumableUpload:
+        purpose = metadata.get("purpose") or ""
+        if purpose not in PURPOSES:
+            raise UploadError("unknown purpose")
+        filename = (metadata.get("filename") or "").strip()
+        if not filename:
+            raise UploadError("filename is required")
+        allowed = PURPOSES[purpose]
+        if allowed and not filename.lower().endswith(allowed):
+            raise UploadError("file type not allowed", 415)
+        if length < 0:
+            raise UploadError("invalid Upload-Length")
+        if length > MAX_UPLOAD_SIZE:
+            raise UploadError("file too large", 413)
+        sha256 = (metadata.get("sha256") or "").lower() or None
+        if sha256 and len(sha256) != 64:
+            raise UploadError("invalid sha256")
+
+        upload = ResumableUpload(
+            id=uuid.uuid4().hex, user_id=user_id, purpose=purpose, filename=filename[:255],
+            length=length, offset=0, sha256=sha256,
+        )
+        open(self.part_path(upload.id), "wb").close()
+        db.session.add(upload)
+        db.session.commit()
+        return upload
+
+    def get(self, upload_id: str, user_id: int, lock: bool = False) -> ResumableUpload:
+        query = ResumableUpload.query.filter_by(id=upload_id, user_id=user_id)
+        if lock:
+            query = query.with_for_update()
+        upload = query.first()
+        if upload is None:
+            raise UploadError("upload not found", 404)
+        return upload
+
+    def append(self, upload_id: str, user_id: int, offset: int, stream,
+               content_length: Optional[int], checksum: Optional[bytes]) -> ResumableUpload:
+        """كتابة دفعة عند الإزاحة المعطاة. يرجع الصف بعد تحديث الإزاحة."""
+        upload = self.get(upload_id, user_id, lock=True)
+        if upload.status != "uploading":
+            raise UploadError("upload already finalized", 409)
+        if offset != upload.offset:
+            # العميل يستأنف من إزاحة قديمة: يجب أن يسأل بـ HEAD أولاً
+            raise UploadError("offset mismatch", 409)
+        if content_length is None:
+            raise UploadError("Content-Length is required", 411)
+        if content_length > MAX_CHUNK_SIZE:
+            raise UploadError("chunk too large", 413)
+        if offset + content_length > upload.length:
+            raise UploadError("chunk exceeds Upload-Length", 413)
+
+        path = self.part_path(upload.id)
+        digest = hashlib.sha256()
+        written = 0
+        with open(path, "r+b") as out:
+            out.seek(offset)
+            out.truncate()
+            try:
+                while written < content_length:
+                    chunk = stream.read(min(CHUNK_SIZE, content_length - written))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    written += len(chunk)
+            except Exception:
+                # انقطاع أثناء الدفعة: نتجاهل الجزء غير المكتمل ويستأنف العميل من الإزاحة السابقة
+                out.truncate(offset)
+                db.session.rollback()
+                raise UploadError("connection interrupted", 400)
+            if written != content_length or (checksum is not None and digest.digest() != checksum):
+                out.truncate(offset)
+                db.session.rollback()
+                if written != content_length:
+                    raise UploadError("incomplete chunk", 400)
+                raise UploadError("checksum mismatch", 460)
+
+        upload.offset = offset + written
+        upload.updated_at = datetime.utcnow()
+        db.session.commit()
+        return upload
+
+    def finalize(self, upload_id: str, user_id: int) -> ResumableUpload:
+        """نقل الملف المكتمل إلى upload_store. استدعاء متكرر بعد الإنهاء يعيد نفس الصف."""
+        upload = self.get(upload_id, user_id, lock=True)
+        if upload.status != "uploading":
+            db.session.rollback()
+            return upload
+        if upload.offset != upload.length:
+            raise UploadError("upload incomplete", 409)
+        path = self.part_path(upload.id)
+        ref = self.store.save_file(path, upload.filename, move=True)
+        if upload.sha256 and parse_blob_ref(ref)[0] != upload.sha256:
+            self.store.release(ref)
+            upload.offset = 0
+            open(path, "wb").close()
+            db.session.commit()
+            raise UploadError("file checksum mismatch", 460)
+        upload.ref = ref
+        upload.status = "finalized"
+        upload.updated_at = datetime.utcnow()
+        db.session.commit()
+        return upload
+
+    def terminate(self, upload_id: str, user_id: int) -> None:
+        upload = self.get(upload_id, user_id, lock=True)
+        self._drop(upload)
+        db.session.commit()
+
+    # ----- الاستهلاك من المعالجات -----
+    def consume(self, upload_id: Optional[str], user_id: Optional[int], purpose: str) -> Optional[str]:
+        """مرجع upload_store لرفع منتهٍ يخص المستخدم، وتنتقل ملكيته للمستدعي.
+
+        لا يعمل commit: يُثبَّت مع سجل المعالج حتى لا يضيع الملف إن فشل الطلب.
+        """
+        if not upload_id or not user_id:
+            return None
+        upload = (
+            ResumableUpload.query.filter_by(id=upload_id.strip(), user_id=user_id, purpose=purpose, status="finalized")
+            .with_for_update()
+            .first()
+        )
+        if upload is None:
+            return None
+        upload.status = "consumed"
+        upload.updated_at = datetime.utcnow()
+        return upload.ref
+
+    def consume_many(self, upload_ids: List[str], user_id: Optional[int], purpose: str) -> List[str]:
+        refs = []
+        for upload_id in upload_ids:
+            ref = self.consume(upload_id, user_id, purpose)
+            if ref:
+                refs.append(ref)
+        return refs
+
+    # ----- التنظيف -----
+    def _drop(self, upload: ResumableUpload) -> None:
+        if upload.status == "finalized":
+            self.store.release(upload.ref)
+        try:
+            os.remove(self.part_path(upload.id))
+        except OSError:
+            pass
+        db.session.delete(upload)
+
+    def collect(self, max_age: timedelta = EXPIRE_AFTER) -> int:
+        """حذف الرفوع المتروكة (غير المكتملة أو غير المستهلكة) والصفوف المستهلكة القديمة."""
+        cutoff = datetime.utcnow() - max_age
+        rows = ResumableUpload.query.filter(ResumableUpload.updated_at < cutoff).all()
+        for upload in rows:
+            self._drop(upload)
+        db.session.commit()
+        return len(rows)
+
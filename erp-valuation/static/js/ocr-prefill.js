@@ -0,0 +1,85 @@
+// تعبئة نموذج المعاملة من مستند ممسوح (صك/إيصال) عبر OCR في الخلفية.
+// الزر [data-ocr-prefill] يشير لحقل الملفات عبر data-ocr-source؛ يُرفع أول ملف إلى /api/ocr/extract
+// ثم يُسأل الخادم عن النتيجة كل ثانيتين، وتُعبأ الحقول الفارغة فقط (لا نطغى على ما كتبه الموظف).
+(function () {
+  var FIELD_NAMES = { client: "client_name", area: "area", state: "state", region: "region" };
+  var POLL_MS = 2000;
+  var MAX_POLLS = 90;
+
+  function fill(form, fields) {
+    var filled = [];
+    Object.keys(FIELD_NAMES).forEach(function (key) {
+      var input = form.querySelector('[name="' + FIELD_NAMES[key] + '"]');
+      if (input && !input.value && fields[key]) {
+        input.value = fields[key];
+        input.dispatchEvent(new Event("input", { bubbles: true }));
+        filled.push(key);
+      }
+    });
+    return filled;
+  }
+
+  function poll(sha, onDone, onFail, attempt) {
+    fetch("/api/ocr/" + sha, { credentials: "same-origin" })
+      .then(function (resp) { return resp.json(); })
+      .then(function (data) {
+        if (data.status === "done") return onDone(data);
+        if (data.status === "failed" || data.status === "unsupported" || data.status === "unavailable") {
+          return onFail("تعذر قراءة المستند");
+        }
+        if (attempt >= MAX_POLLS) return onFail("انتهت مهلة القراءة");
+        setTimeout(function () { poll(sha, onDone, onFail, attempt + 1); }, POLL_MS);
+      })
+      .catch(function () { onFail("تعذر الاتصال بالخادم"); });
+  }
+
+  function attach(button) {
+    var form = button.closest("form");
+    var source = document.querySelector(button.dataset.ocrSource);
+    var status = document.querySelector(button.dataset.ocrStatus || "");
+    if (!form || !source) return;
+
+    function say(text) {
+      if (status) status.textContent = text;
+    }
+
+    button.addEventListener("click", function () {
+      var file = source.files && source.files[0];
+      if (!file) {
+        say("اختر ملف الصك أو المستند أولاً");
+        return;
+      }
+      var body = new FormData();
+      body.append("file", file);
+      button.disabled = true;
+      say("⏳ جاري قراءة المستند...");
+      fetch("/api/ocr/extract", { method: "POST", body: body, credentials: "same-origin" })
+        .then(function (resp) {
+          return resp.json().then(function (data) {
+            if (!resp.ok) throw new Error(data.error === "ocr_unavailable" ? "خدمة القراءة غير متاحة" : "تعذر رفع المستند");
+            return data;
+          });
+        })
+        .then(function (data) {
+          var done = function (result) {
+            button.disabled = false;
+            var filled = fill(form, result.fields || {});
+            say(filled.length ? "✅ تمت تعبئة " + filled.length + " حقول، يرجى المراجعة" : "لم يُعثر على بيانات قابلة للتعبئة");
+          };
+          if (data.status === "done") return done(data);
+          poll(data.sha256, done, function (message) {
+            button.disabled = false;
+            say("⚠️ " + message);
+          }, 0);
+        })
+        .catch(function (err) {
+          button.disabled = false;
+          say("⚠️ " + err.message);
+        });
+    });
+  }
+
+  document.addEventListener("DOMContentLoaded", function () {
+    document.querySelectorAll("[data-ocr-prefill]").forEach(attach);
+  });
+})();
@@ -0,0 +1,174 @@
+// رفع الملفات على دفعات قابلة للاستئناف (/api/uploads) قبل إرسال النموذج.
+// الاستخدام: <form data-resumable-upload> و <input type="file" data-resumable="report">
+// عند الإرسال يُرفع كل ملف على دفعات مع بصمة SHA-256 لكل دفعة، وعند الانقطاع يُسأل الخادم
+// عن الإزاحة (HEAD) ويُستأنف من حيث توقف. بعد الإنهاء يُضاف حقل مخفي upload_id لكل ملف
+// ويُرسل النموذج إلى المعالج المعتاد بدون الملف نفسه.
+(function () {
+  var MAX_RETRIES = 8;
+
+  function b64(str) {
+    return btoa(unescape(encodeURIComponent(str)));
+  }
+
+  function bufferToBase64(buffer) {
+    var bytes = new Uint8Array(buffer), binary = "";
+    for (var i = 0; i < bytes.length; i++) binary += String.fromCharCode(bytes[i]);
+    return btoa(binary);
+  }
+
+  function sha256(blob) {
+    if (!(window.crypto && window.crypto.subtle)) return Promise.resolve(null);
+    return blob.arrayBuffer().then(function (buf) {
+      return window.crypto.subtle.digest("SHA-256", buf);
+    });
+  }
+
+  function sleep(ms) {
+    return new Promise(function (resolve) { setTimeout(resolve, ms); });
+  }
+
+  function storageKey(file, purpose) {
+    return "resumable:" + purpose + ":" + file.name + ":" + file.size + ":" + file.lastModified;
+  }
+
+  function request(method, url, headers, body) {
+    headers = Object.assign({ "Tus-Resumable": "1.0.0" }, headers || {});
+    return fetch(url, { method: method, headers: headers, body: body, credentials: "same-origin" });
+  }
+
+  function createUpload(file, purpose) {
+    var metadata = "filename " + b64(file.name) + ",purpose " + b64(purpose);
+    return request("POST", "/api/uploads", {
+      "Upload-Length": String(file.size),
+      "Upload-Metadata": metadata
+    }).then(function (resp) {
+      if (!resp.ok) return resp.json().then(function (data) { throw new Error(data.error || resp.status); });
+      return resp.json();
+    });
+  }
+
+  function currentOffset(id) {
+    return request("HEAD", "/api/uploads/" + id).then(function (resp) {
+      if (!resp.ok) return null;
+      return parseInt(resp.headers.get("Upload-Offset"), 10);
+    });
+  }
+
+  function sendChunk(id, file, offset, size) {
+    var chunk = file.slice(offset, Math.min(offset + size, file.size));
+    return sha256(chunk).then(function (digest) {
+      var headers = {
+        "Content-Type": "application/offset+octet-stream",
+        "Upload-Offset": String(offset)
+      };
+      if (digest) headers["Upload-Checksum"] = "sha256 " + bufferToBase64(digest);
+      return request("PATCH", "/api/uploads/" + id, headers, chunk);
+    }).then(function (resp) {
+      if (resp.status === 204) return parseInt(resp.headers.get("Upload-Offset"), 10);
+      var err = new Error("chunk failed: " + resp.status);
+      err.status = resp.status;
+      throw err;
+    });
+  }
+
+  function uploadFile(file, purpose, onProgress) {
+    var key = storageKey(file, purpose);
+    var saved = null;
+    try { saved = JSON.parse(localStorage.getItem(key) || "null"); } catch (e) { saved = null; }
+
+    var start = saved
+      ? currentOffset(saved.upload_id).then(function (offset) {
+          return offset === null ? createUpload(file, purpose) : Object.assign(saved, { offset: offset });
+        })
+      : createUpload(file, purpose);
+
+    return start.then(function (info) {
+      try { localStorage.setItem(key, JSON.stringify({ upload_id: info.upload_id, chunk_size: info.chunk_size })); } catch (e) {}
+      var offset = info.offset || 0, retries = 0;
+
+      function next() {
+        onProgress(offset, file.size);
+        if (offset >= file.size) return Promise.resolve();
+        return sendChunk(info.upload_id, file, offset, info.chunk_size).then(function (newOffset) {
+          offset = newOffset;
+          retries = 0;
+          return next();
+        }, function (err) {
+          // خطأ دائم (حجم/نوع/صلاحية): لا فائدة من الإعادة
+          if (err.status && [401, 404, 413, 415].indexOf(err.status) !== -1) throw err;
+          if (++retries > MAX_RETRIES) throw err;
+          return sleep(Math.min(30000, 500 * Math.pow(2, retries))).then(function () {
+            return currentOffset(info.upload_id);
+          }).then(function (serverOffset) {
+            if (serverOffset !== null) offset = serverOffset;
+            return next();
+          }, next);
+        });
+      }
+
+      return next().then(function () {
+        return request("POST", "/api/uploads/" + info.upload_id + "/finalize");
+      }).then(function (resp) {
+        if (!resp.ok) throw new Error("finalize failed: " + resp.status);
+        localStorage.removeItem(key);
+        return resp.json();
+      });
+    });
+  }
+
+  function attach(form) {
+    var inputs = form.querySelectorAll("input[type=file][data-resumable]");
+    if (!inputs.length || !window.fetch || !window.Blob || !Blob.prototype.slice) return;
+
+    form.addEventListener("submit", function (event) {
+      if (form.dataset.resumableDone) return;
+      event.preventDefault();
+      var button = form.querySelector("[type=submit]");
+      var label = button ? button.textContent : "";
+      if (button) button.disabled = true;
+
+      var jobs = [];
+      Array.prototype.forEach.call(inputs, function (input) {
+        var field = input.dataset.uploadField || "upload_id";
+        Array.prototype.forEach.call(input.files, function (file) {
+          jobs.push({ input: input, file: file, field: field, purpose: input.dataset.resumable });
+        });
+      });
+
+      var total = jobs.reduce(function (sum, job) { return sum + job.file.size; }, 0) || 1;
+      var done = 0;
+      jobs.reduce(function (chain, job) {
+        return chain.then(function () {
+          return uploadFile(job.file, job.purpose, function (offset) {
+            if (button) button.textContent = "⏳ " + Math.floor(((done + offset) / total) * 100) + "%";
+          }).then(function (result) {
+            done += job.file.size;
+            var hidden = document.createElement("input");
+            hidden.type = "hidden";
+            hidden.name = job.field;
+            hidden.value = result.upload_id;
+            form.appendChild(hidden);
+          });
+        });
+      }, Promise.resolve()).then(function () {
+        // الملفات رُفعت بالفعل؛ لا نرسلها مرة ثانية مع النموذج
+        Array.prototype.forEach.call(inputs, function (input) {
+          input.required = false;
+          input.disabled = true;
+        });
+        form.dataset.resumableDone = "1";
+        form.submit();
+      }, function (err) {
+        if (button) {
+          button.disabled = false;
+          button.textContent = label;
+        }
+        alert("⚠️ تعذر رفع الملف: " + err.message + "\nيمكنك إعادة المحاولة وسيُستأنف الرفع من حيث توقف.");
+      });
+    });
+  }
+
+  document.addEventListener("DOMContentLoaded", function () {
+    document.querySelectorAll("form[data-resumable-upload]").forEach(attach);
+  });
+})();
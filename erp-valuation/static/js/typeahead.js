@@ -0,0 +1,83 @@
+// حقول اختيار بالبحث (typeahead) بدل قوائم select تحمل الجدول كاملاً.
+// الاستخدام:
+//   <input type="search" data-typeahead="/consulting/api/clients/typeahead" data-typeahead-target="client_id">
+//   <input type="hidden" name="client_id" value="...">
+// الواجهة تعيد {"items": [{"id": 1, "name": "..."}]}؛ اختيار اسم يضبط الحقل المخفي ويرسل النموذج.
+(() => {
+  const DEBOUNCE_MS = 250;
+  let counter = 0;
+
+  const ready = (fn) => {
+    if (document.readyState !== 'loading') {
+      fn();
+    } else {
+      document.addEventListener('DOMContentLoaded', fn, { once: true });
+    }
+  };
+
+  const bind = (input) => {
+    const form = input.form;
+    const hidden = form && form.querySelector(`input[type="hidden"][name="${input.dataset.typeaheadTarget}"]`);
+    if (!hidden) {
+      return;
+    }
+
+    const list = document.createElement('datalist');
+    list.id = `typeahead-list-${++counter}`;
+    input.setAttribute('list', list.id);
+    input.setAttribute('autocomplete', 'off');
+    input.after(list);
+
+    const ids = new Map();
+    if (input.value && hidden.value) {
+      ids.set(input.value, hidden.value);
+    }
+
+    let timer = null;
+    let controller = null;
+
+    const load = () => {
+      if (controller) {
+        controller.abort();
+      }
+      controller = new AbortController();
+      const url = new URL(input.dataset.typeahead, window.location.origin);
+      url.searchParams.set('q', input.value.trim());
+      fetch(url, { signal: controller.signal, credentials: 'same-origin', headers: { Accept: 'application/json' } })
+        .then((resp) => (resp.ok ? resp.json() : { items: [] }))
+        .then((data) => {
+          list.replaceChildren();
+          (data.items || []).forEach((item) => {
+            ids.set(item.name, String(item.id));
+            const option = document.createElement('option');
+            option.value = item.name;
+            list.appendChild(option);
+          });
+        })
+        .catch(() => {});
+    };
+
+    input.addEventListener('focus', () => {
+      if (!list.children.length) {
+        load();
+      }
+    });
+
+    input.addEventListener('input', () => {
+      clearTimeout(timer);
+      timer = setTimeout(load, DEBOUNCE_MS);
+    });
+
+    input.addEventListener('change', () => {
+      const value = input.value.trim();
+      const id = value ? ids.get(value) : '';
+      if (id === undefined || id === hidden.value) {
+        return;
+      }
+      hidden.value = id;
+      form.submit();
+    });
+  };
+
+  ready(() => document.querySelectorAll('input[data-typeahead]').forEach(bind));
+})();
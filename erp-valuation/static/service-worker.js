@@ -1,11 +1,46 @@
 // static/service-worker.js
+// PRECACHE_VERSION و PRECACHE_URLS يضيفهما الخادم في بداية الملف (/service-worker.js)
+
+const SHELL_CACHE_PREFIX = "shell-";
+const SHELL_CACHE = SHELL_CACHE_PREFIX + (typeof PRECACHE_VERSION !== "undefined" ? PRECACHE_VERSION : "dev");
+const SHELL_URLS = new Set(typeof PRECACHE_URLS !== "undefined" ? PRECACHE_URLS : []);
 
 self.addEventListener("install", function(event) {
   console.log("✅ Service Worker تم تثبيته");
+  // تخزين ملفات الواجهة (CSS/JS/الخط) مسبقاً؛ فشل أحدها لا يمنع التثبيت
+  event.waitUntil(
+    caches.open(SHELL_CACHE)
+      .then((cache) => Promise.all(Array.from(SHELL_URLS).map((url) => cache.add(url).catch(() => null))))
+      .then(() => self.skipWaiting())
+  );
 });
 
 self.addEventListener("activate", function(event) {
   console.log("✅ Service Worker مفعل");
+  // حذف نسخ الواجهة السابقة (بصمات قديمة)
+  event.waitUntil(
+    caches.keys()
+      .then((keys) => Promise.all(keys
+        .filter((key) => key.startsWith(SHELL_CACHE_PREFIX) && key !== SHELL_CACHE)
+        .map((key) => caches.delete(key))))
+      .then(() => self.clients.claim())
+  );
+});
+
+// ملفات الواجهة من التخزين المسبق أولاً (أسماؤها ببصمة المحتوى فلا تتقادم)
+self.addEventListener("fetch", function(event) {
+  const request = event.request;
+  if (request.method !== "GET") return;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin || !SHELL_URLS.has(url.pathname)) return;
+  event.respondWith(
+    caches.open(SHELL_CACHE).then((cache) =>
+      cache.match(url.pathname).then((cached) => cached || fetch(request).then((response) => {
+        if (response.ok) cache.put(url.pathname, response.clone());
+        return response;
+      }))
+    )
+  );
 });
 
 // تجربة: عند وصول إشعار Push
@@ -0,0 +1,253 @@
+"""
+static_assets.py
+
+بصمات المحتوى والضغط المسبق لملفات static (css/js/fonts).
+
+- build (خطوة البناء): ينسخ كل ملف إلى static/build/<المسار>.<بصمة>.<الامتداد> مع نسختين مضغوطتين
+  مسبقاً (.gz، و .br إن كانت حزمة brotli مثبتة)، ويعيد كتابة روابط url(...) داخل CSS لتشير
+  للأسماء الجديدة (مثل خط Amiri في style.css)، ثم يكتب static/build/manifest.json.
+- وقت التشغيل: StaticAssets.init_app يجعل url_for('static', filename='css/style.css') يُخرج الاسم
+  ذا البصمة تلقائياً (بدون تعديل القوالب)، ويخدم هذه الأسماء بترويسة Cache-Control: immutable
+  لمدة سنة مع اختيار النسخة المضغوطة حسب Accept-Encoding. بدون بناء تعمل الروابط القديمة كما هي.
+- shell_urls() روابط واجهة التطبيق التي يخزّنها Service Worker مسبقاً (precache)، و version
+  يتغير مع تغير أي منها فيُحدَّث الـ Service Worker.
+
+أمثلة:
+  python3 static_assets.py build
+  python3 static_assets.py clean
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import sys
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import brotli
+except ImportError:  # اختياري: بدونه تُبنى نسخ gzip فقط
+    brotli = None
+
+
+SOURCE_DIRS = ("css", "js", "fonts")
+BUILD_DIR = "build"
+MANIFEST_NAME = "manifest.json"
+HASH_LENGTH = 10
+ONE_YEAR = 31536000
+# أنواع نصية تستفيد من الضغط (woff2 والصور مضغوطة أصلاً)
+COMPRESSIBLE = {".css", ".js", ".ttf", ".otf", ".svg", ".json", ".map", ".txt"}
+# واجهة التطبيق المشتركة في base.html
+SHELL = (
+    "css/bootstrap.min.css",
+    "css/style.css",
+    "js/bootstrap.bundle.min.js",
+    "js/back-button.js",
+    "fonts/Amiri-Regular.ttf",
+)
+
+_CSS_URL = re.compile(r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)")
+
+
+# ----- البناء -----
+def _sources(static_dir: str) -> List[str]:
+    found = []
+    for top in SOURCE_DIRS:
+        for dirpath, _, filenames in os.walk(os.path.join(static_dir, top)):
+            for name in filenames:
+                rel = os.path.relpath(os.path.join(dirpath, name), static_dir).replace(os.sep, "/")
+                found.append(rel)
+    # CSS أخيراً حتى تكون بصمات الملفات التي يشير إليها (الخطوط) معروفة
+    return sorted(found, key=lambda rel: (rel.endswith(".css"), rel))
+
+
+def _rewrite_css(data: bytes, rel: str, assets: Dict[str, str]) -> bytes:
+    css_dir = os.path.dirname(rel)
+
+    def replace(match):
+        quote, url = match.group(1), match.group(2).strip()
+        if url.startswith(("data:", "http:", "https:", "//", "/", "#")):
+            return match.group(0)
+        path, sep, suffix = url, "", ""
+        cut = re.search(r"[?#]", url)
+        if cut:
+            # مثل Font.eot?#iefix
+            path, sep, suffix = url[:cut.start()], url[cut.start()], url[cut.start() + 1:]
+        target = os.path.normpath(os.path.join(css_dir, path)).replace(os.sep, "/")
+        if target not in assets:
+            return match.group(0)
+        new = os.path.relpath(assets[target], os.path.join(BUILD_DIR, css_dir)).replace(os.sep, "/")
+        return f"url({quote}{new}{sep}{suffix}{quote})"
+
+    return _CSS_URL.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+
+def _write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def build(static_dir: str) -> dict:
+    """بناء static/build ذرّياً (مجلد مؤقت ثم استبدال) وإرجاع ملخص الأحجام."""
+    final_dir = os.path.join(static_dir, BUILD_DIR)
+    work_dir = f"{final_dir}.{uuid.uuid4().hex}.tmp"
+    assets: Dict[str, str] = {}
+    stats = {"files": 0, "bytes": 0, "gzip_bytes": 0, "brotli_bytes": 0}
+    try:
+        for rel in _sources(static_dir):
+            with open(os.path.join(static_dir, rel), "rb") as f:
+                data = f.read()
+            if rel.endswith(".css"):
+                data = _rewrite_css(data, rel, assets)
+            base, ext = os.path.splitext(rel)
+            hashed = f"{base}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+            out = os.path.join(work_dir, hashed)
+            _write(out, data)
+            stats["files"] += 1
+            stats["bytes"] += len(data)
+            if ext.lower() in COMPRESSIBLE:
+                # mtime=0 حتى يكون الناتج متطابقاً بين عمليات البناء
+                gz = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(gz) < len(data):
+                    _write(out + ".gz", gz)
+                    stats["gzip_bytes"] += len(gz)
+                if brotli is not None:
+                    br = brotli.compress(data, quality=11)
+                    if len(br) < len(data):
+                        _write(out + ".br", br)
+                        stats["brotli_bytes"] += len(br)
+            assets[rel] = f"{BUILD_DIR}/{hashed}"
+        version = hashlib.sha256(json.dumps(assets, sort_keys=True).encode()).hexdigest()[:HASH_LENGTH]
+        _write(os.path.join(work_dir, MANIFEST_NAME), json.dumps(
+            {"version": version, "assets": assets}, indent=1, sort_keys=True
+        ).encode("utf-8"))
+        # ناتج بناء، لا يُضاف إلى git
+        _write(os.path.join(work_dir, ".gitignore"), b"*\n")
+        old_dir = None
+        if os.path.isdir(final_dir):
+            old_dir = f"{final_dir}.{uuid.uuid4().hex}.old"
+            os.replace(final_dir, old_dir)
+        os.replace(work_dir, final_dir)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    finally:
+        if os.path.isdir(work_dir):
+            shutil.rmtree(work_dir, ignore_errors=True)
+    stats["version"] = version
+    return stats
+
+
+# ----- وقت التشغيل -----
+class StaticAssets:
+    def __init__(self, app=None):
+        self.static_dir: Optional[str] = None
+        self.assets: Dict[str, str] = {}
+        self.hashed: set = set()
+        self.version = "dev"
+        self._send_unhashed = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.static_dir = app.static_folder
+        self.load()
+        self._send_unhashed = app.view_functions["static"]
+        app.view_functions["static"] = self.send_static
+        app.url_defaults(self._url_defaults)
+        app.extensions["static_assets"] = self
+
+    def load(self) -> None:
+        path = os.path.join(self.static_dir, BUILD_DIR, MANIFEST_NAME)
+        try:
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        if manifest:
+            self.assets = dict(manifest.get("assets") or {})
+            self.version = manifest.get("version") or "build"
+        else:
+            # بدون بناء: الإصدار من أحجام وتواريخ ملفات الواجهة حتى يتجدد الـ precache عند تعديلها
+            self.assets = {}
+            digest = hashlib.sha256()
+            for rel in SHELL:
+                try:
+                    st = os.stat(os.path.join(self.static_dir, rel))
+                except OSError:
+                    continue
+                digest.update(f"{rel}:{st.st_size}:{st.st_mtime_ns}".encode())
+            self.version = "dev-" + digest.hexdigest()[:HASH_LENGTH]
+        self.hashed = set(self.assets.values())
+
+    def hashed_name(self, filename: str) -> str:
+        """الاسم ذو البصمة لملف static (أو الاسم نفسه إن لم يُبنَ)."""
+        return self.assets.get(filename, filename)
+
+    def _url_defaults(self, endpoint: str, values: dict) -> None:
+        if endpoint == "static" and values.get("filename") in self.assets:
+            values["filename"] = self.assets[values["filename"]]
+
+    def shell_urls(self) -> List[str]:
+        from flask import url_for
+
+        return [
+            url_for("static", filename=rel) for rel in SHELL
+            if os.path.isfile(os.path.join(self.static_dir, self.hashed_name(rel)))
+        ]
+
+    def send_static(self, filename: str):
+        if filename not in self.hashed:
+            return self._send_unhashed(filename=filename)
+        from flask import request, send_file
+
+        path = os.path.join(self.static_dir, *filename.split("/"))
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        encoding = None
+        for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+        resp = send_file(path, mimetype=mimetype, etag=f"{filename}:{encoding or 'identity'}", conditional=True)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+        resp.headers["Vary"] = "Accept-Encoding"
+        # الاسم يتغير مع المحتوى، فلا حاجة لإعادة التحقق أبداً
+        resp.headers["Cache-Control"] = f"public, max-age={ONE_YEAR}, immutable"
+        return resp
+
+
+# ----- سطر الأوامر -----
+def parse_args(argv: Iterable[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress static assets.")
+    parser.add_argument("--static-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="Write static/build with hashed, precompressed copies and a manifest")
+    sub.add_parser("clean", help="Remove static/build (serve unhashed files again)")
+    return parser.parse_args(list(argv))
+
+
+def main(argv: Iterable[str]) -> int:
+    args = parse_args(argv)
+    if args.command == "clean":
+        shutil.rmtree(os.path.join(args.static_dir, BUILD_DIR), ignore_errors=True)
+        print("removed static/build")
+        return 0
+    stats = build(args.static_dir)
+    print(
+        f"version={stats['version']} files={stats['files']} bytes={stats['bytes']} "
+        f"gzip_bytes={stats['gzip_bytes']} brotli_bytes={stats['brotli_bytes']}"
+        + ("" if brotli is not None else " (brotli not installed)")
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
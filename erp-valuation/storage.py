@@ -0,0 +1,528 @@
+"""
+storage.py
+
+طبقة تخزين موحّدة للملفات: قرص محلي + نسخة بعيدة (Backblaze B2 أو بديل وهمي داخل العملية).
+
+- LocalBackend: مجلد الرفع (uploads/).
+- B2Backend: اتصال B2 واحد يُفوَّض مرة ويُعاد استخدامه (بدل authorize_account في كل طلب)،
+  مع تجديده عند انتهاء صلاحيته.
+- FakeBackend: تخزين في الذاكرة بنفس الواجهة، مع إمكانية محاكاة الفشل (للتجارب المحلية).
+- ReplicatingStorage: الكتابة تنتهي على القرص المحلي أولاً ثم تُنسخ للخادم البعيد عبر طابور
+  خلفي مع إعادة المحاولة (تأخير أسّي حتى STORAGE_REPLICATION_MAX_DELAY ثم بهذا الفاصل حتى النجاح؛
+  لا يُسقط أي ملف). القراءة تفضّل النسخة المحلية إن وُجدت ثم البعيدة.
+- replicate_after_commit: النسخ يُجدول فقط بعد commit الجلسة (ويُلغى عند rollback)، فلا يسبق
+  callback تسجيلَ الصف الذي يحدّثه.
+- sweepers: دوال تُعيد جدولة ما لم يُنسخ بعد (من قاعدة البيانات) عند بدء خيط النسخ في كل عملية
+  ثم كل STORAGE_REPLICATION_SWEEP ثانية؛ مجلد uploads/ على Render غير دائم، فلا يُعتمد على
+  طابور الذاكرة وحده.
+
+الإعداد مرة واحدة من متغيرات البيئة في configure_storage:
+  STORAGE_REMOTE = b2 | fake | none   (الافتراضي b2 إن وُجدت مفاتيح B2 وإلا none)
+  STORAGE_REPLICATION_ATTEMPTS محاولات التأخير الأسّي (6)، STORAGE_REPLICATION_DELAY ثواني التأخير الأول (2)
+  STORAGE_REPLICATION_MAX_DELAY أقصى تأخير بين المحاولات (300)، STORAGE_REPLICATION_SWEEP (600، 0 يعطّل)
+"""
+
+from __future__ import annotations
+
+import heapq
+import os
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+CHUNK_SIZE = 64 * 1024
+_AFTER_COMMIT = "storage_after_commit"
+
+
+class StorageError(RuntimeError):
+    pass
+
+
+class StorageBackend:
+    """الواجهة المشتركة لكل أنواع التخزين."""
+
+    name = "base"
+
+    def put_file(self, key: str, path: str) -> Optional[str]:
+        """رفع ملف محلي تحت المفتاح key وإرجاع معرّفه لدى الخادم (إن وُجد)."""
+        raise NotImplementedError
+
+    def open(self, key: str) -> Optional[Iterator[bytes]]:
+        """مولّد بايتات لمحتوى المفتاح، أو None إن لم يوجد."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def public_url(self, key: str) -> Optional[str]:
+        return None
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+def _iter_file(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+class LocalBackend(StorageBackend):
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> Optional[str]:
+        path = os.path.normpath(os.path.join(self.root, key or ""))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            return None
+        return path
+
+    def put_file(self, key: str, path: str) -> Optional[str]:
+        dest = self.path(key)
+        if dest is None:
+            raise StorageError(f"unsafe key: {key!r}")
+        if os.path.abspath(path) != os.path.abspath(dest):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(path, "rb") as src, open(tmp, "wb") as out:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    out.write(chunk)
+            os.replace(tmp, dest)
+        return None
+
+    def open(self, key: str) -> Optional[Iterator[bytes]]:
+        path = self.path(key)
+        if not path or not os.path.isfile(path):
+            return None
+        return _iter_file(path)
+
+    def exists(self, key: str) -> bool:
+        path = self.path(key)
+        return bool(path) and os.path.isfile(path)
+
+    def delete(self, key: str) -> None:
+        path = self.path(key)
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class FakeBackend(StorageBackend):
+    """تخزين بعيد وهمي في الذاكرة. fail_next=N يجعل أول N عمليات رفع تفشل."""
+
+    name = "fake"
+
+    def __init__(self, base_url: str = "https://fake-storage.local/file"):
+        self.base_url = base_url
+        self.objects: Dict[str, bytes] = {}
+        self.fail_next = 0
+        self.uploads = 0
+        self._lock = threading.Lock()
+
+    def put_file(self, key: str, path: str) -> Optional[str]:
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise StorageError("simulated upload failure")
+            with open(path, "rb") as f:
+                self.objects[key] = f.read()
+            self.uploads += 1
+            return f"fake_{self.uploads}"
+
+    def open(self, key: str) -> Optional[Iterator[bytes]]:
+        data = self.objects.get(key)
+        if data is None:
+            return None
+        return iter([data])
+
+    def exists(self, key: str) -> bool:
+        return key in self.objects
+
+    def public_url(self, key: str) -> Optional[str]:
+        return f"{self.base_url}/{quote(key)}" if key in self.objects else None
+
+    def delete(self, key: str) -> None:
+        self.objects.pop(key, None)
+
+
+class B2Backend(StorageBackend):
+    """Backblaze B2 باتصال مفوَّض واحد لكل عملية."""
+
+    name = "b2"
+    # رمز التفويض في B2 صالح 24 ساعة؛ نجدده قبل ذلك
+    AUTH_TTL_SECONDS = 12 * 3600
+
+    def __init__(self, key_id: Optional[str], app_key: Optional[str], bucket_id: Optional[str] = None,
+                 bucket_name: Optional[str] = None):
+        self.key_id = key_id
+        self.app_key = app_key
+        self.bucket_id = bucket_id
+        self.bucket_name = bucket_name
+        self._lock = threading.Lock()
+        self._api = None
+        self._bucket = None
+        self._authorized_at = 0.0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.key_id and self.app_key and (self.bucket_id or self.bucket_name))
+
+    def api(self):
+        from b2sdk.v2 import B2Api, InMemoryAccountInfo
+
+        if not self.key_id or not self.app_key:
+            raise StorageError("B2 credentials (B2_KEY_ID/B2_APPLICATION_KEY) are not configured")
+        with self._lock:
+            if self._api is None or time.monotonic() - self._authorized_at > self.AUTH_TTL_SECONDS:
+                api = B2Api(InMemoryAccountInfo())
+                api.authorize_account("production", self.key_id, self.app_key)
+                self._api, self._bucket, self._authorized_at = api, None, time.monotonic()
+            return self._api
+
+    def bucket(self):
+        api = self.api()
+        with self._lock:
+            if self._bucket is not None:
+                return self._bucket
+        bucket = None
+        if self.bucket_id:
+            try:
+                bucket = api.get_bucket_by_id(self.bucket_id)
+            except Exception:
+                bucket = next((b for b in api.list_buckets() if getattr(b, "id_", None) == self.bucket_id), None)
+            if bucket is None:
+                raise StorageError("B2 bucket not found for configured B2_BUCKET_ID")
+        elif self.bucket_name:
+            try:
+                bucket = api.get_bucket_by_name(self.bucket_name)
+            except Exception:
+                bucket = next((b for b in api.list_buckets() if getattr(b, "name", None) == self.bucket_name), None)
+            if bucket is None:
+                raise StorageError("B2 bucket not found for configured B2_BUCKET_NAME/B2_BUCKET")
+        else:
+            raise StorageError("B2 bucket is not configured. Set B2_BUCKET_ID or B2_BUCKET_NAME/B2_BUCKET")
+        with self._lock:
+            self._bucket = bucket
+        return bucket
+
+    def reset(self) -> None:
+        """إسقاط الاتصال المحفوظ (بعد خطأ تفويض مثلاً) ليُعاد إنشاؤه في الطلب التالي."""
+        with self._lock:
+            self._api = None
+            self._bucket = None
+
+    def put_file(self, key: str, path: str) -> Optional[str]:
+        try:
+            uploaded = self.bucket().upload_local_file(local_file=path, file_name=key)
+        except StorageError:
+            raise
+        except Exception as e:
+            self.reset()
+            raise StorageError(f"B2 upload failed for {key}: {e}") from e
+        return getattr(uploaded, "id_", None) or getattr(uploaded, "file_id", None)
+
+    def open(self, key: str) -> Optional[Iterator[bytes]]:
+        try:
+            downloaded = self.bucket().download_file_by_name(key)
+        except Exception:
+            return None
+        return downloaded.response.iter_content(chunk_size=CHUNK_SIZE)
+
+    def exists(self, key: str) -> bool:
+        try:
+            return self.bucket().get_file_info_by_name(key) is not None
+        except Exception:
+            return False
+
+    def public_url(self, key: str) -> Optional[str]:
+        """رابط تنزيل عام مباشر (يفترض أن البكت عام)."""
+        if not key:
+            return None
+        try:
+            api = self.api()
+            try:
+                download_base = api.account_info.get_download_url()
+            except Exception:
+                download_base = api.session.account_info.get_download_url()
+            bucket_name = self.bucket_name or getattr(self.bucket(), "name", None)
+        except Exception:
+            return None
+        if not download_base or not bucket_name:
+            return None
+        return f"{download_base}/file/{quote(bucket_name)}/{quote(key)}"
+
+    def delete(self, key: str) -> None:
+        try:
+            info = self.bucket().get_file_info_by_name(key)
+            self.bucket().delete_file_version(info.id_, key)
+        except Exception:
+            pass
+
+
+ReplicationCallback = Callable[[str, Optional[str]], None]
+
+
+def after_commit(session, func: Callable[[], None]) -> None:
+    """تشغيل func بعد commit الجلسة الخارجي؛ تُهمل إن انتهت المعاملة بـ rollback."""
+    session.info.setdefault(_AFTER_COMMIT, []).append(func)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session) -> None:
+    for func in session.info.pop(_AFTER_COMMIT, ()):
+        try:
+            func()
+        except Exception as e:
+            print(f"⚠️ after-commit hook failed: {e}")
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_after_rollback(session, transaction) -> None:
+    # after_commit يسبق هذا الحدث، فما بقي هنا يخص معاملة تراجعت
+    if transaction.parent is None:
+        session.info.pop(_AFTER_COMMIT, None)
+
+
+class ReplicatingStorage:
+    """قرص محلي أولاً ثم نسخ غير متزامن إلى خادم بعيد مع إعادة المحاولة."""
+
+    def __init__(self, local: LocalBackend, remote: Optional[StorageBackend] = None,
+                 max_attempts: int = 6, base_delay: float = 2.0, max_delay: float = 300.0,
+                 sweep_interval: float = 600.0, app=None):
+        self.local = local
+        self.remote = remote
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+        self.sweep_interval = max(0.0, float(sweep_interval))
+        self.app = app
+        self._cond = threading.Condition()
+        # (وقت التنفيذ، تسلسل، المفتاح المحلي، المفتاح البعيد، المحاولة، callback)
+        self._queue: List[Tuple[float, int, str, str, int, Optional[ReplicationCallback]]] = []
+        self._seq = 0
+        self._inflight = 0
+        # المفاتيح البعيدة في الطابور أو قيد الرفع (لا تُجدول مرتين)
+        self._keys: set = set()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid: Optional[int] = None
+        self._next_sweep = 0.0
+        # دوال بدون معاملات تعيد جدولة ما لم يُنسخ بعد (تُنفذ داخل app_context)
+        self.sweepers: List[Callable[[], None]] = []
+        # المفاتيح التي تجاوزت محاولات التأخير الأسّي وما زالت تُعاد: {المفتاح البعيد: المفتاح المحلي}
+        self.failed: Dict[str, str] = {}
+
+    # ----- الكتابة -----
+    def replicate(self, local_key: str, remote_key: Optional[str] = None,
+                  callback: Optional[ReplicationCallback] = None) -> bool:
+        """جدولة نسخ ملف محلي موجود إلى الخادم البعيد. يرجع False إن لم يكن هناك خادم بعيد."""
+        if self.remote is None:
+            return False
+        remote_key = remote_key or local_key
+        with self._cond:
+            self._ensure_worker()
+            if remote_key not in self._keys:
+                self._keys.add(remote_key)
+                self._push(time.monotonic(), local_key, remote_key, 1, callback)
+        return True
+
+    def replicate_after_commit(self, session, local_key: str, remote_key: Optional[str] = None,
+                               callback: Optional[ReplicationCallback] = None) -> bool:
+        """مثل replicate لكن بعد commit الجلسة، فيجد callback الصف الذي سيحدّثه."""
+        if self.remote is None:
+            return False
+        after_commit(session, lambda: self.replicate(local_key, remote_key, callback))
+        return True
+
+    def upload_now(self, stream: BinaryIO, remote_key: str) -> Optional[str]:
+        """رفع متزامن مباشر إلى الخادم البعيد (بدون نسخة محلية) وإرجاع معرّف الملف."""
+        if self.remote is None:
+            raise StorageError("remote storage is not configured")
+        fd, tmp_path = tempfile.mkstemp(prefix="upload_now_")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    out.write(chunk)
+            return self.remote.put_file(remote_key, tmp_path)
+        finally:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def start(self) -> None:
+        """تشغيل خيط النسخ في هذه العملية (أول تشغيل ينفذ sweepers فوراً)."""
+        if self.remote is None:
+            return
+        with self._cond:
+            self._ensure_worker()
+
+    def _push(self, when: float, local_key: str, remote_key: str, attempt: int, callback) -> None:
+        self._seq += 1
+        heapq.heappush(self._queue, (when, self._seq, local_key, remote_key, attempt, callback))
+        self._cond.notify()
+
+    def _ensure_worker(self) -> None:
+        # بعد fork (gunicorn --preload) لا ينتقل الخيط للعملية الابنة؛ نعيد تشغيله فيها
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        self._worker_pid = os.getpid()
+        self._next_sweep = time.monotonic()
+        self._worker = threading.Thread(target=self._run, name="storage-replication", daemon=True)
+        self._worker.start()
+
+    def _sweep_due(self) -> bool:
+        return bool(self.sweepers) and self.sweep_interval > 0 and time.monotonic() >= self._next_sweep
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._sweep_due() and (not self._queue or self._queue[0][0] > time.monotonic()):
+                    wake = [self._queue[0][0]] if self._queue else []
+                    if self.sweepers and self.sweep_interval > 0:
+                        wake.append(self._next_sweep)
+                    self._cond.wait(max(0.0, min(wake) - time.monotonic()) if wake else None)
+                if self._sweep_due():
+                    self._next_sweep = time.monotonic() + self.sweep_interval
+                    job = None
+                else:
+                    job = heapq.heappop(self._queue)
+                    self._inflight += 1
+            if job is None:
+                self._sweep()
+                continue
+            _, _, local_key, remote_key, attempt, callback = job
+            try:
+                self._replicate_one(local_key, remote_key, attempt, callback)
+            finally:
+                with self._cond:
+                    self._inflight -= 1
+                    self._cond.notify_all()
+
+    def _sweep(self) -> None:
+        for sweeper in list(self.sweepers):
+            try:
+                if self.app is not None:
+                    with self.app.app_context():
+                        sweeper()
+                else:
+                    sweeper()
+            except Exception as e:
+                print(f"⚠️ storage replication sweep failed: {e}")
+
+    def _replicate_one(self, local_key: str, remote_key: str, attempt: int, callback) -> None:
+        path = self.local.path(local_key)
+        if not path or not os.path.isfile(path):
+            # الملف حُذف محلياً قبل نسخه؛ لا شيء لنسخه
+            self._done(remote_key)
+            return
+        try:
+            file_id = self.remote.put_file(remote_key, path)
+        except Exception as e:
+            if attempt == self.max_attempts:
+                print(f"⚠️ storage replication still failing for {remote_key} after {attempt} attempts: {e}")
+            if attempt >= self.max_attempts:
+                self.failed[remote_key] = local_key
+            delay = min(self.base_delay * (2 ** (attempt - 1)), self.max_delay)
+            with self._cond:
+                self._push(time.monotonic() + delay, local_key, remote_key, attempt + 1, callback)
+            return
+        self._done(remote_key)
+        if callback is not None:
+            try:
+                if self.app is not None:
+                    with self.app.app_context():
+                        callback(remote_key, file_id)
+                else:
+                    callback(remote_key, file_id)
+            except Exception as e:
+                print(f"⚠️ storage replication callback failed for {remote_key}: {e}")
+
+    def _done(self, remote_key: str) -> None:
+        with self._cond:
+            self._keys.discard(remote_key)
+            self.failed.pop(remote_key, None)
+
+    def _busy(self) -> bool:
+        # المفاتيح التي تجاوزت المحاولات تُعاد في الخلفية بلا نهاية؛ لا ننتظرها
+        waiting = sum(1 for job in self._queue if job[4] <= self.max_attempts)
+        return bool(waiting or self._inflight)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """انتظار فراغ الطابور (لأدوات سطر الأوامر). يرجع False عند انتهاء المهلة.
+
+        المفاتيح التي ما زالت تفشل بعد كل محاولات التأخير الأسّي (failed) لا تُنتظر.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._busy():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.5)
+        return True
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._queue) + self._inflight
+
+    # ----- القراءة -----
+    def open(self, local_key: Optional[str], remote_key: Optional[str] = None) -> Optional[Iterator[bytes]]:
+        """محتوى الملف من النسخة المحلية إن وُجدت، وإلا من الخادم البعيد."""
+        if local_key:
+            stream = self.local.open(local_key)
+            if stream is not None:
+                return stream
+        if self.remote is not None and (remote_key or local_key):
+            return self.remote.open(remote_key or local_key)
+        return None
+
+    def has_local(self, local_key: Optional[str]) -> bool:
+        return bool(local_key) and self.local.exists(local_key)
+
+    def public_url(self, remote_key: Optional[str]) -> Optional[str]:
+        if self.remote is None or not remote_key:
+            return None
+        return self.remote.public_url(remote_key)
+
+
+def configure_storage(app, local_root: str) -> ReplicatingStorage:
+    """إنشاء طبقة التخزين من إعدادات التطبيق/البيئة وتسجيلها في app.extensions["storage"]."""
+    b2 = B2Backend(
+        app.config.get("B2_KEY_ID"),
+        app.config.get("B2_APPLICATION_KEY"),
+        app.config.get("B2_BUCKET_ID"),
+        app.config.get("B2_BUCKET_NAME"),
+    )
+    kind = (os.environ.get("STORAGE_REMOTE") or ("b2" if b2.configured else "none")).strip().lower()
+    remote: Optional[StorageBackend]
+    if kind == "b2":
+        remote = b2
+    elif kind == "fake":
+        remote = FakeBackend()
+    else:
+        remote = None
+    storage = ReplicatingStorage(
+        LocalBackend(local_root),
+        remote,
+        max_attempts=int(os.environ.get("STORAGE_REPLICATION_ATTEMPTS", "6")),
+        base_delay=float(os.environ.get("STORAGE_REPLICATION_DELAY", "2")),
+        max_delay=float(os.environ.get("STORAGE_REPLICATION_MAX_DELAY", "300")),
+        sweep_interval=float(os.environ.get("STORAGE_REPLICATION_SWEEP", "600")),
+        app=app,
+    )
+    storage.b2 = b2
+    app.extensions["storage"] = storage
+    return storage
+
@@ -0,0 +1,86 @@
+"""
+إعداد مشترك للاختبارات.
+
+التطبيق يُستورد مرة واحدة لكل جلسة اختبار بمجلدات مؤقتة (ERP_INSTANCE_PATH / UPLOAD_FOLDER)
+وقاعدة SQLite داخلها، فلا تلمس الاختبارات instance/erp.db ولا uploads/ الحقيقيين.
+"""
+
+import atexit
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+_TMP = tempfile.mkdtemp(prefix="erp_tests_")
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+os.environ["ERP_INSTANCE_PATH"] = os.path.join(_TMP, "instance")
+os.environ["UPLOAD_FOLDER"] = os.path.join(_TMP, "uploads")
+os.environ["STORAGE_REMOTE"] = "none"
+os.environ["OCR_ON_UPLOAD"] = "0"
+os.environ.pop("DATABASE_URL", None)
+
+# القياسات بطيئة نسبياً فلا تعمل إلا عند الطلب: ERP_BENCH=1 python -m pytest -q -s tests -k bench
+bench = pytest.mark.skipif(not os.environ.get("ERP_BENCH"), reason="set ERP_BENCH=1 to run benchmarks")
+
+
+@pytest.fixture(scope="session")
+def erp():
+    """وحدة app بعد تهيئتها (النماذج، المخازن، المسارات)."""
+    import app as erp_app
+
+    return erp_app
+
+
+@pytest.fixture
+def app_ctx(erp):
+    with erp.app.app_context():
+        yield erp.app
+        erp.db.session.rollback()
+        erp.db.session.remove()
+
+
+@pytest.fixture
+def client(erp):
+    erp.app.config["TESTING"] = True
+    return erp.app.test_client()
+
+
+def login(client, role, user_id=None):
+    """جلسة مستخدم بدور معين (بدون المرور بنموذج الدخول)."""
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id or 1
+        sess["role"] = role
+
+
+def make_project(name="مشروع اختبار", client_name="عميل اختبار"):
+    """عميل ومشروع استشارات محفوظان (flush فقط؛ المستدعي يقرر commit)."""
+    from consulting.clients.models import Client
+    from consulting.projects.models import ConsultingProject
+    from extensions import db
+
+    client = Client(name=client_name, type="شركة")
+    db.session.add(client)
+    db.session.flush()
+    project = ConsultingProject(name=name, type="تصميم معماري", client_id=client.id)
+    db.session.add(project)
+    db.session.flush()
+    return client, project
+
+
+def timed(func, repeat=5):
+    """وسيط زمن التنفيذ بالثواني لعدة مرات (بعد تشغيل تمهيدي)."""
+    func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
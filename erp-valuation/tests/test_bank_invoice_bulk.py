@@ -0,0 +1,146 @@
+import io
+import threading
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from conftest import login
+
+
+@pytest.fixture
+def bank_month(erp, app_ctx):
+    bank = erp.Bank(name="Bulk Test Bank")
+    branch = erp.Branch(name="فرع الاختبار")
+    erp.db.session.add_all([bank, branch])
+    erp.db.session.flush()
+    user = erp.User(username="bulk_finance", password="x", role="finance", branch_id=branch.id)
+    erp.db.session.add(user)
+    erp.db.session.flush()
+    for i in range(3):
+        erp.db.session.add(erp.Transaction(client=f"عميل {i}", bank_id=bank.id, fee=100 + i,
+                                           branch_id=branch.id, created_by=user.id,
+                                           date=datetime(2001, 3, 5 + i)))
+    erp.db.session.commit()
+    return bank
+
+
+@pytest.fixture
+def fake_render(erp, monkeypatch, tmp_path):
+    calls = []
+
+    def render(template_path, mapping, output_format="docx"):
+        calls.append(mapping)
+        if len(calls) == 2:
+            raise RuntimeError("soffice crashed")
+        path = tmp_path / f"doc{len(calls)}.{output_format}"
+        path.write_bytes(b"document %d" % len(calls))
+        return str(path)
+
+    monkeypatch.setattr(erp, "_render_document_file", render)
+    return calls
+
+
+def test_invalid_month_redirects_without_issuing(erp, client, fake_render):
+    login(client, "finance")
+    with erp.app.app_context():
+        before = erp.BankInvoice.query.count()
+    resp = client.post("/finance/bank_invoices/bulk", data={"month": "2001-13"})
+    assert resp.status_code == 302
+    assert resp.headers["Location"].endswith("/finance")
+    assert fake_render == []
+    with erp.app.app_context():
+        assert erp.BankInvoice.query.count() == before
+
+
+def test_failed_document_is_listed_in_errors_entry(erp, client, bank_month, fake_render):
+    login(client, "finance")
+    resp = client.post("/finance/bank_invoices/bulk", data={"month": "2001-03", "bank_id": bank_month.id})
+    assert resp.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(resp.get_data()))
+    assert archive.testzip() is None
+    names = archive.namelist()
+    documents = [n for n in names if n.endswith(".docx")]
+    assert len(documents) == 2
+    failed = archive.read(erp.BULK_RENDER_ERRORS_NOTE).decode("utf-8").split()
+    assert len(failed) == 1 and failed[0].endswith(".docx") and failed[0] not in documents
+    with erp.app.app_context():
+        assert erp.BankInvoice.query.filter_by(bank_id=bank_month.id).count() == 3
+
+
+def _seed_month(erp, name, day, count):
+    bank = erp.Bank(name=name)
+    branch = erp.Branch(name=f"فرع {name}")
+    erp.db.session.add_all([bank, branch])
+    erp.db.session.flush()
+    user = erp.User(username=f"finance {name}", password="x", role="finance", branch_id=branch.id)
+    erp.db.session.add(user)
+    erp.db.session.flush()
+    transactions = [
+        erp.Transaction(client=f"عميل {i}", bank_id=bank.id, fee=10 + i, branch_id=branch.id,
+                        created_by=user.id, date=day)
+        for i in range(count)
+    ]
+    erp.db.session.add_all(transactions)
+    erp.db.session.commit()
+    return bank, [t.id for t in transactions]
+
+
+def test_concurrent_bulk_runs_invoice_each_transaction_once(erp, app_ctx):
+    bank, tx_ids = _seed_month(erp, "Concurrent Bulk Bank", datetime(2002, 4, 10), 12)
+    runs = 4
+    start = threading.Barrier(runs)
+    issued, errors = [], []
+
+    def worker():
+        try:
+            with erp.app.app_context():
+                start.wait()
+                invoices = erp.issue_bank_invoices_for_period(
+                    datetime(2002, 4, 1), datetime(2002, 5, 1), bank_id=bank.id
+                )
+                issued.append([inv.transaction_id for inv in invoices])
+        except Exception as e:  # noqa: BLE001 - يُفحص في الخيط الرئيسي
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(runs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+    assert errors == []
+    assert sorted(tx for run in issued for tx in run) == sorted(tx_ids)
+    rows = erp.BankInvoice.query.filter(erp.BankInvoice.transaction_id.in_(tx_ids)).all()
+    assert len(rows) == len(tx_ids)
+    assert len({inv.invoice_number for inv in rows}) == len(tx_ids)
+
+
+def test_transaction_cannot_get_a_second_bank_invoice(erp, app_ctx):
+    bank, (tx_id,) = _seed_month(erp, "Unique Bulk Bank", datetime(2002, 6, 3), 1)
+    erp.db.session.add(erp.BankInvoice(bank_id=bank.id, transaction_id=tx_id, invoice_number="INV-T-DUP-1"))
+    erp.db.session.commit()
+    erp.db.session.add(erp.BankInvoice(bank_id=bank.id, transaction_id=tx_id, invoice_number="INV-T-DUP-2"))
+    with pytest.raises(erp.IntegrityError):
+        erp.db.session.commit()
+    erp.db.session.rollback()
+
+
+def test_bulk_run_retries_when_a_transaction_was_invoiced_meanwhile(erp, app_ctx, monkeypatch):
+    bank, tx_ids = _seed_month(erp, "Retry Bulk Bank", datetime(2002, 7, 8), 3)
+    erp.db.session.add(erp.BankInvoice(bank_id=bank.id, transaction_id=tx_ids[0], invoice_number="INV-T-RACE-1"))
+    erp.db.session.commit()
+    real_query = erp.uninvoiced_bank_transactions_query
+    calls = []
+
+    def stale_first_query(period_start, period_end, bank_id=None):
+        # الاختيار الأول لا يرى الفاتورة المفردة (كأنها أُنشئت بعده في اتصال آخر)
+        calls.append(bank_id)
+        if len(calls) == 1:
+            return erp.Transaction.query.filter(erp.Transaction.id.in_(tx_ids)).order_by(erp.Transaction.id)
+        return real_query(period_start, period_end, bank_id)
+
+    monkeypatch.setattr(erp, "uninvoiced_bank_transactions_query", stale_first_query)
+    invoices = erp.issue_bank_invoices_for_period(datetime(2002, 7, 1), datetime(2002, 8, 1), bank_id=bank.id)
+    assert len(calls) == 2
+    assert sorted(inv.transaction_id for inv in invoices) == tx_ids[1:]
+    assert erp.BankInvoice.query.filter(erp.BankInvoice.transaction_id.in_(tx_ids)).count() == 3
@@ -0,0 +1,66 @@
+import pytest
+from docx import Document as DocxDocument
+from docx.oxml.ns import qn
+
+from conftest import bench, timed
+from legacy_default_docx import _generate_default_docx
+
+CASES = {
+    "invoice": ("invoice", {
+        "TRANSACTION_ID": "1042", "DATE": "2025-01-31", "CLIENT_NAME": "شركة المسار & أبناؤه",
+        "EMPLOYEE": "سالم", "BANK_NAME": "بنك مسقط", "BANK_BRANCH": "الخوير",
+        "PRICE": "150.000", "TAX": "7.500", "TOTAL_PRICE": "157.500",
+        "DETAILS": "تثمين أرض سكنية\nالسيب <مربع 3>", "INVOICE_NO": "INV-2025-00042",
+    }),
+    # المفاتيح البديلة القديمة (NAME, AMOUNT, TOTAL) ورقم العرض
+    "quote_fallbacks": ("quote", {"NAME": "أحمد", "AMOUNT": "80", "TOTAL": "84", "QUOTE_NO": "Q-7"}),
+    "empty": ("quote", {}),
+}
+
+
+def _paragraph(p):
+    ppr = p._p.pPr
+    bidi = ppr.find(qn("w:bidi")) if ppr is not None else None
+    return (
+        p.text,
+        p.alignment,
+        bidi.get(qn("w:val")) if bidi is not None else None,
+        "".join(r.text for r in p.runs if r.bold),
+    )
+
+
+def _signature(path):
+    """النص والمحاذاة والاتجاه والخط العريض لكل فقرة وخلية بترتيب المستند."""
+    document = DocxDocument(path)
+    body = []
+    for block in document.element.body.iterchildren():
+        if block.tag == qn("w:p"):
+            body.append(("p", _paragraph(next(p for p in document.paragraphs if p._p is block))))
+        elif block.tag == qn("w:tbl"):
+            table = next(t for t in document.tables if t._tbl is block)
+            body.append(("table", [[[_paragraph(p) for p in cell.paragraphs] for cell in row.cells]
+                                   for row in table.rows]))
+    return body
+
+
+def _render_template(erp, doc_type, placeholders, out_path):
+    mapping = erp._default_docx_mapping(doc_type, placeholders)
+    erp._fill_docx_from_template_xml(erp.DEFAULT_DOCX_TEMPLATE, str(out_path), mapping)
+
+
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_default_template_matches_legacy_generator(erp, tmp_path, case):
+    doc_type, placeholders = CASES[case]
+    legacy, rendered = tmp_path / "legacy.docx", tmp_path / "template.docx"
+    _generate_default_docx(doc_type, placeholders, str(legacy))
+    _render_template(erp, doc_type, placeholders, rendered)
+    assert _signature(rendered) == _signature(legacy)
+
+
+@bench
+def test_bench_default_docx(erp, tmp_path):
+    doc_type, placeholders = CASES["invoice"]
+    legacy = timed(lambda: _generate_default_docx(doc_type, placeholders, str(tmp_path / "legacy.docx")), 30)
+    template = timed(lambda: _render_template(erp, doc_type, placeholders, tmp_path / "template.docx"), 30)
+    print(f"\ndefault docx: legacy={legacy * 1000:.1f}ms template={template * 1000:.1f}ms")
+    assert template < legacy
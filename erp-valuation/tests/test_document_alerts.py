@@ -0,0 +1,68 @@
+from datetime import date, datetime
+
+import pytest
+
+TODAY = date(2004, 5, 1)
+
+
+class _StaleAlertQuery:
+    """قراءة التنبيهات الموجودة قبل أن تُثبّت عملية مسح أخرى تنبيهاتها."""
+
+    def filter(self, *args):
+        return self
+
+    def all(self):
+        return []
+
+
+@pytest.fixture
+def branch_docs(erp, app_ctx):
+    branch = erp.Branch(name="فرع تنبيهات الاختبار")
+    erp.db.session.add(branch)
+    erp.db.session.flush()
+    docs = [
+        erp.BranchDocument(branch_id=branch.id, title=f"سجل {i}", expires_at=datetime(2004, 5, 10 + i))
+        for i in range(3)
+    ]
+    erp.db.session.add_all(docs)
+    erp.db.session.commit()
+    yield [(d.id, branch.id, d.expires_at.date()) for d in docs]
+
+    erp.db.session.rollback()
+    ids = [d.id for d in docs]
+    erp.BranchDocumentAlert.query.filter(erp.BranchDocumentAlert.document_id.in_(ids)).delete(synchronize_session=False)
+    erp.BranchDocument.query.filter(erp.BranchDocument.id.in_(ids)).delete(synchronize_session=False)
+    erp.Branch.query.filter_by(id=branch.id).delete(synchronize_session=False)
+    erp.db.session.commit()
+
+
+def _alerts(erp, docs):
+    return erp.BranchDocumentAlert.query.filter(
+        erp.BranchDocumentAlert.document_id.in_([d[0] for d in docs])
+    ).all()
+
+
+def test_sync_creates_warning_alerts_once(erp, branch_docs):
+    assert erp._sync_document_alerts(erp.BranchDocumentAlert, "branch_id", branch_docs, TODAY) == 3
+    erp.db.session.commit()
+    assert erp._sync_document_alerts(erp.BranchDocumentAlert, "branch_id", branch_docs, TODAY) == 0
+    alerts = _alerts(erp, branch_docs)
+    assert len(alerts) == 3
+    assert {a.alert_type for a in alerts} == {erp.ALERT_WARNING}
+
+
+def test_conflicting_alert_does_not_drop_the_rest_of_the_batch(erp, branch_docs, monkeypatch):
+    doc_id, branch_id, expiry = branch_docs[1]
+    # عملية مسح أخرى أدرجت تنبيه المستند الثاني بعد أن قرأت هذه العملية التنبيهات الموجودة
+    erp.db.session.add(erp.BranchDocumentAlert(
+        document_id=doc_id, branch_id=branch_id, alert_type=erp.ALERT_WARNING,
+        expiry_date=expiry, days_before_expiry=(expiry - TODAY).days, status="نشط",
+    ))
+    erp.db.session.commit()
+    monkeypatch.setattr(erp.BranchDocumentAlert, "query", _StaleAlertQuery())
+
+    assert erp._sync_document_alerts(erp.BranchDocumentAlert, "branch_id", branch_docs, TODAY) == 2
+    erp.db.session.commit()
+    monkeypatch.undo()
+    alerts = _alerts(erp, branch_docs)
+    assert sorted(a.document_id for a in alerts) == sorted(d[0] for d in branch_docs)
@@ -0,0 +1,146 @@
+import os
+import stat
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import bench
+from docx_pdf import BENCH_DOCX, DocxPdfConverter, PdfConversionError, benchmark, find_soffice, uno_available
+
+# soffice وهمي: يشغّل عملية فرعية (مثل soffice.bin) ويعلق حتى تنتهي المهلة
+FAKE_SOFFICE = """#!/bin/sh
+for arg in "$@"; do
+  [ "$arg" = "--terminate_after_init" ] && exit 0
+done
+sleep 60 &
+echo $! > "{pid_file}"
+wait
+"""
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pools = []
+
+    def make(**kwargs):
+        converter = DocxPdfConverter(str(tmp_path / "pool"), workers=1, **kwargs)
+        pools.append(converter)
+        return converter
+
+    yield make
+    for converter in pools:
+        converter.shutdown()
+
+
+def test_pool_converts_with_pymupdf(pool, tmp_path):
+    converter = pool(soffice=None)
+    for name in ("a.pdf", "b.pdf"):
+        out = converter.convert(BENCH_DOCX, str(tmp_path / name))
+        with open(out, "rb") as f:
+            assert f.read(5) == b"%PDF-"
+    assert converter.engine == "pymupdf"
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg"), reason="process groups are POSIX only")
+def test_soffice_timeout_kills_whole_process_group(pool, tmp_path):
+    pid_file = tmp_path / "child.pid"
+    fake = tmp_path / "soffice"
+    fake.write_text(FAKE_SOFFICE.format(pid_file=pid_file))
+    fake.chmod(fake.stat().st_mode | stat.S_IEXEC)
+    converter = pool(soffice=str(fake), timeout=1)
+    if uno_available():
+        pytest.skip("uno is importable: the worker would use a listener, not per-document soffice")
+
+    with pytest.raises(PdfConversionError, match="timed out"):
+        converter.convert(BENCH_DOCX, str(tmp_path / "out.pdf"))
+    assert converter.engine == "soffice"
+    child = int(pid_file.read_text())
+    deadline = time.monotonic() + 5
+    while _alive(child) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not _alive(child)
+
+
+@pytest.mark.skipif(not (find_soffice() and uno_available()), reason="LibreOffice with python3-uno is not installed")
+def test_uno_listener_serves_many_documents(pool, tmp_path):
+    converter = pool(soffice=find_soffice())
+    converter.convert(BENCH_DOCX, str(tmp_path / "a.pdf"))
+    office = converter._slots[0].office_pgid
+    converter.convert(BENCH_DOCX, str(tmp_path / "b.pdf"))
+    assert converter.engine == "uno"
+    assert office and converter._slots[0].office_pgid == office
+
+
+
+class SlowStartConverter:
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.instances.append(self)
+
+    def start(self):
+        time.sleep(0.05)
+
+
+def test_concurrent_first_use_creates_one_converter(erp, monkeypatch):
+    SlowStartConverter.instances = []
+    monkeypatch.setattr(erp, "DocxPdfConverter", SlowStartConverter)
+    monkeypatch.setattr(erp, "_pdf_converter", None)
+    threads = 8
+    start = threading.Barrier(threads)
+    seen = []
+
+    def worker():
+        start.wait()
+        seen.append(erp.get_pdf_converter())
+
+    pool_threads = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool_threads:
+        t.start()
+    for t in pool_threads:
+        t.join(10)
+    assert len(SlowStartConverter.instances) == 1
+    assert seen == SlowStartConverter.instances * threads
+
+
+def test_concurrent_first_use_creates_one_render_cache(erp, monkeypatch):
+    caches = []
+
+    def slow_cache(*args, **kwargs):
+        time.sleep(0.05)
+        caches.append(object())
+        return caches[-1]
+
+    monkeypatch.setattr(erp, "RenderCache", slow_cache)
+    monkeypatch.setattr(erp, "_render_cache", None)
+    threads = 8
+    start = threading.Barrier(threads)
+    seen = []
+
+    def worker():
+        start.wait()
+        seen.append(erp.get_render_cache())
+
+    pool_threads = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool_threads:
+        t.start()
+    for t in pool_threads:
+        t.join(10)
+    assert len(caches) == 1
+    assert seen == caches * threads
+
+@bench
+def test_bench_pdf_pool():
+    result = benchmark(10, workers=2, soffice=find_soffice(), python=sys.executable)
+    print(f"\npdf ({result['engine']}): cold={result['cold_ms']:.1f}ms/doc pool={result['pool_ms']:.1f}ms/doc")
+    assert result["pool_ms"] < result["cold_ms"]
@@ -0,0 +1,146 @@
+import time
+from datetime import date, timedelta
+
+import pytest
+from flask import template_rendered
+from sqlalchemy import insert
+
+from conftest import bench, login
+from consulting.hr.attendance import refresh_attendance_monthly
+from consulting.hr.models import Attendance, AttendanceMonthly, Department, Employee, LeaveRequest, LeaveType
+from extensions import db
+from test_project_detail import count_queries
+
+EMPLOYEE_STATUSES = ["نشط", "نشط", "إجازة", "متوقف"]
+ATTENDANCE_STATUSES = ["حاضر", "غائب", "متأخر"]
+
+
+def seed_hr(tag, departments, employees_per_department, attendance_per_employee):
+    """أقسام وموظفون وحضور هذا الشهر وإجازات معلقة بإدخال مجمّع؛ يعيد الأرقام المتوقعة لكل قسم."""
+    month_start = date.today().replace(day=1)
+    leave_type = LeaveType(name=f"{tag} سنوية")
+    db.session.add(leave_type)
+    db.session.add_all(Department(name=f"{tag} {d:03d}") for d in range(departments))
+    db.session.flush()
+    dept_ids = [d.id for d in Department.query.filter(Department.name.like(f"{tag} %"))]
+    db.session.execute(insert(Employee), [
+        {"first_name": f"م{i}", "last_name": tag, "department_id": dept_id,
+         "status": EMPLOYEE_STATUSES[i % len(EMPLOYEE_STATUSES)]}
+        for dept_id in dept_ids for i in range(employees_per_department)
+    ])
+    employees = db.session.query(Employee.id, Employee.department_id).filter(Employee.last_name == tag).all()
+    expected = {
+        dept_id: {"total_employees": 0, "active_employees": 0, "on_leave_employees": 0,
+                  "present_count": 0, "absent_count": 0, "pending_leaves": 0}
+        for dept_id in dept_ids
+    }
+    attendance, leaves = [], []
+    for n, (employee_id, dept_id) in enumerate(employees):
+        stats = expected[dept_id]
+        status = EMPLOYEE_STATUSES[(n % employees_per_department) % len(EMPLOYEE_STATUSES)]
+        stats["total_employees"] += 1
+        stats["active_employees"] += status == "نشط"
+        stats["on_leave_employees"] += status == "إجازة"
+        for k in range(attendance_per_employee):
+            att_status = ATTENDANCE_STATUSES[(n + k) % len(ATTENDANCE_STATUSES)]
+            attendance.append({"employee_id": employee_id, "attendance_date": month_start + timedelta(days=k % 28),
+                               "status": att_status})
+            stats["present_count"] += att_status == "حاضر"
+            stats["absent_count"] += att_status == "غائب"
+        if n % 3 == 0:
+            leaves.append({"employee_id": employee_id, "leave_type_id": leave_type.id, "status": "معلق",
+                           "start_date": month_start, "end_date": month_start, "total_days": 1})
+            stats["pending_leaves"] += 1
+    # حضور الشهر السابق لا يدخل في الإحصائيات
+    attendance += [{"employee_id": employee_id, "attendance_date": month_start - timedelta(days=1), "status": "حاضر"}
+                   for employee_id, _ in employees]
+    for start in range(0, len(attendance), 10000):
+        db.session.execute(insert(Attendance), attendance[start:start + 10000])
+    db.session.execute(insert(LeaveRequest), leaves)
+    # اللوحة تقرأ الحضور من الملخص الشهري كما يحدّثه استيراد الحضور
+    previous = month_start - timedelta(days=1)
+    refresh_attendance_monthly([(month_start.year, month_start.month), (previous.year, previous.month)])
+    db.session.commit()
+    return expected
+
+
+def drop_hr(tag):
+    employee_ids = db.session.query(Employee.id).filter(Employee.last_name == tag).scalar_subquery()
+    Attendance.query.filter(Attendance.employee_id.in_(employee_ids)).delete(synchronize_session=False)
+    AttendanceMonthly.query.filter(AttendanceMonthly.employee_id.in_(employee_ids)).delete(synchronize_session=False)
+    LeaveRequest.query.filter(LeaveRequest.employee_id.in_(employee_ids)).delete(synchronize_session=False)
+    Employee.query.filter(Employee.last_name == tag).delete(synchronize_session=False)
+    Department.query.filter(Department.name.like(f"{tag} %")).delete(synchronize_session=False)
+    LeaveType.query.filter(LeaveType.name == f"{tag} سنوية").delete(synchronize_session=False)
+    db.session.commit()
+
+
+@pytest.fixture
+def dashboard(erp, client):
+    """يطلب لوحة HR ويعيد (سياق القالب، عدد الاستعلامات، الزمن)."""
+    login(client, "hr")
+
+    def fetch():
+        captured = []
+
+        def on_render(sender, template, context, **extra):
+            captured.append(context)
+
+        template_rendered.connect(on_render, erp.app)
+        try:
+            with erp.app.app_context(), count_queries() as statements:
+                start = time.perf_counter()
+                resp = client.get("/consulting/dashboard")
+                elapsed = time.perf_counter() - start
+        finally:
+            template_rendered.disconnect(on_render, erp.app)
+        assert resp.status_code == 200
+        return captured[0], len(statements), elapsed
+
+    fetch()  # مهام before_request الدورية لا تدخل في المقارنة
+    return fetch
+
+
+@pytest.fixture
+def hr_data(app_ctx):
+    tags = []
+
+    def seed(tag, *args):
+        tags.append(tag)
+        return seed_hr(tag, *args)
+
+    yield seed
+    db.session.rollback()
+    for tag in tags:
+        drop_hr(tag)
+
+
+def _department_stats(context, expected):
+    return {s["department"].id: {k: v for k, v in s.items() if k != "department"}
+            for s in context["department_stats"] if s["department"].id in expected}
+
+
+def test_dashboard_department_stats_use_constant_queries(dashboard, hr_data):
+    small = hr_data("قسم-أ", 2, 4, 3)
+    context, small_queries, _ = dashboard()
+    assert _department_stats(context, small) == small
+
+    large = hr_data("قسم-ب", 12, 4, 3)
+    context, large_queries, _ = dashboard()
+    assert _department_stats(context, large) == large
+    assert _department_stats(context, small) == small
+    assert large_queries == small_queries
+
+
+@bench
+def test_bench_hr_dashboard(dashboard, hr_data):
+    # 50 قسماً و 5000 موظف و 100 ألف سجل حضور: كانت ~5.2 ثانية قبل التجميع بـ GROUP BY
+    expected = hr_data("قياس", 50, 100, 20)
+    timings = []
+    for _ in range(5):
+        context, queries, elapsed = dashboard()
+        timings.append(elapsed)
+    assert _department_stats(context, expected) == expected
+    best = min(timings)
+    print(f"\nhr dashboard: {best * 1000:.0f}ms, {queries} queries")
+    assert best < 1.0
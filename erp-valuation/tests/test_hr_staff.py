@@ -0,0 +1,57 @@
+import pytest
+from flask import template_rendered
+
+from conftest import login
+from consulting.hr.models import Department, Employee, Engineer
+from extensions import db
+
+TAG = "staff-test"
+
+
+@pytest.fixture
+def staff(erp, app_ctx):
+    # قسم اسمه مطابق لعنوان "بدون فرع" كان يُدمج مع الموظفين بلا قسم
+    named = Department(name="بدون فرع")
+    other = Department(name=f"{TAG} هندسة")
+    db.session.add_all([named, other])
+    db.session.flush()
+    db.session.add_all(
+        [Employee(first_name=f"م{i}", last_name=TAG, department_id=named.id) for i in range(3)]
+        + [Employee(first_name=f"ب{i}", last_name=TAG) for i in range(2)]
+        + [Employee(first_name="ه", last_name=TAG, department_id=other.id)]
+        + [Engineer(name=f"{TAG} مهندس", specialty="مدني", department_id=other.id)]
+    )
+    db.session.commit()
+    yield named, other
+
+    db.session.rollback()
+    Employee.query.filter_by(last_name=TAG).delete(synchronize_session=False)
+    Engineer.query.filter(Engineer.name.like(f"{TAG}%")).delete(synchronize_session=False)
+    Department.query.filter(Department.id.in_([named.id, other.id])).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def test_staff_groups_and_totals_are_keyed_by_department_id(erp, client, staff):
+    named, other = staff
+    login(client, "hr")
+    captured = []
+
+    def on_render(sender, template, context, **extra):
+        captured.append(context)
+
+    template_rendered.connect(on_render, erp.app)
+    try:
+        resp = client.get("/consulting/staff", query_string={"q": TAG})
+    finally:
+        template_rendered.disconnect(on_render, erp.app)
+    assert resp.status_code == 200
+    groups = captured[0]["staff_by_department"]
+
+    assert groups[named.id]["name"] == "بدون فرع"
+    assert groups[named.id]["employees_total"] == 3
+    assert len(groups[named.id]["employees"]) == 3
+    assert groups[None]["name"] == "بدون فرع"
+    assert groups[None]["employees_total"] == 2
+    assert len(groups[None]["employees"]) == 2
+    assert groups[other.id]["name"] == other.name
+    assert (groups[other.id]["employees_total"], groups[other.id]["engineers_total"]) == (1, 1)
@@ -0,0 +1,89 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from conftest import login
+from extensions import db
+from image_normalize import ImageNormalization, ImageNormalizer
+from upload_store import UploadBlob, UploadStore, parse_blob_ref
+
+
+def _photo(size=(400, 300)):
+    buf = io.BytesIO()
+    Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _refcount(ref):
+    return UploadBlob.query.filter_by(sha256=parse_blob_ref(ref)[0]).one().refcount
+
+
+def _referenced():
+    return {sha256 for (sha256,) in db.session.query(UploadBlob.sha256).filter(UploadBlob.refcount > 0)}
+
+
+@pytest.fixture
+def normalizer(app_ctx, tmp_path):
+    return ImageNormalizer(UploadStore(str(tmp_path / "uploads")), max_dimension=64, keep_original=True, workers=1)
+
+
+def test_release_frees_kept_original_with_normalized_copy(normalizer):
+    ref = normalizer.save(FileStorage(io.BytesIO(_photo()), filename="receipt.png"))
+    db.session.commit()
+    row = ImageNormalization.query.filter_by(ref=ref).one()
+    original_ref = row.original_ref
+    assert ref.endswith(".webp") and original_ref.endswith("receipt.png")
+    assert _refcount(ref) == 1 and _refcount(original_ref) == 1
+
+    normalizer.release(ref)
+    db.session.commit()
+    assert _refcount(ref) == 0 and _refcount(original_ref) == 0
+    db.session.refresh(row)
+    assert row.original_ref is None
+
+    # إعادة التحرير لا تنقص مراجع أصل رفع آخر
+    normalizer.release(ref)
+    db.session.commit()
+    assert _refcount(original_ref) == 0
+
+
+def test_release_of_non_image_only_releases_its_ref(normalizer):
+    ref = normalizer.save(FileStorage(io.BytesIO(b"%PDF-1.4 receipt"), filename="receipt.pdf"))
+    db.session.commit()
+    normalizer.release(ref)
+    db.session.commit()
+    assert _refcount(ref) == 0
+
+
+def test_unused_bank_receipt_is_released(erp, client, monkeypatch, tmp_path):
+    monkeypatch.setattr(erp.image_normalizer, "store", UploadStore(str(tmp_path / "uploads")))
+    monkeypatch.setattr(erp.image_normalizer, "keep_original", True)
+    monkeypatch.setattr(erp.image_normalizer, "max_dimension", 64)
+    monkeypatch.setattr(erp.image_normalizer, "enabled", True)
+    with erp.app.app_context():
+        bank = erp.Bank(name="Receipt Release Bank")
+        erp.db.session.add(bank)
+        erp.db.session.flush()
+        invoice = erp.BankInvoice(bank_id=bank.id, amount=50)
+        erp.db.session.add(invoice)
+        erp.db.session.commit()
+        invoice_id = invoice.id
+        # دفعة بنك سابقة غير مرتبطة بنفس المبلغ: الإيصال الجديد لا يُربط بدفعة
+        erp.db.session.add(erp.Payment(transaction_id=None, amount=50, method="بنك"))
+        erp.db.session.commit()
+        referenced = _referenced()
+
+    login(client, "finance")
+    resp = client.post(f"/finance/bank_invoices/{invoice_id}/status", data={
+        "action": "receive", "receipt_file": (io.BytesIO(_photo()), "bank.png"),
+    })
+    assert resp.status_code == 302
+    with erp.app.app_context():
+        row = ImageNormalization.query.order_by(ImageNormalization.id.desc()).first()
+        assert row.original_ref is None
+        assert _refcount(row.ref) == 0
+        # لا النسخة المطبّعة ولا الأصل المحتفظ به بقي لهما مرجع
+        assert _referenced() == referenced
@@ -0,0 +1,171 @@
+import csv
+import io
+import time
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from conftest import login, make_project
+from consulting.contracts.models import Contract
+from consulting.invoices import aging
+from consulting.invoices.models import Invoice
+from consulting.projects.models import ConsultingProject
+from extensions import db
+
+
+def _overdue_invoice(amount, days_late):
+    client, project = make_project()
+    today = date.today()
+    invoice = Invoice(
+        project_id=project.id, client_id=client.id, amount=amount,
+        issue_date=today - timedelta(days=days_late + 30), due_date=today - timedelta(days=days_late),
+    )
+    db.session.add(invoice)
+    db.session.commit()
+    return invoice
+
+
+def test_local_invoice_change_invalidates_immediately(app_ctx):
+    before = aging.get_invoice_aging()["totals"]["d31_60"]
+    _overdue_invoice(100, 40)
+    assert aging.get_invoice_aging()["totals"]["d31_60"] == before + 100
+
+
+def test_change_from_another_worker_is_seen_after_ttl(app_ctx, monkeypatch):
+    monkeypatch.setattr(aging, "AGING_TTL_SECONDS", 0.2)
+    invoice = _overdue_invoice(100, 45)
+    first = aging.get_invoice_aging()
+
+    # عامل gunicorn آخر يعدّل الفاتورة: لا يصل إبطال الكاش لهذه العملية
+    db.session.execute(text("UPDATE consulting_invoice SET amount = 250 WHERE id = :id"), {"id": invoice.id})
+    db.session.commit()
+    assert aging.get_invoice_aging() is first
+
+    time.sleep(0.25)
+    second = aging.get_invoice_aging()
+    assert second["totals"]["d31_60"] == first["totals"]["d31_60"] + 150
+
+
+def _invoice(client, project, amount, days_late, contract=None, status="غير مدفوعة"):
+    """فاتورة متأخرة days_late يوماً عن اليوم (None: بدون تاريخ استحقاق، سالب: لم تستحق بعد)."""
+    today = date.today()
+    invoice = Invoice(
+        project_id=project.id, client_id=client.id, amount=amount, status=status,
+        contract_id=contract.id if contract else None, issue_date=today - timedelta(days=120),
+        due_date=None if days_late is None else today - timedelta(days=days_late),
+    )
+    db.session.add(invoice)
+    return invoice
+
+
+def _entry(group, entry_id, report=None):
+    report = report or aging.get_invoice_aging()
+    return next(e for e in aging.aging_by(report, group) if e["id"] == entry_id)
+
+
+@pytest.mark.parametrize("days_late, bucket", [
+    (None, "not_due"),
+    (-5, "not_due"),
+    (0, "not_due"),
+    (1, "d0_30"),
+    (30, "d0_30"),
+    (31, "d31_60"),
+    (60, "d31_60"),
+    (61, "d61_90"),
+    (90, "d61_90"),
+    (91, "d90_plus"),
+])
+def test_bucket_boundaries(app_ctx, days_late, bucket):
+    client, project = make_project(client_name=f"عميل حدود {days_late}")
+    _invoice(client, project, 100, days_late)
+    _invoice(client, project, 7, days_late, status="مدفوعة")
+    db.session.commit()
+
+    entry = _entry("client", client.id)
+    assert {key: entry[key] for key in aging.BUCKET_KEYS} == {
+        key: 100.0 if key == bucket else 0.0 for key in aging.BUCKET_KEYS
+    }
+    assert entry["outstanding"] == 100.0
+    assert entry["overdue"] == (0.0 if bucket == "not_due" else 100.0)
+
+
+@pytest.fixture
+def grouped_client(app_ctx):
+    client, first = make_project(name="مشروع التجميع الأول", client_name="عميل التجميع")
+    second = ConsultingProject(name="مشروع التجميع الثاني", type="تصميم معماري", client_id=client.id)
+    db.session.add(second)
+    db.session.flush()
+    contract = Contract(project_id=first.id, client_id=client.id, contract_number="AGING-TEST-1")
+    db.session.add(contract)
+    db.session.flush()
+    _invoice(client, first, 100, 10, contract=contract)
+    _invoice(client, first, 50, 45, contract=contract)
+    _invoice(client, first, 20, None)
+    _invoice(client, second, 300, 95)
+    _invoice(client, second, 40, -3)
+    db.session.commit()
+    return client, first, second, contract
+
+
+def test_aging_by_groups_lines_by_client_project_and_contract(grouped_client):
+    client, first, second, contract = grouped_client
+    report = aging.get_invoice_aging()
+
+    by_client = _entry("client", client.id, report)
+    assert by_client["name"] == "عميل التجميع"
+    assert (by_client["not_due"], by_client["d0_30"], by_client["d31_60"], by_client["d90_plus"]) == (60, 100, 50, 300)
+    assert (by_client["overdue"], by_client["outstanding"]) == (450, 510)
+
+    projects = [e for e in aging.aging_by(report, "project") if e["id"] in (first.id, second.id)]
+    # الأكثر تأخراً أولاً
+    assert [e["id"] for e in projects] == [second.id, first.id]
+    assert (projects[0]["overdue"], projects[0]["not_due"]) == (300, 40)
+    assert (projects[1]["overdue"], projects[1]["not_due"]) == (150, 20)
+
+    by_contract = _entry("contract", contract.id, report)
+    assert by_contract["name"] == "AGING-TEST-1"
+    assert (by_contract["d0_30"], by_contract["d31_60"], by_contract["not_due"]) == (100, 50, 0)
+    without_contract = _entry("contract", None, report)
+    assert without_contract["name"] == "بدون عقد"
+    assert without_contract["d90_plus"] >= 300
+
+    with pytest.raises(ValueError):
+        aging.aging_by(report, "branch")
+
+
+def test_aging_api(erp, client, grouped_client):
+    _, first, second, _ = grouped_client
+    login(client, "finance")
+    resp = client.get("/consulting/api/invoices/aging", query_string={"group": "project"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/json"
+    body = resp.get_json()
+    assert body["group"] == "project"
+    assert body["as_of"] == date.today().isoformat()
+    assert [b["key"] for b in body["buckets"]] == aging.BUCKET_KEYS
+    items = {item["id"]: item for item in body["items"]}
+    assert (items[first.id]["overdue"], items[second.id]["d90_plus"]) == (150, 300)
+    assert body["totals"]["overdue"] >= 450
+
+    assert client.get("/consulting/api/invoices/aging", query_string={"group": "branch"}).status_code == 400
+    login(client, "employee")
+    assert client.get("/consulting/api/invoices/aging").status_code == 302
+
+
+def test_aging_csv(erp, client, grouped_client):
+    owner = grouped_client[0]
+    login(client, "manager")
+    resp = client.get("/consulting/invoices/aging.csv", query_string={"group": "client"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/csv"
+    assert resp.headers["Content-Disposition"] == (
+        f"attachment; filename=invoice_aging_client_{date.today().isoformat()}.csv"
+    )
+    rows = list(csv.reader(io.StringIO(resp.get_data(as_text=True))))
+    assert rows[0] == ["ID", "Client", "غير مستحقة", "0-30", "31-60", "61-90", "90+", "Overdue", "Outstanding"]
+    assert [str(owner.id), "عميل التجميع", "60.00", "100.00", "50.00", "0.00", "300.00", "450.00", "510.00"] in rows[1:]
+
+    # مجموعة غير معروفة تعود للتجميع حسب العميل
+    fallback = client.get("/consulting/invoices/aging.csv", query_string={"group": "branch"})
+    assert fallback.headers["Content-Disposition"].startswith("attachment; filename=invoice_aging_client_")
@@ -0,0 +1,99 @@
+import os
+import re
+import subprocess
+import sys
+import threading
+
+from conftest import ROOT
+
+THREADS = 6
+PROCESSES = 4
+PER_WORKER = 20
+# كل رابع حجز دفعة من 3 أرقام
+NUMBERS_PER_WORKER = PER_WORKER - PER_WORKER // 4 + 3 * (PER_WORKER // 4)
+
+# كل عامل يخلط أرقاماً مفردة ودفعات داخل معاملة واحدة (مثل الإصدار الجماعي)
+CHILD = r"""
+import os, sys, time
+import app as erp
+
+go = sys.argv[1]
+with erp.app.app_context():
+    erp.db.session.execute(erp.db.text("SELECT 1"))
+    print("ready", flush=True)
+    while not os.path.exists(go):
+        time.sleep(0.01)
+    numbers = []
+    for i in range(int(sys.argv[2])):
+        if i % 4 == 3:
+            numbers += erp.allocate_invoice_numbers(3, kind="MP")
+            erp.db.session.commit()
+        else:
+            numbers.append(erp.generate_unique_invoice_number(kind="MP"))
+print("\n".join(numbers), flush=True)
+"""
+
+
+def _serials(numbers):
+    return [int(re.search(r"-(\d{5})$", n).group(1)) for n in numbers]
+
+
+def _assert_unique_and_gap_free(numbers, expected):
+    assert len(numbers) == expected
+    assert len(set(numbers)) == expected
+    serials = sorted(_serials(numbers))
+    assert serials == list(range(serials[0], serials[0] + expected))
+
+
+def test_threads_get_unique_gap_free_numbers(erp):
+    start = threading.Barrier(THREADS)
+    results, errors = [], []
+
+    def worker():
+        try:
+            with erp.app.app_context():
+                start.wait()
+                for i in range(PER_WORKER):
+                    if i % 4 == 3:
+                        block = erp.allocate_invoice_numbers(3, kind="MT")
+                        erp.db.session.commit()
+                        results.extend(block)
+                    else:
+                        results.append(erp.generate_unique_invoice_number(kind="MT"))
+        except Exception as e:  # noqa: BLE001 - يُفحص في الخيط الرئيسي
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+    assert errors == []
+    _assert_unique_and_gap_free(results, THREADS * NUMBERS_PER_WORKER)
+
+
+def test_processes_share_one_sequence(erp, tmp_path):
+    with erp.app.app_context():
+        erp.db.create_all()  # ملف SQLite المشترك موجود قبل بدء العمليات
+    go = tmp_path / "go"
+    children = [
+        subprocess.Popen(
+            [sys.executable, "-c", CHILD, str(go), str(PER_WORKER)],
+            cwd=ROOT, env=dict(os.environ), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        )
+        for _ in range(PROCESSES)
+    ]
+    try:
+        for child in children:
+            assert child.stdout.readline().strip() == "ready", child.stderr.read()
+        go.write_text("go")
+        numbers = []
+        for child in children:
+            out, err = child.communicate(timeout=120)
+            assert child.returncode == 0, err
+            numbers += [line for line in out.splitlines() if line]
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.kill()
+    _assert_unique_and_gap_free(numbers, PROCESSES * NUMBERS_PER_WORKER)
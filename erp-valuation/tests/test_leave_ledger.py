@@ -0,0 +1,95 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from consulting.hr.leave_ledger import (
+    ALLOCATION,
+    CARRY_FORWARD,
+    OPENING_NOTE,
+    USAGE,
+    backfill_leave_ledger,
+    post_entry,
+    recompute_balances,
+)
+from consulting.hr.models import Employee, LeaveBalance, LeaveLedgerEntry, LeaveRequest, LeaveType
+from extensions import db
+
+YEAR = 2003
+TAG = "ledger-test"
+
+
+@pytest.fixture
+def people(app_ctx):
+    leave_type = LeaveType(name=f"{TAG} سنوية")
+    db.session.add(leave_type)
+    employees = [Employee(first_name=f"م{i}", last_name=TAG) for i in range(2)]
+    db.session.add_all(employees)
+    db.session.flush()
+    yield leave_type, employees
+
+    db.session.rollback()
+    employee_ids = [e.id for e in employees]
+    for model in (LeaveLedgerEntry, LeaveBalance, LeaveRequest):
+        model.query.filter(model.employee_id.in_(employee_ids)).delete(synchronize_session=False)
+    Employee.query.filter(Employee.id.in_(employee_ids)).delete(synchronize_session=False)
+    LeaveType.query.filter_by(id=leave_type.id).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def _balance(employee, leave_type, **values):
+    row = LeaveBalance(employee_id=employee.id, leave_type_id=leave_type.id, year=YEAR, **values)
+    db.session.add(row)
+    db.session.flush()
+    return row
+
+
+def _columns(row):
+    db.session.refresh(row)
+    return tuple(Decimal(v) for v in (row.initial_balance, row.carry_forward, row.used_balance, row.remaining_balance))
+
+
+def test_recompute_seeds_opening_entries_for_balances_without_ledger(people, capsys):
+    leave_type, (legacy, tracked) = people
+    old = _balance(legacy, leave_type, initial_balance=30, carry_forward=5, used_balance=7, remaining_balance=28)
+    post_entry(tracked.id, leave_type.id, YEAR, ALLOCATION, Decimal("21"))
+    post_entry(tracked.id, leave_type.id, YEAR, USAGE, Decimal("-4"))
+    new = LeaveBalance.query.filter_by(employee_id=tracked.id, year=YEAR).one()
+
+    recompute_balances(YEAR)
+    assert _columns(old) == (Decimal("30"), Decimal("5"), Decimal("7"), Decimal("28"))
+    assert _columns(new) == (Decimal("21"), Decimal("0"), Decimal("4"), Decimal("17"))
+    assert "seeded opening entries for 1 balances" in capsys.readouterr().out
+    opening = LeaveLedgerEntry.query.filter_by(employee_id=legacy.id, year=YEAR).order_by(LeaveLedgerEntry.id).all()
+    assert [(e.entry_type, Decimal(e.days), e.notes) for e in opening] == [
+        (ALLOCATION, Decimal("30"), OPENING_NOTE),
+        (CARRY_FORWARD, Decimal("5"), OPENING_NOTE),
+        (USAGE, Decimal("-7"), OPENING_NOTE),
+    ]
+
+    # إعادة التشغيل لا تضيف حركات، والحركات اللاحقة تُطبّق فوق الرصيد الافتتاحي
+    recompute_balances(YEAR)
+    assert capsys.readouterr().out == ""
+    assert LeaveLedgerEntry.query.filter_by(employee_id=legacy.id, year=YEAR).count() == 3
+    post_entry(legacy.id, leave_type.id, YEAR, USAGE, Decimal("-2"))
+    recompute_balances(YEAR)
+    assert _columns(old) == (Decimal("30"), Decimal("5"), Decimal("9"), Decimal("26"))
+
+
+def test_backfill_keeps_used_days_without_approved_requests(people):
+    leave_type, (employee, _) = people
+    if db.session.query(LeaveLedgerEntry.id).first() is not None:
+        pytest.skip("backfill only runs on an empty ledger")
+    row = _balance(employee, leave_type, initial_balance=30, carry_forward=0, used_balance=10, remaining_balance=20)
+    request = LeaveRequest(employee_id=employee.id, leave_type_id=leave_type.id, status="معتمد",
+                           start_date=date(YEAR, 3, 1), end_date=date(YEAR, 3, 3), total_days=3)
+    db.session.add(request)
+    db.session.commit()
+
+    backfill_leave_ledger()
+    assert _columns(row) == (Decimal("30"), Decimal("0"), Decimal("10"), Decimal("20"))
+    usage = {
+        (e.leave_request_id, Decimal(e.days))
+        for e in LeaveLedgerEntry.query.filter_by(employee_id=employee.id, entry_type=USAGE)
+    }
+    assert usage == {(request.id, Decimal("-3")), (None, Decimal("-7"))}
@@ -0,0 +1,66 @@
+import io
+import json
+import os
+
+import pytest
+
+from conftest import login
+from ocr import OcrPipeline, extract_fields, tesseract_available
+from upload_store import UploadBlob, parse_blob_ref
+
+SCANS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "scans")
+
+with open(os.path.join(SCANS, "expected.json"), encoding="utf-8") as _f:
+    EXPECTED = json.load(_f)
+
+
+def test_text_layer_pdf_is_read_without_ocr():
+    pipeline = OcrPipeline(None, workers=1, enabled=True)
+    text, pages = pipeline.extract(os.path.join(SCANS, "deed_text.pdf"))
+    assert pages == 1
+    assert extract_fields(text) == EXPECTED["deed_text.pdf"]
+
+
+@pytest.mark.skipif(not tesseract_available(), reason="tesseract is not installed")
+@pytest.mark.parametrize("name", sorted(n for n in EXPECTED if n != "deed_text.pdf"))
+def test_scanned_fixture_fields(name):
+    pipeline = OcrPipeline(None, workers=1, lang="eng", enabled=True)
+    text, pages = pipeline.extract(os.path.join(SCANS, name))
+    assert pages == 1
+    assert extract_fields(text) == EXPECTED[name]
+
+
+@pytest.fixture
+def ocr_enabled(erp, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(erp.ocr_pipeline, "enabled", True)
+    monkeypatch.setattr(erp.ocr_pipeline, "schedule", lambda sha256, path=None: scheduled.append(sha256) or True)
+    return scheduled
+
+
+def test_prefill_scan_takes_no_reference(erp, client, ocr_enabled):
+    login(client, "employee")
+    with open(os.path.join(SCANS, "deed_scan.png"), "rb") as f:
+        data = f.read()
+    resp = client.post("/api/ocr/extract", data={"file": (io.BytesIO(data), "deed.png")})
+    assert resp.status_code == 202
+    sha256 = resp.get_json()["sha256"]
+    assert ocr_enabled == [sha256]
+    with erp.app.app_context():
+        blob = UploadBlob.query.filter_by(sha256=sha256).one()
+        assert blob.refcount == 0
+
+        # إرفاق نفس الملف بالمعاملة لاحقاً يأخذ المرجع الفعلي
+        ref = erp.upload_store.save_stream(io.BytesIO(data), "deed.png")
+        erp.db.session.commit()
+        assert parse_blob_ref(ref)[0] == sha256
+        erp.db.session.refresh(blob)
+        assert blob.refcount == 1
+
+
+@pytest.mark.parametrize("limit", ["abc", "-5", "1000", ""])
+def test_search_limit_is_parsed_safely(client, limit):
+    login(client, "manager")
+    resp = client.get("/api/ocr/search", query_string={"q": "Seeb", "limit": limit})
+    assert resp.status_code == 200
+    assert resp.get_json()["results"] == []
@@ -0,0 +1,166 @@
+import time
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import insert
+
+from conftest import bench
+from consulting.hr.models import (
+    AttendanceMonthly,
+    Employee,
+    LeaveRequest,
+    LeaveType,
+    Payroll,
+    PayrollDetail,
+    SalaryComponent,
+)
+from consulting.hr.payroll import compute_payroll, run_payroll, working_days_between
+from extensions import db
+
+YEAR, MONTH = 2001, 2  # فبراير 2001: 20 يوم عمل (الجمعة والسبت عطلة)
+TAG = "payroll-test"
+
+
+@pytest.fixture
+def payroll_data(app_ctx):
+    components = [
+        SalaryComponent(name="housing", name_ar="بدل سكن", type="allowance", is_percentage=True, default_value=25),
+        SalaryComponent(name="transport", type="allowance", default_value=Decimal("50.00")),
+        SalaryComponent(name="eid", type="bonus", default_value=0),
+        SalaryComponent(name="pension", type="deduction", is_percentage=True, default_value=Decimal("6.5")),
+        SalaryComponent(name="old", type="allowance", default_value=99, is_active=False),
+    ]
+    paid = LeaveType(name=f"{TAG} سنوية", is_paid=True)
+    unpaid = LeaveType(name=f"{TAG} بدون راتب", is_paid=False)
+    db.session.add_all(components + [paid, unpaid])
+    db.session.flush()
+
+    def employee(base, status="نشط"):
+        emp = Employee(first_name="م", last_name=TAG, base_salary=base, status=status)
+        db.session.add(emp)
+        db.session.flush()
+        return emp
+
+    yield {"employee": employee, "paid": paid, "unpaid": unpaid}
+
+    db.session.rollback()
+    employee_ids = db.session.query(Employee.id).filter(Employee.last_name == TAG).scalar_subquery()
+    payroll_ids = db.session.query(Payroll.id).filter(Payroll.employee_id.in_(employee_ids)).scalar_subquery()
+    PayrollDetail.query.filter(PayrollDetail.payroll_id.in_(payroll_ids)).delete(synchronize_session=False)
+    for model in (Payroll, AttendanceMonthly, LeaveRequest):
+        model.query.filter(model.employee_id.in_(employee_ids)).delete(synchronize_session=False)
+    Employee.query.filter(Employee.last_name == TAG).delete(synchronize_session=False)
+    SalaryComponent.query.delete()
+    LeaveType.query.filter(LeaveType.name.like(f"{TAG} %")).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def _lines(employees):
+    ids = {e.id for e in employees}
+    return {line.employee_id: line for line in compute_payroll(YEAR, MONTH) if line.employee_id in ids}
+
+
+def test_compute_payroll_components_attendance_and_leave(payroll_data):
+    emp = payroll_data["employee"](Decimal("1000.00"))
+    other = payroll_data["employee"](Decimal("333.33"))
+    stopped = payroll_data["employee"](Decimal("900.00"), status="متوقف")
+    no_salary = payroll_data["employee"](None)
+    db.session.add(AttendanceMonthly(employee_id=emp.id, year=YEAR, month=MONTH,
+                                     present_days=15, late_days=1, absent_days=2))
+    db.session.add_all([
+        # الأحد 4 فبراير إلى الثلاثاء 6: 3 أيام عمل بدون راتب
+        LeaveRequest(employee_id=emp.id, leave_type_id=payroll_data["unpaid"].id, status="معتمد",
+                     start_date=date(2001, 2, 4), end_date=date(2001, 2, 6), total_days=3),
+        # تبدأ في يناير: يُحتسب منها 1 فبراير (الخميس) فقط
+        LeaveRequest(employee_id=emp.id, leave_type_id=payroll_data["paid"].id, status="معتمد",
+                     start_date=date(2001, 1, 30), end_date=date(2001, 2, 1), total_days=3),
+        LeaveRequest(employee_id=emp.id, leave_type_id=payroll_data["unpaid"].id, status="معلق",
+                     start_date=date(2001, 2, 11), end_date=date(2001, 2, 11), total_days=1),
+    ])
+    db.session.flush()
+
+    lines = _lines([emp, other, stopped, no_salary])
+    assert set(lines) == {emp.id, other.id}
+    assert working_days_between(date(2001, 2, 1), date(2001, 3, 1)) == 20
+
+    line = lines[emp.id]
+    assert line.working_days == 20
+    assert (line.present_days, line.absent_days, line.leave_days) == (16, 2, 4)
+    assert line.allowances_total == Decimal("300.00")
+    assert line.bonuses_total == Decimal("0.00")
+    # 6.5% تقاعد + غياب يومين + 3 أيام بدون راتب بسعر يومي 50.00
+    assert line.other_deductions == Decimal("65.00") + Decimal("100.00") + Decimal("150.00")
+    assert line.gross_salary == Decimal("1300.00")
+    assert line.net_salary == Decimal("985.00")
+    assert [(d["component_name"], d["amount"], d["type"]) for d in line.details] == [
+        ("بدل سكن", Decimal("250.00"), "allowance"),
+        ("transport", Decimal("50.00"), "allowance"),
+        ("pension", Decimal("65.00"), "deduction"),
+        ("خصم غياب", Decimal("100.00"), "deduction"),
+        ("خصم إجازة بدون راتب", Decimal("150.00"), "deduction"),
+    ]
+
+    # تقريب كل مكوّن لخانتين (ROUND_HALF_UP) قبل الجمع
+    line = lines[other.id]
+    assert line.allowances_total == Decimal("83.33") + Decimal("50.00")
+    assert line.other_deductions == Decimal("21.67")
+    assert line.net_salary == Decimal("333.33") + Decimal("133.33") - Decimal("21.67")
+    assert (line.present_days, line.absent_days, line.leave_days) == (0, 0, 0)
+
+
+def test_run_payroll_replaces_drafts_and_keeps_locked(payroll_data):
+    first = payroll_data["employee"](Decimal("1000.00"))
+    second = payroll_data["employee"](Decimal("2000.00"))
+    db.session.commit()
+
+    result = run_payroll(YEAR, MONTH)
+    assert result.changes[first.id] == result.changes[second.id] == "جديد"
+    assert run_payroll(YEAR, MONTH, dry_run=True).changes[first.id] == "بدون تغيير"
+
+    Payroll.query.filter_by(employee_id=second.id, payroll_year=YEAR, payroll_month=MONTH).update({"status": "معتمد"})
+    Employee.query.filter(Employee.id.in_([first.id, second.id])).update({"base_salary": Decimal("1200.00")})
+    db.session.commit()
+
+    preview = run_payroll(YEAR, MONTH, dry_run=True)
+    assert preview.changes[first.id] == "متغير" and preview.changes[second.id] == "مقفل"
+    assert preview.previous_net[first.id] == Decimal("1235.00")
+    assert Payroll.query.filter_by(employee_id=first.id).one().net_salary == Decimal("1235.00")
+
+    run_payroll(YEAR, MONTH)
+    rows = {p.employee_id: p for p in Payroll.query.filter(Payroll.employee_id.in_([first.id, second.id]))}
+    assert rows[first.id].net_salary == Decimal("1472.00") and rows[first.id].status == "مسودة"
+    assert rows[second.id].net_salary == Decimal("2420.00") and rows[second.id].status == "معتمد"
+    assert PayrollDetail.query.filter_by(payroll_id=rows[first.id].id).count() == 3
+
+
+@bench
+def test_bench_payroll_10k_employees(payroll_data):
+    bases = [Decimal(800 + 25 * (i % 40)) for i in range(10000)]
+    db.session.execute(insert(Employee), [
+        {"first_name": f"م{i}", "last_name": TAG, "base_salary": base, "status": "نشط"}
+        for i, base in enumerate(bases)
+    ])
+    ids = [i for (i,) in db.session.query(Employee.id).filter(Employee.last_name == TAG).order_by(Employee.id)]
+    db.session.execute(insert(AttendanceMonthly), [
+        {"employee_id": emp_id, "year": YEAR, "month": MONTH, "present_days": 18, "late_days": 0,
+         "absent_days": n % 3, "leave_days": 0, "hours_worked": 0}
+        for n, emp_id in enumerate(ids)
+    ])
+    db.session.execute(insert(LeaveRequest), [
+        {"employee_id": emp_id, "leave_type_id": payroll_data["unpaid"].id, "status": "معتمد",
+         "start_date": date(2001, 2, 4), "end_date": date(2001, 2, 5), "total_days": 2}
+        for emp_id in ids[::10]
+    ])
+    db.session.commit()
+
+    start = time.perf_counter()
+    lines = compute_payroll(YEAR, MONTH)
+    computed = time.perf_counter() - start
+    start = time.perf_counter()
+    result = run_payroll(YEAR, MONTH)
+    written = time.perf_counter() - start
+    details = PayrollDetail.query.count()
+    print(f"\npayroll 10k: compute={computed * 1000:.0f}ms run={written * 1000:.0f}ms details={details}")
+    assert len(lines) == result.written == 10000
+    assert computed < 1.0 and written < 5.0
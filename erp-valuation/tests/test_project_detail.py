@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from conftest import login, make_project
+from consulting.contracts.models import Contract
+from consulting.hr.models import Engineer, Task
+from consulting.invoices.models import Invoice
+from consulting.projects.detail import load_project_detail
+from consulting.projects.models import ProjectEngineerAssignment, ProjectFile
+from extensions import db
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "after_cursor_execute", on_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "after_cursor_execute", on_execute)
+
+
+def _project_with_children(n):
+    client, project = make_project(name=f"مشروع {n}")
+    today = date.today()
+    for i in range(n):
+        engineer = Engineer(name=f"مهندس {n}-{i}", specialty="مدني")
+        db.session.add(engineer)
+        db.session.flush()
+        db.session.add_all([
+            Contract(project_id=project.id, client_id=client.id, contract_number=f"C-{n}-{i}"),
+            ProjectFile(project_id=project.id, stored_filename=f"f{i}.pdf", original_filename=f"f{i}.pdf"),
+            ProjectEngineerAssignment(project_id=project.id, engineer_id=engineer.id, is_lead=(i == 0)),
+            Invoice(project_id=project.id, client_id=client.id, amount=100 + i,
+                    issue_date=today, due_date=today - timedelta(days=i)),
+            Task(project_id=project.id, engineer_id=engineer.id, title=f"مهمة {i}",
+                 deadline=today - timedelta(days=i)),
+        ])
+    db.session.commit()
+    return project.id
+
+
+@pytest.fixture
+def projects(app_ctx):
+    return _project_with_children(1), _project_with_children(15)
+
+
+def test_load_project_detail_query_count_is_constant(projects):
+    small, large = projects
+    counts = []
+    for project_id in (small, large):
+        db.session.expunge_all()
+        with count_queries() as statements:
+            detail = load_project_detail(project_id)
+            # ما يقرؤه القالب: لا تحميل كسول بعد الاستعلامات الأولى
+            for assignment in detail["assignments"]:
+                assert assignment.engineer.name
+            assert detail["project"].client.name
+        counts.append(len(statements))
+    assert counts[0] == counts[1] == 4
+    detail = load_project_detail(large)
+    assert len(detail["contracts"]) == len(detail["files"]) == len(detail["assignments"]) == 15
+    assert detail["invoice_summary"]["count"] == 15
+    assert detail["task_summary"]["total"] == 15
+
+
+def test_project_detail_page_query_count_is_constant(erp, client, projects):
+    small, large = projects
+    login(client, "manager")
+    # طلب أول يمرّر مهام before_request الدورية حتى لا تُحسب في المقارنة
+    assert client.get(f"/consulting/projects/{small}").status_code == 200
+    counts = []
+    for project_id in (small, large):
+        with erp.app.app_context(), count_queries() as statements:
+            assert client.get(f"/consulting/projects/{project_id}").status_code == 200
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
@@ -0,0 +1,186 @@
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import login
+from extensions import db
+from storage import FakeBackend, LocalBackend, ReplicatingStorage
+from upload_store import UploadBlob, UploadStore, parse_blob_ref
+
+
+class RecordingBackend(FakeBackend):
+    """FakeBackend يسجل وقت كل محاولة رفع."""
+
+    def __init__(self):
+        super().__init__()
+        self.attempts = []
+
+    def put_file(self, key, path):
+        self.attempts.append(time.monotonic())
+        return super().put_file(key, path)
+
+
+def _write(root, key, data):
+    path = os.path.join(root, *key.split("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture
+def replicating(tmp_path):
+    remote = RecordingBackend()
+    storage = ReplicatingStorage(
+        LocalBackend(str(tmp_path)), remote, max_attempts=4, base_delay=0.05, max_delay=0.2
+    )
+    return storage, remote
+
+
+def test_retries_with_exponential_backoff_until_upload_succeeds(replicating, tmp_path):
+    storage, remote = replicating
+    _write(str(tmp_path), "docs/a.pdf", b"payload")
+    remote.fail_next = 3
+    calls = []
+
+    assert storage.replicate("docs/a.pdf", callback=lambda key, file_id: calls.append((key, file_id)))
+    assert storage.wait_idle(5)
+
+    assert remote.objects["docs/a.pdf"] == b"payload"
+    assert calls == [("docs/a.pdf", "fake_1")]
+    assert len(remote.attempts) == 4
+    gaps = [b - a for a, b in zip(remote.attempts, remote.attempts[1:])]
+    # 0.05 ثم 0.1 ثم 0.2 ثانية
+    for gap, expected in zip(gaps, (0.05, 0.1, 0.2)):
+        assert gap >= expected * 0.9
+    assert storage.failed == {}
+
+
+def test_keeps_retrying_after_max_attempts(replicating, tmp_path):
+    storage, remote = replicating
+    _write(str(tmp_path), "docs/b.pdf", b"late")
+    remote.fail_next = 7
+
+    storage.replicate("docs/b.pdf")
+    # الأدوات لا تنتظر مفتاحاً تجاوز محاولات التأخير الأسّي، لكنه لا يُسقط
+    assert storage.wait_idle(5)
+    assert storage.failed == {"docs/b.pdf": "docs/b.pdf"}
+    assert storage.pending() == 1
+
+    assert _wait_for(lambda: "docs/b.pdf" in remote.objects)
+    assert _wait_for(lambda: not storage.failed)
+    assert len(remote.attempts) == 8
+
+
+def test_same_key_is_queued_once(replicating, tmp_path):
+    storage, remote = replicating
+    _write(str(tmp_path), "docs/c.pdf", b"once")
+    remote.fail_next = 1
+    storage.replicate("docs/c.pdf")
+    storage.replicate("docs/c.pdf")
+    assert storage.wait_idle(5)
+    assert remote.uploads == 1
+
+
+def test_open_prefers_local_copy(replicating, tmp_path):
+    storage, remote = replicating
+    _write(str(tmp_path), "docs/d.pdf", b"local bytes")
+    remote.objects["docs/d.pdf"] = b"remote bytes"
+    assert b"".join(storage.open("docs/d.pdf")) == b"local bytes"
+
+
+def test_open_falls_back_to_remote(replicating):
+    storage, remote = replicating
+    remote.objects["docs/e.pdf"] = b"remote only"
+    assert not storage.has_local("docs/e.pdf")
+    assert b"".join(storage.open("docs/e.pdf")) == b"remote only"
+    assert storage.open("docs/missing.pdf") is None
+
+
+# ----- upload_store + commit -----
+@pytest.fixture
+def replicated_store(app_ctx, tmp_path):
+    root = str(tmp_path / "uploads")
+    remote = FakeBackend()
+    storage = ReplicatingStorage(LocalBackend(root), remote, base_delay=0.01, app=app_ctx)
+    return UploadStore(root, storage=storage), storage, remote
+
+
+def test_replication_waits_for_commit(replicated_store):
+    store, storage, remote = replicated_store
+    ref = store.save_stream(io.BytesIO(b"commit me"), "a.pdf")
+    sha256 = parse_blob_ref(ref)[0]
+    assert storage.pending() == 0 and not remote.objects
+
+    db.session.commit()
+    assert storage.wait_idle(5)
+    key = store.blob_relpath(sha256)
+    assert remote.objects[key] == b"commit me"
+    db.session.expire_all()
+    assert UploadBlob.query.filter_by(sha256=sha256).one().replicated_at is not None
+
+
+def test_rolled_back_upload_is_not_replicated(replicated_store):
+    store, storage, remote = replicated_store
+    store.save_stream(io.BytesIO(b"never committed"), "b.pdf")
+    db.session.rollback()
+    db.session.commit()
+    assert storage.wait_idle(5)
+    assert not remote.objects
+
+
+def test_unreplicated_rows_are_requeued_by_sweeper(app_ctx, tmp_path):
+    root = str(tmp_path / "uploads")
+    # محتوى حُفظ بدون خادم بعيد (أو سقط من طابور عملية أعيد تشغيلها)
+    ref = UploadStore(root).save_stream(io.BytesIO(b"left behind"), "c.pdf")
+    db.session.commit()
+    sha256 = parse_blob_ref(ref)[0]
+
+    remote = FakeBackend()
+    storage = ReplicatingStorage(LocalBackend(root), remote, base_delay=0.01, app=app_ctx)
+    store = UploadStore(root, storage=storage)
+    assert store.requeue_unreplicated() == 0  # أحدث من REQUEUE_MIN_AGE
+
+    UploadBlob.query.filter_by(sha256=sha256).update({"created_at": datetime.utcnow() - timedelta(hours=1)})
+    db.session.commit()
+    storage.start()  # أول تشغيل لخيط النسخ ينفذ sweepers
+    assert _wait_for(lambda: store.blob_relpath(sha256) in remote.objects)
+    assert storage.wait_idle(5)
+    db.session.expire_all()
+    assert UploadBlob.query.filter_by(sha256=sha256).one().replicated_at is not None
+
+
+# ----- /api/upload -----
+def test_api_upload_puts_file_on_remote_without_local_blob(erp, client, monkeypatch):
+    remote = FakeBackend()
+    monkeypatch.setattr(erp.storage, "remote", remote)
+    login(client, "employee")
+    with erp.app.app_context():
+        blobs_before = UploadBlob.query.count()
+
+    resp = client.post("/api/upload", data={"file": (io.BytesIO(b"%PDF-1.4 direct"), "scan.pdf")})
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body["file_id"] == "fake_1"
+    assert body["file_name"].endswith("_scan.pdf")
+    assert remote.objects[body["file_name"]] == b"%PDF-1.4 direct"
+    with erp.app.app_context():
+        assert UploadBlob.query.count() == blobs_before
+
+
+def test_api_upload_without_remote(erp, client):
+    login(client, "employee")
+    resp = client.post("/api/upload", data={"file": (io.BytesIO(b"x"), "scan.pdf")})
+    assert resp.status_code == 503
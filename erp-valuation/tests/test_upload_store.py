@@ -0,0 +1,118 @@
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from upload_store import UploadBlob, UploadStore, parse_blob_ref
+
+SHA = "ab" + "cd" + "0" * 60
+
+
+@pytest.fixture
+def store(app_ctx, tmp_path):
+    return UploadStore(str(tmp_path / "uploads"))
+
+
+def _age(path, seconds=3600 * 2):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_parse_blob_ref_accepts_hex_sha():
+    assert parse_blob_ref(f"blobs/ab/cd/{SHA}/scan.pdf") == (SHA, "scan.pdf")
+
+
+@pytest.mark.parametrize("segment", [
+    "...." + "a" * 60,
+    "A" * 64,
+    "g" * 64,
+    "ab" + "cd" + "0" * 59,
+])
+def test_parse_blob_ref_rejects_non_hex_segment(segment):
+    sha256, name = parse_blob_ref(f"blobs/ab/cd/{segment}/scan.pdf")
+    assert sha256 is None
+    assert name == "scan.pdf"
+
+
+def test_parse_blob_ref_rejects_mismatched_shard():
+    assert parse_blob_ref(f"blobs/00/00/{SHA}/scan.pdf")[0] is None
+
+
+def test_resolve_rejects_traversal_disguised_as_blob_ref(store):
+    # قبل التحقق من الأحرف كان blob_path يبني uploads/blobs/../../<المقطع>
+    assert store.resolve("blobs/../../" + "...." + "a" * 60 + "/scan.pdf") is None
+
+
+def test_collect_removes_blob_file_left_by_rollback(store):
+    ref = store.save_stream(io.BytesIO(b"rolled back upload"), "a.pdf")
+    sha256 = parse_blob_ref(ref)[0]
+    path = store.blob_path(sha256)
+    db.session.rollback()
+    assert os.path.isfile(path)
+    assert UploadBlob.query.filter_by(sha256=sha256).first() is None
+
+    # ضمن المهلة: قد يكون طلباً لم يصل إلى commit بعد
+    assert sha256 not in store.collect()
+    assert os.path.isfile(path)
+
+    _age(path)
+    assert sha256 in store.collect()
+    assert not os.path.exists(path)
+
+
+def test_collect_keeps_committed_blob(store):
+    ref = store.save_stream(io.BytesIO(b"committed upload"), "b.pdf")
+    db.session.commit()
+    sha256 = parse_blob_ref(ref)[0]
+    _age(store.blob_path(sha256))
+    assert sha256 not in store.collect()
+    assert os.path.isfile(store.blob_path(sha256))
+
+
+def test_resave_refreshes_mtime_of_existing_orphan(store):
+    data = b"same content twice"
+    sha256 = parse_blob_ref(store.save_stream(io.BytesIO(data), "c.pdf"))[0]
+    db.session.rollback()
+    _age(store.blob_path(sha256))
+    # رفع جديد لنفس المحتوى (لم يصل إلى commit بعد) لا يُحذف ملفه
+    store.save_stream(io.BytesIO(data), "c.pdf")
+    assert sha256 not in store.collect(grace=timedelta(minutes=5))
+    db.session.commit()
+    assert UploadBlob.query.filter_by(sha256=sha256).one().refcount == 1
+
+
+def test_collect_keeps_file_refreshed_by_uncommitted_save(store):
+    data = b"released then uploaded again"
+    sha256 = parse_blob_ref(store.save_stream(io.BytesIO(data), "d.pdf"))[0]
+    db.session.commit()
+    store.release(store.make_ref(sha256, "d.pdf"))
+    UploadBlob.query.filter_by(sha256=sha256).update({"updated_at": datetime.utcnow() - timedelta(hours=2)})
+    db.session.commit()
+    path = store.blob_path(sha256)
+    _age(path)
+
+    # رفع متزامن لنفس المحتوى: _place حدّث وقت الملف لكن صفه لم يُثبَّت قبل أن يحذف collect الصف القديم
+    os.utime(path)
+    assert sha256 not in store.collect()
+    assert UploadBlob.query.filter_by(sha256=sha256).first() is None
+    assert os.path.isfile(path)
+
+    # لم يصل ذلك الرفع إلى commit: يُحذف الملف بعد المهلة كيتيم
+    _age(path)
+    assert sha256 in store.collect()
+    assert not os.path.exists(path)
+
+
+def test_collect_removes_released_blob_after_grace(store):
+    sha256 = parse_blob_ref(store.save_stream(io.BytesIO(b"released for good"), "e.pdf"))[0]
+    db.session.commit()
+    store.release(store.make_ref(sha256, "e.pdf"))
+    UploadBlob.query.filter_by(sha256=sha256).update({"updated_at": datetime.utcnow() - timedelta(hours=2)})
+    db.session.commit()
+    _age(store.blob_path(sha256))
+    assert sha256 in store.collect()
+    assert UploadBlob.query.filter_by(sha256=sha256).first() is None
+    assert not os.path.exists(store.blob_path(sha256))
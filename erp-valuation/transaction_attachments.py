@@ -0,0 +1,142 @@
+"""
+transaction_attachments.py
+
+مرفقات المعاملات في جدول مستقل (transaction_attachment) بدل السلاسل المفصولة بفواصل
+في Transaction.files و Transaction.bank_sent_files.
+
+- كل ملف صف واحد: المعاملة، النوع (file = ملفات المعاملة، bank = ملفات أُرسلت للبنك)، مرجع
+  upload_store، الحجم، نوع المحتوى، وتاريخ الإضافة.
+- صفحة البنك تعرض المرفقات على صفحات باستعلام واحد مفهرس (transaction.bank_id ثم
+  transaction_attachment.transaction_id) بدل تحميل كل معاملات البنك وتقسيم السلاسل في بايثون.
+- backfill_transaction_attachments() ينقل السلاسل القديمة إلى الجدول مرة واحدة عند بدء التشغيل
+  (المعاملات التي لها صفوف مسبقاً تُتجاوز، فهو آمن لإعادة التشغيل).
+"""
+
+from __future__ import annotations
+
+import mimetypes
+import os
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, Integer, Text, column, func, select, table
+
+from extensions import db
+from upload_store import display_name
+
+
+KIND_FILE = "file"
+KIND_BANK = "bank"
+
+# أعمدة المعاملة التي نحتاجها هنا (بدون استيراد app لتفادي الاستيراد الدائري)
+_transaction = table(
+    "transaction",
+    column("id", Integer), column("bank_id", Integer), column("date", DateTime),
+    column("files", Text), column("bank_sent_files", Text),
+)
+
+
+class TransactionAttachment(db.Model):
+    __tablename__ = "transaction_attachment"
+    __table_args__ = (
+        db.Index("ix_transaction_attachment_txn_kind", "transaction_id", "kind", "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(
+        db.Integer, db.ForeignKey("transaction.id", ondelete="CASCADE"), nullable=False
+    )
+    kind = db.Column(db.String(20), nullable=False, default=KIND_FILE)
+    ref = db.Column(db.String(400), nullable=False)
+    size = db.Column(db.BigInteger, nullable=True)
+    mime = db.Column(db.String(120), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    @property
+    def filename(self) -> str:
+        return display_name(self.ref)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<TransactionAttachment {self.transaction_id} {self.kind} {self.ref}>"
+
+
+def split_refs(value: Optional[str]) -> List[str]:
+    return [part.strip() for part in (value or "").split(",") if part.strip()]
+
+
+def _describe(upload_store, ref: str) -> Tuple[Optional[int], Optional[str]]:
+    """(الحجم، نوع المحتوى) لمرجع ملف؛ الحجم None إن لم يوجد الملف محلياً."""
+    mime = mimetypes.guess_type(display_name(ref))[0]
+    path = upload_store.resolve(ref)
+    try:
+        size = os.path.getsize(path) if path else None
+    except OSError:
+        size = None
+    return size, mime
+
+
+def add_attachments(upload_store, transaction, refs: Iterable[str], kind: str = KIND_FILE) -> List[TransactionAttachment]:
+    """إضافة مرفقات لمعاملة (لا يعمل commit؛ تُثبَّت مع المعاملة)."""
+    rows = []
+    for ref in refs:
+        size, mime = _describe(upload_store, ref)
+        row = TransactionAttachment(kind=kind, ref=ref, size=size, mime=mime)
+        transaction.attachments.append(row)
+        rows.append(row)
+    return rows
+
+
+def bank_attachments_page(bank_id: int, page: int = 1, per_page: int = 50):
+    """صفحة من مرفقات معاملات البنك (الأحدث أولاً) مع العدد الكلي، باستعلام واحد.
+
+    يرجع (قائمة المرفقات، العدد الكلي).
+    """
+    page = max(page, 1)
+    rows = db.session.execute(
+        select(TransactionAttachment, func.count().over().label("total"))
+        .join(_transaction, _transaction.c.id == TransactionAttachment.transaction_id)
+        .where(_transaction.c.bank_id == bank_id)
+        .order_by(TransactionAttachment.transaction_id.desc(), TransactionAttachment.id)
+        .offset((page - 1) * per_page)
+        .limit(per_page)
+    ).all()
+    if not rows and page > 1:
+        # صفحة بعد النهاية: نحتاج العدد فقط لعرض أزرار التنقل
+        total = db.session.execute(
+            select(func.count(TransactionAttachment.id))
+            .join(_transaction, _transaction.c.id == TransactionAttachment.transaction_id)
+            .where(_transaction.c.bank_id == bank_id)
+        ).scalar() or 0
+        return [], int(total)
+    return [row[0] for row in rows], int(rows[0][1]) if rows else 0
+
+
+def backfill_transaction_attachments(upload_store, batch_size: int = 500) -> int:
+    """نقل Transaction.files / bank_sent_files القديمة إلى transaction_attachment."""
+    has_rows = select(TransactionAttachment.id).where(
+        TransactionAttachment.transaction_id == _transaction.c.id
+    ).exists()
+    query = (
+        select(_transaction.c.id, _transaction.c.date, _transaction.c.files, _transaction.c.bank_sent_files)
+        .where(
+            (func.coalesce(_transaction.c.files, "") != "") | (func.coalesce(_transaction.c.bank_sent_files, "") != ""),
+            ~has_rows,
+        )
+        .order_by(_transaction.c.id)
+    )
+    created = 0
+    pending = 0
+    for txn_id, txn_date, files, bank_files in db.session.execute(query).all():
+        for kind, value in ((KIND_FILE, files), (KIND_BANK, bank_files)):
+            for ref in split_refs(value):
+                size, mime = _describe(upload_store, ref)
+                db.session.add(TransactionAttachment(
+                    transaction_id=txn_id, kind=kind, ref=ref, size=size, mime=mime, created_at=txn_date,
+                ))
+                created += 1
+                pending += 1
+        if pending >= batch_size:
+            db.session.commit()
+            pending = 0
+    db.session.commit()
+    return created
@@ -0,0 +1,193 @@
+"""
+upload_blobs.py
+
+صيانة مخزن الملفات المعنون بالمحتوى (upload_store) من سطر الأوامر.
+
+- rehome: ترحيل الملفات القديمة المحفوظة بأسمائها مباشرة في uploads/ (و static/uploads/projects
+  لمستندات المشاريع) إلى uploads/blobs/.. وتحديث أعمدة قاعدة البيانات التي تشير إليها.
+  الملفات المتطابقة تُخزَّن مرة واحدة ويُحسب لها عدد المراجع. آمن لإعادة التشغيل: المراجع
+  المرحّلة (blobs/..) تُتجاوز.
+- gc: حذف الرفوع المتروكة على دفعات (resumable_upload)، ثم المحتوى الذي لم تعد له مراجع
+  (بعد مهلة الأمان) وملفات tmp المتروكة.
+- replicate: جدولة نسخ المحتوى الذي لم يصل بعد للتخزين البعيد (replicated_at فارغ)
+  وانتظار انتهاء الطابور؛ مفيد بعد rehome أو بعد انقطاع طويل لـ B2.
+- previews: توليد المعاينات المصغّرة الناقصة للمحتوى الموجود (بعد rehome مثلاً).
+
+أمثلة:
+  python3 upload_blobs.py rehome --dry-run
+  python3 upload_blobs.py rehome
+  python3 upload_blobs.py rehome --keep-originals
+  python3 upload_blobs.py gc
+  python3 upload_blobs.py replicate --timeout 600
+  python3 upload_blobs.py previews
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+
+def parse_args(argv: Iterable[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Maintain the content-addressed upload store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rehome = sub.add_parser("rehome", help="Move legacy flat uploads into the blob store")
+    rehome.add_argument("--dry-run", action="store_true", help="Report what would move without changing anything")
+    rehome.add_argument("--keep-originals", action="store_true", help="Leave the legacy files in place after copying")
+    sub.add_parser("gc", help="Delete unreferenced blobs")
+    replicate = sub.add_parser("replicate", help="Queue blobs missing from remote storage and wait")
+    replicate.add_argument("--timeout", type=float, default=None, help="Seconds to wait for the queue to drain")
+    sub.add_parser("previews", help="Generate missing preview thumbnails")
+    return parser.parse_args(list(argv))
+
+
+def _targets(app):
+    """(النموذج، اسم العمود، قائمة مفصولة بفواصل؟، مجلد الملفات القديمة)."""
+    from app import BankDocument, BranchDocument, Expense, Payment
+    from transaction_attachments import TransactionAttachment
+    from consulting.contracts.models import Contract
+    from consulting.documents.models import Document
+    from consulting.projects.models import ProjectFile
+
+    uploads = app.config["UPLOAD_FOLDER"]
+    documents_dir = os.path.join(app.root_path, "static", "uploads", "projects")
+    return [
+        # Transaction.files/bank_sent_files القديمة نُقلت إلى transaction_attachment عند بدء التشغيل
+        (TransactionAttachment, "ref", False, uploads),
+        (Expense, "file", False, uploads),
+        (Payment, "receipt_file", False, uploads),
+        (BankDocument, "file", False, uploads),
+        (BranchDocument, "file", False, uploads),
+        (ProjectFile, "stored_filename", False, uploads),
+        (Contract, "file_path", False, uploads),
+        (Document, "file_path", False, documents_dir),
+    ]
+
+
+def _split(value, is_list: bool) -> List[str]:
+    if not value:
+        return []
+    if not is_list:
+        return [value]
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def rehome(app, dry_run: bool = False, keep_originals: bool = False) -> Dict[str, int]:
+    from app import Transaction, db, upload_store
+    from upload_store import is_blob_ref
+
+    targets = _targets(app)
+
+    # 1) عدد المراجع لكل ملف قديم (قد يشير أكثر من سجل لنفس الاسم)
+    ref_counts: Dict[Tuple[str, str], int] = defaultdict(int)
+    for model, column, is_list, directory in targets:
+        col = getattr(model, column)
+        for (value,) in db.session.query(col).filter(col.isnot(None), col != ""):
+            for name in _split(value, is_list):
+                if not is_blob_ref(name):
+                    ref_counts[(directory, name)] += 1
+
+    stats = {"files": 0, "missing": 0, "rows": 0, "bytes_before": 0}
+    mapping: Dict[Tuple[str, str], str] = {}
+    for (directory, name), count in ref_counts.items():
+        path = os.path.normpath(os.path.join(directory, name))
+        if not path.startswith(os.path.normpath(directory) + os.sep) or not os.path.isfile(path):
+            stats["missing"] += 1
+            continue
+        stats["files"] += 1
+        stats["bytes_before"] += os.path.getsize(path)
+        if not dry_run:
+            mapping[(directory, name)] = upload_store.save_file(path, name, refs=count)
+
+    if dry_run:
+        return stats
+
+    # 2) إعادة كتابة الأعمدة إلى المراجع الجديدة
+    for model, column, is_list, directory in targets:
+        col = getattr(model, column)
+        for row in model.query.filter(col.isnot(None), col != "").yield_per(500):
+            names = _split(getattr(row, column), is_list)
+            new_names = [mapping.get((directory, name), name) for name in names]
+            if new_names != names:
+                setattr(row, column, ",".join(new_names) if is_list else new_names[0])
+                stats["rows"] += 1
+    db.session.commit()
+
+    # 3) حذف الأصول بعد تثبيت المراجع الجديدة (ما عدا أسماء تقارير المعاملات التي لا تُرحَّل)
+    if not keep_originals:
+        report_files = {
+            name for (name,) in db.session.query(Transaction.report_file).filter(Transaction.report_file.isnot(None))
+        }
+        for (directory, name) in mapping:
+            if name in report_files:
+                continue
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return stats
+
+
+def replicate_pending(timeout=None) -> Tuple[int, bool]:
+    from datetime import timedelta
+
+    from app import storage, upload_store
+
+    if storage.remote is None:
+        return 0, True
+    queued = upload_store.requeue_unreplicated(min_age=timedelta(0))
+    return queued, storage.wait_idle(timeout)
+
+
+def generate_previews() -> Dict[str, int]:
+    from app import previews, upload_store
+    from upload_store import UploadBlob
+
+    stats = {"generated": 0, "skipped": 0}
+    for (sha256,) in UploadBlob.query.with_entities(UploadBlob.sha256).filter(UploadBlob.refcount > 0).yield_per(500):
+        if previews.ready(sha256) or previews.unavailable(sha256):
+            continue
+        try:
+            out = previews.generate(sha256, upload_store.blob_path(sha256))
+        except Exception as e:
+            print(f"⚠️ {sha256[:12]}: {e}")
+            out = None
+        stats["generated" if out else "skipped"] += 1
+    return stats
+
+
+def main(argv: Iterable[str]) -> int:
+    args = parse_args(argv)
+
+    from app import app, resumable_uploads, upload_store
+
+    with app.app_context():
+        if args.command == "gc":
+            expired = resumable_uploads.collect()
+            removed = upload_store.collect()
+            print(f"expired uploads={expired} removed blobs={len(removed)}")
+            return 0
+        if args.command == "previews":
+            stats = generate_previews()
+            print(f"generated={stats['generated']} skipped={stats['skipped']}")
+            return 0
+        if args.command == "replicate":
+            from app import storage
+
+            queued, drained = replicate_pending(args.timeout)
+            # ما زال يفشل: يبقى replicated_at فارغاً ويعيد التطبيق جدولته دورياً
+            print(f"queued={queued} drained={drained} failing={len(storage.failed)}")
+            return 0 if drained and not storage.failed else 1
+        stats = rehome(app, dry_run=args.dry_run, keep_originals=args.keep_originals)
+    print(
+        f"files={stats['files']} missing={stats['missing']} rows_updated={stats['rows']} "
+        f"legacy_bytes={stats['bytes_before']}" + (" (dry run)" if args.dry_run else "")
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,395 @@
+"""
+upload_store.py
+
+مخزن الملفات المرفوعة معنون بالمحتوى (content-addressed) مع إزالة التكرار.
+
+- يُحسب SHA-256 أثناء قراءة الرفع على دفعات ويُكتب إلى ملف مؤقت، ثم يُنقل ذرّياً (os.replace)
+  إلى مسار مجزّأ: uploads/blobs/ab/cd/<sha256>. الملفات المتطابقة تُخزَّن مرة واحدة.
+- جدول upload_blob يحفظ لكل محتوى عدد المراجع (refcount)؛ كل حفظ يزيد العدد وكل حذف/استبدال
+  ينقصه. الملفات التي يصل عدد مراجعها للصفر تُحذف لاحقاً بـ collect() بعد مهلة أمان
+  حتى لا يتسابق الحذف مع رفع جديد لنفس المحتوى. الملف يوضع في مكانه قبل commit الطلب، فإن
+  تراجع الطلب بقي ملف بلا صف؛ collect() يحذف هذه الملفات أيضاً بعد نفس المهلة.
+- المرجع المخزَّن في أعمدة قاعدة البيانات: "blobs/ab/cd/<sha256>/<الاسم الأصلي الآمن>"،
+  فيبقى اسم الملف وامتداده للعرض والتنزيل، ولا يطغى رفع "scan.pdf" من مستخدم على آخر.
+- المراجع القديمة (اسم ملف مباشرة في uploads/) تبقى مدعومة في resolve/release حتى تُرحَّل
+  بـ upload_blobs.py rehome.
+- عند تمرير طبقة تخزين (storage.ReplicatingStorage) يُجدول نسخ كل محتوى جديد للخادم البعيد
+  في الخلفية بعد commit الطلب، ويُسجَّل وقت اكتمال النسخ في upload_blob.replicated_at.
+  requeue_unreplicated() يعيد جدولة الصفوف التي لم تُنسخ بعد (يسجلها المخزن كـ sweeper فتُنفذ
+  عند بدء خيط النسخ ثم دورياً). المستمعون (listeners) يُستدعون أيضاً بعد commit فقط.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import BinaryIO, Callable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from extensions import db
+from storage import after_commit
+
+
+BLOB_PREFIX = "blobs"
+CHUNK_SIZE = 64 * 1024
+# مهلة قبل حذف محتوى لم تعد له مراجع (لتفادي التسابق مع رفع جديد لنفس المحتوى)
+COLLECT_GRACE = timedelta(hours=1)
+# لا يُعاد جدولة نسخ محتوى أحدث من هذا (قد يكون في طابور عملية أخرى)
+REQUEUE_MIN_AGE = timedelta(minutes=5)
+_SHA256 = re.compile(r"[0-9a-f]{64}")
+
+
+class UploadBlob(db.Model):
+    __tablename__ = "upload_blob"
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    refcount = db.Column(db.Integer, nullable=False, default=0, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # وقت اكتمال نسخ المحتوى إلى التخزين البعيد (None = لم يُنسخ بعد)
+    replicated_at = db.Column(db.DateTime, nullable=True, index=True)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<UploadBlob {self.sha256[:12]} size={self.size} refs={self.refcount}>"
+
+
+def is_blob_ref(ref: Optional[str]) -> bool:
+    return bool(ref) and ref.startswith(BLOB_PREFIX + "/")
+
+
+def parse_blob_ref(ref: str) -> Tuple[Optional[str], str]:
+    """(sha256، الاسم الأصلي) من مرجع blob، أو (None، الاسم) لمرجع قديم."""
+    parts = (ref or "").split("/")
+    if (
+        len(parts) >= 5 and parts[0] == BLOB_PREFIX and _SHA256.fullmatch(parts[3])
+        and parts[1] == parts[3][:2] and parts[2] == parts[3][2:4]
+    ):
+        return parts[3], "/".join(parts[4:])
+    return None, os.path.basename(ref or "")
+
+
+def display_name(ref: Optional[str]) -> str:
+    """الاسم الذي يُعرض للمستخدم (الاسم الأصلي للمرجع)."""
+    return parse_blob_ref(ref or "")[1]
+
+
+def _safe_name(filename: Optional[str], sha256: str) -> str:
+    name = secure_filename(filename or "")
+    # secure_filename يحذف الحروف العربية فقد يبقى "pdf" فقط؛ نحافظ على الامتداد دائماً
+    base, ext = os.path.splitext(filename or "")
+    ext = secure_filename(ext.lstrip("."))
+    ext = f".{ext}" if ext else ""
+    if name and name.lower().endswith(ext.lower()) and name.lower() != ext.lstrip(".").lower():
+        return name
+    return (secure_filename(base) or f"file_{sha256[:12]}") + ext
+
+
+class UploadStore:
+    """مجلد الرفع مع تخزين معنون بالمحتوى وعدّاد مراجع في upload_blob."""
+
+    def __init__(self, root: str, storage=None):
+        self.root = root
+        self.storage = storage
+        # دوال تُستدعى بـ (sha256، المسار) عند وصول محتوى جديد (مثل توليد المعاينات)
+        self.listeners: List[Callable[[str, str], None]] = []
+        os.makedirs(os.path.join(self.root, BLOB_PREFIX, "tmp"), exist_ok=True)
+        if storage is not None:
+            storage.sweepers.append(self.requeue_unreplicated)
+
+    # ----- المسارات -----
+    def blob_relpath(self, sha256: str) -> str:
+        return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, *self.blob_relpath(sha256).split("/"))
+
+    def make_ref(self, sha256: str, filename: Optional[str]) -> str:
+        return f"{self.blob_relpath(sha256)}/{_safe_name(filename, sha256)}"
+
+    def resolve(self, ref: str) -> Optional[str]:
+        """المسار الفعلي على القرص لمرجع (blob أو اسم قديم)، أو None إن كان المرجع غير آمن."""
+        sha256, _ = parse_blob_ref(ref)
+        if sha256:
+            return self.blob_path(sha256)
+        path = os.path.normpath(os.path.join(self.root, ref or ""))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            return None
+        return path
+
+    # ----- الكتابة -----
+    def _write_temp(self, stream: BinaryIO) -> Tuple[str, str, int]:
+        tmp_path = os.path.join(self.root, BLOB_PREFIX, "tmp", uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            self._discard(tmp_path)
+            raise
+        return tmp_path, digest.hexdigest(), size
+
+    @staticmethod
+    def _discard(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _acquire(self, sha256: str, size: int, count: int = 1) -> None:
+        """زيادة عدد مراجع المحتوى (أو إنشاء صفه). لا يعمل commit؛ يُثبَّت مع سجل الطلب."""
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(UploadBlob)
+            .where(UploadBlob.sha256 == sha256)
+            .values(refcount=UploadBlob.refcount + count, updated_at=now)
+        )
+        if result.rowcount:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(UploadBlob(sha256=sha256, size=size, refcount=count, created_at=now, updated_at=now))
+        except IntegrityError:
+            # رفع متزامن لنفس المحتوى أنشأ الصف أولاً
+            db.session.execute(
+                update(UploadBlob)
+                .where(UploadBlob.sha256 == sha256)
+                .values(refcount=UploadBlob.refcount + count, updated_at=now)
+            )
+
+    def _place(self, tmp_path: str, sha256: str, replicate: bool = True) -> None:
+        final_path = self.blob_path(sha256)
+        if os.path.exists(final_path):
+            self._discard(tmp_path)
+            # تحديث وقت التعديل حتى لا يعدّه collect() يتيماً قبل commit هذا الطلب
+            try:
+                os.utime(final_path)
+            except OSError:
+                pass
+            return
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+        # بعد commit فقط: صف upload_blob موجود عندها، وعند rollback لا نسخ ولا معاينة لملف يتيم
+        after_commit(db.session, lambda: self._on_committed(sha256, final_path, replicate))
+
+    def _on_committed(self, sha256: str, final_path: str, replicate: bool = True) -> None:
+        if replicate:
+            self.replicate(sha256)
+        for listener in self.listeners:
+            try:
+                listener(sha256, final_path)
+            except Exception as e:
+                print(f"⚠️ upload_store listener failed for {sha256[:12]}: {e}")
+
+    # ----- النسخ البعيد -----
+    def replicate(self, sha256: str) -> bool:
+        """جدولة نسخ المحتوى للتخزين البعيد (إن كان مهيأ)."""
+        if self.storage is None:
+            return False
+        return self.storage.replicate(self.blob_relpath(sha256), callback=_mark_replicated)
+
+    def requeue_unreplicated(self, min_age: timedelta = REQUEUE_MIN_AGE) -> int:
+        """جدولة المحتوى المرجَع الذي لم يصل للتخزين البعيد بعد (replicated_at فارغ)."""
+        if self.storage is None or self.storage.remote is None:
+            return 0
+        cutoff = datetime.utcnow() - min_age
+        shas = [
+            sha256 for (sha256,) in
+            UploadBlob.query.with_entities(UploadBlob.sha256)
+            .filter(UploadBlob.replicated_at.is_(None), UploadBlob.refcount > 0, UploadBlob.created_at <= cutoff)
+        ]
+        db.session.rollback()
+        return sum(1 for sha256 in shas if self.replicate(sha256))
+
+    def open(self, ref: str):
+        """مولّد بايتات المحتوى: النسخة المحلية أولاً ثم البعيدة. None إن لم يوجد."""
+        sha256, _ = parse_blob_ref(ref)
+        key = self.blob_relpath(sha256) if sha256 else ref
+        if self.storage is None:
+            path = self.resolve(ref)
+            if not path or not os.path.isfile(path):
+                return None
+            return _iter_path(path)
+        return self.storage.open(key)
+
+    def save_stream(self, stream: BinaryIO, filename: Optional[str], refs: int = 1) -> str:
+        """حفظ محتوى مجرى قراءة وإرجاع المرجع الذي يُخزَّن في قاعدة البيانات.
+
+        refs=0 لملف مؤقت لا يشير إليه أي سجل: لا يُنسخ للتخزين البعيد ويحذفه collect() بعد
+        المهلة، إلا إن حُفظ نفس المحتوى لاحقاً بمرجع.
+        """
+        tmp_path, sha256, size = self._write_temp(stream)
+        try:
+            self._acquire(sha256, size, count=refs)
+        except Exception:
+            self._discard(tmp_path)
+            raise
+        self._place(tmp_path, sha256, replicate=refs > 0)
+        return self.make_ref(sha256, filename)
+
+    def save(self, file_storage, filename: Optional[str] = None, refs: int = 1) -> str:
+        """حفظ ملف مرفوع (werkzeug FileStorage) وإرجاع مرجعه."""
+        return self.save_stream(file_storage.stream, filename or file_storage.filename, refs=refs)
+
+    def save_file(self, path: str, filename: Optional[str] = None, move: bool = False, refs: int = 1) -> str:
+        """استيراد ملف موجود على القرص (للترحيل)؛ move=True يحذف الأصل بعد الاستيراد."""
+        with open(path, "rb") as src:
+            tmp_path, sha256, size = self._write_temp(src)
+        self._acquire(sha256, size, count=refs)
+        self._place(tmp_path, sha256, replicate=refs > 0)
+        if move:
+            self._discard(path)
+        return self.make_ref(sha256, filename or os.path.basename(path))
+
+    # ----- الحذف -----
+    def release(self, ref: Optional[str]) -> None:
+        """إنقاص مراجع المحتوى عند حذف السجل أو استبدال ملفه.
+
+        المراجع القديمة (خارج blobs/) تُحذف مباشرة كما كان يحدث قبل المخزن.
+        """
+        if not ref:
+            return
+        sha256, _ = parse_blob_ref(ref)
+        if sha256 is None:
+            path = self.resolve(ref)
+            if path and os.path.isfile(path):
+                self._discard(path)
+            return
+        db.session.execute(
+            update(UploadBlob)
+            .where(UploadBlob.sha256 == sha256, UploadBlob.refcount > 0)
+            .values(refcount=UploadBlob.refcount - 1, updated_at=datetime.utcnow())
+        )
+
+    def release_many(self, refs: Iterable[str]) -> None:
+        for ref in refs:
+            self.release(ref)
+
+    def collect(self, grace: timedelta = COLLECT_GRACE) -> List[str]:
+        """حذف المحتوى الذي لا مراجع له منذ أكثر من grace، مع ملفات tmp المتروكة."""
+        cutoff = datetime.utcnow() - grace
+        # utcnow() بلا منطقة زمنية؛ timestamp() سيعدّه توقيتاً محلياً
+        cutoff_ts = time.time() - grace.total_seconds()
+        removed: List[str] = []
+        rows = (
+            UploadBlob.query.filter(UploadBlob.refcount <= 0, UploadBlob.updated_at < cutoff)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        deleted = [blob.sha256 for blob in rows]
+        for blob in rows:
+            db.session.delete(blob)
+        db.session.commit()
+        for sha256 in deleted:
+            # رفع جديد لنفس المحتوى بعد الحذف يعيد إنشاء الصف ويحتاج الملف. قبل commit ذلك الرفع
+            # لا يظهر صفه هنا، لكن _place حدّث وقت تعديل الملف: ملف عُدّل خلال المهلة لا يُحذف
+            # (وإن تراجع ذلك الطلب يحذفه _collect_orphans لاحقاً)
+            path = self.blob_path(sha256)
+            if UploadBlob.query.filter_by(sha256=sha256).first() is None and _untouched_since(path, cutoff_ts):
+                self._discard(path)
+                if self.storage is not None and self.storage.remote is not None:
+                    self.storage.remote.delete(self.blob_relpath(sha256))
+                removed.append(sha256)
+        db.session.rollback()
+
+        tmp_dir = os.path.join(self.root, BLOB_PREFIX, "tmp")
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff_ts:
+                    self._discard(path)
+            except OSError:
+                pass
+        removed.extend(self._collect_orphans(cutoff_ts))
+        return removed
+
+    def _blob_files(self) -> Iterable[Tuple[str, str]]:
+        """(sha256، المسار) لكل ملف تحت blobs/ab/cd/."""
+        base = os.path.join(self.root, BLOB_PREFIX)
+        for top in os.listdir(base):
+            if len(top) != 2 or not os.path.isdir(os.path.join(base, top)):
+                continue
+            for sub in os.listdir(os.path.join(base, top)):
+                directory = os.path.join(base, top, sub)
+                if not os.path.isdir(directory):
+                    continue
+                for name in os.listdir(directory):
+                    if _SHA256.fullmatch(name):
+                        yield name, os.path.join(directory, name)
+
+    def _collect_orphans(self, cutoff_ts: float, batch: int = 500) -> List[str]:
+        """حذف ملفات blobs التي لا صف لها (وُضع الملف ثم تراجع الطلب) وأقدم من المهلة."""
+        removed: List[str] = []
+        candidates: List[Tuple[str, str]] = []
+
+        def flush() -> None:
+            known = {
+                sha256 for (sha256,) in db.session.query(UploadBlob.sha256)
+                .filter(UploadBlob.sha256.in_([sha256 for sha256, _ in candidates]))
+            }
+            for sha256, path in candidates:
+                if sha256 not in known:
+                    self._discard(path)
+                    removed.append(sha256)
+            candidates.clear()
+
+        for sha256, path in self._blob_files():
+            try:
+                if os.path.getmtime(path) >= cutoff_ts:
+                    continue
+            except OSError:
+                continue
+            candidates.append((sha256, path))
+            if len(candidates) >= batch:
+                flush()
+        if candidates:
+            flush()
+        db.session.rollback()
+        return removed
+
+
+def _untouched_since(path: str, cutoff_ts: float) -> bool:
+    """لم يُعدَّل الملف منذ cutoff_ts (أو لا نسخة محلية له)."""
+    try:
+        return os.path.getmtime(path) < cutoff_ts
+    except OSError:
+        return True
+
+
+def _iter_path(path: str):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _mark_replicated(remote_key: str, file_id: Optional[str]) -> None:
+    sha256 = remote_key.rsplit("/", 1)[-1]
+    db.session.execute(
+        update(UploadBlob).where(UploadBlob.sha256 == sha256).values(replicated_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+
+def get_upload_store() -> UploadStore:
+    """المخزن المهيأ في التطبيق (للـ blueprints التي لا تستورد app مباشرة)."""
+    from flask import current_app
+
+    return current_app.extensions["upload_store"]
@@ -0,0 +1,215 @@
+"""
+zip_stream.py
+
+إنشاء أرشيف ZIP كدفق (generator) يُرسل للمتصفح مباشرة دون تجميعه في الذاكرة أو على القرص.
+
+zipfile يدعم الكتابة إلى مجرى غير قابل للتقديم (unseekable) باستخدام data descriptors،
+فنكتب إلى مخزن صغير ونفرغه بعد كل قطعة.
+
+- مصدر العنصر إما مسار ملف محلي أو مولّد بايتات (محتوى من التخزين البعيد).
+- compression_for() يختار STORED للملفات المضغوطة أصلاً (PDF، الصور، DOCX) و DEFLATED لغيرها.
+- prefetch() يفتح عناصر التخزين البعيد بالتوازي (عدد محدود من الخيوط) مع مخزن محدود لكل عنصر،
+  فلا ينتظر الأرشيف كل ملف على حدة ولا تتجاوز الذاكرة workers × buffer_chunks قطعة.
+
+الاستخدام:
+  return Response(iter_zip([("a.pdf", "/path/a.pdf"), ...]), mimetype="application/zip")
+"""
+
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, Tuple, Union
+
+CHUNK_SIZE = 64 * 1024
+
+# امتدادات مضغوطة أصلاً: ضغطها مرة أخرى يستهلك المعالج بلا فائدة
+STORED_EXTENSIONS = {
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".tif", ".tiff",
+    ".zip", ".rar", ".7z", ".gz", ".docx", ".xlsx", ".pptx", ".mp4", ".mov",
+}
+
+
+class ZipEntry(NamedTuple):
+    arcname: str
+    # مسار ملف، أو مولّد بايتات، أو (قبل prefetch) دالة تُرجع مولّداً أو None
+    source: Union[str, Iterable[bytes], Callable[[], Optional[Iterable[bytes]]], None]
+    compress_type: Optional[int] = None
+    date_time: Optional[Tuple[int, int, int, int, int, int]] = None
+
+
+def compression_for(name: str) -> int:
+    ext = os.path.splitext(name or "")[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+class _ChunkSink:
+    """مجرى كتابة فقط يحتفظ بما كُتب حتى يُفرَّغ."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _iter_path(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as src:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_zip(
+    entries: Iterable[Union[Tuple[str, str], ZipEntry]],
+    compression: int = zipfile.ZIP_STORED,
+    missing_note: Optional[str] = None,
+) -> Iterator[bytes]:
+    """يولّد بايتات أرشيف ZIP لقائمة (اسم داخل الأرشيف، مسار الملف) أو عناصر ZipEntry.
+
+    الافتراضي بدون ضغط: ملفات DOCX/PDF/الصور مضغوطة أصلاً ولا فائدة من ضغطها مرة أخرى؛
+    ZipEntry.compress_type يتجاوز الافتراضي لكل عنصر.
+    القائمة قد تكون generator؛ يُقرأ كل عنصر عند الحاجة فقط.
+    العناصر التي مصدرها None (غير موجودة) تُتجاوز، وتُسرد أسماؤها في ملف missing_note إن حُدد.
+    """
+    sink = _ChunkSink()
+    missing: list[str] = []
+    with zipfile.ZipFile(sink, mode="w", compression=compression, allowZip64=True) as zf:
+        for entry in entries:
+            entry = entry if isinstance(entry, ZipEntry) else ZipEntry(*entry)
+            source = entry.source
+            if source is None:
+                missing.append(entry.arcname)
+                continue
+            if isinstance(source, str):
+                zinfo = zipfile.ZipInfo.from_file(source, entry.arcname)
+                chunks = _iter_path(source)
+            else:
+                zinfo = zipfile.ZipInfo(entry.arcname, date_time=entry.date_time or time.localtime()[:6])
+                chunks = iter(source)
+            zinfo.compress_type = compression if entry.compress_type is None else entry.compress_type
+            try:
+                with zf.open(zinfo, mode="w") as dest:
+                    for chunk in chunks:
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            finally:
+                close = getattr(chunks, "close", None)
+                if close:
+                    close()
+            data = sink.drain()
+            if data:
+                yield data
+        if missing and missing_note:
+            zf.writestr(missing_note, "\n".join(missing) + "\n")
+    data = sink.drain()
+    if data:
+        yield data
+
+
+# ----- جلب المصادر البعيدة بالتوازي -----
+_END = object()
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _pump(opener, buffer: "queue.Queue", stop: threading.Event) -> None:
+    """يفتح المصدر في خيط ويملأ buffer بقطعه؛ يتوقف عند امتلائه حتى يستهلكه الأرشيف."""
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    stream = None
+    try:
+        stream = opener()
+        if stream is None:
+            put(None)
+            return
+        for chunk in stream:
+            if chunk and not put(chunk):
+                return
+        put(_END)
+    except BaseException as e:  # noqa: BLE001 - يُعاد رفعه في خيط الأرشيف
+        put(_Failed(e))
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+
+
+def _drain(buffer: "queue.Queue", first) -> Iterator[bytes]:
+    item = first
+    while item is not _END:
+        if isinstance(item, _Failed):
+            raise item.error
+        yield item
+        item = buffer.get()
+
+
+def prefetch(entries: Iterable[ZipEntry], workers: int = 4, buffer_chunks: int = 8) -> Iterator[ZipEntry]:
+    """يحوّل عناصر مصدرها دالة فتح (تخزين بعيد) إلى عناصر مصدرها مولّد بايتات جاهز.
+
+    حتى workers عنصراً تُجلب مسبقاً بالترتيب، وكل عنصر يخزّن حتى buffer_chunks قطعة فقط.
+    الدالة التي ترجع None تعني أن المحتوى غير موجود (المصدر يصبح None فيتجاوزه iter_zip).
+    المسارات المحلية تمر كما هي.
+    """
+    workers = max(1, int(workers or 1))
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zip-prefetch")
+    window: deque = deque()
+    source_iter = iter(entries)
+    try:
+        while True:
+            while len(window) < workers:
+                entry = next(source_iter, None)
+                if entry is None:
+                    break
+                if callable(entry.source):
+                    buffer: queue.Queue = queue.Queue(maxsize=max(1, buffer_chunks))
+                    executor.submit(_pump, entry.source, buffer, stop)
+                    window.append((entry, buffer))
+                else:
+                    window.append((entry, None))
+            if not window:
+                break
+            entry, buffer = window.popleft()
+            if buffer is None:
+                yield entry
+                continue
+            first = buffer.get()
+            if first is None:
+                yield entry._replace(source=None)
+                continue
+            yield entry._replace(source=_drain(buffer, first))
+    finally:
+        # إغلاق الأرشيف قبل اكتماله (انقطاع اتصال العميل): إيقاف الخيوط وإغلاق الاتصالات
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)